@@ -30,16 +30,25 @@ _inject_internal_mpi_libs()
 
 import subprocess  # after env vars set
 
+from .model import Model
+from .pool import ModelPool
+
 # Version of the package
 __version__ = "2.7.1"
 
-def run(input_file="wt.in", output_file=None):
+def run(input_file="wt.in", output_file=None, hr_cache=True, resume=False):
     """
     Run the WannierTools main program using the compiled Fortran extension.
 
     Parameters:
     input_file (str): Path to the WannierTools input file (default: "wt.in").
     output_file (str or None): If set, redirect stdout/stderr to this file.
+    hr_cache (bool): If True, write or refresh the binary sidecar of the hr
+        file (<Hrfile>.wtb) so the Fortran code does not parse the text file.
+        If False, the text file is read even if a sidecar exists.
+    resume (bool): If True, continue a killed run from the checkpoint files
+        wt_checkpoint_*.bin in the directory of the input file and skip the
+        k points that are already done.
     """
     # Check if we're running under MPI by looking at environment variables
     # This works without requiring mpi4py
@@ -64,6 +73,8 @@ def run(input_file="wt.in", output_file=None):
             print("Output will be displayed in console")
     
     try:
+        from .model import _configure_threads
+        _configure_threads()
         from . import wannier_tools_ext
         if is_main_process:
             print("Successfully loaded wannier_tools_ext extension module.")
@@ -76,6 +87,13 @@ def run(input_file="wt.in", output_file=None):
             print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
         return
 
+    # run() reads its own input into the same Fortran module state
+    from .model import _wrapper, is_loaded
+    if is_loaded():
+        if is_main_process:
+            print("!!! ERROR: a wannier_tools.Model is loaded in this process, close it before run().")
+        return
+
     original_cwd = os.getcwd()
     input_path = os.path.abspath(input_file)
     input_dir = os.path.dirname(input_path)
@@ -90,7 +108,23 @@ def run(input_file="wt.in", output_file=None):
             print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
         return
 
+    # Only rank 0 writes the binary hr cache and reads the hr file, the
+    # Fortran code uses the cache only if it was checked here.
+    use_cache = False
+    if hr_cache and is_main_process:
+        from .io import ensure_hr_cache
+        try:
+            cache_path = ensure_hr_cache(input_path)
+            if cache_path:
+                use_cache = True
+                print(f"Binary Hamiltonian cache: {cache_path}")
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not write the binary Hamiltonian cache ({e}), "
+                  "the hr file will be read as text.")
+
     os.chdir(input_dir)
+    _wrapper().set_checkpoint_resume(1 if resume else 0)
+    _wrapper().set_hr_cache(1 if use_cache else 0)
 
     try:
         if output_file:
@@ -100,7 +134,7 @@ def run(input_file="wt.in", output_file=None):
                 try:
                     if is_main_process:
                         print("Calling the Fortran `run_wannier_tools` subroutine...")
-                    wannier_tools_ext.wannier_tools_wrapper.run_wannier_tools()
+                    _wrapper().run_wannier_tools()
                     if is_main_process:
                         print("Fortran subroutine finished.")
                 finally:
@@ -108,10 +142,21 @@ def run(input_file="wt.in", output_file=None):
         else:
             if is_main_process:
                 print("Calling the Fortran `run_wannier_tools` subroutine...")
-            wannier_tools_ext.wannier_tools_wrapper.run_wannier_tools()
+            _wrapper().run_wannier_tools()
             if is_main_process:
                 print("Fortran subroutine finished.")
 
+        # binary results of Output_format= 'NPZ' or 'HDF5', written by rank 0
+        if is_main_process:
+            from .results import pack_results
+            try:
+                packed = pack_results('.', input_path)
+                if packed:
+                    print(f"Results written to {packed}")
+            except (OSError, ValueError) as e:
+                print(f"Warning: could not pack the binary results ({e}), "
+                      "wt_results.bin and wt_results.json are kept.")
+
         if is_main_process:
             print("\n==========================================================")
             print("        WannierTools Calculation Completed Successfully!")
@@ -251,13 +296,13 @@ KCUBE_BULK
     print("Sample input file 'wt.in' created.")
     print("You can edit this file according to your needs and then run wannier_tools.run()")
 
-# Lazy import of cli module to avoid circular imports
+# Lazy import of the cli and results modules to avoid circular imports
 def __getattr__(name):
-    if name == 'cli':
+    if name in ('cli', 'results'):
         import importlib
-        cli_module = importlib.import_module('.cli', package=__name__)
-        globals()['cli'] = cli_module  # Cache it
-        return cli_module
+        module = importlib.import_module('.' + name, package=__name__)
+        globals()[name] = module  # Cache it
+        return module
     raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
-__all__ = ['run', 'create_sample_input', 'cli'] 
\ No newline at end of file
+__all__ = ['run', 'Model', 'ModelPool', 'create_sample_input', 'cli', 'results'] 
\ No newline at end of file
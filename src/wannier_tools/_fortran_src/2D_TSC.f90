@@ -253,6 +253,7 @@ subroutine ek_slab_BdG
   
    use wmpi
    use para
+   use slab_banded
    implicit none 
 
    ! loop index
@@ -320,13 +321,10 @@ subroutine ek_slab_BdG
       k= k2_path(i, :)
       chamk_BdG=0.0d0 
 
-      call ham_slab_BdG(k,Chamk_BdG)
-
-
       eigenvalue_BdG=0.0d0
 
-      ! diagonal Chamk
-      call eigensystem_c('V', 'U', Num_wann_BdG*Nslab, CHamk_BdG, eigenvalue_BdG)
+      ! build and diagonal Chamk, dense or banded, see slab_banded.f90
+      call eigensystem_slab_BdG(k, CHamk_BdG, eigenvalue_BdG, window=.true.)
      
       ekslab_BdG(:,i)=eigenvalue_BdG
 
@@ -485,6 +483,7 @@ subroutine  wannier_center2D_BdG
 
     use para
     use wmpi
+    use slab_banded
     implicit none
 
     integer :: Nkx
@@ -727,10 +726,8 @@ subroutine  wannier_center2D_BdG
           k(1)= kpoints(1, ikx, iky)
           k(2)= kpoints(2, ikx, iky)
 
-          call ham_slab_BdG(k,hamk)
-
-          !> diagonal hamk
-          call eigensystem_c('V', 'U', Num_wann_BdG*Nslab, hamk, eigenvalue)
+          !> build and diagonal hamk, dense or banded, see slab_banded.f90
+          call eigensystem_slab_BdG(k, hamk, eigenvalue)
 
           Eigenvector(:, :, ikx)= hamk
        enddo
@@ -31,6 +31,7 @@
 
      use wmpi
      use para
+     use result_sink
      implicit none
     
      integer :: iR, ik, ikx, iky, ikz
@@ -79,8 +80,16 @@
 
      call  sigma_ahc_vary_ChemicalPotential(OmegaNum, energy, NumberofEta, eta_array, sigma_tensor_ahc)
 
+     !> binary output, the components in the order xy, yz, zx of the text files
+     if (cpuid.eq.0 .and. result_binary) then
+        call result_write('ahc/energy', [OmegaNum], energy/eV2Hartree, 'eV', 'energy')
+        call result_write('ahc/eta', [NumberofEta], eta_array*1000d0/eV2Hartree, 'meV', 'eta')
+        call result_write('ahc/sigma', [3, OmegaNum, NumberofEta], sigma_tensor_ahc([3, 1, 2], :, :), &
+           'S/cm', 'eta,energy,component')
+     endif
+
      outfileindex= outfileindex+ 1
-     if (cpuid.eq.0) then
+     if (cpuid.eq.0 .and. .not.result_binary) then
         do ieta=1, NumberofEta
            write(etaname, '(f12.2)')eta_array(ieta)*1000d0/eV2Hartree
            write(ahcfilename, '(7a)')'sigma_ahc_eta', trim(adjustl(etaname)), 'meV.txt'
@@ -100,7 +109,7 @@
 
      !> write script for gnuplot
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         write(etaname, '(f12.2)')Fermi_broadening*1000d0/eV2Hartree
         write(ahcfilename, '(7a)')'sigma_ahc_eta', trim(adjustl(etaname)), 'meV.txt'
         open(unit=outfileindex, file='sigma_ahc.gnu')
@@ -339,6 +348,8 @@ subroutine sigma_ahc_vary_ChemicalPotential(NumOfmu, mulist, NumberofEta, eta_ar
 
      use wmpi
      use para
+     use scheduler
+     use checkpoint
      implicit none
 
      integer, intent(in)    :: NumOfmu
@@ -347,23 +358,32 @@ subroutine sigma_ahc_vary_ChemicalPotential(NumOfmu, mulist, NumberofEta, eta_ar
      real(dp), intent(in)    :: eta_array(NumberofEta)
      real(dp), intent(inout) :: sigma_tensor_ahc(3, NumOfmu, NumberofEta)
      
-     integer :: iR, ik, ikx, iky, ikz
+     integer :: iR, ik, ikx, iky, ikz, j1
      integer :: i, m, ie, ieta
-     integer :: ierr, knv3
-
-     real(dp) :: mu, Beta_fake, eta_local
+     integer :: ierr, knv3, nkirr
+     integer :: ik0, ikb, nkb, nk_batch, ik1, ik2
+     integer, external :: hk_batch_size
+     integer :: nthreads
+     integer, external :: get_num_threads
+     type(scheduler_type) :: sched
+     type(checkpoint_type) :: ckpt, ckpt_refine
+
+     real(dp) :: deg
      real(dp) :: k(3)
 
-     real(dp) :: time_start, time_end
-
      ! eigen value of H
      real(dp), allocatable :: W(:)
      complex(dp), allocatable :: Hamk_bulk(:, :)
      complex(dp), allocatable :: UU(:, :)
 
+     !> H(k) for a block of k points from ham_bulk_atomicgauge_batch
+     complex(dp), allocatable :: Hamk_batch(:, :, :)
+     real(dp), allocatable :: k_batch(:, :)
+     integer, allocatable :: ik_batch(:)
+
      !> conductivity  dim= OmegaNum
      real(dp), allocatable :: energy(:)
-     real(dp), allocatable :: sigma_tensor_ahc_mpi(:, :, :)
+     real(dp), allocatable, target :: sigma_tensor_ahc_mpi(:, :, :)
      
      !> Fermi-Dirac distribution
      real(dp), external :: fermi
@@ -375,80 +395,225 @@ subroutine sigma_ahc_vary_ChemicalPotential(NumOfmu, mulist, NumberofEta, eta_ar
 
      !> Berry curvature vectors for all bands
      real(dp),allocatable :: Omega_BerryCurv(:, :)
-     real(dp),allocatable :: Omega_BerryCurv_t(:, :)
+
+     !> irreducible k points of the k cube
+     type(kcube_type_symm) :: kcube
+
+     !> -sum_n Omega_n f_n at one k point
+     real(dp), allocatable :: sigma_k(:, :, :), sigma_cell(:, :, :)
+
+     !> adaptive refinement: refine_flag(1, ik)= 1 if the cell of ik is
+     !> refined, the correction of the refined cells is summed in
+     !> sigma_refine_mpi
+     logical :: refine
+     integer :: iref, nref, nk_cell
+     integer, allocatable :: ik_refine(:)
+     real(dp) :: dk(3, 3)
+     real(dp), target :: nk_refined(1)
+     real(dp) :: nk_refined_all(1)
+     real(dp), allocatable, target :: refine_flag(:, :)
+     real(dp), allocatable :: refine_flag_mpi(:, :)
+     real(dp), allocatable, target :: sigma_refine_mpi(:, :, :)
 
      allocate(Dmn_Ham(Num_wann, Num_wann, 3))
      allocate(Vmn_Ham(Num_wann, Num_wann, 3))
      allocate(Omega_BerryCurv(Num_wann, 3))
-     allocate(Omega_BerryCurv_t(Num_wann, 3))
 
      allocate( W (Num_wann))
      allocate( Hamk_bulk(Num_wann, Num_wann))
      allocate( UU(Num_wann, Num_wann))
      allocate( sigma_tensor_ahc_mpi(3, NumOfmu, NumberofEta))
+     allocate( sigma_k(3, NumOfmu, NumberofEta), sigma_cell(3, NumOfmu, NumberofEta))
      sigma_tensor_ahc_mpi= 0d0
      Hamk_bulk=0d0
      UU= 0d0
       
      knv3= Nk1*Nk2*Nk3
+     call kmesh_symm_reduce(kcube, Nk1, Nk2, Nk3, K3D_start_cube, &
+        K3D_vec1_cube, K3D_vec2_cube, K3D_vec3_cube)
+     nkirr= kcube%Nk_total_symm
+
+     !> H(k) is built in blocks of nkb k points with one ZGEMM per block
+     nkb= hk_batch_size(nkirr)
+     allocate(Hamk_batch(Num_wann, Num_wann, nkb), k_batch(3, nkb), ik_batch(nkb))
+     nthreads= get_num_threads()
+
+     call atomicgauge_table_init()
+
+     !> the partial sums of the finished k points are kept in checkpoints,
+     !> with the cells that will be refined
+     call checkpoint_add(ckpt, sigma_tensor_ahc_mpi, size(sigma_tensor_ahc_mpi))
+     if (Nk_refine_levels>0) then
+        allocate(refine_flag(1, nkirr))
+        refine_flag= 0d0
+        call checkpoint_add_items(ckpt, refine_flag, 1)
+        call checkpoint_start(ckpt, 'sigma_ahc', nkirr, [mulist, eta_array, &
+           dble(Nk_refine_levels), Refine_threshold, Refine_gap_threshold])
+     else
+        call checkpoint_start(ckpt, 'sigma_ahc', nkirr, [mulist, eta_array])
+     endif
 
-     call now(time_start) 
-     do ik= 1+ cpuid, knv3, num_cpu
-        if (cpuid.eq.0.and. mod(ik/num_cpu, 100).eq.0) then
-           call now(time_end) 
-           write(stdout, '(a, i18, "/", i18, a, f10.2, "s")') 'ik/knv3', &
-           ik, knv3, '  time left', (knv3-ik)*(time_end-time_start)/num_cpu/100d0
-           time_start= time_end
-        endif
-
-        ikx= (ik-1)/(nk2*nk3)+1
-        iky= ((ik-1-(ikx-1)*Nk2*Nk3)/nk3)+1
-        ikz= (ik-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
-        k= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1)  &
-         + K3D_vec2_cube*(iky-1)/dble(nk2)  &
-         + K3D_vec3_cube*(ikz-1)/dble(nk3)
+     !> every rank takes one block per OpenMP thread at a time, and writes
+     !> its checkpoint in between. The Berry curvature is summed over the
+     !> blocks in sigma_tensor_ahc_mpi
+     call scheduler_start(sched, nkirr, nkb*nthreads)
+     do while (scheduler_next(sched, ik1, ik2))
+     if (cpuid.eq.0.and. mod(sched%nchunks, 10).eq.1) &
+        write(stdout, '(a, i18, "/", i18, a, f10.2, "s")') 'ik/knv3', &
+        ik1, nkirr, '  time left', scheduler_time_left(sched)
+
+     !$OMP PARALLEL DO SCHEDULE(STATIC, 1) &
+     !$OMP PRIVATE(ik0, nk_batch, ikb, ik, ikx, iky, ikz, j1, k, deg, refine) &
+     !$OMP PRIVATE(W, Hamk_bulk, UU, Vmn_Ham, Dmn_Ham, Omega_BerryCurv, sigma_k) &
+     !$OMP PRIVATE(Hamk_batch, k_batch, ik_batch) &
+     !$OMP REDUCTION(+:sigma_tensor_ahc_mpi)
+     do ik0= ik1, ik2, nkb
+        nk_batch= 0
+        do ik= ik0, min(ik0+nkb-1, ik2)
+           if (checkpoint_done(ckpt, ik)) cycle
+           nk_batch= nk_batch+ 1
+           ik_batch(nk_batch)= ik
+           j1= kcube%ik_array_symm(ik)
+           ikx= (j1-1)/(nk2*nk3)+1
+           iky= ((j1-1-(ikx-1)*Nk2*Nk3)/nk3)+1
+           ikz= (j1-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
+           k_batch(:, nk_batch)= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1)  &
+            + K3D_vec2_cube*(iky-1)/dble(nk2)  &
+            + K3D_vec3_cube*(ikz-1)/dble(nk3)
+        enddo
+        if (nk_batch==0) cycle
 
         ! calculation bulk hamiltonian by a direct Fourier transformation of HmnR
-        call ham_bulk_atomicgauge(k, Hamk_bulk)
+        call ham_bulk_atomicgauge_batch(nk_batch, k_batch, Hamk_batch)
        !call ham_bulk_latticegauge(k, Hamk_bulk)
+
+        do ikb= 1, nk_batch
+           ik= ik_batch(ikb)
+           k= k_batch(:, ikb)
+           Hamk_bulk= Hamk_batch(:, :, ikb)
    
-        !> diagonalization by call zheev in lapack
-        UU=Hamk_bulk
-        call eigensystem_c( 'V', 'U', Num_wann, UU, W)
+           !> diagonalization by call zheev in lapack
+           UU=Hamk_bulk
+           call eigensystem_c( 'V', 'U', Num_wann, UU, W)
   
-        !> get velocity operator in Hamiltonian basis
-        call dHdk_atomicgauge_Ham(k, UU, Vmn_Ham)
-       !call dHdk_latticegauge_Ham(k, W, UU, Vmn_Ham)
-
-        call get_Dmn_Ham(W, Vmn_Ham, Dmn_Ham)
-
+           !> get velocity operator in Hamiltonian basis
+           call dHdk_atomicgauge_Ham(k, UU, Vmn_Ham)
+          !call dHdk_latticegauge_Ham(k, W, UU, Vmn_Ham)
+
+           call get_Dmn_Ham(W, Vmn_Ham, Dmn_Ham)
+
+
+           !> calculate Berry curvature at a single k point for all bands
+           !> \Omega_n^{\gamma}(k)=i\sum_{\alpha\beta}\epsilon_{\gamma\alpha\beta}(D^{\alpha\dag}D^{\beta})_{nn}
+           call Berry_curvature_singlek_allbands(Dmn_Ham, Omega_BerryCurv)
+
+           call sigma_ahc_fermi_sum(W, Omega_BerryCurv, NumOfmu, mulist, &
+              NumberofEta, eta_array, sigma_k, refine)
+
+           !> the k point stands for its star of deg k points
+           deg= dble(kcube%ndeg(ik))
+           sigma_tensor_ahc_mpi= sigma_tensor_ahc_mpi+ sigma_k*deg
+           if (Nk_refine_levels>0 .and. refine) refine_flag(1, ik)= 1d0
+           call checkpoint_mark(ckpt, ik)
+        enddo ! ikb
+     enddo ! ik0
+     !$OMP END PARALLEL DO
+     call checkpoint_update(ckpt)
+     enddo
+     call scheduler_finish(sched, 'sigma_ahc')
+     deallocate(Hamk_batch, k_batch, ik_batch)
+
+     !> adaptive refinement. The integral over the cell of a flagged k point
+     !> is replaced by the average over its refined cells, the difference is
+     !> summed in sigma_refine_mpi with the weight of the star
+     nref= 0
+     allocate(sigma_refine_mpi(3, NumOfmu, NumberofEta))
+     sigma_refine_mpi= 0d0
+     nk_refined= 0d0
+     if (Nk_refine_levels>0) then
+        allocate(refine_flag_mpi(1, nkirr))
+#if defined (MPI)
+        call mpi_allreduce(refine_flag, refine_flag_mpi, size(refine_flag), &
+                          mpi_dp, mpi_sum, mpi_cmw, ierr)
+#else
+        refine_flag_mpi= refine_flag
+#endif
+        nref= count(refine_flag_mpi(1, :)>0.5d0)
+        allocate(ik_refine(nref))
+        ik_refine= pack([(ik, ik=1, nkirr)], refine_flag_mpi(1, :)>0.5d0)
+        deallocate(refine_flag_mpi)
+        if (cpuid.eq.0) write(stdout, '(a, i12, a, i12, a, i3, a)') &
+           ' >> AHC: refining ', nref, ' of ', nkirr, ' k points, up to ', &
+           Nk_refine_levels, ' levels'
+     endif
 
-        !> calculate Berry curvature at a single k point for all bands
-        !> \Omega_n^{\gamma}(k)=i\sum_{\alpha\beta}\epsilon_{\gamma\alpha\beta}(D^{\alpha\dag}D^{\beta})_{nn}
-        call Berry_curvature_singlek_allbands(Dmn_Ham, Omega_BerryCurv)
- 
-        do ieta= 1, NumberofEta
-           eta_local = eta_array(ieta)
-           !> consider the Fermi-distribution according to the broadening Earc_eta
-           Beta_fake= 1d0/eta_local
-   
-           do ie=1, NumOfmu
-              mu = mulist(ie)
-              do m= 1, Num_wann
-                 Omega_BerryCurv_t(m, :)= Omega_BerryCurv(m, :)*fermi(W(m)-mu, Beta_fake)
-              enddo
-              sigma_tensor_ahc_mpi(:, ie, ieta)= sigma_tensor_ahc_mpi(:, ie, ieta)- &
-                 (sum(Omega_BerryCurv_t(:, :), dim=1))
-           enddo ! ie
-        enddo ! ieta
-     enddo ! ik
+     if (nref>0) then
+        !> edges of the cell of a mesh point
+        dk(:, 1)= K3D_vec1_cube/dble(nk1)
+        dk(:, 2)= K3D_vec2_cube/dble(nk2)
+        dk(:, 3)= K3D_vec3_cube/dble(nk3)
+
+        call checkpoint_add(ckpt_refine, sigma_refine_mpi, size(sigma_refine_mpi))
+        call checkpoint_add(ckpt_refine, nk_refined, 1)
+        call checkpoint_start(ckpt_refine, 'sigma_ahc_refine', nref, [mulist, eta_array, &
+           dble(Nk_refine_levels), Refine_threshold, Refine_gap_threshold, dble(nref)])
+
+        !> a refined cell takes up to 8^Nk_refine_levels k points, so the
+        !> cells are handed out one per thread
+        call scheduler_start(sched, nref, nthreads)
+        do while (scheduler_next(sched, ik1, ik2))
+        if (cpuid.eq.0.and. mod(sched%nchunks, 10).eq.1) &
+           write(stdout, '(a, i18, "/", i18, a, f10.2, "s")') 'refined cell', &
+           ik1, nref, '  time left', scheduler_time_left(sched)
+
+        !$OMP PARALLEL DO SCHEDULE(DYNAMIC, 1) &
+        !$OMP PRIVATE(iref, ik, ikx, iky, ikz, j1, k, deg, sigma_k, sigma_cell, nk_cell) &
+        !$OMP REDUCTION(+:sigma_refine_mpi, nk_refined)
+        do iref= ik1, ik2
+           if (checkpoint_done(ckpt_refine, iref)) cycle
+           ik= ik_refine(iref)
+           j1= kcube%ik_array_symm(ik)
+           ikx= (j1-1)/(nk2*nk3)+1
+           iky= ((j1-1-(ikx-1)*Nk2*Nk3)/nk3)+1
+           ikz= (j1-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
+           k= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1)  &
+            + K3D_vec2_cube*(iky-1)/dble(nk2)  &
+            + K3D_vec3_cube*(ikz-1)/dble(nk3)
+
+           !> sigma_k is the value of the first pass, which is replaced
+           call sigma_ahc_refine_cell(k, dk, NumOfmu, mulist, NumberofEta, eta_array, &
+              sigma_k, sigma_cell, nk_cell)
+
+           deg= dble(kcube%ndeg(ik))
+           sigma_refine_mpi= sigma_refine_mpi+ (sigma_cell- sigma_k)*deg
+           nk_refined(1)= nk_refined(1)+ dble(nk_cell)
+           call checkpoint_mark(ckpt_refine, iref)
+        enddo ! iref
+        !$OMP END PARALLEL DO
+        call checkpoint_update(ckpt_refine)
+        enddo
+        call scheduler_finish(sched, 'sigma_ahc_refine')
+     endif
 
+     !> the refined cells are summed with the first pass
+     sigma_tensor_ahc_mpi= sigma_tensor_ahc_mpi+ sigma_refine_mpi
 #if defined (MPI)
      call mpi_allreduce(sigma_tensor_ahc_mpi,sigma_tensor_ahc,size(sigma_tensor_ahc),&
                        mpi_dp,mpi_sum,mpi_cmw,ierr)
+     call mpi_allreduce(nk_refined, nk_refined_all, 1, mpi_dp, mpi_sum, mpi_cmw, ierr)
 #else
      sigma_tensor_ahc= sigma_tensor_ahc_mpi
+     nk_refined_all= nk_refined
 #endif
+     if (nref>0) then
+        if (cpuid.eq.0) write(stdout, '(a, i14, a)') &
+           ' >> AHC: ', nint(nk_refined_all(1), 8), ' k points in the refined cells'
+        call checkpoint_finish(ckpt_refine)
+     endif
+     call checkpoint_finish(ckpt)
+
+     !> the Berry curvature of the stars is symmetric under the operators
+     call symm_average_pseudovector(kcube, NumOfmu*NumberofEta, sigma_tensor_ahc)
    ! --------------------------------------------------------------------
    ! At this point ahc contains
    !
@@ -483,6 +648,182 @@ subroutine sigma_ahc_vary_ChemicalPotential(NumOfmu, mulist, NumberofEta, eta_ar
       ! deallocate( sigma_tensor_ahc_mpi)
   end subroutine sigma_ahc_vary_ChemicalPotential
 
+  subroutine sigma_ahc_fermi_sum(W, Omega_BerryCurv, NumOfmu, mulist, NumberofEta, eta_array, sigma_k, refine)
+   !------------------------------------------------------------------!
+   !> -sum_n Omega_n(k) f(E_n-mu) at one k point for all chemical     !
+   !> potentials and broadenings, the integrand of the AHC            !
+   !>                                                                 !
+   !> refine is .true. if the cell around k should be split by the    !
+   !> adaptive refinement: the integrand is larger than               !
+   !> Refine_threshold, or two neighbouring bands closer than         !
+   !> Refine_gap_threshold lie within 5 eta of the chemical potentials!
+   !------------------------------------------------------------------!
+
+     use para, only : dp, Num_wann, Angstrom2atomic, Nk_refine_levels, &
+        Refine_threshold, Refine_gap_threshold
+     implicit none
+
+     real(dp), intent(in) :: W(Num_wann)
+     real(dp), intent(in) :: Omega_BerryCurv(Num_wann, 3)
+     integer, intent(in) :: NumOfmu
+     real(dp), intent(in) :: mulist(NumOfmu)
+     integer, intent(in) :: NumberofEta
+     real(dp), intent(in) :: eta_array(NumberofEta)
+     real(dp), intent(out) :: sigma_k(3, NumOfmu, NumberofEta)
+     logical, intent(out) :: refine
+
+     integer :: ie, ieta, m
+     real(dp) :: mu, Beta_fake, emin, emax
+     real(dp) :: Omega_BerryCurv_t(Num_wann, 3)
+
+     !> Fermi-Dirac distribution
+     real(dp), external :: fermi
+
+     do ieta= 1, NumberofEta
+        !> consider the Fermi-distribution according to the broadening Earc_eta
+        Beta_fake= 1d0/eta_array(ieta)
+
+        do ie=1, NumOfmu
+           mu = mulist(ie)
+           do m= 1, Num_wann
+              Omega_BerryCurv_t(m, :)= Omega_BerryCurv(m, :)*fermi(W(m)-mu, Beta_fake)
+           enddo
+           sigma_k(:, ie, ieta)= -sum(Omega_BerryCurv_t(:, :), dim=1)
+        enddo ! ie
+     enddo ! ieta
+
+     refine= .false.
+     if (Nk_refine_levels<1) return
+
+     !> Omega is in Bohr^2, Refine_threshold in Angstrom^2
+     refine= maxval(abs(sigma_k))>Refine_threshold*Angstrom2atomic**2
+
+     emin= minval(mulist)- 5d0*maxval(eta_array)
+     emax= maxval(mulist)+ 5d0*maxval(eta_array)
+     do m= 1, Num_wann-1
+        if (W(m+1)-W(m)<Refine_gap_threshold .and. W(m)<emax .and. W(m+1)>emin) refine= .true.
+     enddo
+
+     return
+  end subroutine sigma_ahc_fermi_sum
+
+  subroutine sigma_ahc_singlek(k, NumOfmu, mulist, NumberofEta, eta_array, sigma_k, refine)
+   !------------------------------------------------------------------!
+   !> The integrand of the AHC at a single k point, see               !
+   !> sigma_ahc_fermi_sum                                             !
+   !------------------------------------------------------------------!
+
+     use para, only : dp, Num_wann
+     implicit none
+
+     real(dp), intent(in) :: k(3)
+     integer, intent(in) :: NumOfmu
+     real(dp), intent(in) :: mulist(NumOfmu)
+     integer, intent(in) :: NumberofEta
+     real(dp), intent(in) :: eta_array(NumberofEta)
+     real(dp), intent(out) :: sigma_k(3, NumOfmu, NumberofEta)
+     logical, intent(out) :: refine
+
+     real(dp), allocatable :: W(:)
+     real(dp), allocatable :: Omega_BerryCurv(:, :)
+     complex(dp), allocatable :: UU(:, :)
+     complex(dp), allocatable :: Vmn_Ham(:, :, :)
+     complex(dp), allocatable :: Dmn_Ham(:, :, :)
+
+     allocate(W(Num_wann), Omega_BerryCurv(Num_wann, 3))
+     allocate(UU(Num_wann, Num_wann))
+     allocate(Vmn_Ham(Num_wann, Num_wann, 3), Dmn_Ham(Num_wann, Num_wann, 3))
+
+     !> the same H(k) as in the k mesh of sigma_ahc_vary_ChemicalPotential
+     call ham_bulk_atomicgauge_batch(1, k, UU)
+     call eigensystem_c( 'V', 'U', Num_wann, UU, W)
+     call dHdk_atomicgauge_Ham(k, UU, Vmn_Ham)
+     call get_Dmn_Ham(W, Vmn_Ham, Dmn_Ham)
+     call Berry_curvature_singlek_allbands(Dmn_Ham, Omega_BerryCurv)
+
+     call sigma_ahc_fermi_sum(W, Omega_BerryCurv, NumOfmu, mulist, &
+        NumberofEta, eta_array, sigma_k, refine)
+
+     deallocate(W, Omega_BerryCurv, UU, Vmn_Ham, Dmn_Ham)
+
+     return
+  end subroutine sigma_ahc_singlek
+
+  subroutine sigma_ahc_refine_cell(k0, dk, NumOfmu, mulist, NumberofEta, eta_array, &
+        sigma0, sigma_cell, nk_cell)
+   !------------------------------------------------------------------!
+   !> Average of the AHC integrand over the cell k0+ dk*x with        !
+   !> x in [-1/2, 1/2]^3                                              !
+   !>                                                                 !
+   !> The cell is split into 2x2x2 cells, and every new cell that     !
+   !> sigma_ahc_fermi_sum flags is split again, down to the level     !
+   !> Nk_refine_levels. The cells that are not split contribute their !
+   !> centre value times their volume. sigma0 is the value at k0,     !
+   !> nk_cell the number of k points in the new cells.                !
+   !------------------------------------------------------------------!
+
+     use para, only : dp, Nk_refine_levels
+     implicit none
+
+     real(dp), intent(in) :: k0(3)
+     real(dp), intent(in) :: dk(3, 3)
+     integer, intent(in) :: NumOfmu
+     real(dp), intent(in) :: mulist(NumOfmu)
+     integer, intent(in) :: NumberofEta
+     real(dp), intent(in) :: eta_array(NumberofEta)
+     real(dp), intent(out) :: sigma0(3, NumOfmu, NumberofEta)
+     real(dp), intent(out) :: sigma_cell(3, NumOfmu, NumberofEta)
+     integer, intent(out) :: nk_cell
+
+     integer :: nstack, level, i
+     logical :: refine
+     real(dp) :: k(3), s(3)
+     real(dp), allocatable :: sigma_k(:, :, :)
+
+     !> cells still to be done, depth first. Their centres and levels,
+     !> at most 7 per level and the 8 of the last one are waiting
+     real(dp), allocatable :: kstack(:, :)
+     integer, allocatable :: lstack(:)
+
+     allocate(sigma_k(3, NumOfmu, NumberofEta))
+     allocate(kstack(3, 8*Nk_refine_levels+1), lstack(8*Nk_refine_levels+1))
+
+     sigma0= 0d0
+     sigma_cell= 0d0
+     nk_cell= 0
+     nstack= 1
+     kstack(:, 1)= k0
+     lstack(1)= 0
+     do while (nstack>0)
+        k= kstack(:, nstack)
+        level= lstack(nstack)
+        nstack= nstack- 1
+
+        call sigma_ahc_singlek(k, NumOfmu, mulist, NumberofEta, eta_array, sigma_k, refine)
+        if (level==0) then
+           sigma0= sigma_k
+        else
+           nk_cell= nk_cell+ 1
+        endif
+
+        if (level==0 .or. (refine .and. level<Nk_refine_levels)) then
+           !> the centres of the 8 cells of half the size
+           do i= 0, 7
+              s= [dble(2*mod(i, 2)-1), dble(2*mod(i/2, 2)-1), dble(2*mod(i/4, 2)-1)]
+              nstack= nstack+ 1
+              kstack(:, nstack)= k+ matmul(dk, s)/2d0**(level+2)
+              lstack(nstack)= level+ 1
+           enddo
+        else
+           sigma_cell= sigma_cell+ sigma_k/8d0**level
+        endif
+     enddo
+
+     deallocate(sigma_k, kstack, lstack)
+
+     return
+  end subroutine sigma_ahc_refine_cell
+
   subroutine sigma_SHC
    !------------------------------------------------------------------!
    !> This subroutine is to calculate the spin Hall conductivity      !
@@ -503,12 +844,12 @@ subroutine sigma_ahc_vary_ChemicalPotential(NumOfmu, mulist, NumberofEta, eta_ar
      use para
      implicit none
     
-     integer :: ik, ikx, iky, ikz, ieta
+     integer :: ik, ikx, iky, ikz, ieta, j1
      integer :: m, n, i, j, ie, ialpha, ibeta, igamma
-     integer :: ierr, knv3, nwann
+     integer :: ierr, knv3, nwann, nkirr
      integer :: NumberofEta
 
-     real(dp) :: mu, Beta_fake, deno_fac, eta_local
+     real(dp) :: mu, Beta_fake, deno_fac, eta_local, deg
      real(dp) :: k(3)
 
      real(dp) :: time_start, time_end
@@ -545,6 +886,9 @@ subroutine sigma_ahc_vary_ChemicalPotential(NumOfmu, mulist, NumberofEta, eta_ar
      real(dp), allocatable :: eta_array(:)
      character(80) :: shcfilename, etaname
 
+     !> irreducible k points of the k cube
+     type(kcube_type_symm) :: kcube
+
      NumberofEta=9
 
      allocate(Vmn_Ham(Num_wann, Num_wann, 3))
@@ -605,19 +949,25 @@ subroutine sigma_ahc_vary_ChemicalPotential(NumOfmu, mulist, NumberofEta, eta_ar
      enddo ! ie
 
      knv3= Nk1*Nk2*Nk3
+     call kmesh_symm_reduce(kcube, Nk1, Nk2, Nk3, K3D_start_cube, &
+        K3D_vec1_cube, K3D_vec2_cube, K3D_vec3_cube)
+     nkirr= kcube%Nk_total_symm
 
      call now(time_start) 
-     do ik= 1+ cpuid, knv3, num_cpu
+     do ik= 1+ cpuid, nkirr, num_cpu
         if (cpuid.eq.0.and. mod(ik/num_cpu, 100).eq.0) then
            call now(time_end) 
            write(stdout, '(a, i18, "/", i18, a, f10.2, "s")') 'ik/knv3', &
-           ik, knv3, '  time left', (knv3-ik)*(time_end-time_start)/num_cpu/100d0
+           ik, nkirr, '  time left', (nkirr-ik)*(time_end-time_start)/num_cpu/100d0
            time_start= time_end
         endif
 
-        ikx= (ik-1)/(nk2*nk3)+1
-        iky= ((ik-1-(ikx-1)*Nk2*Nk3)/nk3)+1
-        ikz= (ik-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
+        !> the k point stands for its star of deg k points
+        j1= kcube%ik_array_symm(ik)
+        deg= dble(kcube%ndeg(ik))
+        ikx= (j1-1)/(nk2*nk3)+1
+        iky= ((j1-1-(ikx-1)*Nk2*Nk3)/nk3)+1
+        ikz= (j1-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
         k= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1)  &
          + K3D_vec2_cube*(iky-1)/dble(nk2)  &
          + K3D_vec3_cube*(ikz-1)/dble(nk3)
@@ -683,7 +1033,7 @@ subroutine sigma_ahc_vary_ChemicalPotential(NumOfmu, mulist, NumberofEta, eta_ar
                        !> sum over all "spin" Berry curvature below chemical potential mu
                        sigma_tensor_shc_mpi(ie, igamma, ialpha, ibeta, ieta)= &
                           sigma_tensor_shc_mpi(ie, igamma, ialpha, ibeta, ieta)+ &
-                          sum(Omega_spin_t(:))
+                          sum(Omega_spin_t(:))*deg
                     enddo ! ie
                  enddo ! ibeta  v
               enddo ! ieta=1, NumberofEta
@@ -698,6 +1048,13 @@ subroutine sigma_ahc_vary_ChemicalPotential(NumOfmu, mulist, NumberofEta, eta_ar
      sigma_tensor_shc= sigma_tensor_shc_mpi
 #endif
 
+     !> the spin Berry curvature of the stars is symmetric under the operators
+     do ieta= 1, NumberofEta
+        do ie= 1, OmegaNum
+           call symm_average_spin_tensor(kcube, sigma_tensor_shc(ie, :, :, :, ieta))
+        enddo
+     enddo
+
      !> in the latest version, we use the atomic unit
      !> in unit of ((hbar/e)(Ohm*m)^-1
      sigma_tensor_shc= sigma_tensor_shc/dble(knv3)/Origin_cell%CellVolume*&
@@ -0,0 +1,270 @@
+!> Interpolation of the band energies and velocities along the cyclotron
+!> orbits of sigma_OHE.
+!>
+!> RKF45_pack needs E_n(k) and v_n(k) of one band at every step of every
+!> orbit, each time with a diagonalization of H(k). With Nk_interp > 0 the
+!> bands in bands_fermi_level are diagonalized once on a regular
+!> Nk_interp^3 grid over the reciprocal cell, and E_n and v_n are then
+!> evaluated by periodic tricubic (Catmull-Rom) interpolation of the grid
+!> values, which needs 64 grid points and no diagonalization.
+!>
+!> The error is checked once per grid cell against the exact values at the
+!> cell centre. Cells where |dE| + |dv|*dk is larger than Interp_tolerance,
+!> dk being the largest grid spacing, usually cells with band crossings,
+!> are marked, and k points inside them fall back to the exact
+!> diagonalization.
+!>
+!> Usage:
+!>    call band_interp_build(Nband_Fermi_Level, bands_fermi_level)
+!>    ...
+!>    if (band_interp_eval(iband, k, velocity_k, E_iband)) ...
+!>    call band_interp_free
+!>
+!> band_interp_build and band_interp_free are collective over all ranks.
+!> Without a table band_interp_eval always returns .false.
+
+module band_interp
+   use wmpi
+   use para, only : dp, stdout, Nk_interp, Interp_tolerance, EF_integral_range, &
+      eV2Hartree, Origin_cell
+   implicit none
+
+   !> number of grid points along each reciprocal lattice vector
+   integer, save :: interp_nk= 0
+
+   !> band indices of the table
+   integer, allocatable, save :: interp_bands(:)
+
+   !> E, vx, vy, vz on the grid, (4, 0:nk-1, 0:nk-1, 0:nk-1, band),
+   !> in the units of velocity_calc
+   real(dp), allocatable, save :: interp_table(:, :, :, :, :)
+
+   !> cells where the exact calculation is used, (0:nk-1, 0:nk-1, 0:nk-1, band)
+   logical, allocatable, save :: interp_exact(:, :, :, :)
+
+   !> number of evaluations from the table and of exact fallbacks
+   real(dp), save :: interp_count(2)= 0d0
+
+contains
+
+   subroutine band_interp_build(nbands, bands)
+      !> Tabulate the bands on the Nk_interp^3 grid and check the cells.
+      !> Does nothing if Nk_interp <= 0.
+      implicit none
+
+      integer, intent(in) :: nbands
+      integer, intent(in) :: bands(nbands)
+
+      integer :: n, ig, ib, c(3), ierr
+      integer :: nexact
+      real(dp) :: k(3), dk, err, time_start, time_end
+      real(dp) :: w(4, 3), f(4)
+      real(dp), allocatable :: Ek(:), velocity_k(:, :)
+      real(dp), allocatable :: table_mpi(:, :, :, :, :)
+      real(dp), allocatable :: cell_err(:, :, :, :), cell_err_mpi(:, :, :, :)
+
+      call band_interp_free
+      if (Nk_interp<=0 .or. nbands<=0) return
+
+      call now(time_start)
+      n= Nk_interp
+      interp_nk= n
+      allocate(interp_bands(nbands))
+      interp_bands= bands
+      allocate(interp_table(4, 0:n-1, 0:n-1, 0:n-1, nbands))
+      allocate(table_mpi(4, 0:n-1, 0:n-1, 0:n-1, nbands))
+      allocate(interp_exact(0:n-1, 0:n-1, 0:n-1, nbands))
+      allocate(cell_err(0:n-1, 0:n-1, 0:n-1, nbands))
+      allocate(cell_err_mpi(0:n-1, 0:n-1, 0:n-1, nbands))
+      allocate(Ek(nbands), velocity_k(3, nbands))
+      table_mpi= 0d0
+      cell_err_mpi= 0d0
+      interp_exact= .false.
+
+      !> energies and velocities on the grid points
+      do ig= 1+ cpuid, n**3, num_cpu
+         call grid_index(ig, n, c)
+         k= c/dble(n)
+         call velocity_calc(nbands, bands, k, velocity_k, Ek)
+         do ib= 1, nbands
+            table_mpi(1, c(1), c(2), c(3), ib)= Ek(ib)
+            table_mpi(2:4, c(1), c(2), c(3), ib)= velocity_k(:, ib)
+         enddo
+      enddo
+#if defined (MPI)
+      call mpi_allreduce(table_mpi, interp_table, size(interp_table), &
+                        mpi_dp, mpi_sum, mpi_cmw, ierr)
+#else
+      interp_table= table_mpi
+#endif
+      deallocate(table_mpi)
+
+      !> compare with the exact values at the cell centres
+      dk= max(norm2(Origin_cell%Kua), norm2(Origin_cell%Kub), norm2(Origin_cell%Kuc))/n
+      w= spread(catmull_rom(0.5d0), 2, 3)
+      do ig= 1+ cpuid, n**3, num_cpu
+         call grid_index(ig, n, c)
+         k= (c+ 0.5d0)/dble(n)
+         call velocity_calc(nbands, bands, k, velocity_k, Ek)
+         do ib= 1, nbands
+            call interp_value(ib, c, w, f)
+            !> bands away from the Fermi level are not integrated, the
+            !> margin |v|*dk covers the change of E within the cell
+            if ((min(abs(Ek(ib)), abs(f(1)))- norm2(velocity_k(:, ib))*dk)/eV2Hartree &
+                >EF_integral_range) cycle
+            err= abs(f(1)- Ek(ib))+ norm2(f(2:4)- velocity_k(:, ib))*dk
+            cell_err_mpi(c(1), c(2), c(3), ib)= err
+         enddo
+      enddo
+#if defined (MPI)
+      call mpi_allreduce(cell_err_mpi, cell_err, size(cell_err), &
+                        mpi_dp, mpi_sum, mpi_cmw, ierr)
+#else
+      cell_err= cell_err_mpi
+#endif
+      interp_exact= cell_err>Interp_tolerance
+      nexact= count(interp_exact)
+      call now(time_end)
+
+      if (cpuid.eq.0) then
+         write(stdout, '(a, i5, a, i5, a, f10.2, a)') &
+            ' >> Band interpolation on a ', n, '^3 grid for ', nbands, &
+            ' bands, built in ', time_end- time_start, ' s'
+         write(stdout, '(a, i12, a, i12, a)') &
+            ' >> Band interpolation: exact calculation in ', nexact, &
+            ' of ', size(interp_exact), ' cells'
+      endif
+
+      return
+   end subroutine band_interp_build
+
+
+   logical function band_interp_eval(iband, k, velocity_k, E_iband)
+      !> E and v of band iband at the fractional k from the table.
+      !> Returns .false. without a table for iband, or if k lies in a cell
+      !> that failed the error check; the outputs are not set then.
+      implicit none
+
+      integer, intent(in) :: iband
+      real(dp), intent(in) :: k(3)
+      real(dp), intent(inout) :: velocity_k(3)
+      real(dp), intent(out) :: E_iband
+
+      integer :: i, ib, c(3)
+      real(dp) :: x, w(4, 3), f(4)
+
+      band_interp_eval= .false.
+      if (.not. allocated(interp_table)) return
+
+      ib= 0
+      do i= 1, size(interp_bands)
+         if (interp_bands(i)==iband) ib= i
+      enddo
+      if (ib==0) return
+
+      do i= 1, 3
+         x= modulo(k(i), 1d0)*interp_nk
+         c(i)= min(int(x), interp_nk- 1)
+         w(:, i)= catmull_rom(x- c(i))
+      enddo
+      if (interp_exact(c(1), c(2), c(3), ib)) then
+         interp_count(2)= interp_count(2)+ 1d0
+         return
+      endif
+
+      call interp_value(ib, c, w, f)
+      E_iband= f(1)
+      velocity_k= f(2:4)
+      interp_count(1)= interp_count(1)+ 1d0
+      band_interp_eval= .true.
+
+      return
+   end function band_interp_eval
+
+
+   subroutine band_interp_free
+      !> Write the statistics of the evaluations and release the table.
+      implicit none
+
+      integer :: ierr
+      real(dp) :: count_all(2)
+
+      if (allocated(interp_table)) then
+#if defined (MPI)
+         call mpi_allreduce(interp_count, count_all, 2, mpi_dp, mpi_sum, mpi_cmw, ierr)
+#else
+         count_all= interp_count
+#endif
+         if (cpuid.eq.0) write(stdout, '(a, i14, a, i14, a)') &
+            ' >> Band interpolation: ', nint(count_all(1), 8), ' interpolated and ', &
+            nint(count_all(2), 8), ' exact evaluations'
+      endif
+
+      if (allocated(interp_bands)) deallocate(interp_bands)
+      if (allocated(interp_table)) deallocate(interp_table)
+      if (allocated(interp_exact)) deallocate(interp_exact)
+      interp_nk= 0
+      interp_count= 0d0
+
+      return
+   end subroutine band_interp_free
+
+
+   subroutine interp_value(ib, c, w, f)
+      !> Tricubic sum over the 4x4x4 grid points around cell c with the
+      !> weights w along the three directions.
+      implicit none
+
+      integer, intent(in) :: ib, c(3)
+      real(dp), intent(in) :: w(4, 3)
+      real(dp), intent(out) :: f(4)
+
+      integer :: i1, i2, i3, j1, j2, j3
+
+      f= 0d0
+      do i3= 1, 4
+         j3= modulo(c(3)+ i3- 2, interp_nk)
+         do i2= 1, 4
+            j2= modulo(c(2)+ i2- 2, interp_nk)
+            do i1= 1, 4
+               j1= modulo(c(1)+ i1- 2, interp_nk)
+               f= f+ w(i1, 1)*w(i2, 2)*w(i3, 3)*interp_table(:, j1, j2, j3, ib)
+            enddo
+         enddo
+      enddo
+
+      return
+   end subroutine interp_value
+
+
+   pure function catmull_rom(t) result(w)
+      !> weights of the grid points -1, 0, 1, 2 at 0 <= t < 1
+      implicit none
+
+      real(dp), intent(in) :: t
+      real(dp) :: w(4)
+
+      w(1)= 0.5d0*(-t**3+ 2d0*t**2- t)
+      w(2)= 0.5d0*(3d0*t**3- 5d0*t**2+ 2d0)
+      w(3)= 0.5d0*(-3d0*t**3+ 4d0*t**2+ t)
+      w(4)= 0.5d0*(t**3- t**2)
+
+      return
+   end function catmull_rom
+
+
+   subroutine grid_index(ig, n, c)
+      !> grid point ig= 1..n^3 to its indices 0..n-1, the last one fastest
+      implicit none
+
+      integer, intent(in) :: ig, n
+      integer, intent(out) :: c(3)
+
+      c(1)= (ig- 1)/(n*n)
+      c(2)= mod((ig- 1)/n, n)
+      c(3)= mod(ig- 1, n)
+
+      return
+   end subroutine grid_index
+
+end module band_interp
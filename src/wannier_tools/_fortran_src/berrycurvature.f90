@@ -93,6 +93,7 @@
 
      use wmpi
      use para
+     use slab_banded
      implicit none
 
      !> input parameter, k is in unit of reciprocal lattice vectors
@@ -102,7 +103,7 @@
      integer :: m, n, Mdim, i1, i2
      real(dp), allocatable :: W(:)
      complex(dp), allocatable :: Amat(:, :), DHDk(:, :, :), DHDkdag(:, :, :)
-     complex(dp), allocatable :: UU(:, :), UU_dag(:, :), Hamk_slab(:, :)
+     complex(dp), allocatable :: UU(:, :), UU_dag(:, :)
      complex(dp), allocatable :: vx(:, :), vy(:, :)
      complex(dp), allocatable :: Vij_x(:, :, :), Vij_y(:, :, :)
 
@@ -111,7 +112,7 @@
 
      allocate(W(Mdim))
      allocate(vx(Mdim, Mdim), vy(Mdim, Mdim))
-     allocate(UU(Mdim, Mdim), UU_dag(Mdim, Mdim), Hamk_slab(Mdim, Mdim))
+     allocate(UU(Mdim, Mdim), UU_dag(Mdim, Mdim))
      allocate(Amat(Mdim, Mdim), DHDk(Mdim, Mdim, 3), DHDkdag(Mdim, Mdim, 3))
      allocate(Vij_x(-ijmax:ijmax, Num_wann, Num_wann))
      allocate(Vij_y(-ijmax:ijmax, Num_wann, Num_wann))
@@ -133,11 +134,8 @@
      enddo ! i1
 
      ! calculation slab hamiltonian by a direct Fourier transformation of HmnR
-     call ham_slab(k, Hamk_slab)
-
-     !> diagonalization by call zheev in lapack
-     UU=Hamk_slab
-     call eigensystem_c( 'V', 'U', Mdim, UU, W)
+     !> and diagonalization, dense or banded, see slab_banded.f90
+     call eigensystem_slab(k, UU, W)
     !call zhpevx_pack(hamk_slab,Mdim, W, UU)
 
      UU_dag= conjg(transpose(UU))
@@ -1146,6 +1144,7 @@
 
      use wmpi
      use para
+     use result_sink
      implicit none
     
      integer :: ik, i, j, m, n, ierr, nkmesh2
@@ -1154,6 +1153,9 @@
 
      !> k points slice
      real(dp), allocatable :: kslice(:, :), kslice_xyz(:, :)
+
+     !> k points in the rotated frame of the plane, for the binary output
+     real(dp), allocatable :: kslice_plane(:, :)
    
      real(dp) :: time_start, time_end, time_start0
 
@@ -1265,9 +1267,30 @@
      m_OrbMag_allk_EF_mpi= m_OrbMag_allk_EF
 #endif
 
+     !> binary output, Berry curvature in Angstrom^2 as (k1, k2, direction)
+     if (cpuid==0 .and. result_binary) then
+        allocate(kslice_plane(3, nkmesh2))
+        do ik= 1, nkmesh2
+           call rotate_k3_to_kplane(kslice_xyz(:, ik), kslice_plane(:, ik))
+        enddo
+        call result_write('berry/k', [3, nk2, nk1], kslice_xyz*Angstrom2atomic, '1/Angstrom', &
+           'k1,k2,direction')
+        call result_write('berry/k_plane', [3, nk2, nk1], kslice_plane*Angstrom2atomic, &
+           '1/Angstrom', 'k1,k2,direction')
+        call result_write('berry/omega_occ_sum', [3, nk2, nk1], &
+           Omega_allk_Occ_mpi(1, :, :)/Angstrom2atomic**2, 'Angstrom^2', 'k1,k2,direction')
+        call result_write('berry/omega_occ_band', [3, nk2, nk1], &
+           Omega_allk_Occ_mpi(2, :, :)/Angstrom2atomic**2, 'Angstrom^2', 'k1,k2,direction')
+        call result_write('berry/omega_ef_sum', [3, nk2, nk1], &
+           Omega_allk_EF_mpi(1, :, :)/Angstrom2atomic**2, 'Angstrom^2', 'k1,k2,direction')
+        call result_write('berry/omega_ef_band', [3, nk2, nk1], &
+           Omega_allk_EF_mpi(2, :, :)/Angstrom2atomic**2, 'Angstrom^2', 'k1,k2,direction')
+        deallocate(kslice_plane)
+     endif
+
      !> write the Berry curvature to file
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='Berrycurvature.dat')
         write(outfileindex, '(a)')'# Berry curvature in unit of (Angstrom^2)  '
         write(outfileindex, '("#", 30X,4a36)')'Sum over 1-NumOccupied bands', &
@@ -1303,10 +1326,21 @@
      m_OrbMag_allk_EF_mpi= m_OrbMag_allk_EF_mpi*eV2Hartree*Ang2Bohr**2*2
      m_OrbMag_allk_Occ_mpi= m_OrbMag_allk_Occ_mpi*eV2Hartree*Ang2Bohr**2*2
 
+     if (cpuid==0 .and. result_binary) then
+        call result_write('orbmag/m_occ_sum', [3, nk2, nk1], m_OrbMag_allk_Occ_mpi(1, :, :), &
+           'mu_B', 'k1,k2,direction')
+        call result_write('orbmag/m_occ_band', [3, nk2, nk1], m_OrbMag_allk_Occ_mpi(2, :, :), &
+           'mu_B', 'k1,k2,direction')
+        call result_write('orbmag/m_ef_sum', [3, nk2, nk1], m_OrbMag_allk_EF_mpi(1, :, :), &
+           'mu_B', 'k1,k2,direction')
+        call result_write('orbmag/m_ef_band', [3, nk2, nk1], m_OrbMag_allk_EF_mpi(2, :, :), &
+           'mu_B', 'k1,k2,direction')
+     endif
+
 
      !> write the orbital magnetization to file
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='Orbitalmagnetization.dat')
         write(outfileindex, '(a)')'# Orbital magnetization in unit of Bohr magneton \mu_B'
         write(outfileindex, '("#col ", i5, 200i12)')(i, i=1, 15)
@@ -1335,7 +1369,7 @@
 
      !> generate gnuplot script to plot the Berry curvature
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         vmin=minval(Omega_allk_Occ_mpi(1, :, :))
         vmax=maxval(Omega_allk_Occ_mpi(1, :, :))
         open(unit=outfileindex, file='Berrycurvature.gnu')
@@ -1408,7 +1442,7 @@
 
      !> generate gnuplot script to plot the Berry curvature
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
 
         open(unit=outfileindex, file='Orbitalmagnetization.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
@@ -1456,7 +1490,7 @@
 
      !> write the normalized Berry curvature to file in order to generate vector plot
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='Berrycurvature-normalized.dat')
         write(outfileindex, '(a)')'# Omega(k)/|Omega(k)|, Omega(k) comes from the 4,5,6 columns of Berrycurvature.dat.'
         write(outfileindex, '("#col ", i5, 200i12)')(i, i=1, 6)
@@ -1479,7 +1513,7 @@
 
      !> generate gnuplot script to plot the Berry curvature
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
 
         open(unit=outfileindex, file='Berrycurvature-normalized.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
@@ -0,0 +1,531 @@
+!> Checkpoints of long k-point loops, so that a killed run can be resumed.
+!>
+!> Every rank writes its partial accumulators and the list of k points it
+!> has finished to wt_checkpoint_<name>_<rank>.bin, at most once per
+!> Checkpoint_interval seconds. With wt-py --resume, rank 0 reads the files
+!> of the previous run back, adds them to its own accumulators, and all
+!> ranks skip the k points that are already done. The usual sum over the
+!> ranks at the end then gives the same result as an uninterrupted run. The
+!> previous run may have used a different number of ranks.
+!>
+!> Usage:
+!>    call checkpoint_add(ckpt, sums, size(sums))         ! summed over k
+!>    call checkpoint_add_items(ckpt, values, nper)       ! values(nper, nk)
+!>    call checkpoint_start(ckpt, 'name', nk, key)
+!>    do ik= ...
+!>       if (checkpoint_done(ckpt, ik)) cycle
+!>       ... add the contribution of ik to sums, or set values(:, ik)
+!>       call checkpoint_mark(ckpt, ik)
+!>    enddo
+!>    call checkpoint_update(ckpt)       ! between chunks, writes if it is time
+!>    ...
+!>    call checkpoint_finish(ckpt)       ! after the results are written
+!>
+!> The registered arrays need the target attribute and have to stay
+!> allocated until checkpoint_finish. The optional key holds the input
+!> parameters the results depend on, files with a different key are not
+!> used. checkpoint_start and checkpoint_finish
+!> are collective, checkpoint_update has to be called outside of OpenMP
+!> parallel regions, checkpoint_done and checkpoint_mark may be called by
+!> any thread. The files are written to a temporary name and renamed, so a
+!> run killed while writing still leaves the previous checkpoint behind.
+
+module checkpoint
+   use wmpi
+   use prec
+   use iso_c_binding
+   implicit none
+
+   integer, parameter :: checkpoint_max_arrays= 16
+
+   !> kinds of registered arrays
+   integer, parameter :: checkpoint_sum= 1
+   integer, parameter :: checkpoint_items= 2
+
+   character(8), parameter :: checkpoint_magic= 'WTCKPT01'
+   character(8), parameter :: checkpoint_trailer= 'WTCKPTEN'
+
+   type checkpoint_type
+      character(40) :: name= ' '
+
+      !> number of k points, done(ik): finished by any rank in this or the
+      !> previous runs, mine(ik): the results of ik are held by this rank
+      integer :: nitems= 0
+      logical, allocatable :: done(:)
+      logical, allocatable :: mine(:)
+
+      !> parameters of the calculation, compared when reading files
+      real(dp), allocatable :: key(:)
+
+      !> generation of the files, increased on every resume
+      integer :: generation= 1
+
+      !> number of files of the previous run, only known on rank 0
+      integer :: nfiles_old= 0
+
+      !> registered arrays
+      integer :: narrays= 0
+      integer :: kinds(checkpoint_max_arrays)= 0
+      integer :: sizes(checkpoint_max_arrays)= 0
+      type(c_ptr) :: ptrs(checkpoint_max_arrays)
+
+      !> wall time of the last write
+      real(dp) :: time_last= 0d0
+   end type checkpoint_type
+
+   !> set by wt-py --resume through wt_set_checkpoint_resume
+   logical, save :: checkpoint_resume= .false.
+
+contains
+
+   subroutine checkpoint_add(ckpt, a, n)
+      !> Register an accumulator a(1:n) that is summed over the k points
+      implicit none
+
+      type(checkpoint_type), intent(inout) :: ckpt
+      integer, intent(in) :: n
+      real(dp), target, intent(inout) :: a(n)
+
+      call checkpoint_register(ckpt, checkpoint_sum, n, c_loc(a(1)))
+
+      return
+   end subroutine checkpoint_add
+
+   subroutine checkpoint_add_items(ckpt, a, nper)
+      !> Register results a(1:nper, ik) that are stored per k point
+      implicit none
+
+      type(checkpoint_type), intent(inout) :: ckpt
+      integer, intent(in) :: nper
+      real(dp), target, intent(inout) :: a(nper, *)
+
+      call checkpoint_register(ckpt, checkpoint_items, nper, c_loc(a(1, 1)))
+
+      return
+   end subroutine checkpoint_add_items
+
+   subroutine checkpoint_register(ckpt, kind, n, ptr)
+      use para, only : stdout
+      implicit none
+
+      type(checkpoint_type), intent(inout) :: ckpt
+      integer, intent(in) :: kind, n
+      type(c_ptr), intent(in) :: ptr
+
+      if (ckpt%narrays>=checkpoint_max_arrays) then
+         if (cpuid==0) write(stdout, *)'ERROR: too many arrays in the checkpoint'
+         stop
+      endif
+
+      ckpt%narrays= ckpt%narrays+ 1
+      ckpt%kinds(ckpt%narrays)= kind
+      ckpt%sizes(ckpt%narrays)= n
+      ckpt%ptrs(ckpt%narrays)= ptr
+
+      return
+   end subroutine checkpoint_register
+
+   subroutine checkpoint_start(ckpt, name, nitems, key)
+      !> Start the checkpoints of the loop over nitems k points. With
+      !> checkpoint_resume, the files of the previous run are read on rank 0
+      !> and the finished k points are sent to all ranks. Otherwise old files
+      !> are removed. Collective over all ranks.
+      use para, only : stdout
+      implicit none
+
+      type(checkpoint_type), intent(inout) :: ckpt
+      character(*), intent(in) :: name
+      integer, intent(in) :: nitems
+      real(dp), intent(in), optional :: key(:)
+
+      integer :: ifile, gen0, nfiles0, ndone
+      logical :: ok
+
+#if defined (MPI)
+      integer :: ierr
+#endif
+
+      ckpt%name= name
+      ckpt%nitems= nitems
+      ckpt%generation= 1
+      ckpt%nfiles_old= 0
+      if (allocated(ckpt%done)) deallocate(ckpt%done)
+      if (allocated(ckpt%mine)) deallocate(ckpt%mine)
+      if (allocated(ckpt%key)) deallocate(ckpt%key)
+      allocate(ckpt%done(nitems), ckpt%mine(nitems))
+      if (present(key)) then
+         allocate(ckpt%key(size(key)))
+         ckpt%key= key
+      else
+         allocate(ckpt%key(0))
+      endif
+      ckpt%done= .false.
+      ckpt%mine= .false.
+
+      if (cpuid==0) then
+         call checkpoint_read_header(ckpt, 0, gen0, nfiles0, ok)
+         if (ok) then
+            ckpt%nfiles_old= nfiles0
+            if (checkpoint_resume) then
+               do ifile= 0, nfiles0-1
+                  call checkpoint_absorb(ckpt, ifile, gen0)
+               enddo
+               ckpt%generation= gen0+ 1
+            else
+               do ifile= 0, nfiles0-1
+                  call checkpoint_delete(ckpt, ifile)
+               enddo
+               ckpt%nfiles_old= 0
+            endif
+         elseif (checkpoint_resume) then
+            write(stdout, '(3a)')' No usable checkpoint for ', trim(ckpt%name), &
+               ', starting from the beginning'
+         endif
+
+         ndone= count(ckpt%done)
+         if (ndone>0) then
+            write(stdout, '(3a, i10, a, i10, a)')' Resuming ', trim(ckpt%name), &
+               ' from the checkpoint, ', ndone, ' of ', nitems, ' k points are done'
+
+            !> the absorbed results now only live in this file
+            call checkpoint_write(ckpt)
+         endif
+      endif
+
+#if defined (MPI)
+      if (num_cpu>1) then
+         !> the generation is only known on rank 0, the other ranks add 0.
+         !> mpi_bcast is kept for the LOGICAL flags alone, an INTEGER buffer
+         !> in a second mpi_bcast is a type mismatch without an interface
+         if (cpuid/=0) ckpt%generation= 0
+         gen0= ckpt%generation
+         call mpi_allreduce(gen0, ckpt%generation, 1, mpi_in, mpi_sum, mpi_cmw, ierr)
+         call mpi_bcast(ckpt%done, nitems, mpi_logical, 0, mpi_cmw, ierr)
+      endif
+#endif
+
+      call now(ckpt%time_last)
+
+      return
+   end subroutine checkpoint_start
+
+   logical function checkpoint_done(ckpt, i)
+      !> .true. if k point i was finished before the resume
+      implicit none
+
+      type(checkpoint_type), intent(in) :: ckpt
+      integer, intent(in) :: i
+
+      checkpoint_done= ckpt%done(i)
+
+      return
+   end function checkpoint_done
+
+   subroutine checkpoint_mark(ckpt, i)
+      !> k point i is finished and its contribution is in the registered arrays
+      implicit none
+
+      type(checkpoint_type), intent(inout) :: ckpt
+      integer, intent(in) :: i
+
+      ckpt%mine(i)= .true.
+
+      return
+   end subroutine checkpoint_mark
+
+   subroutine checkpoint_update(ckpt, force)
+      !> Write the checkpoint of this rank if Checkpoint_interval has passed,
+      !> or in any case with force, e.g. when a loop is finished but the
+      !> checkpoint is still needed
+      use para, only : Checkpoint_interval
+      implicit none
+
+      type(checkpoint_type), intent(inout) :: ckpt
+      logical, intent(in), optional :: force
+
+      real(dp) :: time_now
+      logical :: write_now
+
+      if (.not.allocated(ckpt%mine)) return
+      if (Checkpoint_interval<=0d0) return
+
+      call now(time_now)
+
+      !> the clock of now() restarts at the beginning of a month
+      if (time_now<ckpt%time_last) ckpt%time_last= time_now
+      write_now= time_now- ckpt%time_last>=Checkpoint_interval
+      if (present(force)) write_now= write_now .or. force
+      if (.not.write_now) return
+
+      call checkpoint_write(ckpt)
+      call now(ckpt%time_last)
+
+      return
+   end subroutine checkpoint_update
+
+   subroutine checkpoint_finish(ckpt)
+      !> Remove the checkpoint files once the results are safe.
+      !> Collective over all ranks.
+      implicit none
+
+      type(checkpoint_type), intent(inout) :: ckpt
+
+      integer :: ifile
+
+#if defined (MPI)
+      integer :: ierr
+      call mpi_barrier(mpi_cmw, ierr)
+#endif
+
+      if (.not.allocated(ckpt%mine)) return
+
+      call checkpoint_delete(ckpt, cpuid)
+
+      !> files of a previous run with more ranks
+      if (cpuid==0) then
+         do ifile= num_cpu, ckpt%nfiles_old-1
+            call checkpoint_delete(ckpt, ifile)
+         enddo
+      endif
+
+      deallocate(ckpt%done, ckpt%mine, ckpt%key)
+      ckpt%narrays= 0
+
+      return
+   end subroutine checkpoint_finish
+
+   function checkpoint_filename(ckpt, ifile) result(fname)
+      implicit none
+
+      type(checkpoint_type), intent(in) :: ckpt
+      integer, intent(in) :: ifile
+      character(80) :: fname
+
+      write(fname, '(3a, i0, a)')'wt_checkpoint_', trim(ckpt%name), '_', ifile, '.bin'
+
+      return
+   end function checkpoint_filename
+
+   subroutine checkpoint_delete(ckpt, ifile)
+      implicit none
+
+      type(checkpoint_type), intent(in) :: ckpt
+      integer, intent(in) :: ifile
+
+      integer :: iunit, ios
+      character(80) :: fname
+
+      !> also a temporary file left behind by a killed run
+      fname= checkpoint_filename(ckpt, ifile)
+      open(newunit=iunit, file=fname, status='old', iostat=ios)
+      if (ios==0) close(iunit, status='delete')
+      open(newunit=iunit, file=trim(fname)//'.tmp', status='old', iostat=ios)
+      if (ios==0) close(iunit, status='delete')
+
+      return
+   end subroutine checkpoint_delete
+
+   subroutine checkpoint_write(ckpt)
+      !> Header, the k points held by this rank, the sums and the per k
+      !> point results of those k points
+      use para, only : stdout
+      implicit none
+
+      type(checkpoint_type), intent(in) :: ckpt
+
+      integer :: iunit, ios, ia, ik, nmine
+      integer, allocatable :: idx(:)
+      real(dp), pointer :: a(:), b(:, :)
+      character(80) :: fname
+
+      nmine= count(ckpt%mine)
+      allocate(idx(nmine))
+      idx= pack([(ik, ik=1, ckpt%nitems)], ckpt%mine)
+
+      fname= checkpoint_filename(ckpt, cpuid)
+      open(newunit=iunit, file=trim(fname)//'.tmp', access='stream', &
+         form='unformatted', status='replace', iostat=ios)
+      if (ios/=0) return
+
+      write(iunit)checkpoint_magic, ckpt%name, ckpt%generation, num_cpu, &
+         ckpt%nitems, ckpt%narrays
+      write(iunit)ckpt%kinds(1:ckpt%narrays), ckpt%sizes(1:ckpt%narrays)
+      write(iunit)size(ckpt%key), ckpt%key
+      write(iunit)nmine, idx
+
+      do ia= 1, ckpt%narrays
+         if (ckpt%kinds(ia)==checkpoint_sum) then
+            call c_f_pointer(ckpt%ptrs(ia), a, [ckpt%sizes(ia)])
+            write(iunit)a
+         else
+            call c_f_pointer(ckpt%ptrs(ia), b, [ckpt%sizes(ia), ckpt%nitems])
+            do ik= 1, nmine
+               write(iunit)b(:, idx(ik))
+            enddo
+         endif
+      enddo
+
+      write(iunit)checkpoint_trailer
+      close(iunit)
+
+      call rename_file(trim(fname)//'.tmp', trim(fname), ios)
+      if (ios/=0) write(stdout, '(3a)')' Warning: could not rename ', &
+         trim(fname)//'.tmp', ', the previous checkpoint is kept'
+
+      deallocate(idx)
+
+      return
+   end subroutine checkpoint_write
+
+   subroutine checkpoint_read_header(ckpt, ifile, generation, nfiles, ok)
+      !> ok if file ifile belongs to the same calculation with the same arrays
+      implicit none
+
+      type(checkpoint_type), intent(in) :: ckpt
+      integer, intent(in) :: ifile
+      integer, intent(out) :: generation, nfiles
+      logical, intent(out) :: ok
+
+      integer :: iunit
+      call checkpoint_open(ckpt, ifile, iunit, generation, nfiles, ok)
+      if (ok) close(iunit)
+
+      return
+   end subroutine checkpoint_read_header
+
+   subroutine checkpoint_open(ckpt, ifile, iunit, generation, nfiles, ok)
+      !> Open file ifile and read its header, ok if it matches ckpt
+      implicit none
+
+      type(checkpoint_type), intent(in) :: ckpt
+      integer, intent(in) :: ifile
+      integer, intent(out) :: iunit, generation, nfiles
+      logical, intent(out) :: ok
+
+      integer :: ios, nitems, narrays, nkey
+      integer :: kinds(checkpoint_max_arrays), sizes(checkpoint_max_arrays)
+      character(8) :: magic
+      character(40) :: name
+      real(dp), allocatable :: key(:)
+
+      ok= .false.
+      generation= 0
+      nfiles= 0
+
+      open(newunit=iunit, file=checkpoint_filename(ckpt, ifile), access='stream', &
+         form='unformatted', status='old', action='read', iostat=ios)
+      if (ios/=0) return
+
+      read(iunit, iostat=ios)magic, name, generation, nfiles, nitems, narrays
+      if (ios==0 .and. magic==checkpoint_magic .and. name==ckpt%name .and. &
+         nitems==ckpt%nitems .and. narrays==ckpt%narrays) then
+         read(iunit, iostat=ios)kinds(1:narrays), sizes(1:narrays)
+         ok= ios==0 .and. all(kinds(1:narrays)==ckpt%kinds(1:narrays)) .and. &
+            all(sizes(1:narrays)==ckpt%sizes(1:narrays))
+      endif
+      if (ok) then
+         read(iunit, iostat=ios)nkey
+         ok= ios==0 .and. nkey==size(ckpt%key)
+      endif
+      if (ok) then
+         allocate(key(nkey))
+         read(iunit, iostat=ios)key
+         ok= ios==0 .and. all(key==ckpt%key)
+      endif
+
+      if (.not.ok) close(iunit)
+
+      return
+   end subroutine checkpoint_open
+
+   subroutine checkpoint_absorb(ckpt, ifile, generation)
+      !> Add the results in file ifile of the given generation to the
+      !> registered arrays of this rank. Nothing is added unless the whole
+      !> file could be read.
+      use para, only : stdout
+      implicit none
+
+      type(checkpoint_type), intent(inout) :: ckpt
+      integer, intent(in) :: ifile, generation
+
+      integer :: iunit, ios, ia, ik, nmine, nfiles, gen, ndata, i0
+      integer, allocatable :: idx(:)
+      real(dp), allocatable :: buf(:)
+      real(dp), pointer :: a(:), b(:, :)
+      character(8) :: trailer
+      logical :: ok
+
+      call checkpoint_open(ckpt, ifile, iunit, gen, nfiles, ok)
+      if (.not.ok) return
+      if (gen/=generation) then
+         close(iunit)
+         return
+      endif
+
+      ok= .false.
+      read(iunit, iostat=ios)nmine
+      if (ios==0 .and. nmine>=0 .and. nmine<=ckpt%nitems) then
+         allocate(idx(nmine))
+         read(iunit, iostat=ios)idx
+         ok= ios==0
+         if (ok) ok= all(idx>=1 .and. idx<=ckpt%nitems)
+      endif
+
+      if (ok) then
+         ndata= 0
+         do ia= 1, ckpt%narrays
+            if (ckpt%kinds(ia)==checkpoint_sum) then
+               ndata= ndata+ ckpt%sizes(ia)
+            else
+               ndata= ndata+ ckpt%sizes(ia)*nmine
+            endif
+         enddo
+         allocate(buf(ndata))
+         read(iunit, iostat=ios)buf, trailer
+         ok= ios==0 .and. trailer==checkpoint_trailer
+      endif
+      close(iunit)
+
+      if (.not.ok) then
+         write(stdout, '(2a)')' Warning: ignoring the damaged checkpoint file ', &
+            trim(checkpoint_filename(ckpt, ifile))
+         return
+      endif
+
+      i0= 0
+      do ia= 1, ckpt%narrays
+         if (ckpt%kinds(ia)==checkpoint_sum) then
+            call c_f_pointer(ckpt%ptrs(ia), a, [ckpt%sizes(ia)])
+            a= a+ buf(i0+1:i0+ckpt%sizes(ia))
+            i0= i0+ ckpt%sizes(ia)
+         else
+            call c_f_pointer(ckpt%ptrs(ia), b, [ckpt%sizes(ia), ckpt%nitems])
+            do ik= 1, nmine
+               b(:, idx(ik))= buf(i0+1:i0+ckpt%sizes(ia))
+               i0= i0+ ckpt%sizes(ia)
+            enddo
+         endif
+      enddo
+
+      ckpt%done(idx)= .true.
+      ckpt%mine(idx)= .true.
+
+      deallocate(idx, buf)
+
+      return
+   end subroutine checkpoint_absorb
+
+end module checkpoint
+
+subroutine wt_set_checkpoint_resume(resume)
+   !> Called from Python before the run, resume= 1 continues from the
+   !> checkpoint files in the current directory
+   use checkpoint, only : checkpoint_resume
+   implicit none
+
+   integer, intent(in) :: resume
+
+   checkpoint_resume= resume/=0
+
+   return
+end subroutine wt_set_checkpoint_resume
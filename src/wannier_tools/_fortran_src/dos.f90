@@ -359,19 +359,24 @@ subroutine dos_sub
 
    use wmpi
    use para
+   use result_sink
    implicit none
 
    !> the integration k space
    real(dp) :: emin, emax
 
-   integer :: ik,ie,ib,ikx,iky,ikz,ieta
-   integer :: knv3,NE,ierr
+   integer :: ik,ie,ib,ikx,iky,ikz,ieta,j1
+   integer :: knv3,NE,ierr,nkirr
    integer :: NumberofEta
+   integer :: ik0, ikb, nkb, nk_batch
+   integer, external :: hk_batch_size
+   integer :: nthreads
+   integer, external :: get_num_threads, get_thread_id
 
    !> integration for band
    integer :: iband_low,iband_high,iband_tot
 
-   real(dp) :: x, dk3, eta0
+   real(dp) :: x, dk3, eta0, deg
 
    real(dp) :: k(3)
    real(dp) :: time_start, time_end
@@ -384,10 +389,20 @@ subroutine dos_sub
    real(dp), allocatable :: eta_array(:)
    complex(dp), allocatable :: Hk(:, :)
 
+   !> H(k) for a block of k points from ham_bulk_atomicgauge_batch
+   complex(dp), allocatable :: Hk_batch(:, :, :)
+   real(dp), allocatable :: k_batch(:, :)
+
    !> delta function
    real(dp), external :: delta
 
+   !> irreducible k points of the k cube
+   type(kcube_type_symm) :: kcube
+
    knv3= Nk1*Nk2*Nk3
+   call kmesh_symm_reduce(kcube, Nk1, Nk2, Nk3, K3D_start_cube, &
+      K3D_vec1_cube, K3D_vec2_cube, K3D_vec3_cube)
+   nkirr= kcube%Nk_total_symm
 
    if (OmegaNum<2) OmegaNum=2
    NE= OmegaNum
@@ -431,46 +446,73 @@ subroutine dos_sub
    !> get eigenvalue
    time_start= 0d0
    time_end= 0d0
-   do ik=1+cpuid, knv3, num_cpu
 
-      if (cpuid.eq.0.and. mod(ik/num_cpu, 100).eq.0) &
-         write(stdout, '(a, i18, "/", i18, a, f10.3, "s")') 'ik/knv3', &
-         ik, knv3, ' time left', (knv3-ik)*(time_end-time_start)/num_cpu
+   !> the tight-binding H(k) are built in blocks of nkb k points
+   nkb= 1
+   if (index(KPorTB, 'KP')==0) nkb= hk_batch_size(nkirr)
+   allocate(Hk_batch(Num_wann, Num_wann, nkb), k_batch(3, nkb))
+   if (index(KPorTB, 'KP')==0) call atomicgauge_table_init()
+   nthreads= get_num_threads()
+
+   !> the blocks are shared by the OpenMP threads, dos_mpi is summed over them
+   !$OMP PARALLEL DO SCHEDULE(STATIC, 1) &
+   !$OMP PRIVATE(ik0, nk_batch, ikb, ik, ikx, iky, ikz, j1, k, ie, ib, ieta, x, eta0, deg) &
+   !$OMP PRIVATE(W, Hk, eigval, Hk_batch, k_batch) &
+   !$OMP FIRSTPRIVATE(time_start, time_end) REDUCTION(+:dos_mpi)
+   do ik0=1+cpuid, nkirr, num_cpu*nkb
+      nk_batch= min(nkb, (nkirr-ik0)/num_cpu+1)
+      do ikb= 1, nk_batch
+         ik= ik0+ (ikb-1)*num_cpu
+         j1= kcube%ik_array_symm(ik)
+         ikx= (j1-1)/(nk2*nk3)+1
+         iky= ((j1-1-(ikx-1)*Nk2*Nk3)/nk3)+1
+         ikz= (j1-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
+         k_batch(:, ikb)= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1)  &
+            + K3D_vec2_cube*(iky-1)/dble(nk2)  &
+            + K3D_vec3_cube*(ikz-1)/dble(nk3)
+      enddo
+      if (index(KPorTB, 'KP')==0) call ham_bulk_atomicgauge_batch(nk_batch, k_batch, Hk_batch)
 
-      call now(time_start)
-      ikx= (ik-1)/(nk2*nk3)+1
-      iky= ((ik-1-(ikx-1)*Nk2*Nk3)/nk3)+1
-      ikz= (ik-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
-      k= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1)  &
-         + K3D_vec2_cube*(iky-1)/dble(nk2)  &
-         + K3D_vec3_cube*(ikz-1)/dble(nk3)
+      do ikb= 1, nk_batch
+         ik= ik0+ (ikb-1)*num_cpu
 
-      if (index(KPorTB, 'KP')/=0)then
-         call ham_bulk_kp_abcb_graphene(k, Hk)
-      else
-         call ham_bulk_atomicgauge(k, Hk)
-      endif
+         if (cpuid.eq.0.and. get_thread_id()==0.and. mod(ik/num_cpu, 100).eq.0) &
+            write(stdout, '(a, i18, "/", i18, a, f10.3, "s")') 'ik/knv3', &
+            ik, nkirr, ' time left', (nkirr-ik)*(time_end-time_start)/num_cpu/nthreads
 
-      W= 0d0
-      call eigensystem_c( 'N', 'U', Num_wann ,Hk, W)
-      eigval(:)= W(iband_low:iband_high)
+         call now(time_start)
+         k= k_batch(:, ikb)
 
-      !> get density of state
-      do ie= 1, NE
-         do ib= 1, iband_tot
-            x= omega(ie)- eigval(ib)
-            do ieta= 1, NumberofEta
-               eta0= eta_array(ieta)
-               dos_mpi(ie, ieta) = dos_mpi(ie, ieta)+ delta(eta0, x)
-            enddo
-         enddo ! ib
-      enddo ! ie
-      call now(time_end)
+         if (index(KPorTB, 'KP')/=0)then
+            call ham_bulk_kp_abcb_graphene(k, Hk)
+         else
+            Hk= Hk_batch(:, :, ikb)
+         endif
 
+         W= 0d0
+         call eigensystem_c( 'N', 'U', Num_wann ,Hk, W)
+         eigval(:)= W(iband_low:iband_high)
+
+         !> get density of state, the k point stands for its star of deg k points
+         deg= dble(kcube%ndeg(ik))
+         do ie= 1, NE
+            do ib= 1, iband_tot
+               x= omega(ie)- eigval(ib)
+               do ieta= 1, NumberofEta
+                  eta0= eta_array(ieta)
+                  dos_mpi(ie, ieta) = dos_mpi(ie, ieta)+ delta(eta0, x)*deg
+               enddo
+            enddo ! ib
+         enddo ! ie
+         call now(time_end)
 
-      call now(time_end)
 
-   enddo  ! ik
+         call now(time_end)
+
+      enddo  ! ikb
+   enddo  ! ik0
+   !$OMP END PARALLEL DO
+   deallocate(Hk_batch, k_batch)
 
 #if defined (MPI)
    call mpi_allreduce(dos_mpi,dos,size(dos),&
@@ -483,8 +525,14 @@ subroutine dos_sub
    !> include the spin degeneracy if there is no SOC in the tight binding Hamiltonian.
    if (SOC<=0) dos=dos*2d0
 
+   if (cpuid.eq.0 .and. result_binary) then
+      call result_write('dos/energy', [NE], omega/eV2Hartree, 'eV', 'energy')
+      call result_write('dos/eta', [NumberofEta], Eta_array*1000d0/eV2Hartree, 'meV', 'eta')
+      call result_write('dos/dos', [NE, NumberofEta], dos*eV2Hartree, '1/eV', 'eta,energy')
+   endif
+
    outfileindex= outfileindex+ 1
-   if (cpuid.eq.0) then
+   if (cpuid.eq.0 .and. .not.result_binary) then
       open(unit=outfileindex, file='dos.dat')
       write(outfileindex, *)'# Density of state of bulk system'
       write(outfileindex, '(2a16)')'# E(eV)', 'DOS(E) (1/eV)'
@@ -497,7 +545,7 @@ subroutine dos_sub
 
    outfileindex= outfileindex+ 1
    !> write script for gnuplot
-   if (cpuid==0) then
+   if (cpuid==0 .and. .not.result_binary) then
       open(unit=outfileindex, file='dos.gnu')
       write(outfileindex, '(a)')"set encoding iso_8859_1"
       write(outfileindex, '(a)')'set terminal pdf enhanced color font ",16" size 5,4 '
@@ -4,6 +4,7 @@
      ! complex hermite matrix
 
      use para, only : Dp, stdout
+     use workspace
      implicit none
 
 !  JOBZ    (input) CHARACTER*1
@@ -42,11 +43,12 @@
      real(Dp), intent(inout) :: W(N)
      integer :: info, lwork, liwork, lrwork
 
-     integer, allocatable :: iwork(:)
+     !> work arrays from the workspace of this thread
+     integer, pointer :: iwork(:)
 
-     real(Dp),allocatable ::  rwork(:)
+     real(Dp), pointer ::  rwork(:)
 
-     complex(Dp),allocatable :: work(:)
+     complex(Dp), pointer :: work(:)
      complex(dp) :: dummy(1)
 
      info=0
@@ -80,7 +82,9 @@
      lrwork = 2*N*N + 5*N + 1
      lwork = N*(N+2)
 
-     allocate (work(lwork), rwork(lrwork), iwork(liwork))
+     work => ws_complex(WS_EIGENSYSTEM_C, 1, lwork)
+     rwork => ws_real(WS_EIGENSYSTEM_C, 1, lrwork)
+     iwork => ws_int(WS_EIGENSYSTEM_C, 1, liwork)
      CALL ZHEEVD( JOBZ, UPLO, N, A, N, W, WORK, LWORK, RWORK, &
                    LRWORK, IWORK, LIWORK, INFO )
 
@@ -89,10 +93,246 @@
         stop
      endif
 
-     deallocate(rwork, work)
      return
   end subroutine eigensystem_c
 
+  subroutine eigensystem_banded(JOBZ, N, KD, AB, W, nvec, ecenter, Z)
+     ! Eigenvalues and eigenvectors of a complex hermite band matrix.
+     ! All eigenvalues come from the reduction to tridiagonal form in
+     ! zhbevd, O(N^2*KD). The eigenvectors of the nvec eigenvalues closest
+     ! to ecenter are calculated by inverse iteration with the band LU
+     ! decomposition, O(N*KD^2) each. If that is more expensive than a
+     ! dense zheevd, it is done with eigensystem_c and the eigenvectors
+     ! outside of the window are dropped.
+
+     use para, only : Dp, stdout
+     implicit none
+
+!  JOBZ    (input) CHARACTER*1
+!          = 'N':  Compute eigenvalues only;
+!          = 'V':  Compute eigenvalues and eigenvectors.
+     character*1, intent(in) :: JOBZ
+
+!  N       (input) INTEGER
+!          The order of the matrix.  N >= 0.
+     integer, intent(in) :: N
+
+!  KD      (input) INTEGER
+!          The number of superdiagonals of the matrix.  KD >= 0.
+     integer, intent(in) :: KD
+
+!  AB      (input) COMPLEX*16 array, dimension (KD+1, N)
+!          The upper triangle of the Hermitian band matrix,
+!          AB(KD+1+i-j, j) = A(i, j) for max(1, j-KD) <= i <= j.
+     complex(Dp), intent(in) :: AB(KD+1, N)
+
+!  W       (output) DOUBLE PRECISION array, dimension (N)
+!          The eigenvalues in ascending order.
+     real(Dp), intent(out) :: W(N)
+
+!  nvec    (input) INTEGER
+!          The number of eigenvectors, nvec >= N for all of them.
+     integer, intent(in) :: nvec
+
+!  ecenter (input) DOUBLE PRECISION
+!          The eigenvectors of the nvec eigenvalues closest to ecenter
+!          are calculated.
+     real(Dp), intent(in) :: ecenter
+
+!  Z       (output) COMPLEX*16 array, dimension (N, N)
+!          If JOBZ = 'V', the orthonormal eigenvectors, as the ones of
+!          eigensystem_c. The columns of the eigenvalues without
+!          eigenvector are zero. Not referenced if JOBZ = 'N'.
+     complex(Dp), intent(out) :: Z(N, N)
+
+     integer :: info, lwork, liwork, lrwork, i, j, il, iu, m
+     integer :: iwork_query(1)
+     real(Dp) :: rwork_query(1)
+     complex(Dp) :: work_query(1), dummy(1, 1)
+
+     integer, allocatable :: iwork(:)
+     real(Dp), allocatable :: rwork(:)
+     complex(Dp), allocatable :: work(:), AB_work(:, :)
+
+     info= 0
+     W= 0.0d0
+
+     !> if N==1, you don't have to do the diagonalization
+     if (N==1) then
+        W= real(AB(KD+1, 1), Dp)
+        if (JOBZ=='V'.or.JOBZ=='v') Z(1, 1)= 1d0
+        return
+     endif
+
+     !> the eigenvalues, use routine workspace query to get optimal workspace
+     allocate(AB_work(KD+1, N))
+     AB_work= AB
+     call ZHBEVD('N', 'U', N, KD, AB_work, KD+1, W, dummy, 1, work_query, -1, &
+                 rwork_query, -1, iwork_query, -1, info)
+     lwork= max(1, nint(real(work_query(1))))
+     lrwork= max(1, nint(rwork_query(1)))
+     liwork= max(1, iwork_query(1))
+     allocate(work(lwork), rwork(lrwork), iwork(liwork))
+     call ZHBEVD('N', 'U', N, KD, AB_work, KD+1, W, dummy, 1, work, lwork, &
+                 rwork, lrwork, iwork, liwork, info)
+     deallocate(work, rwork, iwork, AB_work)
+
+     if (info.ne.0) then
+        write(stdout, *) 'ERROR : something wrong with zhbevd', info
+        stop
+     endif
+
+     if (JOBZ=='N'.or.JOBZ=='n') return
+
+     !> the nvec eigenvalues closest to ecenter, il to iu
+     m= min(max(nvec, 1), N)
+     call window_closest(N, W, m, ecenter, il, iu)
+
+     !> inverse iteration costs about m*N*KD^2, zheevd about N^3
+     if (4d0*m*KD*KD<dble(N)*N) then
+        call eigvec_banded(N, KD, AB, W, il, iu, Z)
+     else
+        Z= 0d0
+        do j=1, N
+           do i=max(1, j-KD), j
+              Z(i, j)= AB(KD+1+i-j, j)
+           enddo
+        enddo
+        call eigensystem_c('V', 'U', N, Z, W)
+        !> only the window has eigenvectors, as with inverse iteration
+        Z(:, 1:il-1)= 0d0
+        Z(:, iu+1:N)= 0d0
+     endif
+
+     return
+  end subroutine eigensystem_banded
+
+  subroutine window_closest(N, W, m, ecenter, il, iu)
+     ! The window il to iu of the m eigenvalues in W, sorted in ascending
+     ! order, that are closest to ecenter.
+
+     use para, only : Dp
+     implicit none
+
+     integer, intent(in) :: N
+     real(Dp), intent(in) :: W(N)
+     integer, intent(in) :: m
+     real(Dp), intent(in) :: ecenter
+     integer, intent(out) :: il, iu
+
+     integer :: i
+
+     il= 1
+     do while (il<=N)
+        if (W(il)>=ecenter) exit
+        il= il+ 1
+     enddo
+     iu= il- 1
+     do i=1, m
+        if (il==1) then
+           iu= iu+ 1
+        else if (iu==N) then
+           il= il- 1
+        else if (ecenter- W(il-1)<W(iu+1)- ecenter) then
+           il= il- 1
+        else
+           iu= iu+ 1
+        endif
+     enddo
+
+     return
+  end subroutine window_closest
+
+  subroutine eigvec_banded(N, KD, AB, W, il, iu, Z)
+     ! Eigenvectors of a complex hermite band matrix for its eigenvalues
+     ! W(il:iu) by inverse iteration, as zstein does for tridiagonal
+     ! matrices. Vectors of eigenvalues closer than 1d-3*|A| are
+     ! orthogonalized to each other. The other columns of Z are zero.
+
+     use para, only : Dp
+     implicit none
+
+     integer, intent(in) :: N
+     integer, intent(in) :: KD
+     complex(Dp), intent(in) :: AB(KD+1, N)
+     real(Dp), intent(in) :: W(N)
+     integer, intent(in) :: il, iu
+     complex(Dp), intent(out) :: Z(N, N)
+
+     integer, parameter :: maxit= 5
+     integer :: i, j, jj, ld, info, it, ifirst
+     integer :: iseed(4)
+     real(Dp) :: eps, onenrm, ortol, pertol, shift, shift_last, rnorm
+     integer, allocatable :: ipiv(:)
+     complex(Dp), allocatable :: A(:, :), LU(:, :), x(:), r(:)
+     real(Dp), external :: dlamch, dznrm2
+     complex(Dp), external :: zdotc
+
+     Z= 0d0
+     if (iu<il) return
+
+     !> the general band storage of zgbtrf, A(i, j) at A(2*KD+1+i-j, j)
+     ld= 3*KD+ 1
+     allocate(A(ld, N), LU(ld, N), ipiv(N), x(N), r(N))
+     A= 0d0
+     do j=1, N
+        do i=max(1, j-KD), j
+           A(2*KD+1+i-j, j)= AB(KD+1+i-j, j)
+           A(2*KD+1+j-i, i)= conjg(AB(KD+1+i-j, j))
+        enddo
+        A(2*KD+1, j)= real(AB(KD+1, j), Dp)
+     enddo
+
+     eps= dlamch('P')
+     onenrm= tiny(1d0)
+     do j=1, N
+        onenrm= max(onenrm, sum(abs(A(KD+1:ld, j))))
+     enddo
+     ortol= 1d-3*onenrm
+     pertol= 1d1*eps*onenrm
+
+     ifirst= il
+     shift_last= 0d0
+     do j=il, iu
+        !> equal eigenvalues get slightly different shifts
+        shift= W(j)
+        if (j>il) then
+           if (W(j)-W(j-1)>ortol) ifirst= j
+           if (shift-shift_last<pertol) shift= shift_last+ pertol
+        endif
+        shift_last= shift
+
+        !> LU decomposition of A-shift, exactly singular pivots are replaced
+        LU= A
+        LU(2*KD+1, :)= LU(2*KD+1, :)- shift
+        call zgbtrf(N, N, KD, KD, LU, ld, ipiv, info)
+        do i=1, N
+           if (abs(LU(2*KD+1, i))<eps*onenrm) LU(2*KD+1, i)= eps*onenrm
+        enddo
+
+        iseed= (/1, 3, 5, 7/)
+        call zlarnv(2, iseed, N, x)
+        do it=1, maxit
+           call zgbtrs('N', N, KD, KD, 1, LU, ld, ipiv, x, N, info)
+           do jj=ifirst, j-1
+              x= x- zdotc(N, Z(:, jj), 1, x, 1)*Z(:, jj)
+           enddo
+           x= x/dznrm2(N, x, 1)
+
+           !> converged if |A x- W(j) x| is at the rounding level
+           r= -W(j)*x
+           call zgbmv('N', N, N, KD, KD, (1d0, 0d0), A(KD+1, 1), ld, x, 1, &
+                      (1d0, 0d0), r, 1)
+           rnorm= dznrm2(N, r, 1)
+           if (rnorm<=1d2*sqrt(dble(N))*eps*onenrm) exit
+        enddo
+        Z(:, j)= x
+     enddo
+
+     deallocate(A, LU, ipiv, x, r)
+     return
+  end subroutine eigvec_banded
+
   subroutine eigensystem_r (JOBZ,UPLO,N,A,W)
      ! A pack of Lapack subroutine dsyev, which is 
      ! a subroutine to calculate eigenvector and eigenvalue for a 
@@ -265,6 +505,7 @@
   !> the IL-th through IU-th eigenvalues will be found.
   subroutine zheevx_pack(JOBZ, UPLO, N, il, iu, A, eigval, eigvec)
      use para, only : dp
+     use workspace
      implicit none
     
      !> inout variables
@@ -277,12 +518,12 @@
      complex(dp), intent(inout) :: A(N, N) !> the input hermite complex matrix
      complex(dp), intent(inout) :: eigvec(N, iu-il+1) !> eigenvectors
 
-     !> local variables
-     real(dp), allocatable :: eigenvalues(:)
-     integer , allocatable :: iwork(:)
-     integer , allocatable :: ifail(:)
-     real(dp), allocatable :: rwork(:)
-     complex(dp), allocatable :: work(:)
+     !> local variables, work arrays from the workspace of this thread
+     real(dp), pointer :: eigenvalues(:)
+     integer , pointer :: iwork(:)
+     integer , pointer :: ifail(:)
+     real(dp), pointer :: rwork(:)
+     complex(dp), pointer :: work(:)
 
      integer :: mdim
      integer :: lwork
@@ -296,26 +537,25 @@
      !abstol= 2*DLAMCH('S')
 
      mdim= iu-il+1
-     lwork= 64*N
      vl=0d0; vu=0d0 
 
-     allocate(ifail(N))
-     allocate(iwork(5*N))
-     allocate(rwork(7*N))
-     allocate(work(lwork))
-     allocate(eigenvalues(N))
-     ifail = 0
-     iwork = 0
-     rwork = 0d0
-     work = 0d0
-
-     eigenvalues= 0d0
+     ifail => ws_int(WS_ZHEEVX_PACK, 1, N)
+     iwork => ws_int(WS_ZHEEVX_PACK, 2, 5*N)
+     rwork => ws_real(WS_ZHEEVX_PACK, 1, 7*N)
+     eigenvalues => ws_real(WS_ZHEEVX_PACK, 2, N)
+     ifail(1:N) = 0
+     iwork(1:5*N) = 0
+     rwork(1:7*N) = 0d0
+
+     eigenvalues(1:N)= 0d0
      eigvec= 0d0
      vl=0d0; vu=0d0
 
+     work => ws_complex(WS_ZHEEVX_PACK, 1, 1)
      call zheevx(JOBZ,'I',UPLO,N,A,N,vl,vu,il,iu,abstol,&
          mdim,eigenvalues,eigvec,N,work,-1,rwork,iwork,ifail,info)
-     lwork=int(work(1))
+     lwork=max(int(work(1)), 2*N)
+     work => ws_complex(WS_ZHEEVX_PACK, 1, lwork)
 
      call zheevx(JOBZ,'I',UPLO,N,A,N,vl,vu,il,iu,abstol,&
          mdim,eigenvalues,eigvec,N,work,lwork,rwork,iwork,ifail,info)
@@ -328,8 +568,6 @@
 
      eigval(1:mdim)= eigenvalues(1:mdim)
 
-     deallocate(eigenvalues, work, iwork, ifail, rwork)
-
      return
   end subroutine  zheevx_pack
 
@@ -0,0 +1,147 @@
+!> Eigenvalues of all bands and eigenvectors of a window of bands.
+!>
+!> The band structure drivers need all eigenvalues, but with
+!> Band_window=T only the eigenvectors of the NumSelectedEigenVals bands
+!> closest to iso_energy for the projection weights. eigensystem_window
+!> reduces H to tridiagonal form once with zhetrd, gets all eigenvalues
+!> from dsterf, the eigenvectors of the window from the MRRR solver dstemr
+!> and transforms them back with zunmtr. This is what zheevr does for
+!> RANGE='I', but the window is chosen from the eigenvalues of the same
+!> reduction. The eigenvectors cost O(N^2*nvec) instead of O(N^3), and
+!> the work arrays come from the workspace of every OpenMP thread instead
+!> of being allocated for every k point.
+!>
+!> Usage:
+!>    ! replaces eigensystem_c('V', 'U', N, A, W)
+!>    call eigensystem_window(N, A, W)
+!>    ! W: all eigenvalues, A(:, j): the eigenvectors of the window,
+!>    ! zero for the other bands
+!>
+!> With Band_window=F, or if the window has all N bands, this is
+!> eigensystem_c.
+
+module eigen_window
+   use para, only : dp, stdout, Band_window, NumSelectedEigenVals, iso_energy
+   use workspace
+   implicit none
+
+   private
+   public :: band_window_nvec, eigensystem_window
+
+contains
+
+   integer function band_window_nvec(ndim)
+      !> number of eigenvectors for the band structure drivers
+      implicit none
+
+      integer, intent(in) :: ndim
+
+      band_window_nvec= ndim
+      if (Band_window .and. NumSelectedEigenVals>0) &
+         band_window_nvec= min(ndim, NumSelectedEigenVals)
+
+      return
+   end function band_window_nvec
+
+
+   subroutine eigensystem_window(N, A, W, ecenter)
+      !> All eigenvalues of the hermite matrix A, upper triangle, and the
+      !> eigenvectors of the band_window_nvec(N) eigenvalues closest to
+      !> ecenter, iso_energy by default. On exit A holds the eigenvectors
+      !> as after eigensystem_c, the other columns are zero.
+      implicit none
+
+      integer, intent(in) :: N
+      complex(dp), intent(inout) :: A(N, N)
+      real(dp), intent(out) :: W(N)
+      real(dp), intent(in), optional :: ecenter
+
+      integer :: nvec, il, iu, m, info, i, lwork, lrwork, liwork
+      integer :: iquery(1)
+      real(dp) :: ec, vl, vu, rquery(1)
+      complex(dp) :: cquery(1)
+      logical :: tryrac
+
+      !> work arrays from the workspace of this thread
+      real(dp), pointer :: d(:), e(:), d_work(:), e_work(:), w_work(:), rwork(:), Zr(:, :)
+      complex(dp), pointer :: tau(:), work(:), Zc(:, :)
+      integer, pointer :: iwork(:), isuppz(:)
+
+      nvec= band_window_nvec(N)
+      if (nvec>=N) then
+         call eigensystem_c('V', 'U', N, A, W)
+         return
+      endif
+      ec= iso_energy
+      if (present(ecenter)) ec= ecenter
+
+      !> workspace queries of zhetrd, zunmtr and dstemr
+      call zhetrd('U', N, A, N, rquery, rquery, cquery, cquery, -1, info)
+      lwork= nint(real(cquery(1)))
+      call zunmtr('L', 'U', 'N', N, nvec, A, N, cquery, cquery, N, cquery, -1, info)
+      lwork= max(lwork, nint(real(cquery(1))), 1)
+      tryrac= .true.
+      call dstemr('V', 'I', N, rquery, rquery, 0d0, 0d0, 1, nvec, m, rquery, rquery, N, &
+                  nvec, iquery, tryrac, rquery, -1, iquery, -1, info)
+      lrwork= nint(rquery(1))
+      liwork= iquery(1)
+
+      d => ws_real(WS_EIGENSYSTEM_WINDOW, 1, N)
+      e => ws_real(WS_EIGENSYSTEM_WINDOW, 2, N)
+      d_work => ws_real(WS_EIGENSYSTEM_WINDOW, 3, N)
+      e_work => ws_real(WS_EIGENSYSTEM_WINDOW, 4, N)
+      w_work => ws_real(WS_EIGENSYSTEM_WINDOW, 5, N)
+      rwork => ws_real(WS_EIGENSYSTEM_WINDOW, 6, lrwork)
+      Zr(1:N, 1:nvec) => ws_real(WS_EIGENSYSTEM_WINDOW, 7, N*nvec)
+      tau => ws_complex(WS_EIGENSYSTEM_WINDOW, 1, N)
+      work => ws_complex(WS_EIGENSYSTEM_WINDOW, 2, lwork)
+      Zc(1:N, 1:nvec) => ws_complex(WS_EIGENSYSTEM_WINDOW, 3, N*nvec)
+      iwork => ws_int(WS_EIGENSYSTEM_WINDOW, 1, liwork)
+      isuppz => ws_int(WS_EIGENSYSTEM_WINDOW, 2, 2*nvec)
+
+      !> tridiagonal form T= Q^H A Q, Q is kept in A and tau
+      call zhetrd('U', N, A, N, d, e, tau, work, lwork, info)
+      if (info/=0) then
+         write(stdout, *) 'ERROR : something wrong with zhetrd', info
+         stop
+      endif
+
+      !> all eigenvalues of T
+      W= d(1:N)
+      e_work(1:N-1)= e(1:N-1)
+      call dsterf(N, W, e_work, info)
+      if (info/=0) then
+         write(stdout, *) 'ERROR : something wrong with dsterf', info
+         stop
+      endif
+
+      !> eigenvectors of T for the window, d and e are destroyed by dstemr
+      call window_closest(N, W, nvec, ec, il, iu)
+      d_work(1:N)= d(1:N)
+      e_work(1:N-1)= e(1:N-1)
+      vl= 0d0; vu= 0d0
+      tryrac= .true.
+      call dstemr('V', 'I', N, d_work, e_work, vl, vu, il, iu, m, w_work, Zr, N, &
+                  nvec, isuppz, tryrac, rwork, lrwork, iwork, liwork, info)
+      if (info/=0 .or. m/=iu-il+1) then
+         write(stdout, *) 'ERROR : something wrong with dstemr', info, m
+         stop
+      endif
+
+      !> back to the eigenvectors of A= Q T Q^H
+      Zc(:, 1:m)= Zr(:, 1:m)
+      call zunmtr('L', 'U', 'N', N, m, A, N, tau, Zc, N, work, lwork, info)
+      if (info/=0) then
+         write(stdout, *) 'ERROR : something wrong with zunmtr', info
+         stop
+      endif
+
+      A= 0d0
+      do i=1, m
+         A(:, il+i-1)= Zc(:, i)
+      enddo
+
+      return
+   end subroutine eigensystem_window
+
+end module eigen_window
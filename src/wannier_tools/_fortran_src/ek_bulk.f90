@@ -10,13 +10,25 @@ subroutine ek_bulk_line
 
    use wmpi
    use para
+   use scheduler
+   use kstream
+   use result_sink
+   use eigen_window, only : eigensystem_window
    ! use runtime_mpi, only: runtime_allreduce_real
 
    implicit none
 
    integer :: ik, il, ig, io, i, j, knv3, ierr
-   real(dp) :: emin,  emax,  k(3)
+   integer :: ik0, ikb, nkb, nk_batch, ik1, ik2, ic, nper, nblk, ngroups
+   integer :: nblk_weight, id_energy, id_weight
+   real(dp) :: emin,  emax,  k(3), eshift, eshift_mpi
    character*40 :: filename
+   logical :: use_batch
+   integer, external :: hk_batch_size
+   integer :: nthreads
+   integer, external :: get_num_threads
+   type(scheduler_type) :: sched
+   type(kstream_type) :: st
 
    !> eigenvalues of H
    real(Dp), allocatable :: W(:)
@@ -24,102 +36,133 @@ subroutine ek_bulk_line
    ! Hamiltonian of bulk system
    complex(Dp), allocatable :: Hamk_bulk(:, :), Sk_bulk(:, :)
 
-   ! eigenectors of H
-   real(dp), allocatable :: eigv(:,:), eigv_mpi(:,:)
-   real(dp), allocatable :: weight(:,:,:), weight_mpi(:,:,:), weight_sum(:,:)
+   !> H(k) for a block of k points from ham_bulk_latticegauge_batch
+   complex(dp), allocatable :: Hamk_batch(:, :, :)
+   real(dp), allocatable :: k_batch(:, :)
+
+   !> eigenvalues followed by the projection weights(group, band) of the
+   !> k points in the current chunk, streamed to disk after every chunk
+   real(dp), allocatable :: ek_chunk(:,:)
+
+   !> blocks of all eigenvalues, of one band and of its weights read back
+   !> for the output
+   real(dp), allocatable :: eig_blk(:,:), band_blk(:,:), weight_blk(:,:)
+
+   !> weights(group, band) of a block of k points for the binary output
+   real(dp), allocatable :: weights_blk(:,:)
 
    knv3= nk3_band
+   ngroups= NumberofSelectedOrbitals_groups
+   nper= Num_wann*(1+ ngroups)
    allocate(W(Num_wann))
    allocate(Hamk_bulk(Num_wann, Num_wann))
-   allocate( eigv    (Num_wann, knv3))
-   allocate( eigv_mpi(Num_wann, knv3))
-   allocate( weight    (NumberofSelectedOrbitals_groups,Num_wann, knv3))
-   allocate( weight_mpi(NumberofSelectedOrbitals_groups,Num_wann, knv3))
-   allocate( weight_sum(Num_wann, knv3))
    W       = 0d0; Hamk_bulk = 0d0
-   eigv    = 0d0; eigv_mpi= 0d0
-   weight  = 0d0; weight_sum = 0d0; weight_mpi = 0d0
 
    if (.not. Orthogonal_Basis) then
       allocate(Sk_bulk(Num_wann, Num_wann))
       Sk_bulk= 0d0
    endif
 
-   do ik= 1+cpuid, knv3, num_cpu
+   !> the tight-binding H(k) of the k points handled by this cpu are built
+   !> in blocks of nkb k points with one ZGEMM per block
+   use_batch= index(KPorTB, 'KP')==0 .and. .not.(index(Particle,'phonon')/=0.and.LOTO_correction) &
+      .and. .not.Is_Sparse
+   nkb= 1
+   if (use_batch) nkb= hk_batch_size(knv3)
+   allocate(Hamk_batch(Num_wann, Num_wann, nkb), k_batch(3, nkb))
+   nthreads= get_num_threads()
+   allocate(ek_chunk(nper, nkb*nthreads))
+
+   !> lowest eigenvalue, the zero of the phonon spectrum
+   eshift= huge(1d0)
+
+   !> every rank takes one block per OpenMP thread at a time, every k point
+   !> writes its own column of ek_chunk
+   call kstream_open(st, 'ek_bulk_line', nper, knv3)
+   call scheduler_start(sched, knv3, nkb*nthreads)
+   do while (scheduler_next(sched, ik1, ik2))
+   ek_chunk= 0d0
+
+   !$OMP PARALLEL DO SCHEDULE(STATIC, 1) &
+   !$OMP PRIVATE(ik0, nk_batch, ikb, ik, ic, k, i, j, ig, io, W, Hamk_bulk, Sk_bulk, Hamk_batch, k_batch) &
+   !$OMP REDUCTION(MIN: eshift)
+   do ik0= ik1, ik2, nkb
+      nk_batch= min(nkb, ik2-ik0+1)
+      do ikb= 1, nk_batch
+         k_batch(:, ikb)= kpath_3d(:, ik0+ikb-1)
+      enddo
+      if (use_batch) call ham_bulk_latticegauge_batch(nk_batch, k_batch, Hamk_batch)
 
-      k = kpath_3d(:, ik)
+      do ikb= 1, nk_batch
+         ik= ik0+ ikb- 1
+         ic= ik- ik1+ 1
+
+         k = kpath_3d(:, ik)
       
-      ! calculation bulk hamiltonian
-      Hamk_bulk= 0d0
+         ! calculation bulk hamiltonian
+         Hamk_bulk= 0d0
 
-      ! generate bulk Hamiltonian
-      if (index(KPorTB, 'KP')/=0)then
-         call ham_bulk_kp_abcb_graphene(k, Hamk_bulk)
-      else
-         !> deal with phonon system
-         if (index(Particle,'phonon')/=0.and.LOTO_correction) then
-            call ham_bulk_LOTO(k, Hamk_bulk)
+         ! generate bulk Hamiltonian
+         if (index(KPorTB, 'KP')/=0)then
+            call ham_bulk_kp_abcb_graphene(k, Hamk_bulk)
          else
-            if (Is_Sparse) then
-               stop 'ERROR: Sparse mode is not supported in ek_bulk_line'
+            !> deal with phonon system
+            if (index(Particle,'phonon')/=0.and.LOTO_correction) then
+               call ham_bulk_LOTO(k, Hamk_bulk)
             else
-               if (Orthogonal_Basis) then
-                  call ham_bulk_latticegauge(k, Hamk_bulk)
+               if (Is_Sparse) then
+                  stop 'ERROR: Sparse mode is not supported in ek_bulk_line'
                else
+                  if (Orthogonal_Basis) then
+                     Hamk_bulk= Hamk_batch(:, :, ikb)
+                  else
                   
-                  Sk_bulk= 0d0
-                  call S_bulk_latticegauge(k, Sk_bulk)
-                  call ham_bulk_latticegauge(k, Hamk_bulk)
-                  call orthogonalize_hamiltonian(Hamk_bulk, Sk_bulk, Num_wann)
-               endif
+                     Sk_bulk= 0d0
+                     call S_bulk_latticegauge(k, Sk_bulk)
+                     Hamk_bulk= Hamk_batch(:, :, ikb)
+                     call orthogonalize_hamiltonian(Hamk_bulk, Sk_bulk, Num_wann)
+                  endif
 
+               endif
+              !call ham_bulk_atomicgauge(k, Hamk_bulk)
             endif
-           !call ham_bulk_atomicgauge(k, Hamk_bulk)
          endif
-      endif
 
-      !> diagonalization by call zheev in lapack
-      W= 0d0
-      call eigensystem_c('V', 'U', Num_wann ,Hamk_bulk, W)
-      eigv(:, ik)= W
-
-      do j= 1, Num_wann  !> band
-           do ig= 1, NumberofSelectedOrbitals_groups
-              do i= 1, NumberofSelectedOrbitals(ig)
-                 io= Selected_WannierOrbitals(ig)%iarray(i)
-                 weight(ig, j, ik)= weight(ig, j, ik)+ abs(Hamk_bulk(io, j))**2 
-              enddo !i
-           enddo !ig
-      enddo !j
-   enddo !ik
+         !> diagonalization by call zheev in lapack, with Band_window only
+         !> the eigenvectors of the bands close to iso_energy
+         W= 0d0
+         call eigensystem_window(Num_wann, Hamk_bulk, W)
+         ek_chunk(1:Num_wann, ic)= W
+         eshift= min(eshift, minval(W))
+
+         do j= 1, Num_wann  !> band
+              do ig= 1, ngroups
+                 do i= 1, NumberofSelectedOrbitals(ig)
+                    io= Selected_WannierOrbitals(ig)%iarray(i)
+                    ek_chunk(Num_wann+(j-1)*ngroups+ig, ic)= &
+                       ek_chunk(Num_wann+(j-1)*ngroups+ig, ic)+ abs(Hamk_bulk(io, j))**2 
+                 enddo !i
+              enddo !ig
+         enddo !j
+      enddo !ikb
+   enddo !ik0
+   !$OMP END PARALLEL DO
+   call kstream_write(st, ik1, ik2, ek_chunk)
+   enddo
+   call scheduler_finish(sched, 'ek_bulk_line')
+   deallocate(Hamk_batch, k_batch, ek_chunk)
 
 #if defined (MPI)
-   call mpi_allreduce(eigv,eigv_mpi,size(eigv),&
-      mpi_dp,mpi_sum,mpi_cmw,ierr)
-   call mpi_allreduce(weight, weight_mpi,size(weight),&
-      mpi_dp,mpi_sum,mpi_cmw,ierr)
-#else
-   eigv_mpi= eigv
-   weight_mpi= weight
+   call mpi_allreduce(eshift, eshift_mpi, 1, mpi_dp, mpi_min, mpi_cmw, ierr)
+   eshift= eshift_mpi
 #endif
+   call kstream_merge(st)
 
-   if (index(Particle,'phonon')/=0) then
-      eigv_mpi = eigv_mpi - MINVAL(eigv_mpi)
-   endif
-
-   !> deal with phonon system
-   if (index(Particle,'phonon')/=0) then
-      do ik=1, knv3
-         do j=1, Num_wann
-            eigv_mpi(j, ik)= sqrt(abs(eigv_mpi(j, ik)))*sign(1d0, eigv_mpi(j, ik))
-            !eigv_mpi(j, ik)=     (abs(eigv_mpi(j, ik)))*sign(1d0, eigv_mpi(j, ik))
-         enddo
-      enddo
-   endif
-   eigv_mpi= eigv_mpi/eV2Hartree
+   nblk= kstream_block_size(st, Num_wann)
+   allocate(eig_blk(Num_wann, nblk), band_blk(1, nblk), weight_blk(max(1, ngroups), nblk))
 
    outfileindex= outfileindex+ 1
-   if (cpuid==0)then
+   if (cpuid==0 .and. .not.result_binary)then
       do il= 1, nk3lines
          if (il<10) then
             write(filename, '(a,i1)')'bulkek.dat-segment', il
@@ -136,8 +179,13 @@ subroutine ek_bulk_line
          write(outfileindex, '(a, 3f10.6)')'# kend   (fractional units)', k3line_end(:, il)!*Angstrom2atomic
    
          do i=1, Num_wann
-            do ik=1+(il-1)*Nk1, il*Nk1
-               write(outfileindex, '(2f19.9, 10000i5)')(k3len(ik)*Angstrom2atomic-k3len((il-1)*Nk1+1)*Angstrom2atomic),eigv_mpi(i, ik)
+            do ik1=1+(il-1)*Nk1, il*Nk1, nblk
+               ik2= min(ik1+nblk-1, il*Nk1)
+               call kstream_read(st, i, i, ik1, ik2, band_blk)
+               call ek_bulk_line_energy(ik2-ik1+1, band_blk)
+               do ik= ik1, ik2
+                  write(outfileindex, '(2f19.9, 10000i5)')(k3len(ik)*Angstrom2atomic-k3len((il-1)*Nk1+1)*Angstrom2atomic),band_blk(1, ik-ik1+1)
+               enddo
             enddo
             write(outfileindex, *)' '
          enddo ! i
@@ -146,7 +194,7 @@ subroutine ek_bulk_line
    endif
 
    outfileindex= outfileindex+ nk3lines+1
-   if (cpuid==0)then
+   if (cpuid==0 .and. .not.result_binary)then
       open(unit=outfileindex, file='bulkek.dat')
 
       write(outfileindex, &
@@ -154,44 +202,101 @@ subroutine ek_bulk_line
          'klen', 'E', (i, i=1, NumberofSelectedOrbitals_groups)
       write(outfileindex, "('#column', i5, 200i16)")(i, i=1, 2+NumberofSelectedOrbitals_groups)
       do i=1, Num_wann
-         do ik=1, knv3
-            write(outfileindex, '(200f16.9)')k3len(ik)*Angstrom2atomic,eigv_mpi(i, ik), &
-               weight_mpi(:, i, ik)
+         do ik1=1, knv3, nblk
+            ik2= min(ik1+nblk-1, knv3)
+            call kstream_read(st, i, i, ik1, ik2, band_blk)
+            call kstream_read(st, Num_wann+(i-1)*ngroups+1, Num_wann+i*ngroups, ik1, ik2, weight_blk)
+            call ek_bulk_line_energy(ik2-ik1+1, band_blk)
+            do ik= ik1, ik2
+               write(outfileindex, '(200f16.9)')k3len(ik)*Angstrom2atomic,band_blk(1, ik-ik1+1), &
+                  weight_blk(1:ngroups, ik-ik1+1)
+            enddo
          enddo
          write(outfileindex, *)' '
       enddo
       close(outfileindex)
    endif
 
+   !> minimum and maximum value of energy bands
+   emin=  huge(1d0)
+   emax= -huge(1d0)
    outfileindex= outfileindex+ nk3lines+1
    if (cpuid==0)then
-      open(unit=outfileindex, file='bulkek.dat-matlab')
-      write(outfileindex, '(2a19)')'% klen', 'E(n)'
+      if (result_binary) then
+         call result_write('bulkek/klen', [knv3], k3len*Angstrom2atomic, '1/Angstrom', 'k')
+         call result_write('bulkek/kpoints', [3, knv3], kpath_3d, 'fractional', 'k,direction')
+         call result_dataset('bulkek/energy', [Num_wann, knv3], 'eV', 'k,band', id_energy)
+      else
+         open(unit=outfileindex, file='bulkek.dat-matlab')
+         write(outfileindex, '(2a19)')'% klen', 'E(n)'
+      endif
 
-      do ik=1, knv3
-         write(outfileindex, '(2000f19.9)')k3len(ik)*Angstrom2atomic,eigv_mpi(:, ik)
+      do ik1=1, knv3, nblk
+         ik2= min(ik1+nblk-1, knv3)
+         call kstream_read(st, 1, Num_wann, ik1, ik2, eig_blk)
+         do ik= ik1, ik2
+            call ek_bulk_line_energy(Num_wann, eig_blk(:, ik-ik1+1))
+            if (.not.result_binary) &
+               write(outfileindex, '(2000f19.9)')k3len(ik)*Angstrom2atomic,eig_blk(:, ik-ik1+1)
+            emin= min(emin, minval(eig_blk(:, ik-ik1+1)))
+            emax= max(emax, maxval(eig_blk(:, ik-ik1+1)))
+         enddo
+         call result_put(id_energy, int(ik1-1, 8)*Num_wann, Num_wann*(ik2-ik1+1), eig_blk)
       enddo
-      close(outfileindex)
+      if (.not.result_binary) close(outfileindex)
+
+      !> projection weights of all bands, weight(group, band, k)
+      if (result_binary .and. ngroups>0) then
+         call result_dataset('bulkek/weight', [ngroups, Num_wann, knv3], ' ', &
+            'k,band,group', id_weight)
+         nblk_weight= kstream_block_size(st, ngroups*Num_wann)
+         allocate(weights_blk(ngroups*Num_wann, nblk_weight))
+         do ik1=1, knv3, nblk_weight
+            ik2= min(ik1+nblk_weight-1, knv3)
+            call kstream_read(st, Num_wann+1, nper, ik1, ik2, weights_blk)
+            call result_put(id_weight, int(ik1-1, 8)*ngroups*Num_wann, &
+               ngroups*Num_wann*(ik2-ik1+1), weights_blk)
+         enddo
+         deallocate(weights_blk)
+      endif
    endif
+   emin=  emin-0.5d0
+   emax=  emax+0.5d0
 
+   if (.not.result_binary) then
+      call generate_ek_kpath_gnu('bulkek.dat', 'bulkek.gnu', 'bulkek.pdf', &
+                                    emin, emax, knv3, Nk3lines, &
+                                    k3line_name, k3line_stop, k3len)
+   endif
 
-   !> minimum and maximum value of energy bands
-   emin=  minval(eigv_mpi)-0.5d0
-   emax=  maxval(eigv_mpi)+0.5d0
-
-   call generate_ek_kpath_gnu('bulkek.dat', 'bulkek.gnu', 'bulkek.pdf', &
-                                 emin, emax, knv3, Nk3lines, &
-                                 k3line_name, k3line_stop, k3len)
+   call kstream_close(st)
 
    deallocate(W)
    deallocate(Hamk_bulk)
-   deallocate( eigv    )
-   deallocate( eigv_mpi)
-   deallocate( weight    )
-   deallocate( weight_mpi)
-   deallocate( weight_sum)
+   deallocate(eig_blk, band_blk, weight_blk)
 
    return
+
+   contains
+
+   subroutine ek_bulk_line_energy(n, e)
+      !> eigenvalues of H in Hartree to band energies in eV, for phonons
+      !> the frequencies measured from the lowest mode
+      integer, intent(in) :: n
+      real(dp), intent(inout) :: e(n)
+
+      integer :: m
+
+      if (index(Particle,'phonon')/=0) then
+         do m= 1, n
+            e(m)= e(m)- eshift
+            e(m)= sqrt(abs(e(m)))*sign(1d0, e(m))
+         enddo
+      endif
+      e= e/eV2Hartree
+
+      return
+   end subroutine ek_bulk_line_energy
 end subroutine ek_bulk_line
 
 
@@ -814,6 +919,8 @@ subroutine ek_bulk_plane
    integer :: knv3
    integer :: ierr
    integer :: nwann
+   integer :: nthreads
+   integer, external :: get_num_threads, get_thread_id
 
    integer :: nband_min
    integer :: nband_max
@@ -876,11 +983,14 @@ subroutine ek_bulk_plane
 
    time_start= 0d0
    time_end= 0d0
+   nthreads= get_num_threads()
+   !$OMP PARALLEL DO SCHEDULE(STATIC, 1) &
+   !$OMP PRIVATE(ik, k, W, Hamk_bulk) FIRSTPRIVATE(time_start, time_end)
    do ik= 1+cpuid, knv3, num_cpu
-      if (cpuid==0.and. mod(ik/num_cpu, 500)==0) &
+      if (cpuid==0.and. get_thread_id()==0.and. mod(ik/num_cpu, 500)==0) &
          write(stdout, '(a, i12, a, i12, a, f10.2, a)') &
          'ek_bulk_plane, ik ', ik, ' knv3',knv3, ' time left', &
-         (knv3-ik)*(time_end- time_start)/num_cpu, ' s'
+         (knv3-ik)*(time_end- time_start)/num_cpu/nthreads, ' s'
       call now(time_start)
 
       k = kxy(:, ik)
@@ -906,6 +1016,7 @@ subroutine ek_bulk_plane
 
       call now(time_end)
    enddo ! ik
+   !$OMP END PARALLEL DO
 
 #if defined (MPI)
    call mpi_allreduce(eigv,eigv_mpi,size(eigv),&
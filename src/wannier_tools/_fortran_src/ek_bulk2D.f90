@@ -334,7 +334,6 @@
 
      integer :: ik, i, j
      integer :: nkx, nky
-     integer :: nwann
      integer :: knv3
      integer :: ierr
      real(Dp) :: k(3)
@@ -358,20 +357,15 @@
 	  real(dp), allocatable :: spin_mpi(:, :)
 
 
-     complex(dp), allocatable :: sigmax(:, :)
-     complex(dp), allocatable :: sigmay(:, :)
-     complex(dp), allocatable :: sigmaz(:, :)
      complex(dp), allocatable :: psi(:)
-     complex(dp), allocatable :: mat1(:, :)
+     integer, allocatable :: orbitals(:)
+     real(dp) :: spin_k(3)
 
      nkx= Nk
      nky= Nk
      knv3= nkx*nky
      allocate( psi( Num_wann))
-     allocate( sigmax( Num_wann, Num_wann))
-     allocate( sigmay( Num_wann, Num_wann))
-     allocate( sigmaz( Num_wann, Num_wann))
-     allocate( mat1  ( Num_wann, Num_wann))
+     allocate( orbitals( Num_wann))
      allocate( dos     (knv3))
      allocate( dos_mpi (knv3))
      allocate( spin    (3, knv3))
@@ -392,21 +386,12 @@
      spin_mpi= 0d0
      dos    = 0d0
      dos_mpi= 0d0
-     sigmax= 0d0
-     sigmay= 0d0
-     sigmaz= 0d0
 
-     nwann= Num_wann/2
 
      if (SOC==0) stop 'you should set soc=0 in the input file'
-     !> construct spin matrix
-     do i= 1, nwann
-        sigmax(i, i+ nwann)= 1d0
-        sigmax(i+ nwann, i)= 1d0
-        sigmay(i, i+ nwann)= -zi
-        sigmay(i+ nwann, i)= zi
-        sigmaz(i, i)= 1d0
-        sigmaz(i+ nwann, i+ nwann)= -1d0
+     !> spin is summed over all orbitals, basis |↑↑↓↓>
+     do i= 1, Num_wann
+        orbitals(i)= i
      enddo
 
 
@@ -441,21 +426,8 @@
            dos(ik)= dos(ik) -aimag(Hamk_bulk(i, i))
         enddo
 
-        call mat_mul(Num_wann, Hamk_bulk, sigmax, mat1)
-
-        do i=1, Num_wann
-           spin(1, ik)= spin(1, ik) -aimag(mat1(i, i))
-        enddo
-
-        call mat_mul(Num_wann, Hamk_bulk, sigmay, mat1)
-        do i=1, Num_wann
-           spin(2, ik)= spin(2, ik) -aimag(mat1(i, i))
-        enddo
-
-        call mat_mul(Num_wann, Hamk_bulk, sigmaz, mat1)
-        do i=1, Num_wann
-           spin(3, ik)= spin(3, ik) -aimag(mat1(i, i))
-        enddo
+        call spin_green_diag(Num_wann, Num_wann, Hamk_bulk, Num_wann, orbitals, spin_k)
+        spin(:, ik)= spin_k
 
         !> for 44 bands
         eigv(:, ik)= W(Numoccupied-1:Numoccupied+ 2)
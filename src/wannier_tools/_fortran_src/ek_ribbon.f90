@@ -6,6 +6,7 @@
 
      use wmpi
      use para
+     use slab_banded
      implicit none 
 
      integer :: mdim
@@ -98,11 +99,10 @@
         if (cpuid==0) write(stdout, *) "Ribbonek the i'th kpoint", i, Nk1
         k=kmax*real(i-1)/(Nk1-1)
         chamk=0.0d0 
-        call ham_ribbon(k,Chamk)
         eigenvalue=0.0d0
 
-        ! diagonal Chamk
-        call eigensystem_c('V', 'U', Ndim1, CHamk, eigenvalue) 
+        ! build and diagonal Chamk, dense or banded, see slab_banded.f90
+        call eigensystem_ribbon(k, CHamk, eigenvalue, window=.true.)
        
         ! only eigenvalues are computed
         ! the eigenvalues with indices il through iu will be found
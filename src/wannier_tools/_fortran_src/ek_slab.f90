@@ -6,6 +6,8 @@
     
      use wmpi
      use para
+     use slab_banded
+     use result_sink
      implicit none 
 
      ! loop index
@@ -73,18 +75,16 @@
         k= k2_path(i, :)
         chamk=0.0d0 
 
+        eigenvalue=0.0d0
+
+        ! build and diagonal Chamk, dense or banded, see slab_banded.f90
         !> surface Zeeman splitting for BdG
         if (abs(Bz_surf)>eps9.or.abs(Bx_surf)>eps9.or.abs(By_surf)>eps9) then
-           call ham_slab_surface_zeeman(k,Chamk)
+           call eigensystem_slab(k, Chamk, eigenvalue, surface_zeeman=.true., window=.true.)
         !> no surface Zeeman splitting
         else
-           call ham_slab(k,Chamk)
+           call eigensystem_slab(k, Chamk, eigenvalue, window=.true.)
         endif
-
-        eigenvalue=0.0d0
-
-        ! diagonal Chamk
-        call eigensystem_c('V', 'U', Num_wann*Nslab, CHamk, eigenvalue)
        
         ekslab(:,i)=eigenvalue
 
@@ -151,7 +151,13 @@
      surf_r_weight= surf_r_weight_mpi/ maxweight
      
      outfileindex= outfileindex+ 1
-     if(cpuid==0)then
+     if (cpuid==0 .and. result_binary) then
+        call result_write('slabek/klen', [knv2], k2len*Angstrom2atomic, '1/Angstrom', 'k')
+        call result_write('slabek/energy', [Num_wann*Nslab, knv2], ekslab, 'eV', 'k,band')
+        call result_write('slabek/weight_l', [Num_wann*Nslab, knv2], surf_l_weight, ' ', 'k,band')
+        call result_write('slabek/weight_r', [Num_wann*Nslab, knv2], surf_r_weight, ' ', 'k,band')
+        write(stdout,*) 'calculate energy band  done'
+     elseif(cpuid==0)then
         open(unit=outfileindex, file='slabek.dat')
         write(outfileindex, "('#', a10, a15, 5X, 2a16 )")'# k', ' E', 'BS weight', 'TS weight'
         do j=1, Num_wann*Nslab
@@ -172,7 +178,7 @@
      emax= maxval(ekslab)+0.5d0
      !> write script for gnuplot
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='slabek.gnu')
         write(outfileindex, '(a)') '# requirement: gnuplot version>5.4'
         write(outfileindex, '(a)')"set encoding iso_8859_1"
@@ -560,6 +566,7 @@ end subroutine ek_slab_sparseHR
     
      use wmpi
      use para
+     use slab_banded
      implicit none 
 
 
@@ -627,12 +634,10 @@ end subroutine ek_slab_sparseHR
         k= k12(:, i)
         chamk=0.0d0 
 
-        call ham_slab(k,Chamk)
-
         eigenvalue=0.0d0
 
-        ! diagonal Chamk
-        call eigensystem_c('V', 'U', Num_wann*Nslab, CHamk, eigenvalue)
+        ! build and diagonal Chamk, dense or banded, see slab_banded.f90
+        call eigensystem_slab(k, Chamk, eigenvalue, window=.true.)
        
         ekslab(:,i)=eigenvalue
 
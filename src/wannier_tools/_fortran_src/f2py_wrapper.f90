@@ -16,6 +16,25 @@ contains
         
     end subroutine run_wannier_tools
 
+    !> Continue from the checkpoint files of a killed run (resume= 1)
+    !> or start from scratch (resume= 0) in the next run_wannier_tools
+    subroutine set_checkpoint_resume(resume) bind(c, name='set_checkpoint_resume')
+        implicit none
+        integer(c_int), intent(in) :: resume
+
+        call wt_set_checkpoint_resume(int(resume))
+    end subroutine set_checkpoint_resume
+
+    !> Read the hr file through its binary sidecar <Hrfile>.wtb, which the
+    !> caller checked against the hr file (use_cache= 1), or always parse
+    !> the text file (use_cache= 0)
+    subroutine set_hr_cache(use_cache) bind(c, name='set_hr_cache')
+        implicit none
+        integer(c_int), intent(in) :: use_cache
+
+        call wt_set_hr_cache(int(use_cache))
+    end subroutine set_hr_cache
+
     !> Test function to verify module is working
     subroutine test_function(result) bind(c, name='test_function')
         implicit none
@@ -24,4 +43,101 @@ contains
         print *, 'WannierTools Python wrapper test: OK'
     end subroutine test_function
 
+    !> Set up the bulk model from wt.in in the current directory
+    !> nwann: number of Wannier orbitals
+    !> ierr: 0 on success, 1 if MPI failed, 2 for a sparse Hamiltonian
+    subroutine model_init(nwann, ierr) bind(c, name='model_init')
+        implicit none
+        integer(c_int), intent(out) :: nwann, ierr
+        integer :: nwann_f, ierr_f
+
+        call wt_model_init(nwann_f, ierr_f)
+        nwann= nwann_f
+        ierr= ierr_f
+    end subroutine model_init
+
+    !> Read the namelists again from fname, keeping the Hamiltonian
+    !> ierr: 0 on success, 1 if the new input changes the size of H(k)
+    subroutine model_reload(fname, ierr)
+        implicit none
+        character(len=*), intent(in) :: fname
+        integer(c_int), intent(out) :: ierr
+        integer :: ierr_f
+
+        call wt_model_reload(fname, ierr_f)
+        ierr= ierr_f
+    end subroutine model_reload
+
+    !> Run the calculations switched on in the CONTROL namelist
+    subroutine model_calculate() bind(c, name='model_calculate')
+        implicit none
+
+        call wt_model_calculate()
+    end subroutine model_calculate
+
+    !> Free the model
+    subroutine model_close() bind(c, name='model_close')
+        implicit none
+
+        call wt_model_close()
+    end subroutine model_close
+
+    !> Shut down MPI, called once when the Python process exits
+    subroutine finalize_wannier_tools() bind(c, name='finalize_wannier_tools')
+        implicit none
+
+        call wannier_tools_finalize()
+    end subroutine finalize_wannier_tools
+
+    !> H(k) in eV, kpts(3, nk) in units of the reciprocal lattice vectors
+    subroutine model_hk(nk, kpts, nwann, hk) bind(c, name='model_hk')
+        implicit none
+        integer(c_int), intent(in) :: nk, nwann
+        real(c_double), intent(in) :: kpts(3, nk)
+        complex(c_double_complex), intent(out) :: hk(nwann, nwann, nk)
+
+        call wt_model_hk(int(nk), kpts, hk)
+    end subroutine model_hk
+
+    !> Eigenvalues ib1..ib1+nb-1 (1-based) in eV
+    subroutine model_eigvals(nk, kpts, ib1, nb, eigval) bind(c, name='model_eigvals')
+        implicit none
+        integer(c_int), intent(in) :: nk, ib1, nb
+        real(c_double), intent(in) :: kpts(3, nk)
+        real(c_double), intent(out) :: eigval(nb, nk)
+
+        call wt_model_eigvals(int(nk), kpts, int(ib1), int(nb), eigval)
+    end subroutine model_eigvals
+
+    !> Eigenvalues in eV and eigenvectors of the bands ib1..ib1+nb-1 (1-based)
+    subroutine model_eigh(nk, kpts, nwann, ib1, nb, eigval, eigvec) bind(c, name='model_eigh')
+        implicit none
+        integer(c_int), intent(in) :: nk, nwann, ib1, nb
+        real(c_double), intent(in) :: kpts(3, nk)
+        real(c_double), intent(out) :: eigval(nb, nk)
+        complex(c_double_complex), intent(out) :: eigvec(nwann, nb, nk)
+
+        call wt_model_eigh(int(nk), kpts, int(ib1), int(nb), eigval, eigvec)
+    end subroutine model_eigh
+
+    !> Band velocities in eV*Angstrom
+    subroutine model_velocity(nk, kpts, nwann, velocity) bind(c, name='model_velocity')
+        implicit none
+        integer(c_int), intent(in) :: nk, nwann
+        real(c_double), intent(in) :: kpts(3, nk)
+        real(c_double), intent(out) :: velocity(3, nwann, nk)
+
+        call wt_model_velocity(int(nk), kpts, velocity)
+    end subroutine model_velocity
+
+    !> Berry curvature of every band in Angstrom^2
+    subroutine model_berry_curvature(nk, kpts, nwann, omega) bind(c, name='model_berry_curvature')
+        implicit none
+        integer(c_int), intent(in) :: nk, nwann
+        real(c_double), intent(in) :: kpts(3, nk)
+        real(c_double), intent(out) :: omega(3, nwann, nk)
+
+        call wt_model_berry_curvature(int(nk), kpts, omega)
+    end subroutine model_berry_curvature
+
 end module wannier_tools_wrapper 
\ No newline at end of file
@@ -17,6 +17,9 @@
 
      use wmpi
      use para
+     use scheduler
+     use checkpoint
+     use result_sink
      implicit none
 
      integer :: arclfile, arcrfile, arcbulkfile
@@ -30,6 +33,9 @@
      ! kpoint loop index
      integer :: ikp, ik1, ik2, iq, Nk1_half, Nk2_half
      integer :: imin1, imax1, imin2, imax2, iq1, iq2, ik1q, ik2q
+     integer :: ikp1, ikp2
+     type(scheduler_type) :: sched
+     type(checkpoint_type) :: ckpt
 
      real(dp) :: dos_l_max, dos_r_max, time_q, time_ss, time1, time2
      real(dp) :: time_start, time_end
@@ -44,25 +50,34 @@
      integer , allocatable :: ik12(:,:)
      real(dp), allocatable :: k12(:,:), k12_shape(:,:)
 
-     real(dp), allocatable :: dos_l(:,:), dos_l_mpi(:,:)
-     real(dp), allocatable :: dos_r(:,:), dos_r_mpi(:,:)
-     real(dp), allocatable :: dos_bulk(:,:), dos_bulk_mpi(:,:)
+     real(dp), allocatable, target :: dos_l(:,:), dos_r(:,:), dos_bulk(:,:)
+     real(dp), allocatable :: dos_l_mpi(:,:), dos_r_mpi(:,:), dos_bulk_mpi(:,:)
      real(dp), allocatable :: jdos_l(:), jdos_l_mpi(:)
      real(dp), allocatable :: jdos_r(:), jdos_r_mpi(:)
      real(dp), allocatable :: jsdos_l(:), jsdos_l_mpi(:)
      real(dp), allocatable :: jsdos_r(:), jsdos_r_mpi(:)
      real(dp), allocatable :: dos_l_only(:, :), dos_r_only(:, :)
-     real(dp), allocatable :: sx_l(:, :), sy_l(:, :), sz_l(:, :)
+     real(dp), allocatable, target :: sx_l(:, :), sy_l(:, :), sz_l(:, :)
      real(dp), allocatable :: sx_l_mpi(:, :), sy_l_mpi(:, :), sz_l_mpi(:, :)
-     real(dp), allocatable :: sx_r(:, :), sy_r(:, :), sz_r(:, :)
+     real(dp), allocatable, target :: sx_r(:, :), sy_r(:, :), sz_r(:, :)
      real(dp), allocatable :: sx_r_mpi(:, :), sy_r_mpi(:, :), sz_r_mpi(:, :)
+     real(dp), allocatable :: qpi_maps(:, :, :)
 
-     ! spin operator matrix spin_sigma_x,spin_sigma_y in spin_sigma_z representation
-     complex(Dp),allocatable :: spin_sigma_x(:,:), spin_sigma_y(:,:), spin_sigma_z(:,:)
-     complex(Dp),allocatable :: ctemp(:,:), ones(:,:)
+     !> spin texture of both surfaces for the binary output, (s, k2, k1)
+     real(dp), allocatable :: spin_l(:, :, :), spin_r(:, :, :)
+
+     ! orbitals of the spin-resolved spectra, for spin_green_diag
+     integer, allocatable :: bottom_orbitals(:), bulk_orbitals(:)
+     real(dp) :: spin_k(3)
+
+     !> work arrays of surfgreen_1985_work, reused for all k points of a thread
+     complex(dp), allocatable :: sgwork(:,:,:)
      complex(dp), allocatable :: GLL(:,:), GRR(:,:), GB(:,:)
      complex(dp), allocatable :: H00(:,:), H01(:,:)
 
+     integer :: nthreads
+     integer, external :: get_num_threads
+
      !> Nk1 and Nk2 should be odd number so that the center of the kslice is (0,0)
      !> if you want to calculate the QPI
      nkx=Nk1; nky=Nk2
@@ -81,7 +96,6 @@
      allocate( jdos_l(nkx*nky), jdos_l_mpi(nkx*nky))
      allocate( jdos_r(nkx*nky), jdos_r_mpi(nkx*nky))
      allocate( GLL(ndim,ndim), GRR(ndim,ndim), GB(ndim, ndim))
-     allocate( ctemp(ndim,ndim))
      if (SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc)) then
         allocate( jsdos_l(nkx*nky), jsdos_l_mpi(nkx*nky))
         allocate( jsdos_r(nkx*nky), jsdos_r_mpi(nkx*nky))
@@ -91,7 +105,7 @@
         allocate( sx_r(nkx,nky), sx_r_mpi(nkx,nky))
         allocate( sy_r(nkx,nky), sy_r_mpi(nkx,nky))
         allocate( sz_r(nkx,nky), sz_r_mpi(nkx,nky))
-        allocate(spin_sigma_x(ndim,ndim), spin_sigma_y(ndim,ndim), spin_sigma_z(ndim,ndim))
+        allocate(bottom_orbitals(NBottomOrbitals), bulk_orbitals(ndim))
      endif
 
      ik12=0
@@ -101,7 +115,6 @@
      jdos_l=0d0; jdos_l_mpi=1d-12
      jdos_r=0d0; jdos_r_mpi=1d-12
      if (SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc)) then
-        spin_sigma_x=0.0d0; spin_sigma_y=0.0d0; spin_sigma_z=0.0d0
         jsdos_l=0d0; jsdos_l_mpi=1d-12
         jsdos_r=0d0; jsdos_r_mpi=1d-12
         sx_l=0d0; sy_l=0d0; sz_l=0d0
@@ -156,38 +169,22 @@
 
      allocate(H00(Ndim, Ndim))
      allocate(H01(Ndim, Ndim))
-     allocate(ones(Ndim, Ndim))
+     allocate(sgwork(Ndim, Ndim, Nwork_surfgreen))
      GLL= 0d0; GRR= 0d0
-     H00= 0d0; H01= 0d0; ones= 0d0
-
-     do i=1,Ndim
-        ones(i,i)=1.0d0
-     enddo
+     H00= 0d0; H01= 0d0; sgwork= 0d0
 
      if (SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc)) then
         if (index(Particle,'phonon')/=0) then
            stop "ERROR: we don't support spintexture calculation for phonon system"
         endif
-        Nwann= Num_wann/2
-        !> spin operator matrix
-        !> this part is package dependent. 
-       !if (index( Package, 'VASP')/=0.or. index( Package, 'Wien2k')/=0 &
-       !   .or. index( Package, 'Abinit')/=0.or. index( Package, 'openmx')/=0) then
-           do i=1, Np
-              do j=1, Nwann
-                 spin_sigma_x(Num_wann*(i-1)+j, Num_wann*(i-1)+Nwann+j)=1.0d0
-                 spin_sigma_x(Num_wann*(i-1)+j+Nwann, Num_wann*(i-1)+j)=1.0d0
-                 spin_sigma_y(Num_wann*(i-1)+j, Num_wann*(i-1)+Nwann+j)=-zi
-                 spin_sigma_y(Num_wann*(i-1)+j+Nwann, Num_wann*(i-1)+j)=zi
-                 spin_sigma_z(Num_wann*(i-1)+j, Num_wann*(i-1)+j)= 1d0
-                 spin_sigma_z(Num_wann*(i-1)+j+Nwann, Num_wann*(i-1)+j+Nwann)=-1d0
-              enddo
-           enddo
-       !else
-       !   if (cpuid.eq.0) write(stdout, *)'Error: please report your software generating tight binding and wannier90.wout to me'
-       !   if (cpuid.eq.0) write(stdout, *)'wuquansheng@gmail.com'
-       !   stop 'Error: please report your software and wannier90.wout to wuquansheng@gmail.com'
-       !endif
+        !> the spin operators are applied by spin_green_diag, which assumes
+        !> the basis |↑↑↓↓> in every principal layer
+        do i= 1, NBottomOrbitals
+           bottom_orbitals(i)= Ndim- Num_wann+ BottomOrbitals(i)
+        enddo
+        do i= 1, Ndim
+           bulk_orbitals(i)= i
+        enddo
      endif
 
      omega = iso_energy
@@ -203,11 +200,38 @@
      time_start= 0d0
      time_end= 0d0
      time_q= 0d0; time_ss= 0d0
-     do ikp= 1+cpuid, nkx*nky, num_cpu
-        if (cpuid==0.and. mod(ikp/num_cpu, 100)==0) &
-           write(stdout, *) 'Arc, ik ', ikp, 'Nk',nkx*nky, 'time left', &
-           (nkx*nky-ikp)*(time_end- time_start)/num_cpu, ' s'
-        call now(time_start)
+     nthreads= get_num_threads()
+
+     !> every k point writes its own element of the dos and spin maps, so the
+     !> maps of a rank are its checkpoint
+     call checkpoint_add(ckpt, dos_l, size(dos_l))
+     call checkpoint_add(ckpt, dos_r, size(dos_r))
+     call checkpoint_add(ckpt, dos_bulk, size(dos_bulk))
+     if (SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc)) then
+        call checkpoint_add(ckpt, sx_l, size(sx_l))
+        call checkpoint_add(ckpt, sy_l, size(sy_l))
+        call checkpoint_add(ckpt, sz_l, size(sz_l))
+        call checkpoint_add(ckpt, sx_r, size(sx_r))
+        call checkpoint_add(ckpt, sy_r, size(sy_r))
+        call checkpoint_add(ckpt, sz_r, size(sz_r))
+     endif
+     call checkpoint_start(ckpt, 'SurfaceDOSkk', nkx*nky, &
+        [omega, eta_broadening, K2D_start, K2D_vec_a, K2D_vec_b])
+
+     !> the convergence of surfgreen_1985 depends on k, so the k points are
+     !> handed out to the MPI ranks on demand, one per OpenMP thread
+     call scheduler_start(sched, nkx*nky, nthreads)
+     do while (scheduler_next(sched, ikp1, ikp2))
+     if (cpuid==0.and. mod(sched%nchunks, 100)==1) &
+        write(stdout, *) 'Arc, ik ', ikp1, 'Nk',nkx*nky, 'time left', &
+        scheduler_time_left(sched), ' s'
+
+     !$OMP PARALLEL DO SCHEDULE(DYNAMIC) &
+     !$OMP PRIVATE(ikp, k, i, io, ik1, ik2, time1, time2, sx_bulk, sy_bulk, sz_bulk, spin_k) &
+     !$OMP PRIVATE(H00, H01, GLL, GRR, GB, sgwork) &
+     !$OMP REDUCTION(+:time_q, time_ss)
+     do ikp= ikp1, ikp2
+        if (checkpoint_done(ckpt, ikp)) cycle
         k(1)= k12(1, ikp)
         k(2)= k12(2, ikp)
 
@@ -226,7 +250,7 @@
         ! the method in 1985 is better, you can find the ref in the
         ! subroutine
         call now(time1)
-        call surfgreen_1985(omega,GLL,GRR,GB,H00,H01,ones, eta_broadening)
+        call surfgreen_1985_work(omega,GLL,GRR,GB,H00,H01, eta_broadening, sgwork)
         ! call surfgreen_1984(omega,GLL,GRR,H00,H01,ones, eta_broadening)
         call now(time2)
         time_ss= time_ss+time2-time1
@@ -249,88 +273,34 @@
 
         if (SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc)) then
            !>> calculate spin-resolved bulk spectrum
-           sx_bulk= 0d0
-           call mat_mul(ndim,GB ,spin_sigma_x,ctemp)
-           do i= 1, Ndim
-              sx_bulk=sx_bulk- aimag(ctemp(i,i))/pi
-           enddo ! i
-   
-           sy_bulk= 0d0
-           call mat_mul(ndim,GB ,spin_sigma_y,ctemp)
-           do i= 1, Ndim
-              sy_bulk=sy_bulk- aimag(ctemp(i,i))/pi
-           enddo ! i
-   
-           sz_bulk= 0d0
-           call mat_mul(ndim,GB ,spin_sigma_z,ctemp)
-           do i= 1, Ndim
-              sz_bulk=sz_bulk- aimag(ctemp(i,i))/pi
-           enddo ! i
+           call spin_green_diag(ndim, Num_wann, GB, Ndim, bulk_orbitals, spin_k)
+           sx_bulk= spin_k(1)/pi
+           sy_bulk= spin_k(2)/pi
+           sz_bulk= spin_k(3)/pi
    
            !>> calculate spin-resolved surface spectrum
-   
-           !ctemp=matmul(surfgreen,spin_sigma_x)
-           call mat_mul(ndim,GLL,spin_sigma_x,ctemp)
-           do i= 1, NtopOrbitals
-              io= TopOrbitals(i)
-              sx_l(ik1, ik2)=sx_l(ik1, ik2)- aimag(ctemp(io,io))/pi
-           enddo ! i
+           call spin_green_diag(ndim, Num_wann, GLL, NtopOrbitals, TopOrbitals, spin_k)
+           sx_l(ik1, ik2)= spin_k(1)/pi
+           sy_l(ik1, ik2)= spin_k(2)/pi
+           sz_l(ik1, ik2)= spin_k(3)/pi
           !sx_l(ik1, ik2)= sx_l(ik1, ik2)- sx_bulk
           !if (sx_l(ik1, ik2)<0) sx_l(ik1, ik2)= eps9
    
-           !ctemp=matmul(surfgreen,spin_sigma_y)
-           call mat_mul(ndim,GLL,spin_sigma_y,ctemp)
-           do i= 1, NtopOrbitals
-              io= TopOrbitals(i)
-              sy_l(ik1, ik2)=sy_l(ik1, ik2)- aimag(ctemp(io,io))/pi
-           enddo ! i
-          !sy_l(ik1, ik2)= sy_l(ik1, ik2)- sy_bulk
-          !if (sy_l(ik1, ik2)<0) sy_l(ik1, ik2)= eps9
-   
-   
-           !ctemp=matmul(surfgreen,spin_sigma_z)
-           call mat_mul(ndim,GLL,spin_sigma_z,ctemp)
-           do i= 1, NtopOrbitals
-              io= TopOrbitals(i)
-              sz_l(ik1, ik2)=sz_l(ik1, ik2)- aimag(ctemp(io,io))/pi
-           enddo ! i
-          !sz_l(ik1, ik2)= sz_l(ik1, ik2)- sz_bulk
-          !if (sz_l(ik1, ik2)<0) sz_l(ik1, ik2)= eps9
-   
-   
-           !ctemp=matmul(surfgreen,spin_sigma_x)
-           call mat_mul(ndim,GRR,spin_sigma_x,ctemp)
-           do i= 1, NBottomOrbitals
-              io= Ndim- Num_wann+ BottomOrbitals(i)
-              sx_r(ik1, ik2)=sx_r(ik1, ik2)- aimag(ctemp(io,io))/pi
-           enddo ! i
-          !sx_r(ik1, ik2)= sx_r(ik1, ik2)- sz_bulk
+           call spin_green_diag(ndim, Num_wann, GRR, NBottomOrbitals, bottom_orbitals, spin_k)
+           sx_r(ik1, ik2)= spin_k(1)/pi
+           sy_r(ik1, ik2)= spin_k(2)/pi
+           sz_r(ik1, ik2)= spin_k(3)/pi
+          !sx_r(ik1, ik2)= sx_r(ik1, ik2)- sx_bulk
           !if (sx_r(ik1, ik2)<0) sx_r(ik1, ik2)= eps9
    
-   
-           !ctemp=matmul(surfgreen,spin_sigma_y)
-           call mat_mul(ndim,GRR,spin_sigma_y,ctemp)
-           do i= 1, NBottomOrbitals
-              io= Ndim- Num_wann+ BottomOrbitals(i)
-              sy_r(ik1, ik2)=sy_r(ik1, ik2)- aimag(ctemp(io,io))/pi
-           enddo ! i
-          !sy_r(ik1, ik2)= sy_r(ik1, ik2)- sz_bulk
-          !if (sy_r(ik1, ik2)<0) sy_r(ik1, ik2)= eps9
-   
-   
-           !ctemp=matmul(surfgreen,spin_sigma_z)
-           call mat_mul(ndim,GRR,spin_sigma_z,ctemp)
-           do i= 1, NBottomOrbitals
-              io= Ndim- Num_wann+ BottomOrbitals(i)
-              sz_r(ik1, ik2)=sz_r(ik1, ik2)- aimag(ctemp(io,io))/pi
-           enddo ! i
-          !sz_r(ik1, ik2)= sz_r(ik1, ik2)- sz_bulk
-          !if (sz_r(ik1, ik2)<0) sz_r(ik1, ik2)= eps9
-   
         endif  !> SOC>0
-        call now(time_end)
 
+        call checkpoint_mark(ckpt, ikp)
+     enddo
+     !$OMP END PARALLEL DO
+     call checkpoint_update(ckpt)
      enddo
+     call scheduler_finish(sched, 'SurfaceDOSkk')
      !print *, time_q, time_ss
 
 #if defined (MPI)
@@ -416,7 +386,37 @@
      outfileindex= outfileindex+ 3
      arcrjsfile= outfileindex
  
-     if (cpuid.eq.0)then
+     !> binary output, all arrays as (k1, k2) in NumPy order
+     if (cpuid.eq.0 .and. result_binary)then
+        call result_write('arc/k', [2, nky, nkx], k12_shape*Angstrom2atomic, '1/Angstrom', &
+           'k1,k2,direction')
+        call result_write('arc/dos_l', [nky, nkx], transpose(log(dos_l_mpi)), 'log', 'k1,k2')
+        call result_write('arc/dos_r', [nky, nkx], transpose(log(dos_r_mpi)), 'log', 'k1,k2')
+        call result_write('arc/dos_bulk', [nky, nkx], transpose(log(abs(dos_bulk_mpi))), 'log', &
+           'k1,k2')
+        if (SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc)) then
+           !> zero where there is no surface state, like the points left out
+           !> of spindos.dat_l and spindos.dat_r
+           allocate(spin_l(3, nky, nkx), spin_r(3, nky, nkx))
+           spin_l= 0d0; spin_r= 0d0
+           do ikp=1, nkx*nky
+              ik1= ik12(1, ikp); ik2= ik12(2, ikp)
+              if (dos_l_only(ik1, ik2)>eps6)then
+                 s0= [sx_l_mpi(ik1, ik2), sy_l_mpi(ik1, ik2), sz_l_mpi(ik1, ik2)]/dos_l_mpi(ik1, ik2)
+                 call rotate(s0, spin_l(:, ik2, ik1))
+              endif
+              if (dos_r_only(ik1, ik2)>eps6)then
+                 s0= [sx_r_mpi(ik1, ik2), sy_r_mpi(ik1, ik2), sz_r_mpi(ik1, ik2)]/dos_r_mpi(ik1, ik2)
+                 call rotate(s0, spin_r(:, ik2, ik1))
+              endif
+           enddo
+           call result_write('arc/spin_l', [3, nky, nkx], spin_l, ' ', 'k1,k2,direction')
+           call result_write('arc/spin_r', [3, nky, nkx], spin_r, ' ', 'k1,k2,direction')
+           deallocate(spin_l, spin_r)
+        endif
+     endif
+
+     if (cpuid.eq.0 .and. .not.result_binary)then
         open (unit=arclfile, file='arc.dat_l')
         open (unit=arcrfile, file='arc.dat_r')
         open (unit=arcbulkfile, file='arc.dat_bulk')
@@ -452,7 +452,8 @@
         close(arcbulkfile)
      endif
            
-     if (cpuid.eq.0.and.SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc))then
+     if (cpuid.eq.0.and.SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc) &
+        .and. .not.result_binary)then
         open(spindoslfile,file='spindos.dat_l')
         open(spindosrfile,file='spindos.dat_r')
         write(spindoslfile,'(a)')'# The coordinates of sx,sy,sz are redefined according to the SURFACE card'
@@ -495,7 +496,34 @@
 
      IF (SlabQPI_kplane_calc) then
 
-     !> calculate QPI (jdos)
+     if (index(QPI_method, 'DIRECT')==0) then
+     !> calculate QPI (jdos) as periodic autocorrelations with FFTs, the
+     !> same sums as the direct loops below. This is cheap, so rank 0 does it
+     !> alone and the other ranks add zeros in the reduction.
+     if (cpuid==0) then
+        call now(time_start)
+        call qpi_jdos_fft(nkx, nky, max(1, nkx-1), max(1, nky-1), 1, dos_l_only, jdos_l)
+        call qpi_jdos_fft(nkx, nky, max(1, nkx-1), max(1, nky-1), 1, dos_r_only, jdos_r)
+        if (SOC>0) then
+           allocate(qpi_maps(nkx, nky, 4))
+           qpi_maps(:, :, 1)= dos_l_only
+           qpi_maps(:, :, 2)= sx_l_mpi
+           qpi_maps(:, :, 3)= sy_l_mpi
+           qpi_maps(:, :, 4)= sz_l_mpi
+           call qpi_jdos_fft(nkx, nky, max(1, Nk1-1), max(1, Nk2-1), 4, qpi_maps, jsdos_l)
+           qpi_maps(:, :, 1)= dos_r_only
+           qpi_maps(:, :, 2)= sx_r_mpi
+           qpi_maps(:, :, 3)= sy_r_mpi
+           qpi_maps(:, :, 4)= sz_r_mpi
+           call qpi_jdos_fft(nkx, nky, max(1, Nk1-1), max(1, Nk2-1), 4, qpi_maps, jsdos_r)
+           deallocate(qpi_maps)
+        endif
+        call now(time_end)
+        write(stdout, '(a, f12.3, a)')' JDOS with FFT took ', time_end- time_start, ' s'
+     endif
+
+     else
+     !> calculate QPI (jdos) with direct sums over k for every q
      do iq= 1+ cpuid, nkx*nky, num_cpu
         !iq1= ik12(1, iq)- Nk1_half
         !iq2= ik12(2, iq)- Nk2_half
@@ -555,6 +583,7 @@
         endif
         call now(time_end)
      enddo !iq
+     endif ! QPI_method
 
      jdos_l_mpi=1d-12
      jdos_r_mpi=1d-12
@@ -787,7 +816,7 @@
 
      !> write script for gnuplot
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='arc_l.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
         write(outfileindex, '(a)')'#set terminal  postscript enhanced color'
@@ -822,7 +851,7 @@
 
      !> write script for gnuplot
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='arc_r.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
         write(outfileindex, '(a)')'#set terminal  postscript enhanced color'
@@ -857,7 +886,7 @@
 
      !> write script for gnuplot for bulk green's function
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='arc_bulk.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
         write(outfileindex, '(a)')'#set terminal  postscript enhanced color'
@@ -890,7 +919,8 @@
      endif
 
      outfileindex= outfileindex+ 1
-     if (cpuid.eq.0.and.SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc))then
+     if (cpuid.eq.0.and.SOC>0 .and. (SlabSpintexture_calc.or.SlabQPI_kplane_calc) &
+        .and. .not.result_binary)then
      !> generate gnuplot scripts for plotting the spin texture
      if (cpuid.eq.0) then
         open(outfileindex,file='spintext_r.gnu')
@@ -968,6 +998,7 @@
 #if defined (MPI)
      call mpi_barrier(mpi_cmw, ierr)
 #endif
+     call checkpoint_finish(ckpt)
 
      deallocate( ik12,  k12,  k12_shape)
      deallocate( dos_l,  dos_l_mpi)
@@ -985,11 +1016,63 @@
         deallocate( sx_r,  sx_r_mpi)
         deallocate( sy_r,  sy_r_mpi)
         deallocate( sz_r,  sz_r_mpi)
-        deallocate(spin_sigma_x, spin_sigma_y, spin_sigma_z)
+        deallocate(bottom_orbitals, bulk_orbitals)
      endif
      deallocate( GLL, GRR, GB)
-     deallocate(ctemp, H00, H01, ones)
+     deallocate(H00, H01, sgwork)
 
   return
   end subroutine SurfaceDOSkk
 
+
+  subroutine qpi_jdos_fft(nkx, nky, m1, m2, nmaps, maps, jdos)
+     !> Joint density of states of a periodic k plane with the
+     !> Wiener-Khinchin theorem, in O(Nk^2 log Nk) instead of O(Nk^4):
+     !>    jdos(q)= sum_maps sum_k A(k)*A(mod(k+q-2, m)+1)
+     !> for the k grid ik1= 1..nkx, ik2= 1..nky with the periods m1, m2
+     !> (the last row and column of the grid repeat the first ones).
+     !> Every term only depends on k modulo the period, so the maps are folded
+     !> onto the m1*m2 torus and the sum becomes a circular cross correlation.
+     !> q has the same ordering as k, iq= (iq1-1)*nky+ iq2.
+     use para, only : dp
+     implicit none
+
+     integer, intent(in) :: nkx, nky, m1, m2, nmaps
+     real(dp), intent(in) :: maps(nkx, nky, nmaps)
+     real(dp), intent(out) :: jdos(nkx*nky)
+
+     integer :: imap, ik1, ik2, iq
+     complex(dp), allocatable :: folded(:, :), periodic(:, :), corr(:, :)
+
+     allocate(folded(m1, m2), periodic(m1, m2), corr(m1, m2))
+     corr= 0d0
+
+     do imap= 1, nmaps
+        folded= 0d0
+        do ik2= 1, nky
+           do ik1= 1, nkx
+              folded(mod(ik1-1, m1)+1, mod(ik2-1, m2)+1)= &
+                 folded(mod(ik1-1, m1)+1, mod(ik2-1, m2)+1)+ maps(ik1, ik2, imap)
+           enddo
+        enddo
+        periodic= maps(1:m1, 1:m2, imap)
+
+        call fft_2d(m1, m2, folded, -1)
+        call fft_2d(m1, m2, periodic, -1)
+        corr= corr+ conjg(folded)*periodic
+     enddo
+
+     call fft_2d(m1, m2, corr, 1)
+
+     iq= 0
+     do ik1= 1, nkx
+        do ik2= 1, nky
+           iq= iq+ 1
+           jdos(iq)= real(corr(mod(ik1-1, m1)+1, mod(ik2-1, m2)+1), dp)/dble(m1*m2)
+        enddo
+     enddo
+
+     deallocate(folded, periodic, corr)
+
+     return
+  end subroutine qpi_jdos_fft
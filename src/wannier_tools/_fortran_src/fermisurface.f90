@@ -5,26 +5,50 @@
 
      use wmpi
      use para
+     use scheduler
+     use checkpoint
+     use kstream
+     use result_sink
 
      implicit none
 
-     integer :: ik, i, knv3, ikx, iky, ikz, ierr
+     integer :: ik, i, knv3, ikx, iky, ikz, ierr, j1, nkcalc
+     integer :: ik0, ikb, nkb, nk_batch, ik1, ik2, nblk, id_energy
+     integer, external :: hk_batch_size
+     integer :: nthreads
+     integer, external :: get_num_threads
+     type(scheduler_type) :: sched
+     type(checkpoint_type) :: ckpt
+     type(kstream_type) :: st
 
      integer :: nband_min, nband_max, nband_store
 
      character(40) :: fsfile
 
      real(dp) :: k(3)
-     real(dp) :: time_start, time_end
      
      ! Hamiltonian of bulk system
      complex(Dp), allocatable :: Hamk_bulk(:, :)
 
+     !> H(k) for a block of k points from ham_bulk_latticegauge_batch
+     complex(dp), allocatable :: Hamk_batch(:, :, :)
+     real(dp), allocatable :: k_batch(:, :)
+     integer, allocatable :: ik_batch(:)
+
      real(dp) :: kxmin, kxmax, kymin, kymax, kzmin, kzmax
 
      real(dp), allocatable :: W(:)
-     real(dp), allocatable :: eigval(:,:)
-     real(dp), allocatable :: eigval_mpi(:,:)
+
+     !> eigenvalues of the k points in the current chunk, and a block of
+     !> one band read back from the stream for the output
+     real(dp), allocatable :: eigval_chunk(:,:)
+     real(dp), allocatable :: eigval_blk(:,:)
+
+     !> irreducible k points of the periodic mesh without the upper edges of
+     !> the grid, and one band of their eigenvalues for the output
+     type(kcube_type_symm) :: kcube
+     logical :: symm
+     real(dp), allocatable :: eigval_irr(:)
 
      ! only for output the FS3D.bxsf, we don't have to output all the bands,
      ! only consider the bands close to the Fermi level 
@@ -64,56 +88,116 @@
      knv3= nk1*nk2*nk3
      allocate(W(Num_wann))
      allocate(Hamk_bulk(Num_wann, Num_wann))
-     allocate(eigval(nband_store, knv3), stat=ierr)
-     if (ierr>0) stop 'not enough memory'
-     allocate(eigval_mpi(nband_store, knv3), stat=ierr)
-     if (ierr>0) stop 'not enough memory'
-
-     eigval_mpi= 0d0
-     eigval= 0d0
-     time_start= 0d0
-     time_end= 0d0
-     do ik= 1+cpuid, knv3, num_cpu
-        if (cpuid==0.and. mod(ik/num_cpu, 500)==0) &
-           write(stdout, *) '3DFS, ik ', ik, 'knv3',knv3, 'time left', &
-           (knv3-ik)*(time_end- time_start)/num_cpu, ' s'
-        call now(time_start)
 
-        ikx= (ik-1)/(nk2*nk3)+1
-        iky= ((ik-1-(ikx-1)*Nk2*Nk3)/nk3)+1
-        ikz= (ik-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
-        k= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1-1)  &
-         + K3D_vec2_cube*(iky-1)/dble(nk2-1)  &
-         + K3D_vec3_cube*(ikz-1)/dble(nk3-1)
+     !> the grid includes both edges of the k cube. If the symmetry operators
+     !> reduce the periodic mesh without the upper edges, only its irreducible
+     !> k points are calculated, and the others are copied on output.
+     symm= .false.
+     nkcalc= knv3
+     if (min(nk1, nk2, nk3)>1) then
+        call kmesh_symm_reduce(kcube, nk1-1, nk2-1, nk3-1, K3D_start_cube, &
+           K3D_vec1_cube, K3D_vec2_cube, K3D_vec3_cube)
+        symm= kcube%Nk_total_symm<kcube%Nk_total
+        if (symm) nkcalc= kcube%Nk_total_symm
+     endif
 
+     !> H(k) is built in blocks of nkb k points with one ZGEMM per block
+     nkb= hk_batch_size(nkcalc)
+     allocate(Hamk_batch(Num_wann, Num_wann, nkb), k_batch(3, nkb), ik_batch(nkb))
+     nthreads= get_num_threads()
+     allocate(eigval_chunk(nband_store, nkb*nthreads))
+     eigval_chunk= 0d0
+
+     !> the eigenvalues are streamed to disk chunk by chunk, the checkpoint
+     !> only keeps track of the finished k points
+     call checkpoint_start(ckpt, 'fermisurface3D', nkcalc, &
+        [K3D_start_cube, K3D_vec1_cube, K3D_vec2_cube, K3D_vec3_cube])
+     call kstream_open(st, 'fermisurface3D', nband_store, nkcalc, ckpt)
+
+     !> every rank takes one block per OpenMP thread at a time, and writes
+     !> its checkpoint in between
+     call scheduler_start(sched, nkcalc, nkb*nthreads)
+     do while (scheduler_next(sched, ik1, ik2))
+     if (cpuid==0.and. mod(sched%nchunks, 20)==1) &
+        write(stdout, *) '3DFS, ik ', ik1, 'knv3',nkcalc, 'time left', &
+        scheduler_time_left(sched), ' s'
+
+     !$OMP PARALLEL DO SCHEDULE(STATIC, 1) &
+     !$OMP PRIVATE(ik0, nk_batch, ikb, ik, ikx, iky, ikz, j1, W, Hamk_bulk, Hamk_batch, k_batch, ik_batch)
+     do ik0= ik1, ik2, nkb
+        nk_batch= 0
+        do ik= ik0, min(ik0+nkb-1, ik2)
+           if (checkpoint_done(ckpt, ik)) cycle
+           nk_batch= nk_batch+ 1
+           ik_batch(nk_batch)= ik
+           if (symm) then
+              j1= kcube%ik_array_symm(ik)
+              ikx= (j1-1)/((nk2-1)*(nk3-1))+1
+              iky= mod((j1-1)/(nk3-1), nk2-1)+1
+              ikz= mod(j1-1, nk3-1)+1
+           else
+              ikx= (ik-1)/(nk2*nk3)+1
+              iky= ((ik-1-(ikx-1)*Nk2*Nk3)/nk3)+1
+              ikz= (ik-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
+           endif
+           k_batch(:, nk_batch)= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1-1)  &
+            + K3D_vec2_cube*(iky-1)/dble(nk2-1)  &
+            + K3D_vec3_cube*(ikz-1)/dble(nk3-1)
+        enddo
+        if (nk_batch==0) cycle
 
         ! calculation bulk hamiltonian
-        Hamk_bulk= 0d0
        !call ham_bulk_atomicgauge    (k, Hamk_bulk)
-        call ham_bulk_latticegauge    (k, Hamk_bulk)
-        call eigensystem_c( 'N', 'U', Num_wann, Hamk_bulk, W)
-        eigval_mpi(:, ik)= W(nband_min:nband_max)
-        call now(time_end)
+        call ham_bulk_latticegauge_batch(nk_batch, k_batch, Hamk_batch)
+
+        do ikb= 1, nk_batch
+           ik= ik_batch(ikb)
+           Hamk_bulk= Hamk_batch(:, :, ikb)
+           call eigensystem_c( 'N', 'U', Num_wann, Hamk_bulk, W)
+           eigval_chunk(:, ik-ik1+1)= W(nband_min:nband_max)
+           call checkpoint_mark(ckpt, ik)
+        enddo
+     enddo
+     !$OMP END PARALLEL DO
+     call kstream_write(st, ik1, ik2, eigval_chunk, &
+        [(.not.checkpoint_done(ckpt, ik), ik= ik1, ik2)])
+     call checkpoint_update(ckpt)
      enddo
+     call scheduler_finish(sched, 'fermisurface3D')
+     deallocate(Hamk_batch, k_batch, ik_batch)
 
-#if defined (MPI)
-     call mpi_allreduce(eigval_mpi, eigval,size(eigval),&
-                       mpi_dp,mpi_sum,mpi_cmw,ierr)
-     if (ierr>0) then
-        print *, 'Something wrong in mpi_allreduce in fermisurface3D', ierr
-        stop
-     endif
-#else
-     eigval= eigval_mpi 
-#endif
+     call kstream_merge(st)
      if (cpuid==0) then
         write(stdout, *)'>> All processors finished their job for fermisurface3D'
      endif
 
+     !> the bands are read back from the stream in blocks of nblk k points
+     nblk= kstream_block_size(st, 1)
+     allocate(eigval_blk(1, nblk))
+     if (symm .and. cpuid==0) allocate(eigval_irr(nkcalc))
+
+     !> binary output: energy(k3, k2, k1, band) of the stored bands
+     if (cpuid==0 .and. result_binary) then
+        call result_write('fs3d/reciprocal_lattice', [3, 3], Angstrom2atomic* &
+           [Origin_cell%Kua, Origin_cell%Kub, Origin_cell%Kuc], '1/Angstrom', 'vector,direction')
+        call result_write('fs3d/bands', [nband_store], &
+           [(dble(i), i=nband_min, nband_max)], ' ', 'band')
+        call result_dataset('fs3d/energy', [nk3, nk2, nk1, nband_store], 'eV', &
+           'band,k1,k2,k3', id_energy)
+        do i=1, nband_store
+           do ik1= 1, knv3, nblk
+              ik2= min(ik1+nblk-1, knv3)
+              call fermisurface3D_read(i, ik1, ik2)
+              eigval_blk(1, 1:ik2-ik1+1)= eigval_blk(1, 1:ik2-ik1+1)/eV2Hartree
+              call result_put(id_energy, int(i-1, 8)*knv3+ ik1- 1, ik2-ik1+1, eigval_blk)
+           enddo
+        enddo
+     endif
+
      !> writeout eigenvalues data for each band into separate files for matlab isosurface function use.
      do i=1, nband_store
         outfileindex= outfileindex+ 1
-        if (cpuid==0) then
+        if (cpuid==0 .and. .not.result_binary) then
            if (i>0 .and. i<10) then
               write(fsfile, '(a, i1, a)')'FS3D_matlab_band_',i, '.txt'
            else if (i>=10 .and. i<100) then
@@ -126,15 +210,17 @@
            open(unit=outfileindex,FILE=fsfile,STATUS='UNKNOWN',FORM='FORMATTED')
            write(outfileindex,'(a, i10)') '%BAND: ',i
            write(outfileindex,'(a, 4i16)') '%Nk1, Nk2, Nk3, total', Nk1, Nk2, Nk3, knv3
-           do ik=1, knv3
-              write(outfileindex,'(f16.8)') eigval(i, ik)/eV2Hartree
+           do ik1= 1, knv3, nblk
+              ik2= min(ik1+nblk-1, knv3)
+              call fermisurface3D_read(i, ik1, ik2)
+              write(outfileindex,'(f16.8)') eigval_blk(1, 1:ik2-ik1+1)/eV2Hartree
            enddo
            close(outfileindex)
         endif
      enddo
 
      outfileindex= outfileindex+ 1
-     if (cpuid==0)then
+     if (cpuid==0 .and. .not.result_binary)then
         open(unit=outfileindex,FILE='FS3D.bxsf',STATUS='UNKNOWN',FORM='FORMATTED')
         write(outfileindex,'(a)') ' BEGIN_INFO'
         write(outfileindex,'(a)') '      #'
@@ -156,8 +242,10 @@
         write(outfileindex,'(3f16.8)') (Origin_cell%Kuc(i)*Angstrom2atomic, i=1,3)
         do i=1,nband_store
            write(outfileindex,'(a, i10)') 'BAND: ',i
-           do ik=1, knv3
-              write(outfileindex,'(E16.8)') eigval(i, ik)/eV2Hartree
+           do ik1= 1, knv3, nblk
+              ik2= min(ik1+nblk-1, knv3)
+              call fermisurface3D_read(i, ik1, ik2)
+              write(outfileindex,'(E16.8)') eigval_blk(1, 1:ik2-ik1+1)/eV2Hartree
            enddo
         enddo
         write(outfileindex,'(a)') 'END_BANDGRID_3D'
@@ -168,12 +256,46 @@
 #if defined (MPI)
      call mpi_barrier(mpi_cmw, ierr)
 #endif
+     call checkpoint_finish(ckpt)
+     call kstream_close(st)
 
      deallocate(W)
      deallocate(Hamk_bulk)
-     deallocate(eigval)
-     deallocate(eigval_mpi)
+     deallocate(eigval_chunk)
+     deallocate(eigval_blk)
+     if (allocated(eigval_irr)) deallocate(eigval_irr)
      return
+
+     contains
+
+     subroutine fermisurface3D_read(iband, i1, i2)
+        !> Band iband of the grid points i1..i2 into eigval_blk. With symm,
+        !> the band of all irreducible k points is read when i1 is 1.
+        integer, intent(in) :: iband, i1, i2
+
+        integer :: j, n(3)
+
+        if (.not.symm) then
+           call kstream_read(st, iband, iband, i1, i2, eigval_blk)
+           return
+        endif
+
+        if (i1==1) then
+           do j= 1, nkcalc, nblk
+              call kstream_read(st, iband, iband, j, min(j+nblk-1, nkcalc), eigval_irr(j))
+           enddo
+        endif
+
+        !> the upper edges of the grid are the lower ones of the periodic mesh
+        do j= i1, i2
+           n(1)= mod((j-1)/(nk2*nk3), nk1-1)
+           n(2)= mod(mod((j-1)/nk3, nk2), nk2-1)
+           n(3)= mod(mod(j-1, nk3), nk3-1)
+           eigval_blk(1, j-i1+1)= eigval_irr(kcube%ik_relate(1+ n(3)+ n(2)*(nk3-1)+ n(1)*(nk2-1)*(nk3-1)))
+        enddo
+
+        return
+     end subroutine fermisurface3D_read
    end subroutine fermisurface3D
 
 
@@ -0,0 +1,159 @@
+!> Fast Fourier transforms of complex arrays of any length.
+!> Powers of two use an iterative radix-2 transform, all other lengths are
+!> mapped onto a radix-2 convolution with Bluestein's chirp-z algorithm, so
+!> every transform costs O(n log n).
+!> The transforms are unnormalized:
+!>    x(k) <- sum_j x(j) exp(isign*2*pi*i*(j-1)*(k-1)/n)
+
+  subroutine fft_1d(n, x, isign)
+     !> In place transform of x(1:n), isign= -1 (forward) or +1 (backward)
+     use para, only : dp
+     implicit none
+
+     integer, intent(in) :: n
+     complex(dp), intent(inout) :: x(n)
+     integer, intent(in) :: isign
+
+     if (n<=1) return
+
+     if (iand(n, n-1)==0) then
+        call fft_radix2(n, x, isign)
+     else
+        call fft_bluestein(n, x, isign)
+     endif
+
+     return
+  end subroutine fft_1d
+
+  subroutine fft_2d(n1, n2, x, isign)
+     !> In place transform of x(1:n1, 1:n2) along both directions
+     use para, only : dp
+     implicit none
+
+     integer, intent(in) :: n1, n2
+     complex(dp), intent(inout) :: x(n1, n2)
+     integer, intent(in) :: isign
+
+     integer :: i1, i2
+     complex(dp), allocatable :: row(:)
+
+     do i2= 1, n2
+        call fft_1d(n1, x(:, i2), isign)
+     enddo
+
+     allocate(row(n2))
+     do i1= 1, n1
+        row= x(i1, :)
+        call fft_1d(n2, row, isign)
+        x(i1, :)= row
+     enddo
+     deallocate(row)
+
+     return
+  end subroutine fft_2d
+
+  subroutine fft_radix2(n, x, isign)
+     !> Iterative radix-2 transform, n has to be a power of two
+     use para, only : dp, twopi
+     implicit none
+
+     integer, intent(in) :: n
+     complex(dp), intent(inout) :: x(n)
+     integer, intent(in) :: isign
+
+     integer :: i, j, k, m, len, half_len, stride
+     complex(dp) :: t, u
+     complex(dp), allocatable :: twiddle(:)
+
+     !> bit reversal permutation
+     j= 1
+     do i= 1, n
+        if (i<j) then
+           t= x(j); x(j)= x(i); x(i)= t
+        endif
+        m= n/2
+        do while (m>=1 .and. j>m)
+           j= j- m
+           m= m/2
+        enddo
+        j= j+ m
+     enddo
+
+     !> twiddle factors of the full length, the stages use every stride-th one
+     allocate(twiddle(0:n/2-1))
+     do k= 0, n/2-1
+        twiddle(k)= exp(cmplx(0d0, isign*twopi*k/dble(n), kind=dp))
+     enddo
+
+     len= 2
+     do while (len<=n)
+        half_len= len/2
+        stride= n/len
+        do i= 1, n, len
+           do k= 0, half_len-1
+              t= twiddle(k*stride)*x(i+k+half_len)
+              u= x(i+k)
+              x(i+k)= u+ t
+              x(i+k+half_len)= u- t
+           enddo
+        enddo
+        len= 2*len
+     enddo
+
+     deallocate(twiddle)
+
+     return
+  end subroutine fft_radix2
+
+  subroutine fft_bluestein(n, x, isign)
+     !> Transform of arbitrary length n as a convolution with the chirp
+     !> w(j)= exp(isign*pi*i*j^2/n), evaluated with radix-2 transforms
+     use para, only : dp, pi
+     implicit none
+
+     integer, intent(in) :: n
+     complex(dp), intent(inout) :: x(n)
+     integer, intent(in) :: isign
+
+     integer :: j, nconv
+     integer(8) :: j2
+     complex(dp), allocatable :: chirp(:), a(:), b(:)
+
+     nconv= 1
+     do while (nconv< 2*n-1)
+        nconv= 2*nconv
+     enddo
+
+     allocate(chirp(0:n-1), a(nconv), b(nconv))
+
+     !> j^2 is reduced modulo 2n to keep the phases accurate for large n
+     do j= 0, n-1
+        j2= mod(int(j, 8)*int(j, 8), int(2*n, 8))
+        chirp(j)= exp(cmplx(0d0, isign*pi*dble(j2)/dble(n), kind=dp))
+     enddo
+
+     a= 0d0
+     do j= 0, n-1
+        a(j+1)= x(j+1)*chirp(j)
+     enddo
+
+     b= 0d0
+     b(1)= conjg(chirp(0))
+     do j= 1, n-1
+        b(j+1)= conjg(chirp(j))
+        b(nconv-j+1)= conjg(chirp(j))
+     enddo
+
+     call fft_radix2(nconv, a, -1)
+     call fft_radix2(nconv, b, -1)
+     a= a*b
+     call fft_radix2(nconv, a, 1)
+
+     do j= 0, n-1
+        x(j+1)= chirp(j)*a(j+1)/dble(nconv)
+     enddo
+
+     deallocate(chirp, a, b)
+
+     return
+  end subroutine fft_bluestein
@@ -9,9 +9,12 @@
       ! Nov 9 2016  at ETHZ
 
       use para
+      use scheduler
       implicit none
 
       integer :: ik, ikx, iky, ikz, knv3, ierr, Nleft
+      integer :: ik1, ik2
+      type(scheduler_type) :: sched
       real(dp) :: k(3), k_cart(3), k_out(3), gap_out
       real(dp), allocatable :: kabc_minimal(:, :)
       real(dp), allocatable :: gap_minimal(:)
@@ -39,7 +42,11 @@
       gap_minimal= 0d0
      
 
-      do ik=1+cpuid, knv3, num_cpu
+      !> the number of iterations of FindNode_k0 differs a lot between the
+      !> starting points, so they are handed out one by one on demand
+      call scheduler_start(sched, knv3, 1)
+      do while (scheduler_next(sched, ik1, ik2))
+      do ik=ik1, ik2
          ikx= (ik- 1)/(Nk2*Nk3)+ 1
          iky= (ik- (ikx-1)*Nk2*Nk3- 1)/Nk3+ 1
          ikz= ik- (ikx-1)*Nk2*Nk3- (iky-1)*Nk3 
@@ -56,6 +63,8 @@
          gap_minimal(ik)= gap_out
  
       enddo 
+      enddo
+      call scheduler_finish(sched, 'FindNodes')
 
 #if defined (MPI)
       kabc_minimal_mpi= 0
@@ -15,66 +15,48 @@ subroutine ham_bulk_atomicgauge(k,Hamk_bulk)
    !  Lattice gauge Hl
    !  Atomic gauge Ha= U* Hl U 
    !  where U = e^ik.wc(i) on diagonal
+   !
+   !  The Rcut mask and the Cartesian vectors are taken from the tables
+   !  built by atomicgauge_table_init, e^{ik.(R+wc(i2)-wc(i1))} is split
+   !  into e^{ik.R} and U, so each k point only needs Nrpts+Num_wann phases.
 
    use para
    implicit none
 
-   integer :: i1,i2,iR
+   integer :: i1,i2,iR,ih
 
    ! wave vector in 3d
-   real(Dp) :: k(3), kdotr, pos0(3), dis
-
-   complex(dp) :: factor
+   real(Dp) :: k(3)
 
-   real(dp) :: pos(3), pos1(3), pos2(3), pos_cart(3), pos_direct(3)
    ! Hamiltonian of bulk system
    complex(Dp),intent(out) ::Hamk_bulk(Num_wann, Num_wann)
-   complex(dp), allocatable :: mat1(:, :)
-   real(dp), external :: norm
-
-   allocate(mat1(Num_wann, Num_wann))
-
-   Hamk_bulk=0d0
-  !do iR=1, Nrpts
-  !   kdotr= k(1)*irvec(1,iR) + k(2)*irvec(2,iR) + k(3)*irvec(3,iR)
-  !   factor= exp(pi2zi*kdotr)
-
-  !   Hamk_bulk(:, :)= Hamk_bulk(:, :) &
-  !      + HmnR(:, :, iR)*factor/ndegen(iR)
-  !enddo ! iR
- 
-  !mat1=0d0
-  !do i1=1,Num_wann
-  !   pos0=Origin_cell%wannier_centers_direct(:, i1)
-  !   kdotr= k(1)*pos0(1)+ k(2)*pos0(2)+ k(3)*pos0(3)
-  !   mat1(i1,i1)= exp(pi2zi*kdotr)
-  !enddo
-  !Hamk_bulk=matmul(conjg(mat1),matmul(Hamk_bulk,mat1))
-
-
-   !> the first atom in home unit cell
-   do iR=1, Nrpts
-      do i2=1, Num_wann
-         pos2= Origin_cell%wannier_centers_direct(:, i2)
-         !> the second atom in unit cell R
-         do i1=1, Num_wann
-            pos1= Origin_cell%wannier_centers_direct(:, i1)
-            pos_direct= irvec(:, iR)
-            pos_direct= pos_direct+ pos2- pos1
-
-            call direct_cart_real(pos_direct, pos_cart, Origin_cell%lattice)
-
-            dis= norm(pos_cart)
-            if (dis> Rcut) cycle
-
-            kdotr=k(1)*pos_direct(1) + k(2)*pos_direct(2) + k(3)*pos_direct(3)
-            factor= (cos(twopi*kdotr)+zi*sin(twopi*kdotr))
+   complex(dp), allocatable :: eikr(:), uk(:)
+
+   call atomicgauge_table_init()
+
+   allocate(eikr(Nrpts), uk(Num_wann))
+   call atomicgauge_phases(k, eikr, uk)
+
+   if (ag_nocut) then
+      !> Hl(k)= sum_R HmnR(:, :, R) e^{ik.R}/ndegen(R)
+      call zgemv('N', Num_wann*Num_wann, Nrpts, (1d0, 0d0), HmnR, Num_wann*Num_wann, &
+         eikr, 1, (0d0, 0d0), Hamk_bulk, 1)
+   else
+      Hamk_bulk=0d0
+      do ih=1, ag_nnz
+         i1= ag_i1(ih)
+         i2= ag_i2(ih)
+         iR= ag_ir(ih)
+         Hamk_bulk(i1, i2)= Hamk_bulk(i1, i2)+ HmnR(i1, i2, iR)*eikr(iR)
+      enddo
+   endif
 
-            Hamk_bulk(i1, i2)= Hamk_bulk(i1, i2) &
-               + HmnR(i1, i2, iR)*factor/ndegen(iR)
-         enddo ! i1
-      enddo ! i2
-   enddo ! iR
+   do i2=1, Num_wann
+      do i1=1, Num_wann
+         Hamk_bulk(i1, i2)= conjg(uk(i1))*Hamk_bulk(i1, i2)*uk(i2)
+      enddo
+   enddo
+   deallocate(eikr, uk)
 
    ! check hermitcity
    do i1=1, Num_wann
@@ -92,6 +74,98 @@ subroutine ham_bulk_atomicgauge(k,Hamk_bulk)
    return
 end subroutine ham_bulk_atomicgauge
 
+subroutine atomicgauge_table_init()
+   !> Build the k independent tables used by ham_bulk_atomicgauge,
+   !> dHdk_atomicgauge and d2Hdk2_atomicgauge: R and the Wannier centers in
+   !> Cartesian coordinates, and the list of hoppings HmnR(i1, i2, iR) with
+   !> |R+wc(i2)-wc(i1)|<=Rcut. With the default Rcut nothing is dropped and
+   !> no list is stored.
+   use para, only : dp, Nrpts, irvec, Num_wann, Origin_cell, Rcut, &
+      ag_table_ready, ag_nocut, ag_nnz, ag_i1, ag_i2, ag_ir, ag_rcart, ag_wc_cart
+   implicit none
+
+   integer :: iR, i1, i2
+   integer(8) :: nkept
+   real(dp) :: pos_direct(3)
+   real(dp), external :: norm
+
+   if (ag_table_ready) return
+
+   !> the drivers build the tables before their thread parallel k loops,
+   !> this only guards against a first call from several threads at once
+   !$OMP CRITICAL (atomicgauge_table)
+   if (.not. ag_table_ready) then
+      if (allocated(ag_rcart)) deallocate(ag_rcart)
+      if (allocated(ag_wc_cart)) deallocate(ag_wc_cart)
+      allocate(ag_rcart(3, Nrpts), ag_wc_cart(3, Num_wann))
+      do iR=1, Nrpts
+         pos_direct= irvec(:, iR)
+         call direct_cart_real(pos_direct, ag_rcart(:, iR), Origin_cell%lattice)
+      enddo
+      do i1=1, Num_wann
+         call direct_cart_real(Origin_cell%wannier_centers_direct(:, i1), ag_wc_cart(:, i1), Origin_cell%lattice)
+      enddo
+
+      nkept= 0
+      do iR=1, Nrpts
+         do i2=1, Num_wann
+            do i1=1, Num_wann
+               if (norm(ag_rcart(:, iR)+ ag_wc_cart(:, i2)- ag_wc_cart(:, i1))<= Rcut) nkept= nkept+ 1
+            enddo
+         enddo
+      enddo
+      ag_nocut= nkept== int(Num_wann, 8)*Num_wann*Nrpts
+
+      if (allocated(ag_i1)) deallocate(ag_i1, ag_i2, ag_ir)
+      ag_nnz= 0
+      if (.not. ag_nocut) then
+         ag_nnz= int(nkept)
+         allocate(ag_i1(ag_nnz), ag_i2(ag_nnz), ag_ir(ag_nnz))
+         nkept= 0
+         do iR=1, Nrpts
+            do i2=1, Num_wann
+               do i1=1, Num_wann
+                  if (norm(ag_rcart(:, iR)+ ag_wc_cart(:, i2)- ag_wc_cart(:, i1))> Rcut) cycle
+                  nkept= nkept+ 1
+                  ag_i1(nkept)= i1
+                  ag_i2(nkept)= i2
+                  ag_ir(nkept)= iR
+               enddo
+            enddo
+         enddo
+      endif
+
+      ag_table_ready= .true.
+   endif
+   !$OMP END CRITICAL (atomicgauge_table)
+
+   return
+end subroutine atomicgauge_table_init
+
+subroutine atomicgauge_phases(k, eikr, uk)
+   !> eikr(iR)= e^{i2pi k.R}/ndegen(R) and uk(i)= e^{i2pi k.wc(i)}
+   use para, only : dp, Nrpts, irvec, ndegen, Num_wann, Origin_cell, twopi
+   implicit none
+
+   real(dp), intent(in) :: k(3)
+   complex(dp), intent(out) :: eikr(Nrpts)
+   complex(dp), intent(out) :: uk(Num_wann)
+
+   integer :: iR, i
+   real(dp) :: kdotr
+
+   do iR=1, Nrpts
+      kdotr=k(1)*irvec(1, iR) + k(2)*irvec(2, iR) + k(3)*irvec(3, iR)
+      eikr(iR)= dcmplx(cos(twopi*kdotr), sin(twopi*kdotr))/ndegen(iR)
+   enddo
+   do i=1, Num_wann
+      kdotr= dot_product(k, Origin_cell%wannier_centers_direct(:, i))
+      uk(i)= dcmplx(cos(twopi*kdotr), sin(twopi*kdotr))
+   enddo
+
+   return
+end subroutine atomicgauge_phases
+
 
 subroutine valley_k_atomicgauge(k,valley_k)
    ! This subroutine performs the Fourier transform of avalley operator
@@ -158,8 +232,11 @@ end subroutine valley_k_atomicgauge
 
 subroutine d2Hdk2_atomicgauge(k, DHDk2_wann)
    !> second derivatve of H(k)
-   use para, only : Nrpts, irvec, crvec, Origin_cell, HmnR, ndegen, &
-       Num_wann, dp, Rcut, pi2zi, zi, twopi, pi
+   !> -sum_R (R+wc(i2)-wc(i1))_i (R+wc(i2)-wc(i1))_j HmnR e^{ik.(R+wc(i2)-wc(i1))}/ndegen
+   !> The R dependent moments sum_R R_i R_j HmnR e^{ik.R}/ndegen, sum_R R_i (...)
+   !> and sum_R (...) are one ZGEMM, the Wannier center terms are added after.
+   use para, only : Nrpts, HmnR, Num_wann, dp, &
+      ag_nocut, ag_nnz, ag_i1, ag_i2, ag_ir, ag_rcart, ag_wc_cart
    implicit none
 
    !> momentum in 3D BZ
@@ -168,49 +245,68 @@ subroutine d2Hdk2_atomicgauge(k, DHDk2_wann)
    !> second derivate of H(k)
    complex(dp), intent(out) :: DHDk2_wann(Num_wann, Num_wann, 3, 3)
 
-   integer :: iR, i1, i2, i, j
+   integer :: iR, i1, i2, i, j, ih
 
-   real(dp) :: pos(3), pos1(3), pos2(3), pos_cart(3), pos_direct(3)
-   real(dp) :: kdotr, dis
-   complex(dp) :: ratio
-   real(dp), external :: norm
+   real(dp) :: pos_cart(3), dwc(3)
+   complex(dp) :: h
+   complex(dp), allocatable :: eikr(:), uk(:), phase(:, :), moments(:, :, :)
+
+   call atomicgauge_table_init()
+   allocate(eikr(Nrpts), uk(Num_wann))
+   call atomicgauge_phases(k, eikr, uk)
 
    DHDk2_wann= 0d0
-   !> the first atom in home unit cell
-   do iR=1, Nrpts
+   if (ag_nocut) then
+      !> columns: 1, R_i (2:4), R_i R_j (4+i+3*(j-1))
+      allocate(phase(Nrpts, 13), moments(Num_wann, Num_wann, 13))
+      phase(:, 1)= eikr
+      do i=1, 3
+         phase(:, 1+i)= ag_rcart(i, :)*eikr
+      enddo
+      do j=1, 3
+         do i=1, 3
+            phase(:, 4+i+3*(j-1))= ag_rcart(i, :)*ag_rcart(j, :)*eikr
+         enddo
+      enddo
+      call zgemm('N', 'N', Num_wann*Num_wann, 13, Nrpts, (1d0, 0d0), HmnR, Num_wann*Num_wann, &
+         phase, Nrpts, (0d0, 0d0), moments, Num_wann*Num_wann)
+
       do i2=1, Num_wann
-         pos2= Origin_cell%wannier_centers_direct(:, i2)
-         !> the second atom in unit cell R
          do i1=1, Num_wann
-            pos1= Origin_cell%wannier_centers_direct(:, i1)
-            pos_direct= irvec(:, iR)
-            pos_direct= pos_direct+ pos2- pos1
-
-            call direct_cart_real(pos_direct, pos_cart, Origin_cell%lattice)
-
-            dis= norm(pos_cart)
-            if (dis> Rcut) cycle
-
-            kdotr=k(1)*pos_direct(1) + k(2)*pos_direct(2) + k(3)*pos_direct(3)
-            ratio= (cos(twopi*kdotr)+zi*sin(twopi*kdotr))/ndegen(iR)
-
+            dwc= ag_wc_cart(:, i2)- ag_wc_cart(:, i1)
             do j=1, 3
                do i=1, 3
-                  DHDk2_wann(i1, i2, i, j)=DHDk2_wann(i1, i2, i, j) &
-                     -pos_cart(i)*pos_cart(j)*HmnR(i1, i2, iR)*ratio
-               enddo ! j 
-            enddo ! i
+                  DHDk2_wann(i1, i2, i, j)= -conjg(uk(i1))*uk(i2)*(moments(i1, i2, 4+i+3*(j-1)) &
+                     + dwc(i)*moments(i1, i2, 1+j)+ dwc(j)*moments(i1, i2, 1+i) &
+                     + dwc(i)*dwc(j)*moments(i1, i2, 1))
+               enddo ! i
+            enddo ! j
          enddo ! i1
       enddo ! i2
-   enddo ! iR
+      deallocate(phase, moments)
+   else
+      do ih=1, ag_nnz
+         i1= ag_i1(ih)
+         i2= ag_i2(ih)
+         iR= ag_ir(ih)
+         pos_cart= ag_rcart(:, iR)+ ag_wc_cart(:, i2)- ag_wc_cart(:, i1)
+         h= HmnR(i1, i2, iR)*eikr(iR)*conjg(uk(i1))*uk(i2)
+         do j=1, 3
+            do i=1, 3
+               DHDk2_wann(i1, i2, i, j)=DHDk2_wann(i1, i2, i, j) &
+                  -pos_cart(i)*pos_cart(j)*h
+            enddo ! i
+         enddo ! j
+      enddo ! ih
+   endif
+   deallocate(eikr, uk)
 
    return
 end subroutine d2Hdk2_atomicgauge
 
 subroutine d2Hdk2_atomicgauge_wann(k, D2HDk2_wann)
-   !> second derivatve of H(k)
-   use para, only : Nrpts, irvec, crvec, Origin_cell, HmnR, ndegen, &
-       Num_wann, dp, Rcut, pi2zi, zi, twopi, pi
+   !> second derivatve of H(k), same as d2Hdk2_atomicgauge
+   use para, only : Num_wann, dp
    implicit none
 
    !> momentum in 3D BZ
@@ -219,41 +315,7 @@ subroutine d2Hdk2_atomicgauge_wann(k, D2HDk2_wann)
    !> second derivate of H(k)
    complex(dp), intent(out) :: D2HDk2_wann(Num_wann, Num_wann, 3, 3)
 
-   integer :: iR, i1, i2, i, j
-
-   real(dp) :: pos(3), pos1(3), pos2(3), pos_cart(3), pos_direct(3)
-   real(dp) :: kdotr, dis
-   complex(dp) :: ratio
-   real(dp), external :: norm
-
-   D2HDk2_wann= 0d0
-   !> the first atom in home unit cell
-   do iR=1, Nrpts
-      do i2=1, Num_wann
-         pos2= Origin_cell%wannier_centers_direct(:, i2)
-         !> the second atom in unit cell R
-         do i1=1, Num_wann
-            pos1= Origin_cell%wannier_centers_direct(:, i1)
-            pos_direct= irvec(:, iR)
-            pos_direct= pos_direct+ pos2- pos1
-
-            call direct_cart_real(pos_direct, pos_cart, Origin_cell%lattice)
-
-            dis= norm(pos_cart)
-            if (dis> Rcut) cycle
-
-            kdotr=k(1)*pos_direct(1) + k(2)*pos_direct(2) + k(3)*pos_direct(3)
-            ratio= (cos(twopi*kdotr)+zi*sin(twopi*kdotr))/ndegen(iR)
-
-            do j=1, 3
-               do i=1, 3
-                  D2HDk2_wann(i1, i2, i, j)=D2HDk2_wann(i1, i2, i, j) &
-                     -pos_cart(i)*pos_cart(j)*HmnR(i1, i2, iR)*ratio
-               enddo ! j 
-            enddo ! i
-         enddo ! i1
-      enddo ! i2
-   enddo ! iR
+   call d2Hdk2_atomicgauge(k, D2HDk2_wann)
 
    return
 end subroutine d2Hdk2_atomicgauge_wann
@@ -287,9 +349,10 @@ end subroutine d2Hdk2_atomicgauge_Ham
 subroutine dHdk_atomicgauge(k, velocity_Wannier)
    !> Velocity operator in Wannier basis using atomic gauge
    !> First derivate of H(k); dH(k)/dk
-   use para, only : Nrpts, irvec, Origin_cell, HmnR, ndegen, &
-       Num_wann, dp, Rcut, pi2zi,  &
-       zi, soc, zzero, twopi
+   !> i sum_R (R+wc(i2)-wc(i1)) HmnR e^{ik.(R+wc(i2)-wc(i1))}/ndegen, the R
+   !> moments are one ZGEMM and the Wannier center term is added after.
+   use para, only : Nrpts, HmnR, Num_wann, dp, zi, zzero, &
+      ag_nocut, ag_nnz, ag_i1, ag_i2, ag_ir, ag_rcart, ag_wc_cart
    implicit none
 
    !> momentum in 3D BZ
@@ -298,39 +361,49 @@ subroutine dHdk_atomicgauge(k, velocity_Wannier)
    !> velocity operator in Wannier basis using atomic gauge 
    complex(dp), intent(out) :: velocity_Wannier(Num_wann, Num_wann, 3)
 
-   integer :: iR, i1, i2, i
+   integer :: iR, i1, i2, i, ih
 
-   real(dp) :: pos1(3), pos2(3), pos_cart(3), pos_direct(3)
-   real(dp) :: kdotr, dis
-   complex(dp) :: ratio
-   real(dp), external :: norm
+   real(dp) :: pos_cart(3)
+   complex(dp) :: h
+   complex(dp), allocatable :: eikr(:), uk(:), phase(:, :), moments(:, :, :)
+
+   call atomicgauge_table_init()
+   allocate(eikr(Nrpts), uk(Num_wann))
+   call atomicgauge_phases(k, eikr, uk)
 
    velocity_Wannier= zzero
-   do iR=1, Nrpts
+   if (ag_nocut) then
+      allocate(phase(Nrpts, 4), moments(Num_wann, Num_wann, 4))
+      phase(:, 1)= eikr
+      do i=1, 3
+         phase(:, 1+i)= ag_rcart(i, :)*eikr
+      enddo
+      call zgemm('N', 'N', Num_wann*Num_wann, 4, Nrpts, (1d0, 0d0), HmnR, Num_wann*Num_wann, &
+         phase, Nrpts, (0d0, 0d0), moments, Num_wann*Num_wann)
+
       do i2=1, Num_wann
-         pos2= Origin_cell%wannier_centers_direct(:, i2)
-         !> the second atom in unit cell R
          do i1=1, Num_wann
-            !> the first atom in home unit cell
-            pos1= Origin_cell%wannier_centers_direct(:, i1)
-            pos_direct= irvec(:, iR)+ pos2- pos1
-
-            call direct_cart_real(pos_direct, pos_cart, Origin_cell%lattice)
-
-            dis= norm(pos_cart)
-            if (dis> Rcut) cycle
-
-            kdotr=k(1)*pos_direct(1) + k(2)*pos_direct(2) + k(3)*pos_direct(3)
-            ratio= (cos(twopi*kdotr)+zi*sin(twopi*kdotr))/ndegen(iR)
-
             do i=1, 3
-               velocity_Wannier(i1, i2, i)=velocity_Wannier(i1, i2, i)+ &
-                  zi*pos_cart(i)*HmnR(i1, i2, iR)*ratio
+               velocity_Wannier(i1, i2, i)= zi*conjg(uk(i1))*uk(i2)*(moments(i1, i2, 1+i) &
+                  + (ag_wc_cart(i, i2)- ag_wc_cart(i, i1))*moments(i1, i2, 1))
             enddo ! i
-
-         enddo ! i2
-      enddo ! i1
-   enddo ! iR
+         enddo ! i1
+      enddo ! i2
+      deallocate(phase, moments)
+   else
+      do ih=1, ag_nnz
+         i1= ag_i1(ih)
+         i2= ag_i2(ih)
+         iR= ag_ir(ih)
+         pos_cart= ag_rcart(:, iR)+ ag_wc_cart(:, i2)- ag_wc_cart(:, i1)
+         h= HmnR(i1, i2, iR)*eikr(iR)*conjg(uk(i1))*uk(i2)
+         do i=1, 3
+            velocity_Wannier(i1, i2, i)=velocity_Wannier(i1, i2, i)+ &
+               zi*pos_cart(i)*h
+         enddo ! i
+      enddo ! ih
+   endif
+   deallocate(eikr, uk)
 
    return
 end subroutine dHdk_atomicgauge
@@ -421,6 +494,112 @@ subroutine ham_bulk_latticegauge(k,Hamk_bulk)
 end subroutine ham_bulk_latticegauge
 
 
+function hk_batch_size(nk) result(nkb)
+   !> Number of k points passed to ham_bulk_latticegauge_batch at once in a
+   !> loop over nk k points shared by all MPI ranks and OpenMP threads.
+   !> Every thread holds its own block Hamk_batch(Num_wann, Num_wann, nkb),
+   !> together they are limited to about 64 MB, and the blocks are small
+   !> enough that every thread gets at least one.
+   use para, only : Num_wann
+   use wmpi, only : num_cpu
+   implicit none
+
+   integer, intent(in) :: nk
+   integer :: nkb, nthreads
+   integer, external :: get_num_threads
+
+   nthreads= get_num_threads()
+   nkb= max(1, min(64, 2**22/(Num_wann*Num_wann)/nthreads))
+   nkb= max(1, min(nkb, (nk+num_cpu*nthreads-1)/(num_cpu*nthreads)))
+
+   return
+end function hk_batch_size
+
+subroutine ham_bulk_latticegauge_batch(nk, kpoints, Hamk_batch)
+   ! This subroutine caculates Hamiltonian for a block of k points
+   ! in the lattice gauge, same as ham_bulk_latticegauge.
+   !
+   ! HmnR is seen as a (Num_wann*Num_wann, Nrpts) matrix and multiplied by
+   ! the phase matrix exp(i2pi k.R)/ndegen(R) of shape (Nrpts, nk), so the
+   ! whole block is one ZGEMM instead of nk*Nrpts matrix updates.
+
+   use para, only : dp, HmnR, ndegen, nrpts, irvec, Num_wann, twopi
+   implicit none
+
+   integer, intent(in) :: nk
+   real(dp), intent(in) :: kpoints(3, nk)
+
+   ! Hamiltonian of bulk system at each k point
+   complex(dp), intent(out) :: Hamk_batch(Num_wann, Num_wann, nk)
+
+   integer :: ik, iR
+   real(dp) :: kdotr
+   complex(dp), allocatable :: phase(:, :)
+
+   allocate(phase(Nrpts, nk))
+   do ik=1, nk
+      do iR=1, Nrpts
+         kdotr= kpoints(1, ik)*irvec(1,iR) + kpoints(2, ik)*irvec(2,iR) + kpoints(3, ik)*irvec(3,iR)
+         phase(iR, ik)= dcmplx(cos(twopi*kdotr), sin(twopi*kdotr))/ndegen(iR)
+      enddo
+   enddo
+
+   call zgemm('N', 'N', Num_wann*Num_wann, nk, Nrpts, (1d0, 0d0), &
+      HmnR, Num_wann*Num_wann, phase, Nrpts, (0d0, 0d0), Hamk_batch, Num_wann*Num_wann)
+
+   deallocate(phase)
+   return
+end subroutine ham_bulk_latticegauge_batch
+
+subroutine ham_bulk_atomicgauge_batch(nk, kpoints, Hamk_batch)
+   ! This subroutine caculates Hamiltonian for a block of k points
+   ! in the atomic gauge, same as ham_bulk_atomicgauge.
+   !
+   ! Ha(k)= U^* Hl(k) U with U= e^{ik.wc(i)} on the diagonal, Hl(k) comes
+   ! from ham_bulk_latticegauge_batch. This only holds when no hopping is
+   ! dropped by Rcut, otherwise we go back to ham_bulk_atomicgauge.
+
+   use para, only : dp, Num_wann, Origin_cell, twopi, ag_nocut
+   implicit none
+
+   integer, intent(in) :: nk
+   real(dp), intent(in) :: kpoints(3, nk)
+
+   ! Hamiltonian of bulk system at each k point
+   complex(dp), intent(out) :: Hamk_batch(Num_wann, Num_wann, nk)
+
+   integer :: ik, i1, i2
+   real(dp) :: kdotr
+   complex(dp), allocatable :: uk(:)
+
+   call atomicgauge_table_init()
+   if (.not. ag_nocut) then
+      do ik=1, nk
+         call ham_bulk_atomicgauge(kpoints(:, ik), Hamk_batch(:, :, ik))
+      enddo
+      return
+   endif
+
+   call ham_bulk_latticegauge_batch(nk, kpoints, Hamk_batch)
+
+   allocate(uk(Num_wann))
+   do ik=1, nk
+      do i1=1, Num_wann
+         kdotr= dot_product(kpoints(:, ik), Origin_cell%wannier_centers_direct(:, i1))
+         uk(i1)= dcmplx(cos(twopi*kdotr), sin(twopi*kdotr))
+      enddo
+      do i2=1, Num_wann
+         do i1=1, Num_wann
+            Hamk_batch(i1, i2, ik)= conjg(uk(i1))*Hamk_batch(i1, i2, ik)*uk(i2)
+         enddo
+      enddo
+   enddo
+   deallocate(uk)
+
+   return
+end subroutine ham_bulk_atomicgauge_batch
+
+
 subroutine S_bulk_latticegauge(k,Sk_bulk)
    ! This subroutine caculates Hamiltonian for
    ! bulk system without the consideration of the atom's position
@@ -718,11 +897,13 @@ subroutine ham_bulk_LOTO(k,Hamk_bulk)
 
    complex(dp), allocatable :: mat1(:, :)
    complex(dp), allocatable :: mat2(:, :)
-   real(dp) :: temp1(3)=(/0.0,0.0,0.0/)
-   real(dp) :: temp2=0.0
+   !> no initialisers here, they would make the variables SAVEd and shared
+   !> between the threads of a k loop
+   real(dp) :: temp1(3)
+   real(dp) :: temp2
    real(dp) :: temp3(30),constant_t
-   real(dp) ::A_ii(3)=(/0.0,0.0,0.0/)
-   real(dp) ::A_jj(3)=(/0.0,0.0,0.0/)
+   real(dp) ::A_ii(3)
+   real(dp) ::A_jj(3)
 
    !> k times Born charge
    real(dp), allocatable :: kBorn(:, :)
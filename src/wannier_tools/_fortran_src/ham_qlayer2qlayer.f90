@@ -5,6 +5,7 @@
      ! Copyright (c) 2010 QuanSheng Wu. All rights reserved.
 
      use para
+     use workspace
 
      implicit none
 
@@ -30,7 +31,7 @@
 
      complex(dp) :: ratio
 
-     complex(Dp), allocatable :: Hij(:, :, :)
+     complex(Dp), pointer :: Hij(:, :, :)
 
      ! H00 Hamiltonian between nearest neighbour-quintuple-layers
      ! the factor 2 is induced by spin
@@ -42,7 +43,9 @@
      !     complex(Dp),allocatable,intent(out) :: H01new(:,:)
      complex(Dp),intent(out) :: H01new(Ndim,Ndim)
 
-     allocate(Hij(Num_wann,Num_wann,-ijmax:ijmax))
+     !> work array from the workspace of this thread
+     Hij(1:Num_wann, 1:Num_wann, -ijmax:ijmax) => &
+        ws_complex(WS_HAM_QLAYER2QLAYER, 1, Num_wann*Num_wann*(2*ijmax+1))
 
      Hij=0.0d0
      do iR=1,nrpts_surfacecell
@@ -96,8 +99,6 @@
      enddo
      enddo
 
-     deallocate(Hij)
-
   return
   end subroutine ham_qlayer2qlayer
 
@@ -7,6 +7,7 @@
      ! Copyright (c) 2010 QuanSheng Wu. All rights reserved.
   
      use para
+     use workspace
      implicit none
 
      ! loop index  
@@ -19,10 +20,15 @@
      complex(Dp),intent(out) ::Hamk_slab(Num_wann*nslab,Num_wann*nslab) 
 
      ! the factor 2 is induced by spin
-     complex(Dp), allocatable :: Hij(:, :, :), ham_elec(:, :), Sij(:, :, :), Sk_slab(:, :)
+     complex(Dp), pointer :: Hij(:, :, :), Sij(:, :, :), Sk_slab(:, :)
 
-     allocate( Hij(-ijmax:ijmax,Num_wann,Num_wann))
-     allocate( ham_elec( Num_wann*nslab, Num_wann*nslab))
+     !> static potential of the electric field on the diagonal
+     real(dp), pointer :: potential(:)
+
+     !> work arrays from the workspace of this thread
+     Hij(-ijmax:ijmax, 1:Num_wann, 1:Num_wann) => &
+        ws_complex(WS_HAM_SLAB, 1, (2*ijmax+1)*Num_wann*Num_wann)
+     potential => ws_real(WS_HAM_SLAB, 1, Num_wann*nslab)
 
      !> deal with phonon system
      if (index(Particle,'phonon')/=0.and.LOTO_correction) then
@@ -46,8 +52,10 @@
      enddo ! i1
 
      if (.not. Orthogonal_Basis) then
-         allocate(Sij(-ijmax:ijmax,Num_wann,Num_wann))
-         allocate(Sk_slab(Num_wann*nslab,Num_wann*nslab))
+         Sij(-ijmax:ijmax, 1:Num_wann, 1:Num_wann) => &
+            ws_complex(WS_HAM_SLAB, 2, (2*ijmax+1)*Num_wann*Num_wann)
+         Sk_slab(1:Num_wann*nslab, 1:Num_wann*nslab) => &
+            ws_complex(WS_HAM_SLAB, 3, (Num_wann*nslab)**2)
          Sk_slab=0.0d0
          
          call s_qlayer2qlayer2(k,Sij)
@@ -63,8 +71,10 @@
          call orthogonalize_hamiltonian(Hamk_slab, Sk_slab,Num_wann*nslab)
      endif
 
-     call add_ham_slab_elec_field(ham_elec)
-     Hamk_slab= Hamk_slab+ ham_elec 
+     call slab_elec_potential(potential)
+     do i1=1, nslab*Num_wann
+        Hamk_slab(i1, i1)= Hamk_slab(i1, i1)+ potential(i1)
+     enddo
 
      ! check hermitcity
 
@@ -77,10 +87,6 @@
      enddo
      enddo
 
-     deallocate( Hij)
-     if (.not. Orthogonal_Basis) then
-        deallocate(Sij)
-     endif
   return
   end subroutine ham_slab
 
@@ -335,13 +341,14 @@ end subroutine ham_slab_sparseHR
   return
   end subroutine ham_slab_parallel_B
 
-  subroutine add_ham_slab_elec_field(ham_elec)
+  subroutine slab_elec_potential(potential)
 
-     !> add a perpendicular electric field to the slab system
+     !> the static potential of a perpendicular electric field on each
+     !> orbital of the slab system, added to the diagonal of ham_slab
      use para
      implicit none
 
-     complex(dp), intent(out) :: ham_elec(nslab*Num_wann, nslab*Num_wann)
+     real(dp), intent(out) :: potential(nslab*Num_wann)
 
      !> first we need to check the center of the slab such that where the static potential is zero
      integer :: i, j, it, ia, io
@@ -388,20 +395,20 @@ end subroutine ham_slab_sparseHR
 
      it= 0
      io= 0
-     ham_elec= 0d0
+     potential= 0d0
      do i=1, Nslab 
         do ia=1, num_atoms_primitive_cell
            it= it+ 1
            static_potential= pos_z(it)*Electric_field_in_eVpA*eV2Hartree/Angstrom2atomic
            do j=1, Origin_cell%nprojs(ia)
               io= io+ 1
-              ham_elec(io, io)= static_potential
+              potential(io)= static_potential
               if (SOC>0) then
-                 ham_elec(io+Nslab*Num_wann/2, io+Nslab*Num_wann/2)= static_potential
+                 potential(io+Nslab*Num_wann/2)= static_potential
               endif
            enddo
         enddo
      enddo
 
      return
-  end subroutine add_ham_slab_elec_field
+  end subroutine slab_elec_potential
@@ -1,6 +1,6 @@
   subroutine inv(ndim,Amat)
 
-
+     use workspace
      implicit none
 
      integer,parameter :: dp=8
@@ -15,7 +15,7 @@
 !    row ipiv(i). Corresponds to the single precision factorization (if info=
 !    0 and iter ≥ 0) or the double precision factorization (if info= 0 and
 !    iter < 0).
-     integer,allocatable   :: ipiv(:)
+     integer,pointer   :: ipiv(:)
 
 
      complex(dp),parameter :: zone=(1.0d0,0.0d0)
@@ -34,13 +34,14 @@
 
 !    Bmat  :
 !    Overwritten by the solution matrix X for dgesv, sgesv,zgesv,zgesv.
-     complex(dp),allocatable :: Bmat(:,:)
+     complex(dp),pointer :: Bmat(:,:)
 
 
-     allocate(ipiv(ndim))
-     allocate(Bmat(ndim,ndim))
+     !> work arrays from the workspace of this thread
+     ipiv => ws_int(WS_INV, 1, ndim)
+     Bmat(1:ndim, 1:ndim) => ws_complex(WS_INV, 1, ndim*ndim)
 
-     ipiv=0
+     ipiv(1:ndim)=0
 
      ! unit matrix
      Bmat= (0d0, 0d0)
@@ -0,0 +1,500 @@
+!> Streaming of per k point results to disk, so that no rank has to hold
+!> the results of the whole k mesh.
+!>
+!> Every rank appends the results of the chunks it has finished to its own
+!> file wt_stream_<name>_<generation>_<rank>.bin, each chunk as the range
+!> i1, i2 followed by values(nper, i1:i2). After the loop, every rank sends
+!> the chunks of its file to rank 0 a block at a time, and rank 0 sorts them
+!> into wt_stream_<name>.bin, where component j of all k points is
+!> contiguous, and reads the results back block by block to write the
+!> output files. Memory then scales with the chunk and block sizes instead
+!> of the number of k points, and there is no reduction over the ranks.
+!> The files of earlier runs are read by rank 0 itself, so like for the
+!> checkpoint files, a resumed run has to see them in the working directory.
+!> kstream_merge stops if k points are missing in all files.
+!>
+!> Usage:
+!>    call kstream_open(st, 'name', nper, nk)
+!>    do while (scheduler_next(sched, ik1, ik2))
+!>       ... values(:, 1:ik2-ik1+1)
+!>       call kstream_write(st, ik1, ik2, values)
+!>    enddo
+!>    call kstream_merge(st)
+!>    if (cpuid==0) then
+!>       nblk= kstream_block_size(st, j2-j1+1)
+!>       ... call kstream_read(st, j1, j2, ik1, ik2, block) for ik2-ik1<nblk
+!>    endif
+!>    call kstream_close(st)
+!>
+!> When a checkpoint is passed to kstream_open, the files of the previous
+!> runs are kept on resume and merged together with the new ones, so the
+!> checkpoint only has to hold the list of finished k points. kstream_write
+!> flushes the file, checkpoint_update has to be called after it.
+!> kstream_open, kstream_merge and kstream_close are collective,
+!> kstream_write has to be called outside of OpenMP parallel regions.
+
+module kstream
+   use wmpi
+   use prec
+   use checkpoint, only : checkpoint_type
+   implicit none
+
+   !> number of values read by one kstream_read
+   integer, parameter :: kstream_block_values= 2**20
+
+   type kstream_type
+      character(40) :: name= ' '
+
+      !> values per k point and number of k points
+      integer :: nper= 0
+      integer :: nitems= 0
+
+      !> generation of the files of this run, the one of the checkpoint
+      integer :: generation= 1
+
+      !> file of this rank, and the merged file on rank 0, -1 when closed
+      integer :: unit= -1
+      integer :: unit_merged= -1
+   end type kstream_type
+
+contains
+
+   subroutine kstream_open(st, name, nper, nitems, ckpt)
+      !> Open the file of this rank for nitems k points with nper values
+      !> each. Without a checkpoint, or if it has no finished k points, the
+      !> files of earlier runs are removed. Collective over all ranks.
+      implicit none
+
+      type(kstream_type), intent(inout) :: st
+      character(*), intent(in) :: name
+      integer, intent(in) :: nper, nitems
+      type(checkpoint_type), intent(in), optional :: ckpt
+
+      logical :: keep
+
+#if defined (MPI)
+      integer :: ierr
+#endif
+
+      st%name= name
+      st%nper= nper
+      st%nitems= nitems
+      st%generation= 1
+      keep= .false.
+      if (present(ckpt)) then
+         st%generation= ckpt%generation
+         keep= any(ckpt%done)
+      endif
+
+      if (cpuid==0 .and. .not.keep) call kstream_delete_all(st)
+#if defined (MPI)
+      call mpi_barrier(mpi_cmw, ierr)
+#endif
+
+      open(newunit=st%unit, file=kstream_filename(st, st%generation, cpuid), &
+         access='stream', form='unformatted', status='replace', action='write')
+
+      return
+   end subroutine kstream_open
+
+   subroutine kstream_write(st, i1, i2, a, mask)
+      !> Append the results a(:, 1:i2-i1+1) of the k points i1..i2. With
+      !> mask, only the k points i1-1+i with mask(i) are written.
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+      integer, intent(in) :: i1, i2
+      real(dp), intent(in) :: a(st%nper, *)
+      logical, intent(in), optional :: mask(:)
+
+      integer :: i, j, n
+
+      n= i2- i1+ 1
+      if (.not.present(mask)) then
+         if (n>0) write(st%unit)i1, i2, a(:, 1:n)
+      else
+         !> one record for every run of consecutive k points
+         i= 1
+         do while (i<=n)
+            if (.not.mask(i)) then
+               i= i+ 1
+               cycle
+            endif
+            j= i
+            do while (j<n)
+               if (.not.mask(j+1)) exit
+               j= j+ 1
+            enddo
+            write(st%unit)i1+i-1, i1+j-1, a(:, i:j)
+            i= j+ 1
+         enddo
+      endif
+      flush(st%unit)
+
+      return
+   end subroutine kstream_write
+
+   subroutine kstream_merge(st)
+      !> Close the files of all ranks and sort them into the merged file on
+      !> rank 0. Stops on all ranks if k points are in none of the files.
+      !> Collective over all ranks.
+      implicit none
+
+      type(kstream_type), intent(inout) :: st
+
+      integer :: gen, ifile, iunit, ios, nmissing
+      logical, allocatable :: seen(:)
+      character(120) :: msg
+
+#if defined (MPI)
+      integer :: ierr
+#endif
+
+      close(st%unit)
+      st%unit= -1
+
+      if (cpuid==0) then
+         open(newunit=st%unit_merged, file=kstream_filename(st, 0, -1), &
+            access='stream', form='unformatted', status='replace')
+
+         !> give the file its full size
+         if (st%nper>0 .and. st%nitems>0) &
+            write(st%unit_merged, pos=kstream_pos(st, st%nper, st%nitems))0d0
+
+         !> k points of the earlier runs, later generations overwrite k
+         !> points that were done twice
+         allocate(seen(st%nitems))
+         seen= .false.
+         do gen= 1, st%generation- 1
+            ifile= 0
+            do
+               open(newunit=iunit, file=kstream_filename(st, gen, ifile), access='stream', &
+                  form='unformatted', status='old', action='read', iostat=ios)
+               if (ios/=0) exit
+               call kstream_merge_file(st, iunit, seen)
+               close(iunit)
+               ifile= ifile+ 1
+            enddo
+         enddo
+      else
+         allocate(seen(0))
+      endif
+
+      !> k points of this run
+      call kstream_gather(st, seen)
+
+      nmissing= 0
+      if (cpuid==0) nmissing= count(.not.seen)
+#if defined (MPI)
+      if (num_cpu>1) call mpi_bcast(nmissing, 1, mpi_in, 0, mpi_cmw, ierr)
+#endif
+      deallocate(seen)
+      if (nmissing>0) then
+         write(msg, '(a, i0, a, i0, 3a)')'ERROR: ', nmissing, ' of ', st%nitems, &
+            ' k points of ', trim(st%name), ' are missing in the stream files'
+         call printerrormsg(msg)
+      endif
+
+      return
+   end subroutine kstream_merge
+
+   subroutine kstream_gather(st, seen)
+      !> Send the chunks in the file of this run of every rank to rank 0,
+      !> which writes them into the merged file. Every rank sends at most
+      !> kstream_block_values/num_cpu values at a time, as records i1, i2,
+      !> values(nper, i1:i2). Collective over all ranks.
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+      logical, intent(inout) :: seen(:)
+
+      integer :: iunit, ios, i1, i2, ic, n, nbuf, nsend
+      logical :: more
+      real(dp), allocatable :: buf(:, :), sendbuf(:)
+
+#if defined (MPI)
+      integer :: ierr, ntotal, icpu
+      integer, allocatable :: counts(:), displs(:)
+      real(dp), allocatable :: recvbuf(:)
+#endif
+
+      nbuf= max(kstream_block_values/max(1, num_cpu), st%nper+ 2)
+      allocate(sendbuf(nbuf), buf(st%nper, 0))
+#if defined (MPI)
+      allocate(counts(num_cpu), displs(num_cpu), recvbuf(0))
+#endif
+
+      open(newunit=iunit, file=kstream_filename(st, st%generation, cpuid), access='stream', &
+         form='unformatted', status='old', action='read', iostat=ios)
+      more= ios==0
+
+      !> k points ic..i2 of the chunk in buf are not sent yet
+      i1= 1
+      i2= 0
+      ic= 1
+      do
+         nsend= 0
+         do while (more)
+            if (ic>i2) then
+               call kstream_read_chunk(st, iunit, i1, i2, buf, more)
+               if (.not.more) exit
+               ic= i1
+            endif
+            n= min(i2- ic+ 1, (nbuf- nsend- 2)/max(1, st%nper))
+            if (n<1) exit
+            sendbuf(nsend+1)= ic
+            sendbuf(nsend+2)= ic+ n- 1
+            sendbuf(nsend+3:nsend+2+n*st%nper)= reshape(buf(:, ic-i1+1:ic-i1+n), [n*st%nper])
+            nsend= nsend+ 2+ n*st%nper
+            ic= ic+ n
+         enddo
+
+#if defined (MPI)
+         if (num_cpu>1) then
+            call mpi_allreduce(nsend, ntotal, 1, mpi_in, mpi_sum, mpi_cmw, ierr)
+            if (ntotal==0) exit
+            call mpi_gather(nsend, 1, mpi_in, counts, 1, mpi_in, 0, mpi_cmw, ierr)
+            if (cpuid==0) then
+               displs(1)= 0
+               do icpu= 2, num_cpu
+                  displs(icpu)= displs(icpu-1)+ counts(icpu-1)
+               enddo
+               if (size(recvbuf)<ntotal) then
+                  deallocate(recvbuf)
+                  allocate(recvbuf(ntotal))
+               endif
+            endif
+            call mpi_gatherv(sendbuf, nsend, mpi_dp, recvbuf, counts, displs, mpi_dp, &
+               0, mpi_cmw, ierr)
+            if (cpuid==0) call kstream_unpack(st, recvbuf, ntotal, seen)
+            cycle
+         endif
+#endif
+         if (nsend==0) exit
+         call kstream_unpack(st, sendbuf, nsend, seen)
+      enddo
+
+      if (ios==0) close(iunit)
+      deallocate(sendbuf, buf)
+
+      return
+   end subroutine kstream_gather
+
+   subroutine kstream_unpack(st, a, n, seen)
+      !> Write the records i1, i2, values(nper, i1:i2) in a(1:n) into the
+      !> merged file
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+      integer, intent(in) :: n
+      real(dp), intent(in) :: a(n)
+      logical, intent(inout) :: seen(:)
+
+      integer :: ip, i1, i2, m, j
+
+      ip= 0
+      do while (ip<n)
+         i1= nint(a(ip+1))
+         i2= nint(a(ip+2))
+         m= i2- i1+ 1
+         do j= 1, st%nper
+            write(st%unit_merged, pos=kstream_pos(st, j, i1))a(ip+2+j:ip+2+m*st%nper:st%nper)
+         enddo
+         seen(i1:i2)= .true.
+         ip= ip+ 2+ m*st%nper
+      enddo
+
+      return
+   end subroutine kstream_unpack
+
+   subroutine kstream_merge_file(st, iunit, seen)
+      !> Copy the chunks of one rank file into the merged file
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+      integer, intent(in) :: iunit
+      logical, intent(inout) :: seen(:)
+
+      integer :: i1, i2, j
+      logical :: ok
+      real(dp), allocatable :: buf(:, :)
+
+      allocate(buf(st%nper, 0))
+      do
+         call kstream_read_chunk(st, iunit, i1, i2, buf, ok)
+         if (.not.ok) exit
+
+         do j= 1, st%nper
+            write(st%unit_merged, pos=kstream_pos(st, j, i1))buf(j, 1:i2-i1+1)
+         enddo
+         seen(i1:i2)= .true.
+      enddo
+      deallocate(buf)
+
+      return
+   end subroutine kstream_merge_file
+
+   subroutine kstream_read_chunk(st, iunit, i1, i2, buf, ok)
+      !> Next chunk of a rank file into buf(:, 1:i2-i1+1), buf grows if
+      !> needed. ok is .false. at the end of the file.
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+      integer, intent(in) :: iunit
+      integer, intent(out) :: i1, i2
+      real(dp), allocatable, intent(inout) :: buf(:, :)
+      logical, intent(out) :: ok
+
+      integer :: n, ios
+
+      ok= .false.
+      read(iunit, iostat=ios)i1, i2
+      if (ios/=0) return
+      if (i1<1 .or. i2>st%nitems .or. i2<i1) return
+      n= i2- i1+ 1
+      if (size(buf, 2)<n) then
+         deallocate(buf)
+         allocate(buf(st%nper, n))
+      endif
+
+      !> the last chunk of a killed run may be cut off
+      read(iunit, iostat=ios)buf(:, 1:n)
+      if (ios/=0) return
+      ok= .true.
+
+      return
+   end subroutine kstream_read_chunk
+
+   integer function kstream_block_size(st, ncomp)
+      !> Number of k points to read at a time for ncomp values per k point
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+      integer, intent(in) :: ncomp
+
+      kstream_block_size= max(1, min(st%nitems, kstream_block_values/max(1, ncomp)))
+
+      return
+   end function kstream_block_size
+
+   subroutine kstream_read(st, j1, j2, i1, i2, a)
+      !> Values j1..j2 of the k points i1..i2 from the merged file into
+      !> a(1:j2-j1+1, 1:i2-i1+1). Only on rank 0, after kstream_merge.
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+      integer, intent(in) :: j1, j2, i1, i2
+      real(dp), intent(out) :: a(j2-j1+1, *)
+
+      integer :: j
+
+      do j= j1, j2
+         read(st%unit_merged, pos=kstream_pos(st, j, i1))a(j-j1+1, 1:i2-i1+1)
+      enddo
+
+      return
+   end subroutine kstream_read
+
+   subroutine kstream_close(st)
+      !> Remove all files. Collective over all ranks.
+      implicit none
+
+      type(kstream_type), intent(inout) :: st
+
+#if defined (MPI)
+      integer :: ierr
+#endif
+
+      if (st%unit/=-1) close(st%unit)
+      st%unit= -1
+
+      !> the file of this run may be in a directory only this rank sees
+      call kstream_delete(kstream_filename(st, st%generation, cpuid))
+#if defined (MPI)
+      call mpi_barrier(mpi_cmw, ierr)
+#endif
+      if (cpuid/=0) return
+
+      if (st%unit_merged/=-1) close(st%unit_merged, status='delete')
+      st%unit_merged= -1
+      call kstream_delete_all(st)
+
+      return
+   end subroutine kstream_close
+
+   subroutine kstream_delete_all(st)
+      !> Remove the merged file and the rank files of all generations
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+
+      integer :: gen, ifile
+
+      call kstream_delete(kstream_filename(st, 0, -1))
+      gen= 1
+      do while (kstream_exists(kstream_filename(st, gen, 0)))
+         ifile= 0
+         do while (kstream_exists(kstream_filename(st, gen, ifile)))
+            call kstream_delete(kstream_filename(st, gen, ifile))
+            ifile= ifile+ 1
+         enddo
+         gen= gen+ 1
+      enddo
+
+      return
+   end subroutine kstream_delete_all
+
+   function kstream_filename(st, gen, ifile) result(fname)
+      !> File of rank ifile in generation gen, ifile<0 for the merged file
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+      integer, intent(in) :: gen, ifile
+      character(80) :: fname
+
+      if (ifile<0) then
+         write(fname, '(3a)')'wt_stream_', trim(st%name), '.bin'
+      else
+         write(fname, '(3a, i0, a, i0, a)')'wt_stream_', trim(st%name), '_', gen, &
+            '_', ifile, '.bin'
+      endif
+
+      return
+   end function kstream_filename
+
+   integer(8) function kstream_pos(st, j, i)
+      !> Position of value j of k point i in the merged file
+      implicit none
+
+      type(kstream_type), intent(in) :: st
+      integer, intent(in) :: j, i
+
+      kstream_pos= (int(j-1, 8)*st%nitems+ int(i-1, 8))*(storage_size(1d0)/8)+ 1
+
+      return
+   end function kstream_pos
+
+   logical function kstream_exists(fname)
+      implicit none
+
+      character(*), intent(in) :: fname
+
+      inquire(file=fname, exist=kstream_exists)
+
+      return
+   end function kstream_exists
+
+   subroutine kstream_delete(fname)
+      implicit none
+
+      character(*), intent(in) :: fname
+
+      integer :: iunit, ios
+
+      open(newunit=iunit, file=fname, status='old', iostat=ios)
+      if (ios==0) close(iunit, status='delete')
+
+      return
+   end subroutine kstream_delete
+
+end module kstream
@@ -11,6 +11,7 @@
 !include "sparse.f90"
 subroutine landau_level_k
    use para
+   use eigen_window, only : band_window_nvec, eigensystem_window
    implicit none
 
 
@@ -146,7 +147,12 @@ subroutine landau_level_k
 
       !> diagonalization by call zheev in lapack
       !W_full= 0d0
-      if (mdimq<2000) then
+      if (LandauLevel_wavefunction_calc .and. band_window_nvec(Ndimq)<Ndimq) then
+         !> eigenvectors only for the bands closest to iso_energy
+         call eigensystem_window(Ndimq, ham_landau, W_full, iso_energy/eV2Hartree)
+         eigv(:, ik)= W_full(il:iu)
+         eigvec(1:Ndimq, 1:mdimq)= ham_landau(1:Ndimq, il:iu)
+      elseif (mdimq<2000) then
          if (LandauLevel_wavefunction_calc) then
             call eigensystem_c( 'V', 'U', Ndimq ,ham_landau, W_full)
             eigv(:, ik)= W_full(il:iu)
@@ -630,6 +636,7 @@ end subroutine landau_level_kplane
 !> fix k point, usually Gamma point
 subroutine landau_level_B
    use para
+   use eigen_window, only : eigensystem_window
    implicit none
 
    !> magnetic supercell size, perpendicular to the magnetic field
@@ -785,7 +792,7 @@ subroutine landau_level_B
       W= 0d0
 
       if (LandauLevel_wavefunction_calc) then
-         call eigensystem_c( 'V', 'U', Ndimq ,ham_landau, W)
+         call eigensystem_window(Ndimq, ham_landau, W)
          !> calculate the weight on the selected orbitals
          do ie= 1, Ndimq
             psi(:)= ham_landau(:, ie)  !> the eigenvector of ib'th band
@@ -1040,6 +1047,7 @@ end subroutine landau_level_B
 
 subroutine landau_sf
    use para
+   use eigen_window, only : band_window_nvec, eigensystem_window
    implicit none
 
 
@@ -1176,7 +1184,12 @@ subroutine landau_sf
 
       !> diagonalization by call zheev in lapack
       !W_full= 0d0
-      if (mdimq<2000) then
+      if (LandauLevel_wavefunction_calc .and. band_window_nvec(Ndimq)<Ndimq) then
+         !> eigenvectors only for the bands closest to iso_energy
+         call eigensystem_window(Ndimq, ham_landau, W_full, iso_energy/eV2Hartree)
+         eigv(:, ik)= W_full(il:iu)
+         eigvec(1:Ndimq, 1:mdimq)= ham_landau(1:Ndimq, il:iu)
+      elseif (mdimq<2000) then
          if (LandauLevel_wavefunction_calc) then
             call eigensystem_c( 'V', 'U', Ndimq ,ham_landau, W_full)
             eigv(:, ik)= W_full(il:iu)
@@ -32,21 +32,22 @@
 ! License: GPL V3
 !--------+--------+--------+--------+--------+--------+--------+------!
 
-  subroutine wannier_tools_run
-!  subroutine wannier_tools_run
+  subroutine wannier_tools_init(time_init, ierr)
+     !> Everything needed before a calculation can be dispatched: MPI,
+     !> WT.out, wt.in, the symmetry operators and the Hamiltonian.
+     !> Shared by wannier_tools_run and the in-process model API.
 
      use wmpi
      use para
      implicit none
 
-     !> file existence
-     logical  :: exists
-     integer :: ierr
-     character(8) :: cht
+     !> time stamp at the start of the initialisation
+     real(Dp), intent(out) :: time_init
 
-     !> time measure
-     real(Dp) :: time_start, time_end, time_init
+     !> nonzero if MPI could not be initialised
+     integer, intent(out) :: ierr
 
+     logical :: mpi_is_on
 
      !> version of WannierTools
      version='2.7.1'
@@ -56,7 +57,8 @@
      num_cpu= 1
      
 #if defined (MPI)
-     call mpi_init(ierr)
+     call mpi_initialized(mpi_is_on, ierr)
+     if (.not.mpi_is_on) call mpi_init(ierr)
      call mpi_comm_rank(mpi_comm_world, cpuid, ierr)
      call mpi_comm_size(mpi_comm_world, num_cpu, ierr)
      if (cpuid==0) then
@@ -91,6 +93,27 @@
         write(stdout, *)' '
      endif
 
+     !> a second initialisation in the same process starts from scratch
+     call wannier_tools_release(.false.)
+     Input_file= 'wt.in'
+
+     call wannier_tools_setup
+     call wannier_tools_read_hr
+
+     return
+  end subroutine wannier_tools_init
+
+  subroutine wannier_tools_setup
+     !> Read wt.in (Input_file), set the dimensions of the Hamiltonian and
+     !> check the symmetry operators
+
+     use wmpi
+     use para
+     implicit none
+
+     !> time measure
+     real(Dp) :: time_start, time_end
+
      !> readin the control parameters for this program
      call now(time_start)
      call readinput
@@ -123,8 +146,17 @@
      call symmetry
      call now(time_end)
      call print_time_cost(time_start, time_end, 'symmetry')
-  
-  
+
+     return
+  end subroutine wannier_tools_setup
+
+  subroutine wannier_tools_read_hr
+     !> Read the tight-binding Hamiltonian given in wt.in
+
+     use wmpi
+     use para
+     implicit none
+
      if (cpuid==0)then
         write(stdout,*) ' >> Begin to read Hmn_R.data'
      endif
@@ -158,6 +190,55 @@
         write(stdout,*) ' << Read Hmn_R.data successfully'
      endif
 
+     return
+  end subroutine wannier_tools_read_hr
+
+  subroutine wannier_tools_run
+!  subroutine wannier_tools_run
+
+     use wmpi
+     use para
+     use workspace
+     implicit none
+
+     integer :: ierr
+
+     !> time measure
+     real(Dp) :: time_end, time_init
+
+     call wannier_tools_init(time_init, ierr)
+     if (ierr.ne.0) return
+
+     call wannier_tools_dispatch
+
+     call now(time_end)
+
+     if(cpuid.eq.0)write(stdout, *)' '
+     call print_time_cost(time_init, time_end, 'whole program')
+     call workspace_report
+     call footer
+
+     !> MPI stays initialised so that the same process can run again,
+     !> it is shut down by wannier_tools_finalize
+     call wannier_tools_release(.false.)
+
+  end subroutine wannier_tools_run
+!  end subroutine wannier_tools_run
+
+  subroutine wannier_tools_dispatch
+     !> Run every calculation switched on in the CONTROL namelist
+
+     use wmpi
+     use para
+     use result_sink
+     implicit none
+
+     !> time measure
+     real(Dp) :: time_start, time_end
+
+   !> binary result container if Output_format is not ASCII
+   call result_open(Output_format)
+
    !> unfold bulk band line mode
    if (BulkBand_unfold_line_calc) then
       if(cpuid.eq.0)write(stdout, *)' '
@@ -792,20 +873,201 @@
       if(cpuid.eq.0)write(stdout, *)'End of calculating the bulk photovotaic effect'
    endif
 
-     call now(time_end)
+     call result_close
 
-     if(cpuid.eq.0)write(stdout, *)' '
-     call print_time_cost(time_init, time_end, 'whole program')
-     call footer
+     return
+  end subroutine wannier_tools_dispatch
+
+  subroutine wannier_tools_finalize
+     !> Shut down MPI at the end of the process, if it is still running
 
+     use wmpi
+     implicit none
+
+     integer :: ierr
+     logical :: mpi_is_on, mpi_is_off
 
 #if defined (MPI)
-     call mpi_finalize(ierr)
+     call mpi_initialized(mpi_is_on, ierr)
+     call mpi_finalized(mpi_is_off, ierr)
+     if (mpi_is_on.and..not.mpi_is_off) call mpi_finalize(ierr)
 #else
      ! Serial mode - no MPI finalization needed
 #endif
-     deallocate(HmnR, stat=ierr)
-     deallocate(SmnR, stat=ierr)
 
-  end subroutine wannier_tools_run
-!  end subroutine wannier_tools_run
+     return
+  end subroutine wannier_tools_finalize
+
+  subroutine wannier_tools_release(keep_hr)
+     !> Deallocate the arrays of the para module so that the memory is
+     !> returned and wt.in can be read again in the same process.
+     !> keep_hr= .true. keeps the Hamiltonian read by wannier_tools_read_hr
+     !> (HmnR, SmnR, the sparse arrays and the atomic gauge tables).
+     !> The scratch buffers of the workspace module are freed as well.
+
+     use para
+     use workspace
+     implicit none
+
+     logical, intent(in) :: keep_hr
+
+     if (.not.keep_hr) then
+        if (allocated(irvec)) deallocate(irvec)
+        if (allocated(crvec)) deallocate(crvec)
+        if (allocated(ndegen)) deallocate(ndegen)
+        if (allocated(HmnR)) deallocate(HmnR)
+        if (allocated(SmnR)) deallocate(SmnR)
+        if (allocated(irvec_valley)) deallocate(irvec_valley)
+        if (allocated(valley_operator_R)) deallocate(valley_operator_R)
+        if (allocated(hicoo)) deallocate(hicoo)
+        if (allocated(hjcoo)) deallocate(hjcoo)
+        if (allocated(hirv)) deallocate(hirv)
+        if (allocated(hacoo)) deallocate(hacoo)
+        if (allocated(sicoo)) deallocate(sicoo)
+        if (allocated(sjcoo)) deallocate(sjcoo)
+        if (allocated(sirv)) deallocate(sirv)
+        if (allocated(sacoo)) deallocate(sacoo)
+        if (allocated(valley_operator_icoo)) deallocate(valley_operator_icoo)
+        if (allocated(valley_operator_jcoo)) deallocate(valley_operator_jcoo)
+        if (allocated(valley_operator_irv)) deallocate(valley_operator_irv)
+        if (allocated(valley_operator_acoo)) deallocate(valley_operator_acoo)
+
+        !> the atomic gauge tables belong to this Hamiltonian
+        ag_table_ready= .false.
+        if (allocated(ag_i1)) deallocate(ag_i1)
+        if (allocated(ag_i2)) deallocate(ag_i2)
+        if (allocated(ag_ir)) deallocate(ag_ir)
+        if (allocated(ag_rcart)) deallocate(ag_rcart)
+        if (allocated(ag_wc_cart)) deallocate(ag_wc_cart)
+     endif
+
+     !> Hamiltonian in the cell defined by the surface, see get_hmnr_cell
+     if (allocated(HmnR_surfacecell)) deallocate(HmnR_surfacecell)
+     if (allocated(SmnR_surfacecell)) deallocate(SmnR_surfacecell)
+     if (allocated(irvec_surfacecell)) deallocate(irvec_surfacecell)
+     if (allocated(ndegen_surfacecell)) deallocate(ndegen_surfacecell)
+     if (allocated(Atom_position_cart_newcell)) deallocate(Atom_position_cart_newcell)
+     if (allocated(Atom_position_direct_newcell)) deallocate(Atom_position_direct_newcell)
+     if (allocated(Rmn_old)) deallocate(Rmn_old)
+     if (allocated(Rmn_new)) deallocate(Rmn_new)
+     if (allocated(irvec_new)) deallocate(irvec_new)
+     if (allocated(irvec_new_int)) deallocate(irvec_new_int)
+
+     !> everything set up by readinput and symmetry
+     call release_cell(Origin_cell)
+     call release_cell(Folded_cell)
+     call release_cell(Magnetic_cell)
+     call release_cell(Cell_defined_by_surface)
+
+     if (allocated(KCube3D%ik_array)) deallocate(KCube3D%ik_array)
+     if (allocated(KCube3D%IKleft_array)) deallocate(KCube3D%IKleft_array)
+     if (allocated(KCube3D%Ek_local)) deallocate(KCube3D%Ek_local)
+     if (allocated(KCube3D%Ek_total)) deallocate(KCube3D%Ek_total)
+     if (allocated(KCube3D%k_direct)) deallocate(KCube3D%k_direct)
+     if (allocated(KCube3D%weight_k)) deallocate(KCube3D%weight_k)
+     if (allocated(KCube3D%vx_local)) deallocate(KCube3D%vx_local)
+     if (allocated(KCube3D%vx_total)) deallocate(KCube3D%vx_total)
+     if (allocated(KCube3D%vy_local)) deallocate(KCube3D%vy_local)
+     if (allocated(KCube3D%vy_total)) deallocate(KCube3D%vy_total)
+     if (allocated(KCube3D%vz_local)) deallocate(KCube3D%vz_local)
+     if (allocated(KCube3D%vz_total)) deallocate(KCube3D%vz_total)
+     if (allocated(KCube3D%weight_k_local)) deallocate(KCube3D%weight_k_local)
+     if (allocated(KCube3D_symm%ik_relate)) deallocate(KCube3D_symm%ik_relate)
+     if (allocated(KCube3D_symm%ik_array_symm)) deallocate(KCube3D_symm%ik_array_symm)
+     if (allocated(KCube3D_symm%weight_k)) deallocate(KCube3D_symm%weight_k)
+     if (allocated(KCube3D_symm%ndeg)) deallocate(KCube3D_symm%ndeg)
+     if (allocated(KCube3D_symm%op_cart)) deallocate(KCube3D_symm%op_cart)
+
+     if (allocated(Omega_array)) deallocate(Omega_array)
+     if (allocated(k3line_name)) deallocate(k3line_name)
+     if (allocated(k3line_stop)) deallocate(k3line_stop)
+     if (allocated(k3line_start)) deallocate(k3line_start)
+     if (allocated(k3line_end)) deallocate(k3line_end)
+     if (allocated(K3list_band)) deallocate(K3list_band)
+     if (allocated(K3len)) deallocate(K3len)
+     if (allocated(kpath_3d)) deallocate(kpath_3d)
+     if (allocated(k3points_pointmode_cart)) deallocate(k3points_pointmode_cart)
+     if (allocated(k3points_pointmode_direct)) deallocate(k3points_pointmode_direct)
+     if (allocated(k3points_unfold_pointmode_cart)) deallocate(k3points_unfold_pointmode_cart)
+     if (allocated(k3points_unfold_pointmode_direct)) deallocate(k3points_unfold_pointmode_direct)
+     if (allocated(K3len_unfold)) deallocate(K3len_unfold)
+     if (allocated(k3line_unfold_stop)) deallocate(k3line_unfold_stop)
+     if (allocated(K3len_mag)) deallocate(K3len_mag)
+     if (allocated(k3line_mag_stop)) deallocate(k3line_mag_stop)
+     if (allocated(k3points_Berry)) deallocate(k3points_Berry)
+     if (allocated(TopAtoms)) deallocate(TopAtoms)
+     if (allocated(TopOrbitals)) deallocate(TopOrbitals)
+     if (allocated(BottomAtoms)) deallocate(BottomAtoms)
+     if (allocated(BottomOrbitals)) deallocate(BottomOrbitals)
+     if (allocated(k2len)) deallocate(k2len)
+     if (allocated(k2_path)) deallocate(k2_path)
+     if (allocated(orbitals_start)) deallocate(orbitals_start)
+     if (allocated(inversion)) deallocate(inversion)
+     if (allocated(mirror_x)) deallocate(mirror_x)
+     if (allocated(mirror_y)) deallocate(mirror_y)
+     if (allocated(mirror_z)) deallocate(mirror_z)
+     if (allocated(C2yT)) deallocate(C2yT)
+     if (allocated(glide)) deallocate(glide)
+     if (allocated(C3z_acoo)) deallocate(C3z_acoo)
+     if (allocated(C3z_icoo)) deallocate(C3z_icoo)
+     if (allocated(C3z_jcoo)) deallocate(C3z_jcoo)
+     if (allocated(inv_op)) deallocate(inv_op)
+     if (allocated(mirror_z_op)) deallocate(mirror_z_op)
+     if (allocated(mirror_x_op)) deallocate(mirror_x_op)
+     if (allocated(mirror_y_op)) deallocate(mirror_y_op)
+     if (allocated(glide_y_op)) deallocate(glide_y_op)
+     if (allocated(weyl_position_cart)) deallocate(weyl_position_cart)
+     if (allocated(weyl_position_direct)) deallocate(weyl_position_direct)
+     if (allocated(NL_center_position_cart)) deallocate(NL_center_position_cart)
+     if (allocated(NL_center_position_direct)) deallocate(NL_center_position_direct)
+     if (allocated(Selected_bands_tbtokp)) deallocate(Selected_bands_tbtokp)
+     if (allocated(Born_Charge)) deallocate(Born_Charge)
+     if (allocated(Atom_Mass)) deallocate(Atom_Mass)
+     if (allocated(Selected_Atoms)) deallocate(Selected_Atoms)
+     if (allocated(NumberofSelectedAtoms)) deallocate(NumberofSelectedAtoms)
+     if (allocated(NumberofSelectedOrbitals)) deallocate(NumberofSelectedOrbitals)
+     if (allocated(Selected_WannierOrbitals)) deallocate(Selected_WannierOrbitals)
+     if (allocated(Selected_band_index)) deallocate(Selected_band_index)
+     if (allocated(Selected_Occupiedband_index)) deallocate(Selected_Occupiedband_index)
+     if (allocated(index_start)) deallocate(index_start)
+     if (allocated(index_end)) deallocate(index_end)
+     if (allocated(generators_find)) deallocate(generators_find)
+     if (allocated(tau_find)) deallocate(tau_find)
+     if (allocated(pggen_cart)) deallocate(pggen_cart)
+     if (allocated(pggen_direct)) deallocate(pggen_direct)
+     if (allocated(pgop_cart)) deallocate(pgop_cart)
+     if (allocated(pgop_direct)) deallocate(pgop_direct)
+     if (allocated(tau_cart)) deallocate(tau_cart)
+     if (allocated(tau_direct)) deallocate(tau_direct)
+     if (allocated(spatial_inversion)) deallocate(spatial_inversion)
+     if (allocated(imap_sym)) deallocate(imap_sym)
+
+     call workspace_release
+
+     return
+  end subroutine wannier_tools_release
+
+  subroutine release_cell(cell)
+     !> Deallocate the atom and projector arrays of a cell
+
+     use para, only : cell_type
+     implicit none
+
+     type(cell_type), intent(inout) :: cell
+
+     if (allocated(cell%Num_atoms_eachtype)) deallocate(cell%Num_atoms_eachtype)
+     if (allocated(cell%Name_of_atomtype)) deallocate(cell%Name_of_atomtype)
+     if (allocated(cell%itype_atom)) deallocate(cell%itype_atom)
+     if (allocated(cell%Atom_name)) deallocate(cell%Atom_name)
+     if (allocated(cell%Atom_position_cart)) deallocate(cell%Atom_position_cart)
+     if (allocated(cell%Atom_position_direct)) deallocate(cell%Atom_position_direct)
+     if (allocated(cell%wannier_centers_cart)) deallocate(cell%wannier_centers_cart)
+     if (allocated(cell%wannier_centers_direct)) deallocate(cell%wannier_centers_direct)
+     if (allocated(cell%Atom_magnetic_moment)) deallocate(cell%Atom_magnetic_moment)
+     if (allocated(cell%nprojs)) deallocate(cell%nprojs)
+     if (allocated(cell%spinorbital_to_atom_index)) deallocate(cell%spinorbital_to_atom_index)
+     if (allocated(cell%spinorbital_to_projector_index)) deallocate(cell%spinorbital_to_projector_index)
+     if (allocated(cell%proj_name)) deallocate(cell%proj_name)
+
+     return
+  end subroutine release_cell
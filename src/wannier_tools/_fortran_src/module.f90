@@ -362,7 +362,14 @@ module prec
      !> define the file index to void the same index in different subroutines
      integer, public, save :: outfileindex= 11932
 
+     !> input file read by readinput, a session may point it to a modified copy of wt.in
+     character(256) :: Input_file= 'wt.in'
+
      character(80) :: Hrfile             ! filename
+
+     !> read Hrfile through its binary sidecar Hrfile.wtb, wt-py switches
+     !> this on through wt_set_hr_cache after it checked the sidecar
+     logical :: Hr_cache= .false.
      character(80) :: Overlapfile        ! overlap matrix between basis only when Orthogonal_Basis=F
      character(80) :: Particle           ! phonon, electron
      character(80) :: Package            ! VASP, QE
@@ -533,6 +540,8 @@ module prec
      integer,parameter :: kmesh(2)=(/200 , 200/)  ! kmesh used for spintexture
      integer,parameter :: knv=kmesh(1)*kmesh(2)  ! number of k points used for spintexture
 
+     integer,parameter :: Nwork_surfgreen= 12  ! number of Ndim*Ndim work arrays of surfgreen_1985_work
+
 
      integer :: Soc, SOC_in  ! A parameter to control soc;  Soc=0 means no spin-orbit coupling; Soc>0 means spin-orbit coupling
 
@@ -605,9 +614,79 @@ module prec
      !> default "zndrv1"
      character(20) :: arpack_solver
 
+     !> a tag to control how the JDOS of SlabQPI_calc is summed over k
+     !> value: FFT    periodic autocorrelation with FFTs, O(Nk^2 log Nk)
+     !>        DIRECT direct sum over k for every q, O(Nk^4), for validation
+     !> default "FFT"
+     character(20) :: QPI_method
+
+     !> a tag to select the eigensolver of the slab, ribbon and slab BdG
+     !> Hamiltonians (SlabBand_calc, SlabBandWaveFunc_calc,
+     !> SlabBand_plane_calc, BerryCurvature_slab_calc, SlabBdG_calc,
+     !> WannierCenter_BdG_calc, RibbonBand_calc)
+     !> value: DENSE  build the dense matrix and diagonalize it with zheevd
+     !>        BANDED keep the matrix in band storage, its bandwidth is
+     !>               ijmax+1 layers, eigenvalues from zhbevd and
+     !>               eigenvectors by inverse iteration
+     !> BANDED is not used for a non-orthogonal basis, see slab_banded.f90
+     !> default "DENSE"
+     character(8) :: Slab_solver
+
+     !> with Band_window=T the band structure drivers (BulkBand_calc,
+     !> SlabBand_calc, SlabBdG_calc, RibbonBand_calc, and LandauLevel_k_calc,
+     !> LandauLevel_B_calc with LandauLevel_wavefunction_calc) only calculate
+     !> the eigenvectors of the NumSelectedEigenVals bands closest to
+     !> iso_energy, the projection weights of the other bands are zero.
+     !> All eigenvalues are still written out. See eigen_window.f90
+     !> default F
+     logical :: Band_window
+
+     !> wall time in seconds between two checkpoints of the long k-point
+     !> loops (sigma_OHE, SurfaceDOSkk, fermisurface3D, AHC, Z2_3D),
+     !> a value <= 0 switches the checkpoints off
+     !> default 1800
+     real(dp) :: Checkpoint_interval
+
+     !> adaptive refinement of the AHC integral (sigma_AHC, alpha_ANE).
+     !> After the pass over the KCUBE_BULK mesh, the cell around a k point is
+     !> split into 2x2x2 cells if |sum_n Omega_n f_n| is larger than
+     !> Refine_threshold (Angstrom^2), or if two neighbouring bands closer
+     !> than Refine_gap_threshold (eV) lie around the chemical potentials.
+     !> The new cells are checked again, up to Nk_refine_levels times.
+     !> default Nk_refine_levels= 0, no refinement
+     integer :: Nk_refine_levels
+     real(dp) :: Refine_threshold
+     real(dp) :: Refine_gap_threshold
+
+     !> interpolation of the band energies and velocities along the orbits
+     !> of sigma_OHE (Boltz_OHE), see band_interp.f90. The bands crossing
+     !> the Fermi level are tabulated on a Nk_interp^3 grid, cells where the
+     !> error of E plus v*dk exceeds Interp_tolerance (eV) are calculated
+     !> exactly.
+     !> default Nk_interp= 0, no interpolation
+     integer :: Nk_interp
+     real(dp) :: Interp_tolerance
+
+     !> a tag to select the format of the result files
+     !> value: ASCII  formatted .dat files and gnuplot scripts
+     !>        NPZ    one binary container wt_results.npz
+     !>        HDF5   one binary container wt_results.h5, NPZ without h5py
+     !>        RAW    wt_results.bin with the index wt_results.json
+     !> the binary formats cover bulk bands, slab bands, Fermi surface, DOS,
+     !> surface states, Fermi arcs, WCC, Berry curvature and AHC, see
+     !> result_sink.f90, readinput warns about the calculations that still
+     !> write text files
+     !> default "ASCII"
+     character(8) :: Output_format
+
      !> a real number to control when it's a cycle in subroutine RKF45_pack
      !> by default RKF45_PERIODIC_LEVEL= 1
      real(dp) :: RKF45_PERIODIC_LEVEL
+
+     !> number of orbits integrated together in sigma_OHE, see rkf45_batch.f90
+     !> RKF45_batch_size<=1 integrates them one by one with RKF45_pack
+     !> default RKF45_batch_size= 16
+     integer :: RKF45_batch_size
  
      !> an integer to print the messages
      !> iprint_level=3 : print all the debug messages
@@ -638,7 +717,9 @@ module prec
         NumRandomConfs, NumSelectedEigenVals, projection_weight_mode, topsurface_atom_index, &
         photon_energy_arpes, polarization_xi_arpes, test_namelist, nnzmax_input, &
         polarization_alpha_arpes, polarization_delta_arpes, penetration_lambda_arpes, polarization_phi_arpes, &
-        FreqNum, FreqMin, FreqMax, eta_smr_fixed
+        FreqNum, FreqMin, FreqMax, eta_smr_fixed, QPI_method, Checkpoint_interval, &
+        Output_format, Nk_refine_levels, Refine_threshold, Refine_gap_threshold, &
+        Nk_interp, Interp_tolerance, RKF45_batch_size, Slab_solver, Band_window
     
      real(Dp) :: E_fermi  ! Fermi energy, search E-fermi in OUTCAR for VASP, set to zero for Wien2k
 
@@ -949,6 +1030,15 @@ module prec
      
      integer, allocatable     :: ndegen(:)  ! degree of degeneracy of R point
 
+     !> k independent tables for the atomic gauge H(k), dH/dk and d2H/dk2,
+     !> built once by atomicgauge_table_init in ham_bulk.f90
+     logical :: ag_table_ready= .false.
+     logical :: ag_nocut   ! no hopping is dropped by Rcut
+     integer :: ag_nnz     ! number of hoppings kept if ag_nocut is false
+     integer, allocatable     :: ag_i1(:), ag_i2(:), ag_ir(:)  ! kept hoppings HmnR(i1, i2, ir)
+     real(dp), allocatable    :: ag_rcart(:,:)   ! R in Cartesian coordinates
+     real(dp), allocatable    :: ag_wc_cart(:,:) ! Wannier centers in Cartesian coordinates
+
      complex(dp), allocatable :: HmnR_surfacecell(:,:,:)   ! Hamiltonian m,n are band indexes
      complex(dp), allocatable :: SmnR_surfacecell(:,:,:)   ! Overlap matrix m,n are band indexes
      real(dp), allocatable :: Atom_position_cart_newcell(:,:)   ! Hamiltonian m,n are band indexes
@@ -1074,6 +1164,12 @@ module prec
         !> reduced k points
         integer, allocatable :: ik_array_symm(:)
         real(dp), allocatable :: weight_k(:)
+        !> number of k points in the star of each reduced k point
+        integer, allocatable :: ndeg(:)
+        !> the symmetry operators that leave the k mesh invariant, in
+        !> cartesian coordinates
+        integer :: nop= 1
+        real(dp), allocatable :: op_cart(:, :, :)
      end type kcube_type_symm
 
      type(kcube_type_symm) :: KCube3D_symm
@@ -14,9 +14,9 @@ subroutine linear_optic
    !> Reference : PHYSICAL REVIEW B 97, 245143 (2018)                 !
    !------------------------------------------------------------------!
     
-    integer :: ik, ikx, iky, ikz, knv3, ifreq, i, j, m, n, index, ierr
+    integer :: ik, ikx, iky, ikz, knv3, ifreq, i, j, m, n, index, ierr, j1, nkirr
 
-    real(dp) :: k(3), time_start, time_end, x, fac_H, fac_AH
+    real(dp) :: k(3), time_start, time_end, x, fac_H, fac_AH, deg
     complex(dp) :: cmplx_i, cmplx_1, cmplx_0, omega
 
     complex(dp), allocatable :: Freq_array(:)
@@ -53,6 +53,9 @@ subroutine linear_optic
     real(dp) :: sigma_S(12), sigma_A(6)
     integer :: alpha_S(6), beta_S(6), alpha_A(3), beta_A(3)
 
+    !> irreducible k points of the k cube
+    type(kcube_type_symm) :: kcube
+
     !> 1 <--> xx
     !> 2 <--> yy
     !> 3 <--> zz
@@ -107,19 +110,25 @@ subroutine linear_optic
     endif
 
     knv3= Nk1*Nk2*Nk3
+    call kmesh_symm_reduce(kcube, Nk1, Nk2, Nk3, K3D_start_cube, &
+        K3D_vec1_cube, K3D_vec2_cube, K3D_vec3_cube)
+    nkirr= kcube%Nk_total_symm
 
     call now(time_start) 
-    do ik= 1+ cpuid, knv3, num_cpu
+    do ik= 1+ cpuid, nkirr, num_cpu
         if (cpuid.eq.0.and. mod(ik/num_cpu, 100).eq.0) then
             call now(time_end) 
             write(stdout, '(a, i18, "/", i18, a, f10.2, "s")') 'ik/knv3', &
-            ik, knv3, '  time left', (knv3-ik)*(time_end-time_start)/num_cpu/100d0
+            ik, nkirr, '  time left', (nkirr-ik)*(time_end-time_start)/num_cpu/100d0
             time_start= time_end
         endif
 
-        ikx= (ik-1)/(nk2*nk3)+1
-        iky= ((ik-1-(ikx-1)*Nk2*Nk3)/nk3)+1
-        ikz= (ik-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
+        !> the k point stands for its star of deg k points
+        j1= kcube%ik_array_symm(ik)
+        deg= dble(kcube%ndeg(ik))
+        ikx= (j1-1)/(nk2*nk3)+1
+        iky= ((j1-1-(ikx-1)*Nk2*Nk3)/nk3)+1
+        ikz= (j1-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
         k= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1)  &
             + K3D_vec2_cube*(iky-1)/dble(nk2)  &
             + K3D_vec3_cube*(ikz-1)/dble(nk3)
@@ -155,8 +164,8 @@ subroutine linear_optic
                 do n = 1, Num_wann
                     if (n == m) cycle
                     x = W(m)-W(n)-real(omega)
-                    fac_H = delta(eta_smr_fixed, x)*(occ(m)-occ(n))*(W(m)-W(n))
-                    fac_AH = (occ(m)-occ(n))*(W(m)-W(n))/real((W(m)-W(n)-omega))
+                    fac_H = delta(eta_smr_fixed, x)*(occ(m)-occ(n))*(W(m)-W(n))*deg
+                    fac_AH = (occ(m)-occ(n))*(W(m)-W(n))/real((W(m)-W(n)-omega))*deg
                     do j = 1, 3
                         do i = 1, 3
                             sigma_kubo_H_mpi(i, j, ifreq) = sigma_kubo_H_mpi(i, j, ifreq) &
@@ -179,6 +188,10 @@ subroutine linear_optic
     sigma_kubo_AH = sigma_kubo_AH_mpi
 #endif
 
+    !> both parts of the conductivity of the stars are symmetric under the operators
+    call symm_average_tensor(kcube, FreqNum, sigma_kubo_H)
+    call symm_average_tensor(kcube, FreqNum, sigma_kubo_AH)
+
    ! ------------------------------------------------------------------------
    ! At this point 
    !
@@ -14,16 +14,11 @@ subroutine readNormalHmnR()
 
    implicit none
 
-   character*4 :: c_temp
-
    integer :: i, j, ir, ia, io 
-   integer :: i1, i2, i3, i4, i5
-   integer :: n, m, ir0
+   integer :: ir0, ierr_hr, ierr
    integer :: add_electric_field
-   integer :: nwann, nwann_nsoc
-   integer :: stat, idx, nRused
    real(dp) :: static_potential
-   real(dp) :: tot, rh, ih
+   real(dp) :: tot
    real(dp) :: pos(Origin_cell%Num_atoms)
 
 
@@ -35,20 +30,178 @@ subroutine readNormalHmnR()
    endif
 
    if(cpuid.eq.0)write(stdout,*)' '
-   open(12, file=Hrfile, status='OLD')
+
+   !> only the root rank reads the hr file, the other ranks get the
+   !> Hamiltonian by broadcast instead of parsing the same file
+   !> an error on the root rank has to stop all ranks, not only the root
+   ierr_hr= 0
+   if (cpuid==0) call read_hr_file(ierr_hr)
+#if defined (MPI)
+   call mpi_bcast(ierr_hr, 1, mpi_in, 0, mpi_cmw, ierr)
+#endif
+   if (ierr_hr/=0) call printerrormsg("ERROR: failed to read the hr file, see the message above")
+   call bcast_hmnr()
+
+
+   !call get_fermilevel
+   !check sum rule
+   tot= 0d0
+   do ir=1, Nrpts
+      tot= tot+ 1d0/ndegen(ir)
+   enddo
+
+   !> get the Cartesian coordinates for R points
+   allocate( crvec(3, nrpts))
+
+   !> get R coordinates
+   do iR=1, Nrpts
+      crvec(:, iR)= Origin_cell%Rua*irvec(1,iR) + Origin_cell%Rub*irvec(2,iR) + Origin_cell%Ruc*irvec(3,iR)
+   enddo
+
+   !> change from "up dn up dn" to "up up dn dn"
+   if (index( Package, 'QE')/=0.or.index( Package, 'quantumespresso')/=0 &
+         .or.index( Package, 'quantum-espresso')/=0.or.index(Package, 'VASP6')/=0.or.index( Package, 'pwscf')/=0) then
+      call reorder_wannierbasis
+
+      if (cpuid==0.and.export_newhr) then
+         !> write to new_hr.dat
+         outfileindex= outfileindex+ 1
+         open(unit=outfileindex, file='wannier90_hr_standard.dat')
+         write(outfileindex, '(a,1X,a,1X,a,1X, a, a)')  &
+            'HmnR transformed from QE ', time_now, date_now, 'UTC', zone_now
+         write(outfileindex, *)Num_wann
+         write(outfileindex, *)nrpts
+         write(outfileindex, '(15I5)')ndegen
+         do ir=1, nrpts
+            do j=1, Num_wann
+               do i=1, Num_wann
+                  write( outfileindex, '(5I5, 2f16.6)') &
+                     irvec(:, ir), i, j, HmnR(i, j, ir)/eV2Hartree
+               end do
+            end do
+         end do
+         close(outfileindex)
+      endif
+   endif
+
+   !> get the ir index that the R(ir)=(0, 0, 0)
+   ir0=0
+   do ir=1, nrpts
+      if (irvec(1, ir)==0.and.irvec(2, ir)==0.and.irvec(3, ir)==0) ir0=ir
+   enddo
+
+   !> Adding zeeman field
+   !> Bx=Bdirection(1)
+   !> By=Bdirection(2)
+   !> Bz=Bdirection(3)
+   !> Hz= Zeeman_energy_in_eV*(Bx*sx+By*sy+Bz*sz)/2d0
+   !> sx, sy, sz are Pauli matrices.
+   if (Add_Zeeman_Field) then
+      call add_zeeman_normal_hr()
+      !> After considering the Zeeman field, we already extended the spin space to spin-full.
+      SOC = 1
+   endif ! Add_Zeeman_Field
+
+   call get_stacking_direction_and_pos(add_electric_field, pos)
+ 
+   if (add_electric_field>0) then
+     io=0
+      do ia=1, Origin_cell%Num_atoms
+         !static_potential= pos(ia)*Origin_cell%cell_parameters(add_electric_field)*Electric_field_in_eVpA
+         !if (Inner_symmetrical_Electric_Field) then
+         !   static_potential= abs(pos(ia)*Origin_cell%cell_parameters(add_electric_field))*Electric_field_in_eVpA
+         !endif
+         static_potential= abs(pos(ia)*Origin_cell%cell_parameters(add_electric_field))&
+            *Symmetrical_Electric_field_in_eVpA*eV2Hartree/Angstrom2atomic+ &
+            (pos(ia)*Origin_cell%cell_parameters(add_electric_field))*&
+            Electric_field_in_eVpA*eV2Hartree/Angstrom2atomic
+
+         do i=1, Origin_cell%nprojs(ia)
+            io=io+1
+            HmnR(io, io, ir0)= HmnR(io, io, ir0)+ static_potential
+            if (SOC>0) then
+               HmnR(io+Num_wann/2, io+Num_wann/2, ir0)= HmnR(io+Num_wann/2, io+Num_wann/2, ir0)+ static_potential
+            endif ! SOC
+         enddo ! nproj
+      enddo ! ia
+   endif  ! add electric field or not
+
+   !> write out Hmn(R=0)
+   if (cpuid.eq.0 .and. Num_wann< 300)then
+      write(stdout, '(a)')" "
+      write(stdout, '(a)')" >> Hopping parameters in the home unit cell"
+      write(stdout, '(a)')" >> H00= Hmn(R=0) real part"
+      do i=1, Num_wann
+         write(stdout, '(50000f7.3)') real(HmnR(i, :, ir0))/eV2Hartree
+      enddo
+      write(stdout, '(a)')" "
+      write(stdout, '(a)')" >> H00= Hmn(R=0) imagary part"
+      do i=1, Num_wann
+         write(stdout, '(50000f7.3)') aimag(HmnR(i, :, ir0))/eV2Hartree
+      enddo
+      write(stdout, '(a)')" "
+   endif
+
+   ! call get_hmnr_cell(Cell_defined_by_surface)
+
+   return
+end subroutine readNormalHmnR
+
+subroutine read_hr_file(ierr_hr)
+   !> Read Hmn(R), irvec and ndegen from Hrfile, shift the Fermi level and
+   !> convert to Hartree. Called by the root rank only, see readNormalHmnR.
+   !> ierr_hr= 0 on success, otherwise the error is written to stdout and
+   !> the caller stops all ranks.
+   use para
+   implicit none
+
+   integer, intent(out) :: ierr_hr
+
+   character*4 :: c_temp
+
+   integer :: i, j, ir
+   integer :: i1, i2, i3, i4, i5
+   integer :: n, m
+   integer :: nwann, nwann_nsoc
+   integer :: stat, idx, nRused
+   integer :: nlines, nblock, nread, iline, nhash
+   integer, allocatable :: rhash(:)
+   real(dp), allocatable :: hr_block(:, :)
+   logical :: hr_cached
+   real(dp) :: rh, ih
+
+   ierr_hr= 0
+
+   !> use the binary sidecar Hrfile.wtb written by wt-py if it matches the hr file
+   hr_cached= .false.
+   if (Hr_cache .and. index(Hrfile, 'HWR')==0 .and. .not. Is_Sparse_Hr) then
+      call open_hr_cache(14, nwann, Nrpts, hr_cached)
+   endif
+   if (.not. hr_cached) then
+      open(12, file=Hrfile, status='OLD', iostat=stat)
+      if (stat/=0) then
+         write(stdout, '(2a)')' >>> ERROR: can not open the hr file ', trim(Hrfile)
+         ierr_hr= 1
+         return
+      endif
+   endif
 
    if (index(Hrfile, 'HWR')==0) then
       !> for Normal HmnR obtained from Wannier90 or sparse HmnR
       if (.not. Is_Sparse_Hr) then
 
-         !> skip a comment line
-         read(12, *)
+         if (.not. hr_cached) then
+            !> skip a comment line
+            read(12, *)
 
-         !> number of Wannier orbitals in the hr file
-         nwann=0
-         read(12, *)nwann
+            !> number of Wannier orbitals in the hr file
+            nwann=0
+            read(12, *)nwann
+         endif
          if (nwann==0) then
-            stop "ERROR : num_wann is zero in hr file"
+            write(stdout, '(a)')' >>> ERROR: num_wann is zero in hr file'
+            ierr_hr= 1
+            goto 1001
          endif
          nwann_nsoc=nwann
          if (SOC>0) nwann_nsoc= nwann/2
@@ -58,33 +211,46 @@ subroutine readNormalHmnR()
          print *, 'sum(Origin_cell%nprojs), num_wann, num_wann/2'
          print *, sum(Origin_cell%nprojs), nwann, nwann/2
          print *, "ERROR: Maybe the SOC tags in the SYSTEM is wrongly set"
-         stop "ERROR: the summation of all projectors times spin degeneracy is not equal to num_wann"
+         print *, "ERROR: the summation of all projectors times spin degeneracy is not equal to num_wann"
+         ierr_hr= 1
+         goto 1001
          endif
    
          !> number of lattice vectors taken into account
-         read(12, *)Nrpts
+         if (.not. hr_cached) read(12, *)Nrpts
          if (.not. allocated(HmnR)) allocate(HmnR(Num_wann,Num_wann,nrpts))
          allocate(irvec(3,nrpts))
          allocate(ndegen(nrpts))
          irvec= 0
          ndegen=1
 
-         !> The degeneracy of each R point, this is caused by the Fourier transform in the Wigner-Seitz cell
-         read(12, *)(ndegen(i), i=1, Nrpts)
+         if (hr_cached) then
+            call read_hr_cache(14, nwann, Nrpts, stat)
+            if (stat/=0) then
+               ierr_hr= 1
+               goto 1001
+            endif
+         else
+            !> The degeneracy of each R point, this is caused by the Fourier transform in the Wigner-Seitz cell
+            read(12, *)(ndegen(i), i=1, Nrpts)
+         endif
       else
          !> for Sparse HmnR
          !> skip a comment line
          read(12, *)
          read(12,*) splen_input   !> number of non-zeros lines
          if (splen_input<=0) then
-            stop "ERROR : splen_input is zero in hr file"
+            write(stdout, '(a)')' >>> ERROR: splen_input is zero in hr file'
+            ierr_hr= 1
+            goto 1001
          endif
 
          !> 读取 Wannier 轨道数
          read(12, *) nwann
          if (nwann /= Num_wann) then
-            write(*, *) '>>> ERROR: Num_wann mismatch in Hr file: ', nwann, ' vs ', Num_wann
-            stop
+            write(stdout, *) '>>> ERROR: Num_wann mismatch in Hr file: ', nwann, ' vs ', Num_wann
+            ierr_hr= 1
+            goto 1001
          endif
          nwann_nsoc = nwann
          if (SOC > 0) nwann_nsoc = nwann/2
@@ -97,32 +263,64 @@ subroutine readNormalHmnR()
          ndegen = 1
       endif
 
+      !> number of data lines, each line is "i1 i2 i3 m n Re(H) Im(H)"
+      if (hr_cached) then
+         nlines= 0
+      elseif (.not. Is_Sparse_Hr) then
+         nlines= Nrpts*nwann*nwann
+      else
+         nlines= splen_input
+      endif
+
+      !> The data lines are parsed in blocks of nwann*nwann lines with one read
+      !> statement per block, and the R vectors are located through a hash
+      !> table instead of a linear scan over all R points found so far.
+      nblock= max(1, min(nwann*nwann, nlines))
+      allocate(hr_block(7, nblock))
+      nhash= 1
+      do while (nhash< 2*Nrpts)
+         nhash= 2*nhash
+      enddo
+      allocate(rhash(0:nhash-1))
+      rhash= 0
+
       nRused = 0
-      do 
-         read(12,*,iostat=stat) i1, i2, i3, i4, i5, rh, ih
-         if (stat<0) exit   ! EOF
-         if (stat>0) stop "格式错误"
-         !—— 1) 在已有 R 点中查找 ——
-         idx = 0
-         do j = 1, nRused
-            if (irvec(1,j)==i1 .and. irvec(2,j)==i2 .and. irvec(3,j)==i3) then
-               idx = j
-               exit
-            end if
-         end do
-      
-         !—— 2) 如果没找到，就新增一个 R 点 ——
-         if (idx == 0) then
-            nRused = nRused + 1
-            idx = nRused
-            irvec(:,idx) = (/ i1, i2, i3 /)
-            ! write(*, '(a, i5, a, i5, a, i5)') 'New R point found: i1 =', i1, ', i2=', i2, ', i3=', i3
-         end if
-      
-         !—— 3) 填写 overlap 矩阵 ——
-         HmnR(i4, i5, idx) = dcmplx(rh, ih)
+      idx = 0
+      iline= 0
+      do while (iline< nlines)
+         nread= min(nblock, nlines- iline)
+         read(12, *, iostat=stat) ((hr_block(j, n), j=1, 7), n=1, nread)
+         if (stat/=0) then
+            write(stdout, '(a, i12, 2a)')' >>> ERROR: failed to read line ', iline+ 1, &
+               ' of the Hmn(R) data in ', trim(Hrfile)
+            ierr_hr= 1
+            goto 1001
+         endif
 
+         do n= 1, nread
+            i1= nint(hr_block(1, n))
+            i2= nint(hr_block(2, n))
+            i3= nint(hr_block(3, n))
+            i4= nint(hr_block(4, n))
+            i5= nint(hr_block(5, n))
+
+            !> the lines usually come in blocks of the same R, so only go to
+            !> the hash table when R changes
+            if (idx==0) then
+               call hr_rhash_index(i1, i2, i3, nhash, rhash, nRused, idx)
+            elseif (irvec(1, idx)/=i1 .or. irvec(2, idx)/=i2 .or. irvec(3, idx)/=i3) then
+               call hr_rhash_index(i1, i2, i3, nhash, rhash, nRused, idx)
+            endif
+            if (idx==0) then
+               ierr_hr= 1
+               goto 1001
+            endif
+
+            HmnR(i4, i5, idx) = dcmplx(hr_block(6, n), hr_block(7, n))
+         enddo
+         iline= iline+ nread
       end do
+      deallocate(hr_block, rhash)
 
       ! ir=0
       ! do ir=1,Nrpts
@@ -198,111 +396,185 @@ subroutine readNormalHmnR()
    endif ! HWR or not
 
    1001 continue
-   close(12)
+   if (.not. hr_cached) close(12)
+   if (allocated(hr_block)) deallocate(hr_block)
+   if (allocated(rhash)) deallocate(rhash)
 
-   !call get_fermilevel
-   !check sum rule
-   tot= 0d0
-   do ir=1, Nrpts
-      tot= tot+ 1d0/ndegen(ir)
+   return
+end subroutine read_hr_file
+
+subroutine bcast_hmnr()
+   !> Broadcast the Hamiltonian read by read_hr_file from the root rank
+   use para
+   implicit none
+
+   integer :: ierr, ir, nr_chunk
+
+#if defined (MPI)
+   call mpi_bcast(Nrpts, 1, mpi_in, 0, mpi_cmw, ierr)
+   call mpi_bcast(splen_input, 1, mpi_in, 0, mpi_cmw, ierr)
+   call mpi_bcast(E_fermi, 1, mpi_dp, 0, mpi_cmw, ierr)
+
+   if (.not. allocated(HmnR)) allocate(HmnR(Num_wann,Num_wann,Nrpts))
+   if (.not. allocated(irvec)) allocate(irvec(3,Nrpts))
+   if (.not. allocated(ndegen)) allocate(ndegen(Nrpts))
+
+   call mpi_bcast(ndegen, Nrpts, mpi_in, 0, mpi_cmw, ierr)
+   call mpi_bcast(irvec, 3*Nrpts, mpi_in, 0, mpi_cmw, ierr)
+
+   !> broadcast HmnR in slices of R points to keep the count in the integer range
+   nr_chunk= max(1, 2**27/(Num_wann*Num_wann))
+   do ir= 1, Nrpts, nr_chunk
+      call mpi_bcast(HmnR(1, 1, ir), Num_wann*Num_wann*min(nr_chunk, Nrpts-ir+1), &
+         mpi_dc, 0, mpi_cmw, ierr)
    enddo
+#endif
 
-   !> get the Cartesian coordinates for R points
-   allocate( crvec(3, nrpts))
+   return
+end subroutine bcast_hmnr
+
+subroutine hr_rhash_index(i1, i2, i3, nhash, rhash, nRused, idx)
+   !> Find the index of R=(i1, i2, i3) in irvec with an open addressing hash
+   !> table. If R is not found, it is appended to irvec as a new R point.
+   !> nhash should be a power of 2 and larger than Nrpts. idx= 0 if there
+   !> are more R points than Nrpts.
+   use para, only : irvec, Nrpts, stdout
+   implicit none
 
-   !> get R coordinates
-   do iR=1, Nrpts
-      crvec(:, iR)= Origin_cell%Rua*irvec(1,iR) + Origin_cell%Rub*irvec(2,iR) + Origin_cell%Ruc*irvec(3,iR)
+   integer, intent(in) :: i1, i2, i3
+   integer, intent(in) :: nhash
+   integer, intent(inout) :: rhash(0:nhash-1)
+   integer, intent(inout) :: nRused
+   integer, intent(out) :: idx
+
+   integer :: h
+   integer(8) :: key
+
+   key= 73856093_8*i1+ 19349663_8*i2+ 83492791_8*i3
+   h= int(modulo(key, int(nhash, 8)))
+   do
+      idx= rhash(h)
+      if (idx==0) exit
+      if (irvec(1, idx)==i1 .and. irvec(2, idx)==i2 .and. irvec(3, idx)==i3) return
+      h= iand(h+1, nhash-1)
    enddo
 
-   !> change from "up dn up dn" to "up up dn dn"
-   if (index( Package, 'QE')/=0.or.index( Package, 'quantumespresso')/=0 &
-         .or.index( Package, 'quantum-espresso')/=0.or.index(Package, 'VASP6')/=0.or.index( Package, 'pwscf')/=0) then
-      call reorder_wannierbasis
+   !> a new R point
+   nRused= nRused+ 1
+   if (nRused> Nrpts) then
+      write(stdout, '(a, i8)')' >>> ERROR: number of R points in the hr file is larger than nrpts=', Nrpts
+      idx= 0
+      return
+   endif
+   idx= nRused
+   irvec(:, idx)= (/i1, i2, i3/)
+   rhash(h)= idx
 
-      if (cpuid==0.and.export_newhr) then
-         !> write to new_hr.dat
-         outfileindex= outfileindex+ 1
-         open(unit=outfileindex, file='wannier90_hr_standard.dat')
-         write(outfileindex, '(a,1X,a,1X,a,1X, a, a)')  &
-            'HmnR transformed from QE ', time_now, date_now, 'UTC', zone_now
-         write(outfileindex, *)Num_wann
-         write(outfileindex, *)nrpts
-         write(outfileindex, '(15I5)')ndegen
-         do ir=1, nrpts
-            do j=1, Num_wann
-               do i=1, Num_wann
-                  write( outfileindex, '(5I5, 2f16.6)') &
-                     irvec(:, ir), i, j, HmnR(i, j, ir)/eV2Hartree
-               end do
-            end do
-         end do
-         close(outfileindex)
-      endif
+   return
+end subroutine hr_rhash_index
+
+subroutine open_hr_cache(iunit, nwann, nrpts_cache, hr_cached)
+   !> Open the binary sidecar trim(Hrfile)//'.wtb' written by wt-py and read
+   !> its header. wt-py only switches Hr_cache on after it checked the size,
+   !> modification time and checksum of the hr file against the sidecar,
+   !> here the format version and the size of the hr file are checked again.
+   !>
+   !> Layout, little endian, 128 byte header followed by three blocks:
+   !>   magic 'WTHRBIN', version, num_wann, nrpts, reserved (int32)
+   !>   size and mtime of the hr file, offsets of the blocks (int64)
+   !>   sha256 of the hr file (32 bytes), padding
+   !>   ndegen(nrpts) int32, irvec(3, nrpts) int32,
+   !>   HmnR(num_wann, num_wann, nrpts) complex128 in eV
+   use para, only : Hrfile, stdout, cpuid
+   implicit none
+
+   integer, intent(in) :: iunit
+   integer, intent(out) :: nwann, nrpts_cache
+   logical, intent(out) :: hr_cached
+
+   integer, parameter :: wtb_version= 1
+   character(len=8) :: magic
+   integer :: ierr, version, ireserved
+   integer(8) :: source_size, hr_size, source_mtime
+   logical :: exists
+
+   hr_cached= .false.
+   nwann= 0
+   nrpts_cache= 0
+
+   inquire(file=trim(Hrfile)//'.wtb', exist=exists)
+   if (.not. exists) return
+   inquire(file=Hrfile, size=hr_size)
+
+   open(unit=iunit, file=trim(Hrfile)//'.wtb', access='stream', form='unformatted', &
+      status='old', action='read', iostat=ierr)
+   if (ierr/=0) return
+   read(iunit, pos=1, iostat=ierr) magic, version, nwann, nrpts_cache, ireserved, &
+      source_size, source_mtime
+   if (ierr/=0 .or. magic/='WTHRBIN'//char(0) .or. version/=wtb_version .or. &
+       source_size/=hr_size .or. &
+       nwann<=0 .or. nrpts_cache<=0) then
+      close(iunit)
+      if (cpuid==0) write(stdout, '(3a)')' >> Ignore the outdated binary cache ', &
+         trim(Hrfile)//'.wtb'
+      nwann= 0
+      nrpts_cache= 0
+      return
    endif
 
-   !> get the ir index that the R(ir)=(0, 0, 0)
-   ir0=0
-   do ir=1, nrpts
-      if (irvec(1, ir)==0.and.irvec(2, ir)==0.and.irvec(3, ir)==0) ir0=ir
-   enddo
+   hr_cached= .true.
+   if (cpuid==0) write(stdout, '(2a)')' >> Read Hmn(R) from the binary cache ', &
+      trim(Hrfile)//'.wtb'
 
-   !> Adding zeeman field
-   !> Bx=Bdirection(1)
-   !> By=Bdirection(2)
-   !> Bz=Bdirection(3)
-   !> Hz= Zeeman_energy_in_eV*(Bx*sx+By*sy+Bz*sz)/2d0
-   !> sx, sy, sz are Pauli matrices.
-   if (Add_Zeeman_Field) then
-      call add_zeeman_normal_hr()
-      !> After considering the Zeeman field, we already extended the spin space to spin-full.
-      SOC = 1
-   endif ! Add_Zeeman_Field
+   return
+end subroutine open_hr_cache
 
-   call get_stacking_direction_and_pos(add_electric_field, pos)
- 
-   if (add_electric_field>0) then
-     io=0
-      do ia=1, Origin_cell%Num_atoms
-         !static_potential= pos(ia)*Origin_cell%cell_parameters(add_electric_field)*Electric_field_in_eVpA
-         !if (Inner_symmetrical_Electric_Field) then
-         !   static_potential= abs(pos(ia)*Origin_cell%cell_parameters(add_electric_field))*Electric_field_in_eVpA
-         !endif
-         static_potential= abs(pos(ia)*Origin_cell%cell_parameters(add_electric_field))&
-            *Symmetrical_Electric_field_in_eVpA*eV2Hartree/Angstrom2atomic+ &
-            (pos(ia)*Origin_cell%cell_parameters(add_electric_field))*&
-            Electric_field_in_eVpA*eV2Hartree/Angstrom2atomic
+subroutine wt_set_hr_cache(use_cache)
+   !> Called from Python before the hr file is read, use_cache= 1 once the
+   !> sidecar Hrfile.wtb was checked against the hr file, use_cache= 0 reads
+   !> the text file even if a Hrfile.wtb exists
+   use para, only : Hr_cache
+   implicit none
 
-         do i=1, Origin_cell%nprojs(ia)
-            io=io+1
-            HmnR(io, io, ir0)= HmnR(io, io, ir0)+ static_potential
-            if (SOC>0) then
-               HmnR(io+Num_wann/2, io+Num_wann/2, ir0)= HmnR(io+Num_wann/2, io+Num_wann/2, ir0)+ static_potential
-            endif ! SOC
-         enddo ! nproj
-      enddo ! ia
-   endif  ! add electric field or not
+   integer, intent(in) :: use_cache
 
-   !> write out Hmn(R=0)
-   if (cpuid.eq.0 .and. Num_wann< 300)then
-      write(stdout, '(a)')" "
-      write(stdout, '(a)')" >> Hopping parameters in the home unit cell"
-      write(stdout, '(a)')" >> H00= Hmn(R=0) real part"
-      do i=1, Num_wann
-         write(stdout, '(50000f7.3)') real(HmnR(i, :, ir0))/eV2Hartree
-      enddo
-      write(stdout, '(a)')" "
-      write(stdout, '(a)')" >> H00= Hmn(R=0) imagary part"
-      do i=1, Num_wann
-         write(stdout, '(50000f7.3)') aimag(HmnR(i, :, ir0))/eV2Hartree
-      enddo
-      write(stdout, '(a)')" "
+   Hr_cache= use_cache/=0
+
+   return
+end subroutine wt_set_hr_cache
+
+subroutine read_hr_cache(iunit, nwann, nrpts_cache, stat)
+   !> Read ndegen, irvec and HmnR from the binary cache opened by open_hr_cache
+   !> and close it. HmnR may be larger than nwann*nwann when the Zeeman field
+   !> doubles the basis later on. stat/=0 if the cache is broken.
+   use para, only : HmnR, irvec, ndegen, Num_wann, stdout
+   implicit none
+
+   integer, intent(in) :: iunit, nwann, nrpts_cache
+   integer, intent(out) :: stat
+
+   integer :: ir
+   integer(8) :: offsets(3)
+
+   read(iunit, pos=41, iostat=stat) offsets
+   if (stat==0) read(iunit, pos=offsets(1)+1, iostat=stat) ndegen(1:nrpts_cache)
+   if (stat==0) read(iunit, pos=offsets(2)+1, iostat=stat) irvec(:, 1:nrpts_cache)
+   if (stat==0) then
+      if (nwann==Num_wann) then
+         read(iunit, pos=offsets(3)+1, iostat=stat) HmnR
+      else
+         read(iunit, pos=offsets(3)+1, iostat=stat) (HmnR(1:nwann, 1:nwann, ir), ir=1, nrpts_cache)
+      endif
    endif
+   close(iunit)
 
-   ! call get_hmnr_cell(Cell_defined_by_surface)
+   if (stat/=0) then
+      write(stdout, '(a)')' >>> ERROR: failed to read the binary cache of the hr file'
+      write(stdout, '(a)')' >>> ERROR: the .wtb file is broken, remove it and rerun'
+   endif
 
    return
-end subroutine readNormalHmnR
+end subroutine read_hr_cache
 
 subroutine readNormalSmnR()
    !>> Read in the overlap matrix from wannier90_sr.dat
@@ -690,21 +962,30 @@ subroutine readSparseHmnR
    integer :: add_electric_field
    real(dp) :: Bx_in_au, By_in_au, Bz_in_au
    complex(dp) :: h_value
+   integer :: ierr
 
-   open(12, file=Hrfile)
+   !> only the root rank reads the hr file, the non-zero entries are
+   !> broadcast to the other ranks below
+   nwann=0
+   if (cpuid==0) then
+      open(12, file=Hrfile)
 
-   !> skip a comment line
-   read(12, *)
+      !> skip a comment line
+      read(12, *)
 
-   !> comparing with the standard hr file, we add another line to show howmany
-   !> lines that Hmn(R) is not zero.
-   if(Is_Sparse_Hr) then
-      read(12,*) splen_input   !> number of non-zeros lines
-   end if
+      !> comparing with the standard hr file, we add another line to show howmany
+      !> lines that Hmn(R) is not zero.
+      if(Is_Sparse_Hr) then
+         read(12,*) splen_input   !> number of non-zeros lines
+      end if
 
-   !> number of Wannier orbitals in the hr file
-   nwann=0
-   read(12, *)nwann
+      !> number of Wannier orbitals in the hr file
+      read(12, *)nwann
+   endif
+#if defined (MPI)
+   call mpi_bcast(splen_input, 1, mpi_in, 0, mpi_cmw, ierr)
+   call mpi_bcast(nwann, 1, mpi_in, 0, mpi_cmw, ierr)
+#endif
    if (nwann==0) then
       stop "ERROR : num_wann is zero in hr file"
    endif
@@ -759,22 +1040,31 @@ subroutine readSparseHmnR
    hirv=0
 
    !> will reread the above line
-   do j=1, splen_input
-      read(12,*,end=1001)i1, i2, i3, i4, i5, r1, r2
-      hirv (1, j)=i1
-      hirv (2, j)=i2
-      hirv (3, j)=i3
-      hicoo(j)=i4
-      hjcoo(j)=i5
-
-      if (trim(adjustl(Package))=="OPENMX") then
-         hacoo(j)=dcmplx(r1,r2)
-      else
-         hacoo(j)=dcmplx(r1,r2)*eV2Hartree
-      endif
-   enddo
-   j=j-1
-   1001 continue
+   if (cpuid==0) then
+      do j=1, splen_input
+         read(12,*,end=1001)i1, i2, i3, i4, i5, r1, r2
+         hirv (1, j)=i1
+         hirv (2, j)=i2
+         hirv (3, j)=i3
+         hicoo(j)=i4
+         hjcoo(j)=i5
+
+         if (trim(adjustl(Package))=="OPENMX") then
+            hacoo(j)=dcmplx(r1,r2)
+         else
+            hacoo(j)=dcmplx(r1,r2)*eV2Hartree
+         endif
+      enddo
+      1001 continue
+      close(12)
+   endif
+#if defined (MPI)
+   call mpi_bcast(hirv, 3*splen_input, mpi_in, 0, mpi_cmw, ierr)
+   call mpi_bcast(hicoo, splen_input, mpi_in, 0, mpi_cmw, ierr)
+   call mpi_bcast(hjcoo, splen_input, mpi_in, 0, mpi_cmw, ierr)
+   call mpi_bcast(hacoo, splen_input, mpi_dc, 0, mpi_cmw, ierr)
+#endif
+   j= splen_input
 
    !> Adding zeeman field
    !> Bx=Bdirection(1)
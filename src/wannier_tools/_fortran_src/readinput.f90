@@ -8,9 +8,10 @@ subroutine readinput
    use para
    implicit none
 
-   character*12 :: fname='wt.in'
+   character(256) :: fname
    character*25 :: char_temp
    character*256 :: inline
+   character(512) :: text_only_calc
    logical ::  exists, lfound
    real(dp) :: cell_volume, cell_volume2
 
@@ -27,13 +28,14 @@ subroutine readinput
    real(dp), allocatable :: mass_temp(:)
    real(dp), allocatable :: Born_Charge_temp(:, :, :)
 
+   fname= Input_file
    inquire(file=fname,exist=exists)
    if (exists)then
       if(cpuid==0)write(stdout,*) '  '
       if(cpuid==0)write(stdout,*) '>>>Read some paramters from wt.in'
       open(unit=1001,file=fname,status='old')
    else
-      if(cpuid==0)write(stdout,*)'file' ,fname, 'does not exist'
+      if(cpuid==0)write(stdout,*)'file ', trim(fname), ' does not exist'
       stop
    endif
 
@@ -610,7 +612,18 @@ subroutine readinput
    Relaxation_Time_Tau= 1d0  ! in ps
    topsurface_atom_index= 0
    arpack_solver= 'zndrv1'
+   QPI_method= 'FFT'
+   Slab_solver= 'DENSE'
+   Band_window= .false.
+   Checkpoint_interval= 1800d0
+   Nk_refine_levels= 0
+   Refine_threshold= 100d0  ! in Angstrom^2
+   Refine_gap_threshold= 0.05d0  ! in eV
+   Nk_interp= 0
+   Interp_tolerance= 1d-4  ! in eV
+   Output_format= 'ASCII'
    RKF45_PERIODIC_LEVEL= 1
+   RKF45_batch_size= 16
    iprint_level = 1
    nnzmax_input=-1
    penetration_lambda_arpes= 5 ! in angstrom
@@ -659,6 +672,46 @@ subroutine readinput
    NBTau= max(NBTau, BTauNum)
   
    projection_weight_mode= upper(projection_weight_mode)
+   QPI_method= upper(QPI_method)
+   Slab_solver= upper(Slab_solver)
+   if (Slab_solver/='DENSE' .and. Slab_solver/='BANDED') then
+      if (cpuid==0) write(stdout, *)'ERROR: Slab_solver should be DENSE or BANDED, not ', &
+         trim(Slab_solver)
+      stop 'ERROR: unknown Slab_solver'
+   endif
+   Output_format= upper(Output_format)
+   if (Output_format/='ASCII' .and. Output_format/='NPZ' .and. &
+       Output_format/='HDF5' .and. Output_format/='RAW') then
+      if (cpuid==0) write(stdout, *)'ERROR: Output_format should be ASCII, NPZ, HDF5 or RAW, not ', &
+         trim(Output_format)
+      stop 'ERROR: unknown Output_format'
+   endif
+
+   !> only the bulk bands, slab bands, Fermi surface, DOS, surface states,
+   !> Fermi arcs, WCC, Berry curvature and AHC have binary output, the
+   !> other calculations write their text files whatever Output_format is
+   text_only_calc= ' '
+   if (SlabBand_calc .and. Is_Sparse) text_only_calc= trim(text_only_calc)//' SlabBand_calc(Is_Sparse)'
+   if (SlabBand_plane_calc) text_only_calc= trim(text_only_calc)//' SlabBand_plane_calc'
+   if (SlabBdG_calc) text_only_calc= trim(text_only_calc)//' SlabBdG_calc'
+   if (BdGChern_calc) text_only_calc= trim(text_only_calc)//' BdGChern_calc'
+   if (BerryCurvature_slab_calc) text_only_calc= trim(text_only_calc)//' BerryCurvature_slab_calc'
+   if (BulkBand_plane_calc) text_only_calc= trim(text_only_calc)//' BulkBand_plane_calc'
+   if (WireBand_calc) text_only_calc= trim(text_only_calc)//' WireBand_calc'
+   if (LandauLevel_k_calc) text_only_calc= trim(text_only_calc)//' LandauLevel_k_calc'
+   if (LandauLevel_B_calc) text_only_calc= trim(text_only_calc)//' LandauLevel_B_calc'
+   if (LandauLevel_kplane_calc) text_only_calc= trim(text_only_calc)//' LandauLevel_kplane_calc'
+   if (Boltz_OHE_calc) text_only_calc= trim(text_only_calc)//' Boltz_OHE_calc'
+   if (SHC_calc) text_only_calc= trim(text_only_calc)//' SHC_calc'
+   if (ANE_calc) text_only_calc= trim(text_only_calc)//' ANE_calc'
+   if (linear_optic_calc) text_only_calc= trim(text_only_calc)//' linear_optic_calc'
+   if (BPVE_calc) text_only_calc= trim(text_only_calc)//' BPVE_calc'
+   if (Output_format/='ASCII' .and. cpuid==0) then
+      write(stdout, '(4a)')' Warning: Output_format= ', trim(Output_format), ' only covers BulkBand_line,', &
+         ' SlabBand, BulkFS, Dos, SlabSS, SlabArc, WannierCenter, BerryCurvature and AHC,'
+      write(stdout, '(a)')' the other calculations write .dat and .gnu files'
+      if (len_trim(text_only_calc)>0) write(stdout, '(2a)')' text output of:', trim(text_only_calc)
+   endif
    if (cpuid==0) then
       write(stdout, *) "  "
       write(stdout, *) ">>>calculation parameters : "
@@ -696,6 +749,17 @@ subroutine readinput
       write(stdout, '(1x, a, i6   )')'NumSelectedEigenVals', NumSelectedEigenVals
       write(stdout, '(1x, a, i6   )')'NumRandomConfs:', NumRandomConfs
       write(stdout, '(1x, a, a    )')'Projection weight mode:', projection_weight_mode
+      write(stdout, '(1x, a, a    )')'QPI_method:', QPI_method
+      write(stdout, '(1x, a, a    )')'Slab_solver:', Slab_solver
+      write(stdout, '(1x, a, l6   )')'Band_window:', Band_window
+      write(stdout, '(1x, a, f16.1)')'Checkpoint_interval (s)', Checkpoint_interval
+      write(stdout, '(1x, a, i6   )')'Nk_refine_levels : ', Nk_refine_levels
+      write(stdout, '(1x, a, f16.5, a)')'Refine_threshold : ', Refine_threshold, ' Angstrom^2'
+      write(stdout, '(1x, a, f16.5, a)')'Refine_gap_threshold : ', Refine_gap_threshold, ' eV'
+      write(stdout, '(1x, a, i6   )')'Nk_interp : ', Nk_interp
+      write(stdout, '(1x, a, es16.5, a)')'Interp_tolerance : ', Interp_tolerance, ' eV'
+      write(stdout, '(1x, a, i6   )')'RKF45_batch_size : ', RKF45_batch_size
+      write(stdout, '(1x, a, a    )')'Output_format:', Output_format
       write(stdout, '(1x, a, i8   )')'The size of magnetic supercell is Magq= :', Magq
       write(stdout, '(1x, a, f16.5)')'Penetration depth of incoming photon for ARPES, in unit angstrom :', penetration_lambda_arpes
       write(stdout, '(1x, a, f16.5)')'Photon energy for ARPES, in unit eV :', photon_energy_arpes
@@ -714,6 +778,8 @@ subroutine readinput
    OmegaMin= OmegaMin*eV2Hartree
    OmegaMax= OmegaMax*eV2Hartree
    Gap_threshold= Gap_threshold*eV2Hartree
+   Refine_gap_threshold= Refine_gap_threshold*eV2Hartree
+   Interp_tolerance= Interp_tolerance*eV2Hartree
    Rcut= Rcut*Ang2Bohr
    penetration_lambda_arpes= penetration_lambda_arpes*Ang2Bohr
    photon_energy_arpes= photon_energy_arpes*eV2Hartree
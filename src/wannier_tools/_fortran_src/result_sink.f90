@@ -0,0 +1,257 @@
+!> Binary output of the results, selected by Output_format in &PARAMETERS.
+!>
+!> With Output_format= 'ASCII' (default) nothing changes. Otherwise the
+!> calculations that support it skip their formatted .dat files and their
+!> gnuplot scripts, and hand their arrays to this module instead. Rank 0
+!> appends the values as float64 in native byte order to wt_results.bin,
+!> and describes every dataset in the index wt_results.json: name, dtype,
+!> shape, byte offset, units and the names of the axes. wt-py then packs
+!> both files into wt_results.npz (NPZ), wt_results.h5 (HDF5, needs h5py)
+!> or leaves them as they are (RAW), see wannier_tools.results.
+!>
+!> The shape is given as for the Fortran array, the index holds it in
+!> reverse order, which is the shape of the same data as a C ordered NumPy
+!> array. The axes are named in that NumPy order.
+!>
+!> Usage, on rank 0:
+!>    call result_write('bulkek/energy', [Num_wann, knv3], eig, 'eV', 'k,band')
+!> or for data that is produced in blocks:
+!>    call result_dataset('fs3d/energy', [knv3, nband], 'eV', 'band,k', id)
+!>    call result_put(id, offset, n, block)     ! values offset+1..offset+n
+!>
+!> result_open and result_close are called around all calculations by
+!> wannier_tools_dispatch. The other routines do nothing unless
+!> result_binary is set, and on ranks other than 0.
+
+module result_sink
+   use wmpi
+   use prec
+   implicit none
+
+   !> .true. if Output_format is not 'ASCII'
+   logical, save :: result_binary= .false.
+
+   character(*), parameter :: result_data_file= 'wt_results.bin'
+   character(*), parameter :: result_index_file= 'wt_results.json'
+
+   integer, parameter :: result_max_rank= 6
+
+   type result_entry
+      character(64) :: name= ' '
+      character(32) :: units= ' '
+      character(64) :: axes= ' '
+      integer :: rank= 0
+      integer :: shape(result_max_rank)= 0
+
+      !> position of the first value in wt_results.bin, in bytes
+      integer(8) :: offset= 0
+   end type result_entry
+
+   type(result_entry), allocatable, save :: result_entries(:)
+   integer, save :: result_nentries= 0
+   integer, save :: result_unit= -1
+
+   !> size of wt_results.bin in bytes
+   integer(8), save :: result_size= 0
+
+   !> Output_format in lower case, the container wt-py makes of the files
+   character(8), save :: result_format= 'ascii'
+
+contains
+
+   subroutine result_open(format)
+      !> Start a new wt_results.bin if format is not 'ASCII'
+      implicit none
+
+      character(*), intent(in) :: format
+
+      integer :: i
+
+      result_format= adjustl(format)
+      do i= 1, len_trim(result_format)
+         if (result_format(i:i)>='A' .and. result_format(i:i)<='Z') &
+            result_format(i:i)= achar(iachar(result_format(i:i))+32)
+      enddo
+      result_binary= result_format/='ascii'
+      if (.not.result_binary .or. cpuid/=0) return
+
+      if (allocated(result_entries)) deallocate(result_entries)
+      allocate(result_entries(16))
+      result_nentries= 0
+      result_size= 0
+      open(newunit=result_unit, file=result_data_file, access='stream', &
+         form='unformatted', status='replace')
+      call result_write_index
+
+      return
+   end subroutine result_open
+
+   subroutine result_close
+      !> Close wt_results.bin and write the final index
+      implicit none
+
+      if (.not.result_binary .or. cpuid/=0) return
+      if (result_unit==-1) return
+
+      close(result_unit)
+      result_unit= -1
+      call result_write_index
+
+      return
+   end subroutine result_close
+
+   subroutine result_dataset(name, shape, units, axes, id)
+      !> Reserve space for a dataset of the given Fortran shape, its values
+      !> are written with result_put
+      implicit none
+
+      character(*), intent(in) :: name
+      integer, intent(in) :: shape(:)
+      character(*), intent(in) :: units
+      character(*), intent(in) :: axes
+      integer, intent(out) :: id
+
+      type(result_entry), allocatable :: tmp(:)
+      integer(8) :: nvalues
+
+      id= 0
+      if (.not.result_binary .or. cpuid/=0) return
+
+      if (result_nentries==size(result_entries)) then
+         allocate(tmp(2*size(result_entries)))
+         tmp(1:result_nentries)= result_entries(1:result_nentries)
+         call move_alloc(tmp, result_entries)
+      endif
+
+      result_nentries= result_nentries+ 1
+      id= result_nentries
+      result_entries(id)%name= name
+      result_entries(id)%units= units
+      result_entries(id)%axes= axes
+      result_entries(id)%rank= size(shape)
+      result_entries(id)%shape= 0
+      result_entries(id)%shape(1:size(shape))= shape
+      result_entries(id)%offset= result_size
+
+      nvalues= product(int(shape, 8))
+      result_size= result_size+ nvalues*(storage_size(1d0)/8)
+
+      !> give the file its full size, so a dataset that is never completed
+      !> still reads as zeros
+      if (nvalues>0) write(result_unit, pos=result_size-(storage_size(1d0)/8)+1)0d0
+      call result_write_index
+
+      return
+   end subroutine result_dataset
+
+   subroutine result_put(id, offset, n, a)
+      !> Write a(1:n) as the values offset+1..offset+n of dataset id, in
+      !> the order of the Fortran array
+      implicit none
+
+      integer, intent(in) :: id
+      integer(8), intent(in) :: offset
+      integer, intent(in) :: n
+      real(dp), intent(in) :: a(n)
+
+      if (.not.result_binary .or. cpuid/=0) return
+      if (id<1 .or. id>result_nentries .or. n<1) return
+
+      write(result_unit, pos=result_entries(id)%offset+offset*(storage_size(1d0)/8)+1)a
+
+      return
+   end subroutine result_put
+
+   subroutine result_write(name, shape, a, units, axes)
+      !> Write a whole dataset at once
+      implicit none
+
+      character(*), intent(in) :: name
+      integer, intent(in) :: shape(:)
+      real(dp), intent(in) :: a(*)
+      character(*), intent(in) :: units
+      character(*), intent(in) :: axes
+
+      integer :: id
+
+      if (.not.result_binary .or. cpuid/=0) return
+
+      call result_dataset(name, shape, units, axes, id)
+      call result_put(id, 0_8, product(shape), a)
+
+      return
+   end subroutine result_write
+
+   subroutine result_write_index
+      !> Write wt_results.json, to a temporary name that is renamed when
+      !> complete
+      implicit none
+
+      integer :: iunit, ios, id, i
+      character(2) :: sep
+      character(3) :: dtype
+      type(result_entry) :: e
+
+      !> byte order of the float64 values
+      dtype= '<f8'
+      if (transfer([1_1, 0_1, 0_1, 0_1], 1)/=1) dtype= '>f8'
+
+      open(newunit=iunit, file=result_index_file//'.tmp', status='replace', &
+         form='formatted', iostat=ios)
+      if (ios/=0) return
+
+      write(iunit, '(a)')'{'
+      write(iunit, '(3a)')'  "format": "', trim(result_format), '",'
+      write(iunit, '(3a)')'  "data": "', result_data_file, '",'
+      write(iunit, '(a)')'  "datasets": ['
+      do id= 1, result_nentries
+         e= result_entries(id)
+         sep= ', '
+         if (id==result_nentries) sep= ' '
+         write(iunit, '(7a)', advance='no')'    {"name": "', trim(e%name), &
+            '", "dtype": "', dtype, '", "units": "', trim(e%units), '", "shape": ['
+         do i= e%rank, 1, -1
+            if (i<e%rank) write(iunit, '(a)', advance='no')', '
+            write(iunit, '(i0)', advance='no')e%shape(i)
+         enddo
+         write(iunit, '(a, i0, 4a)')'], "offset": ', e%offset, ', "axes": [', &
+            trim(result_json_list(e%axes)), ']}', trim(sep)
+      enddo
+      write(iunit, '(a)')'  ]'
+      write(iunit, '(a)')'}'
+      close(iunit)
+
+      call rename_file(result_index_file//'.tmp', result_index_file, ios)
+
+      return
+   end subroutine result_write_index
+
+   function result_json_list(items) result(list)
+      !> 'a,b,c' to '"a", "b", "c"'
+      implicit none
+
+      character(*), intent(in) :: items
+      character(3*len(items)+2) :: list
+
+      integer :: i, n
+
+      list= ' '
+      if (len_trim(items)==0) return
+
+      list(1:1)= '"'
+      n= 1
+      do i= 1, len_trim(items)
+         if (items(i:i)==',') then
+            list(n+1:n+4)= '", "'
+            n= n+ 4
+         elseif (items(i:i)/=' ') then
+            list(n+1:n+1)= items(i:i)
+            n= n+ 1
+         endif
+      enddo
+      list(n+1:n+1)= '"'
+
+      return
+   end function result_json_list
+
+end module result_sink
@@ -0,0 +1,579 @@
+!> Runge-Kutta-Fehlberg integration of a block of cyclotron orbits.
+!>
+!> RKF45_pack integrates one orbit at a time with r8_rkf45, and every
+!> derivative evaluation in dkdt diagonalizes H(k) for a single k point.
+!> RKF45_pack_batch advances nk orbits of the same band together. Every
+!> orbit keeps its own state, step size and error control, exactly as in
+!> r8_rkf45 and RKF45_pack, but the orbits are stepped in sweeps: in each
+!> sweep every orbit that is not finished asks for one derivative dk/d(Bt),
+!> and all of them are evaluated by one call of dkdt_batch. There H(k)
+!> and dH/dk of the whole block are built with ZGEMM from HmnR, see
+!> velocity_calc_iband_batch.
+!>
+!> The orbits follow the same steps as in RKF45_pack, up to the rounding
+!> of the batched H(k). The one-step mode and the error returns of r8_rkf45
+!> are handled as in RKF45_pack: flags 3-7 increase iter, and an orbit
+!> fails after the fourth of them within one output interval.
+
+module rkf45_batch
+   use wmpi
+   use para, only : dp, Num_wann, Nrpts, irvec, crvec, HmnR, ndegen, twopi, zi, &
+      eps3, eps6, eps8, eps9, Bdirection, EF_integral_range, eV2Hartree, &
+      RKF45_PERIODIC_LEVEL
+   implicit none
+
+contains
+
+   subroutine RKF45_pack_batch(iband, nk, NSlice_Btau, k_start, &
+         Btau_start, Btau_final, kout, NSlice_inuse, icycle, fail)
+      !> RKF45_pack for the nk orbits starting at k_start(:, 1:nk).
+      !> NSlice_inuse, icycle, fail and kout(:, :, i) are the
+      !> NSlice_Btau (inout), icycle, fail and kout of RKF45_pack for orbit i.
+      implicit none
+
+      integer, intent(in) :: iband
+      integer, intent(in) :: nk
+      integer, intent(in) :: NSlice_Btau
+      real(dp), intent(in) :: k_start(3, nk)
+      real(dp), intent(in) :: Btau_start
+      real(dp), intent(in) :: Btau_final
+      real(dp), intent(out) :: kout(3, NSlice_Btau, nk)
+      integer, intent(out) :: NSlice_inuse(nk)
+      integer, intent(out) :: icycle(nk)
+      logical, intent(out) :: fail(nk)
+
+      !> the derivative asked for next: at the start point, at the five
+      !> stages of r8_fehl, after an accepted step, after the short final
+      !> step of an output interval
+      integer, parameter :: stage_start= 0, stage_step= 6, stage_tiny= 7
+      integer, parameter :: maxnfe= 3000
+
+      !> orbit states, the last index runs over the orbits
+      real(dp), allocatable :: y(:, :), yp(:, :), yq(:, :), fs(:, :, :)
+      real(dp), allocatable :: t(:), tout(:), h(:), hmin(:), esttol(:), relerr(:), abserr(:)
+      real(dp), allocatable :: dis_smallest(:)
+      integer, allocatable :: stage(:), nfe(:), kop(:), it(:), iter(:)
+      logical, allocatable :: active(:), started(:), hfaild(:), output(:)
+
+      !> the block of pending derivatives
+      integer :: nq
+      integer, allocatable :: iq(:)
+      real(dp), allocatable :: kq(:, :), kdq(:, :), vq(:, :)
+
+      integer :: i, j
+      real(dp) :: DeltaBtau, eps, vcrossB(3)
+
+      eps= epsilon(eps)
+      DeltaBtau= Btau_final/dble(NSlice_Btau)
+
+      allocate(y(3, nk), yp(3, nk), yq(3, nk), fs(3, 5, nk))
+      allocate(t(nk), tout(nk), h(nk), hmin(nk), esttol(nk), relerr(nk), abserr(nk))
+      allocate(dis_smallest(nk))
+      allocate(stage(nk), nfe(nk), kop(nk), it(nk), iter(nk))
+      allocate(active(nk), started(nk), hfaild(nk), output(nk))
+      allocate(iq(nk), kq(3, nk), kdq(3, nk), vq(3, nk))
+
+      kout= 0d0
+      fs= 0d0
+      icycle= NSlice_Btau
+      NSlice_inuse= NSlice_Btau
+      fail= .false.
+      do i= 1, nk
+         y(:, i)= k_start(:, i)
+         yq(:, i)= k_start(:, i)
+         yp(:, i)= 0d0
+         t(i)= Btau_start
+         tout(i)= Btau_start
+         h(i)= 0d0
+         hmin(i)= 0d0
+         esttol(i)= 0d0
+         relerr(i)= 1d-10
+         abserr(i)= 0d0
+         dis_smallest(i)= 0d0
+      enddo
+      stage= stage_start
+      nfe= 0
+      kop= 0
+      it= 0
+      iter= 0
+      active= .true.
+      started= .false.
+      hfaild= .false.
+      output= .false.
+
+      do while (any(active))
+         nq= 0
+         do i= 1, nk
+            if (.not. active(i)) cycle
+            nq= nq+ 1
+            iq(nq)= i
+            kq(:, nq)= yq(:, i)
+         enddo
+
+         call dkdt_batch(nq, kq, kdq, vq, iband)
+
+         do j= 1, nq
+            i= iq(j)
+            if (stage(i)==stage_start) then
+               !> vxB=0 at the start, the orbit is a single point
+               call cross_product(-vq(:, j), Bdirection, vcrossB)
+               if (sum(abs(vcrossB))<eps6) then
+                  NSlice_inuse(i)= 1
+                  kout(:, 1, i)= k_start(:, i)
+                  active(i)= .false.
+                  cycle
+               endif
+            endif
+            call advance(i, kdq(:, j))
+         enddo
+      enddo
+
+      return
+
+   contains
+
+      subroutine advance(i, g)
+         !> take the derivative g at yq(:, i) and run orbit i up to its
+         !> next derivative or its end
+         integer, intent(in) :: i
+         real(dp), intent(in) :: g(3)
+
+         real(dp) :: s
+
+         select case (stage(i))
+         case (stage_start)
+            !> first call of r8_rkf45 with flag= 1 and t= tout
+            yp(:, i)= g
+            nfe(i)= 1
+            if (.not. interval_done(i)) return
+            call interval_start(i)
+         case (1:4)
+            fs(:, stage(i), i)= g
+            call fehl_stage(i, stage(i)+ 1)
+         case (5)
+            fs(:, 5, i)= g
+            call fehl_finish(i)
+         case (stage_step)
+            yp(:, i)= g
+            nfe(i)= nfe(i)+ 1
+            if (0.0001889568d0<esttol(i)) then
+               s= 0.9d0/esttol(i)**0.2d0
+            else
+               s= 5d0
+            endif
+            if (hfaild(i)) s= min(s, 1d0)
+            h(i)= sign(max(s*abs(h(i)), hmin(i)), h(i))
+            call after_step(i)
+         case (stage_tiny)
+            yp(:, i)= g
+            nfe(i)= nfe(i)+ 1
+            if (.not. interval_done(i)) return
+            call interval_start(i)
+         end select
+
+         return
+      end subroutine advance
+
+      subroutine after_step(i)
+         !> end of an accepted step of r8_rkf45
+         integer, intent(in) :: i
+
+         if (output(i)) then
+            t(i)= tout(i)
+            if (.not. interval_done(i)) return
+            call interval_start(i)
+         else
+            call step_start(i)
+         endif
+
+         return
+      end subroutine after_step
+
+      logical function interval_done(i)
+         !> RKF45_pack after r8_rkf45 returned with flag= 2 at t= tout.
+         !> Returns .true. if the orbit goes on with the next interval.
+         integer, intent(in) :: i
+
+         real(dp) :: kdiff(3), dis
+         real(dp), external :: norm
+         integer :: l, m
+
+         interval_done= .false.
+         if (kdot_zero(i)) return
+
+         it(i)= it(i)+ 1
+         kout(:, it(i), i)= y(:, i)
+         iter(i)= 0
+         if (it(i)+ 1>NSlice_Btau) then
+            active(i)= .false.
+            return
+         endif
+
+         call periodic_diff(kout(:, 2, i), kout(:, 1, i), kdiff)
+         if (it(i)>2) dis_smallest(i)= norm(kdiff)/RKF45_PERIODIC_LEVEL
+
+         !> a closed orbit is repeated instead of integrated further
+         if (it(i)>10) then
+            call periodic_diff(kout(:, it(i), i), kout(:, 1, i), kdiff)
+            dis= norm(kdiff)
+            if (dis<dis_smallest(i)) then
+               icycle(i)= it(i)- 1
+               do l= 2, NSlice_Btau/icycle(i)
+                  do m= 1, icycle(i)
+                     kout(:, m+(l-1)*icycle(i), i)= kout(:, m, i)
+                  enddo
+               enddo
+               do l= (NSlice_Btau/icycle(i))*icycle(i)+1, NSlice_Btau
+                  kout(:, l, i)= kout(:, l-(NSlice_Btau/icycle(i))*icycle(i), i)
+               enddo
+               active(i)= .false.
+               return
+            endif
+         endif
+
+         if (dabs(t(i)-Btau_final)>eps8 .and. t(i)>Btau_final) then
+            interval_done= .true.
+         else
+            active(i)= .false.
+         endif
+
+         return
+      end function interval_done
+
+      logical function kdot_zero(i)
+         !> RKF45_pack after every return of r8_rkf45: kdot= 0 means the
+         !> magnetic field does not move k any more
+         integer, intent(in) :: i
+
+         kdot_zero= sum(abs(yp(:, i)))<eps6
+         if (kdot_zero) then
+            it(i)= it(i)+ 1
+            kout(:, it(i), i)= y(:, i)
+            NSlice_inuse(i)= it(i)
+            active(i)= .false.
+         endif
+
+         return
+      end function kdot_zero
+
+      recursive subroutine retry(i)
+         !> RKF45_pack after r8_rkf45 returned with one of the flags 3-7:
+         !> try again from the current state, or give up after 4 times
+         integer, intent(in) :: i
+
+         if (kdot_zero(i)) return
+         iter(i)= iter(i)+ 1
+         if (iter(i)>3) then
+            fail(i)= .true.
+            active(i)= .false.
+            return
+         endif
+         call interval_entry(i)
+
+         return
+      end subroutine retry
+
+      subroutine interval_start(i)
+         !> next output interval of RKF45_pack
+         integer, intent(in) :: i
+
+         tout(i)= t(i)+ DeltaBtau
+         if (.not. started(i)) then
+            !> the first interval sets up the initial step size
+            started(i)= .true.
+            call initial_step(i)
+         endif
+         call interval_entry(i)
+
+         return
+      end subroutine interval_start
+
+      subroutine initial_step(i)
+         integer, intent(in) :: i
+
+         integer :: l
+         real(dp) :: dt, tol, toln, ypk
+
+         dt= tout(i)- t(i)
+         h(i)= abs(dt)
+         toln= 0d0
+         do l= 1, 3
+            tol= relerr(i)*abs(y(l, i))+ abserr(i)
+            if (0d0<tol) then
+               toln= tol
+               ypk= abs(yp(l, i))
+               if (tol<ypk*h(i)**5) h(i)= (tol/ypk)**0.2d0
+            endif
+         enddo
+         if (toln<=0d0) h(i)= 0d0
+         h(i)= max(h(i), 26d0*eps*max(abs(t(i)), abs(dt)))
+
+         return
+      end subroutine initial_step
+
+      recursive subroutine interval_entry(i)
+         !> entry of r8_rkf45 with flag= 2, or after a retry
+         integer, intent(in) :: i
+
+         real(dp) :: dt
+
+         dt= tout(i)- t(i)
+         h(i)= sign(h(i), dt)
+         if (2d0*abs(dt)<=abs(h(i))) kop(i)= kop(i)+ 1
+         if (kop(i)==10000) then
+            kop(i)= 0
+            call retry(i)
+            return
+         endif
+
+         !> the interval is too short for a step
+         if (abs(dt)<=26d0*eps*abs(t(i))) then
+            t(i)= tout(i)
+            y(:, i)= y(:, i)+ dt*yp(:, i)
+            yq(:, i)= y(:, i)
+            stage(i)= stage_tiny
+            return
+         endif
+
+         output(i)= .false.
+         call step_start(i)
+
+         return
+      end subroutine interval_entry
+
+      recursive subroutine step_start(i)
+         !> top of the step loop of r8_rkf45
+         integer, intent(in) :: i
+
+         real(dp) :: dt
+
+         hfaild(i)= .false.
+         hmin(i)= 26d0*eps*abs(t(i))
+         dt= tout(i)- t(i)
+         if (.not. 2d0*abs(h(i))<=abs(dt)) then
+            if (abs(dt)<=abs(h(i))) then
+               output(i)= .true.
+               h(i)= dt
+            else
+               h(i)= 0.5d0*dt
+            endif
+         endif
+         call step_try(i)
+
+         return
+      end subroutine step_start
+
+      recursive subroutine step_try(i)
+         !> one Fehlberg step of size h from y
+         integer, intent(in) :: i
+
+         if (maxnfe<nfe(i)) then
+            !> flag= 4, RKF45_pack calls again and r8_rkf45 resets nfe
+            nfe(i)= 0
+            call retry(i)
+            return
+         endif
+         call fehl_stage(i, 1)
+
+         return
+      end subroutine step_try
+
+      subroutine fehl_stage(i, s)
+         !> ask for the derivative of stage s of r8_fehl
+         integer, intent(in) :: i, s
+
+         real(dp) :: ch
+
+         select case (s)
+         case (1)
+            ch= h(i)/4d0
+            yq(:, i)= y(:, i)+ ch*yp(:, i)
+         case (2)
+            ch= 3d0*h(i)/32d0
+            yq(:, i)= y(:, i)+ ch*(yp(:, i)+ 3d0*fs(:, 1, i))
+         case (3)
+            ch= h(i)/2197d0
+            yq(:, i)= y(:, i)+ ch*(1932d0*yp(:, i)+ (7296d0*fs(:, 2, i)- 7200d0*fs(:, 1, i)))
+         case (4)
+            ch= h(i)/4104d0
+            yq(:, i)= y(:, i)+ ch*((8341d0*yp(:, i)- 845d0*fs(:, 3, i))+ &
+               (29440d0*fs(:, 2, i)- 32832d0*fs(:, 1, i)))
+         case (5)
+            ch= h(i)/20520d0
+            yq(:, i)= y(:, i)+ ch*((-6080d0*yp(:, i)+ (9295d0*fs(:, 3, i)- 5643d0*fs(:, 4, i)))+ &
+               (41040d0*fs(:, 1, i)- 28352d0*fs(:, 2, i)))
+         end select
+         stage(i)= s
+
+         return
+      end subroutine fehl_stage
+
+      subroutine fehl_finish(i)
+         !> fifth order solution, error estimate and step size control
+         integer, intent(in) :: i
+
+         integer :: l
+         real(dp) :: ch, s(3), scale, ae, et, ee, eeoet
+
+         nfe(i)= nfe(i)+ 5
+         ch= h(i)/7618050d0
+         s= y(:, i)+ ch*((902880d0*yp(:, i)+ (3855735d0*fs(:, 3, i)- 1371249d0*fs(:, 4, i)))+ &
+            (3953664d0*fs(:, 2, i)+ 277020d0*fs(:, 5, i)))
+
+         scale= 2d0/relerr(i)
+         ae= scale*abserr(i)
+         eeoet= 0d0
+         do l= 1, 3
+            et= abs(y(l, i))+ abs(s(l))+ ae
+            if (et<=0d0) then
+               !> flag= 5, RKF45_pack switches to an absolute error test
+               abserr(i)= eps9
+               call retry(i)
+               return
+            endif
+            ee= abs((-2090d0*yp(l, i)+ (21970d0*fs(l, 3, i)- 15048d0*fs(l, 4, i)))+ &
+               (22528d0*fs(l, 2, i)- 27360d0*fs(l, 5, i)))
+            eeoet= max(eeoet, ee/et)
+         enddo
+         esttol(i)= abs(h(i))*eeoet*scale/752400d0
+
+         if (esttol(i)>1d0) then
+            !> rejected, try again with a smaller step
+            hfaild(i)= .true.
+            output(i)= .false.
+            if (esttol(i)<59049d0) then
+               h(i)= 0.9d0/esttol(i)**0.2d0*h(i)
+            else
+               h(i)= 0.1d0*h(i)
+            endif
+            if (abs(h(i))<hmin(i)) then
+               !> flag= 6, RKF45_pack loosens the relative error
+               relerr(i)= 10d0*relerr(i)
+               call retry(i)
+               return
+            endif
+            call step_try(i)
+            return
+         endif
+
+         !> accepted, the derivative at the new point is needed
+         t(i)= t(i)+ h(i)
+         y(:, i)= s
+         yq(:, i)= s
+         stage(i)= stage_step
+
+         return
+      end subroutine fehl_finish
+
+   end subroutine RKF45_pack_batch
+
+
+   subroutine dkdt_batch(nk, kt, kdot, velocity_k, iband)
+      !> dkdt for nk k points, also returns the velocities. Like dkdt, only
+      !> the direction of the field enters, through Bdirection
+      implicit none
+
+      integer, intent(in) :: iband
+      integer, intent(in) :: nk
+      real(dp), intent(in) :: kt(3, nk)
+      real(dp), intent(out) :: kdot(3, nk)
+      real(dp), intent(out) :: velocity_k(3, nk)
+
+      integer :: ik
+      real(dp) :: kdot_cart(3)
+
+      call velocity_calc_iband_batch(iband, nk, kt, velocity_k)
+
+      do ik= 1, nk
+         kdot(:, ik)= 0d0
+         if (sum(abs(velocity_k(:, ik)))<eps3) cycle
+
+         !> \hbar*dkn(t)/d(Bt)= − e \vec{vn(kn(t))} \times \vec{Bdirection}
+         kdot_cart(1)= -velocity_k(2, ik)*Bdirection(3)+ velocity_k(3, ik)*Bdirection(2)
+         kdot_cart(2)= -velocity_k(3, ik)*Bdirection(1)+ velocity_k(1, ik)*Bdirection(3)
+         kdot_cart(3)= -velocity_k(1, ik)*Bdirection(2)+ velocity_k(2, ik)*Bdirection(1)
+         call cart_direct_rec(kdot_cart, kdot(:, ik))
+      enddo
+
+      return
+   end subroutine dkdt_batch
+
+
+   subroutine velocity_calc_iband_batch(iband, nk, kpoints, velocity_k)
+      !> velocity_calc_iband for nk k points. H(k) and the three components
+      !> of dH/dk of a block of k points are four ZGEMMs of HmnR with the
+      !> phase matrices, instead of nk*Nrpts matrix updates each.
+      use band_interp
+      implicit none
+
+      integer, intent(in) :: iband
+      integer, intent(in) :: nk
+      real(dp), intent(in) :: kpoints(3, nk)
+      real(dp), intent(out) :: velocity_k(3, nk)
+
+      integer :: ik, iR, i, ia, nm, nkb, ib0, nb
+      real(dp) :: kdotr, E_iband, W(1)
+      integer, allocatable :: imiss(:)
+      complex(dp), allocatable :: phase(:, :), phase_v(:, :)
+      complex(dp), allocatable :: Hamk(:, :, :), dHdk(:, :, :, :)
+      complex(dp), allocatable :: UU(:)
+
+      !> first the table of band_interp
+      allocate(imiss(nk))
+      nm= 0
+      do ik= 1, nk
+         if (band_interp_eval(iband, kpoints(:, ik), velocity_k(:, ik), E_iband)) then
+            if (abs(E_iband)/eV2Hartree>EF_integral_range) velocity_k(:, ik)= 0d0
+         else
+            nm= nm+ 1
+            imiss(nm)= ik
+         endif
+      enddo
+      if (nm==0) return
+
+      !> blocks of up to 64 MB for H(k) and dH/dk
+      nkb= max(1, min(nm, 2**20/(Num_wann*Num_wann)))
+      allocate(phase(Nrpts, nkb), phase_v(Nrpts, nkb))
+      allocate(Hamk(Num_wann, Num_wann, nkb), dHdk(Num_wann, Num_wann, nkb, 3))
+      allocate(UU(Num_wann))
+
+      do ib0= 1, nm, nkb
+         nb= min(nkb, nm- ib0+ 1)
+         do i= 1, nb
+            ik= imiss(ib0+ i- 1)
+            do iR= 1, Nrpts
+               kdotr= kpoints(1, ik)*irvec(1,iR) + kpoints(2, ik)*irvec(2,iR) + kpoints(3, ik)*irvec(3,iR)
+               phase(iR, i)= dcmplx(cos(twopi*kdotr), sin(twopi*kdotr))/ndegen(iR)
+            enddo
+         enddo
+         call zgemm('N', 'N', Num_wann*Num_wann, nb, Nrpts, (1d0, 0d0), &
+            HmnR, Num_wann*Num_wann, phase, Nrpts, (0d0, 0d0), Hamk, Num_wann*Num_wann)
+         do ia= 1, 3
+            do i= 1, nb
+               phase_v(:, i)= zi*crvec(ia, :)*phase(:, i)
+            enddo
+            call zgemm('N', 'N', Num_wann*Num_wann, nb, Nrpts, (1d0, 0d0), &
+               HmnR, Num_wann*Num_wann, phase_v, Nrpts, (0d0, 0d0), dHdk(:, :, :, ia), Num_wann*Num_wann)
+         enddo
+
+         do i= 1, nb
+            ik= imiss(ib0+ i- 1)
+            call zheevx_pack('V', 'U', Num_wann, iband, iband, Hamk(:, :, i), W, UU)
+
+            !> Only the energy levels close to the Fermi level contribute to the conductivity
+            if (abs(W(1))/eV2Hartree>EF_integral_range) then
+               velocity_k(:, ik)= 0d0
+               cycle
+            endif
+            do ia= 1, 3
+               velocity_k(ia, ik)= real(dot_product(UU, matmul(dHdk(:, :, i, ia), UU)), dp)
+            enddo
+         enddo
+      enddo
+
+      deallocate(imiss, phase, phase_v, Hamk, dHdk, UU)
+
+      return
+   end subroutine velocity_calc_iband_batch
+
+end module rkf45_batch
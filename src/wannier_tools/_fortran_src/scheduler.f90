@@ -0,0 +1,222 @@
+!> Dynamic distribution of loop items (k points) over MPI ranks.
+!>
+!> Instead of the static stride do ik= 1+cpuid, nk, num_cpu, every rank asks
+!> for the next chunk of items when it has finished the previous one, so
+!> ranks that get cheap k points simply take more of them. The chunks are
+!> handed out through a counter on rank 0 that is increased with MPI
+!> one-sided atomics (mpi_fetch_and_op); rank 0 does not have to answer
+!> requests and works on k points like every other rank.
+!>
+!> Usage:
+!>    call scheduler_start(sched, nk, chunk)
+!>    do while (scheduler_next(sched, ik1, ik2))
+!>       do ik= ik1, ik2
+!>          ...
+!>       enddo
+!>    enddo
+!>    call scheduler_finish(sched, 'name')
+!>
+!> Every k point is done by exactly one rank, so the usual sum of the
+!> results over the ranks is unchanged. scheduler_next has to be called by
+!> every rank until it returns .false., and outside of OpenMP parallel
+!> regions. scheduler_finish waits for all ranks and writes their busy and
+!> idle times to WT.out. Only one scheduler can be active at a time.
+
+module scheduler
+   use wmpi
+   use prec
+   implicit none
+
+   type scheduler_type
+      !> number of items and items per chunk
+      integer :: nitems= 0
+      integer :: chunk= 1
+
+      !> counter of handed out chunks, only used without the MPI window
+      integer :: next_chunk= 0
+
+      !> items handed to this rank in total and in the current chunk
+      integer :: nitems_done= 0
+      integer :: nitems_chunk= 0
+      integer :: nchunks= 0
+
+      !> last item handed out to this rank
+      integer :: last_item= 0
+
+      !> wall times in seconds
+      real(dp) :: time_start= 0d0
+      real(dp) :: time_chunk= 0d0
+      real(dp) :: time_busy= 0d0
+
+      !> MPI window holding the chunk counter on rank 0
+      integer :: win= 0
+      logical :: use_window= .false.
+   end type scheduler_type
+
+   !> the chunk counter exposed in the MPI window, only accessed through MPI
+   integer, target, save :: scheduler_counter= 0
+
+contains
+
+   subroutine scheduler_start(sched, nitems, chunk)
+      !> Set up a scheduler for the items 1..nitems, handed out chunk by chunk.
+      !> Collective over all ranks.
+      implicit none
+
+      type(scheduler_type), intent(inout) :: sched
+      integer, intent(in) :: nitems
+      integer, intent(in) :: chunk
+
+#if defined (MPI)
+      integer :: ierr
+      integer(kind=mpi_address_kind) :: winsize
+#endif
+
+      sched%nitems= nitems
+      sched%chunk= max(1, chunk)
+      sched%next_chunk= 0
+      sched%nitems_done= 0
+      sched%nitems_chunk= 0
+      sched%nchunks= 0
+      sched%last_item= 0
+      sched%time_busy= 0d0
+      sched%use_window= .false.
+
+#if defined (MPI)
+      if (num_cpu>1) then
+         scheduler_counter= 0
+         winsize= 0
+         if (cpuid==0) winsize= storage_size(scheduler_counter)/8
+         call mpi_win_create(scheduler_counter, winsize, storage_size(scheduler_counter)/8, &
+            mpi_info_null, mpi_cmw, sched%win, ierr)
+         sched%use_window= .true.
+      endif
+#endif
+
+      call now(sched%time_start)
+      sched%time_chunk= sched%time_start
+
+      return
+   end subroutine scheduler_start
+
+   function scheduler_next(sched, i1, i2) result(has_chunk)
+      !> Get the next chunk i1..i2, .false. when all items are handed out
+      implicit none
+
+      type(scheduler_type), intent(inout) :: sched
+      integer, intent(out) :: i1, i2
+      logical :: has_chunk
+
+      integer :: ichunk
+      real(dp) :: time_now
+
+#if defined (MPI)
+      integer :: ierr, one
+      integer(kind=mpi_address_kind) :: disp
+#endif
+
+      !> the time since the last call was spent on the previous chunk
+      call now(time_now)
+      if (sched%nitems_chunk>0) sched%time_busy= sched%time_busy+ time_now- sched%time_chunk
+
+      ichunk= 0
+      if (sched%use_window) then
+#if defined (MPI)
+         disp= 0
+         one= 1
+         call mpi_win_lock(mpi_lock_shared, 0, 0, sched%win, ierr)
+         call mpi_fetch_and_op(one, ichunk, mpi_integer, 0, disp, mpi_sum, sched%win, ierr)
+         call mpi_win_unlock(0, sched%win, ierr)
+#endif
+      else
+         ichunk= sched%next_chunk
+         sched%next_chunk= sched%next_chunk+ 1
+      endif
+
+      i1= ichunk*sched%chunk+ 1
+      i2= min(i1+ sched%chunk- 1, sched%nitems)
+      has_chunk= i1<=sched%nitems
+
+      sched%nitems_chunk= 0
+      if (has_chunk) then
+         sched%nitems_chunk= i2- i1+ 1
+         sched%nitems_done= sched%nitems_done+ sched%nitems_chunk
+         sched%nchunks= sched%nchunks+ 1
+         sched%last_item= i2
+         call now(sched%time_chunk)
+      endif
+
+      return
+   end function scheduler_next
+
+   function scheduler_time_left(sched) result(time_left)
+      !> Estimate of the remaining wall time in seconds from the speed of
+      !> this rank, for the progress messages
+      implicit none
+
+      type(scheduler_type), intent(in) :: sched
+      real(dp) :: time_left
+
+      integer :: nfinished
+
+      time_left= 0d0
+      nfinished= sched%nitems_done- sched%nitems_chunk
+      if (nfinished<=0) return
+      time_left= sched%time_busy/nfinished*(sched%nitems- sched%last_item+ sched%nitems_chunk)/num_cpu
+
+      return
+   end function scheduler_time_left
+
+   subroutine scheduler_finish(sched, subname)
+      !> Wait for all ranks and write the number of items, the busy and the
+      !> idle time of every rank. Collective over all ranks.
+      use para, only : stdout
+      implicit none
+
+      type(scheduler_type), intent(inout) :: sched
+      character(*), intent(in) :: subname
+
+      integer :: i
+      real(dp) :: time_end, time_idle
+      real(dp) :: loads(3), loads_all(3, num_cpu)
+
+#if defined (MPI)
+      integer :: ierr
+#endif
+
+      call now(time_end)
+      if (sched%nitems_chunk>0) sched%time_busy= sched%time_busy+ time_end- sched%time_chunk
+      sched%nitems_chunk= 0
+
+#if defined (MPI)
+      if (sched%use_window) call mpi_win_free(sched%win, ierr)
+      sched%use_window= .false.
+      call mpi_barrier(mpi_cmw, ierr)
+#endif
+
+      call now(time_end)
+      time_idle= max(0d0, time_end- sched%time_start- sched%time_busy)
+
+      loads(1)= sched%nitems_done
+      loads(2)= sched%time_busy
+      loads(3)= time_idle
+#if defined (MPI)
+      call mpi_gather(loads, 3, mpi_dp, loads_all, 3, mpi_dp, 0, mpi_cmw, ierr)
+#else
+      loads_all(:, 1)= loads
+#endif
+
+      if (cpuid==0) then
+         write(stdout, '(a)')' '
+         write(stdout, '(3a, i8, a)')' Load balance of ', subname, ' over ', num_cpu, ' MPI ranks'
+         write(stdout, '(a8, a12, 2a14)')'rank', 'k points', 'busy (s)', 'idle (s)'
+         do i=1, num_cpu
+            write(stdout, '(i8, i12, 2f14.3)')i-1, nint(loads_all(1, i)), loads_all(2:3, i)
+         enddo
+         write(stdout, '(a)')' '
+      endif
+
+      return
+   end subroutine scheduler_finish
+
+end module scheduler
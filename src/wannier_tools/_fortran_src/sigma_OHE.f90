@@ -53,6 +53,10 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
 !-----------------------------------------------------------!
       use wmpi
       use para
+      use scheduler
+      use checkpoint
+      use band_interp
+      use rkf45_batch
       implicit none
 
 
@@ -67,8 +71,12 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
       integer :: ie, ibtau, ikt
 
       integer :: Nk_total, Nk_current, Nk_start, Nk_end
-      integer  :: knv3_left, knv3_left_mod, knv3, knv3_mod
-      integer :: ik, iband, ik1, ik2, ik3, ik_temp
+      integer  :: knv3, knv3_mod
+      integer :: ik, iband, ik1, ik2, ik3
+      integer :: ik_first, ik_last
+      type(scheduler_type) :: sched
+      type(checkpoint_type) :: ckpt(Nband_Fermi_Level)
+      character(40) :: ckname
       integer :: ierr, it, i, ix, j1, j2, j
       integer :: nrecevs
 
@@ -147,7 +155,7 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
            real(dp), allocatable :: time_cost(:)
            real(dp), allocatable :: time_cost_mpi(:)
       end type sigma_iband_type
-      type(sigma_iband_type) :: sigma_iband_k(Nband_Fermi_Level)
+      type(sigma_iband_type), target :: sigma_iband_k(Nband_Fermi_Level)
 
       !> file index
       !integer, allocatable  :: myfileindex(:)
@@ -434,40 +442,13 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
       endif
 
 
-      !> redistribute the left kpoints into different processors
+      !> the left kpoints are handed out to the processors on demand in
+      !> cal_sigma_iband_k, so every processor keeps all of them.
       !> for different bands, the number of left kpoints is different.
       do iband= 1, Nband_Fermi_Level
-         knv3_left= KCube3D_left(iband)%Nk_total
-         knv3_left_mod= mod(knv3_left, num_cpu)
-         if (knv3_left_mod==0) then  !> perfect divided
-            KCube3D_left(iband)%Nk_current= knv3_left/num_cpu
-            KCube3D_left(iband)%Nk_start=1+ knv3_left*cpuid/num_cpu
-            KCube3D_left(iband)%Nk_end  =(1+cpuid)*knv3_left/num_cpu
-         else if (knv3_left/num_cpu==0) then    !> Number of MPI threads is large than knv3_left
-            KCube3D_left(iband)%Nk_current= 1 !> one k piont per MPI thread
-            KCube3D_left(iband)%Nk_start= cpuid+ 1 !> one k piont per MPI thread
-            KCube3D_left(iband)%Nk_end  = cpuid+ 1
-            if (cpuid+1 > knv3_left) then
-               KCube3D_left(iband)%Nk_start= 1
-               KCube3D_left(iband)%Nk_end  = 0
-            endif
-         else
-            KCube3D_left(iband)%Nk_current= knv3_left/num_cpu+ 1
-            if (cpuid< knv3_left_mod) then
-               KCube3D_left(iband)%Nk_start= 1+ cpuid*KCube3D_left(iband)%Nk_current
-               KCube3D_left(iband)%Nk_end  = (1+cpuid)*KCube3D_left(iband)%Nk_current
-            else
-               KCube3D_left(iband)%Nk_start= knv3_left_mod*KCube3D_left(iband)%Nk_current+ &
-                  (cpuid-knv3_left_mod)*(KCube3D_left(iband)%Nk_current-1)+1
-               KCube3D_left(iband)%Nk_end  = knv3_left_mod*KCube3D_left(iband)%Nk_current+ &
-                  (cpuid-knv3_left_mod+1)*(KCube3D_left(iband)%Nk_current-1)
-            endif
-         endif
-
-
-         allocate(KCube3D_left(iband)%k_direct(3, KCube3D_left(iband)%Nk_start:KCube3D_left(iband)%Nk_end))
+         allocate(KCube3D_left(iband)%k_direct(3, KCube3D_left(iband)%Nk_total))
    
-         do ik= KCube3D_left(iband)%Nk_start, KCube3D_left(iband)%Nk_end
+         do ik= 1, KCube3D_left(iband)%Nk_total
             i= KCube3D_left(iband)%IKleft_array(ik)
             ik1= (i-1)/(Nk2*Nk3)+1
             ik2= ((i-1-(ik1-1)*Nk2*Nk3)/Nk3)+1
@@ -493,35 +474,6 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
       enddo  ! iband=1, Nband_Fermi_Level
 
 
-      !> gather the number of receive buffs left into a array info
-      info= -1
-      do iband= 1, Nband_Fermi_Level
-         nrecevs= (KCube3D_left(iband)%Nk_end-KCube3D_left(iband)%Nk_start+1)*9*NBTau*OmegaNum*NumT
-         if (nrecevs<0) nrecevs=0
-#if defined (MPI)
-         call mpi_allgather(nrecevs, 1, mpi_in, info(:, iband), 1, mpi_in, mpi_cmw, ierr)
-#else
-         info(1, iband)= nrecevs
-#endif
-      enddo
-
-      if (cpuid.eq.0) write(stdout, '(a, 10i8)') ' '
-      do iband=1, Nband_Fermi_Level
-         if (cpuid.eq.0) write(stdout, '(a, i7)')'>> Number of k points at different CPUs at band', iband
-         if (cpuid.eq.0) write(stdout, '(10i8)')info(:, iband)/9/NBTau/OmegaNum/NumT
-      enddo
-      if (cpuid.eq.0) write(stdout, '(a, 10i8)') ' '
-
-
-      !> An array for mpi_allgatherv
-      Displs= 0
-      do iband=1, Nband_Fermi_Level
-         Displs(1, iband)=0
-         do i=2, num_cpu+1
-            Displs(i, iband)=Displs(i-1, iband)+ info(i-1, iband)
-         enddo
-      enddo ! iband
-
       do iband=1, Nband_Fermi_Level
          allocate(klist_iband(iband)%klist_rkfs(3, NSlice_Btau))
          allocate(klist_iband(iband)%velocity_k(3, NSlice_Btau))
@@ -567,6 +519,9 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
          enddo ! ie
       endif ! cpuid.eq.0
 
+      !> tabulate the bands for the orbit integration if Nk_interp > 0
+      call band_interp_build(Nband_Fermi_Level, bands_fermi_level)
+
       !> now we turn to use Runge-Kutta method to get all the kpoints from (0, BTauMax)
       !> and we calculate the conductivity/Tau over different bands and different k points
       time_start= 0d0
@@ -577,7 +532,19 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
       
          !> dim=(Nk_start: Nk_end, NumT, OmegaNum))
          allocate(klist_iband(iband)%minusdfde(OmegaNum, NumT))
+
+         !> the sums of the finished k points are kept in checkpoints, one
+         !> per band, until all bands are done
+         call checkpoint_add(ckpt(iband), sigma_iband_k(iband)%sigma_ohe_tensor_k_mpi, &
+            size(sigma_iband_k(iband)%sigma_ohe_tensor_k_mpi))
+         call checkpoint_add(ckpt(iband), sigma_iband_k(iband)%time_cost_mpi, &
+            size(sigma_iband_k(iband)%time_cost_mpi))
+         write(ckname, '(a, i0)')'sigma_OHE_band', iband
+         call checkpoint_start(ckpt(iband), ckname, KCube3D_left(iband)%Nk_total, &
+            [dble(bands_fermi_level(iband)), mu_array, KBT_array, BTau_array, Bdirection])
+
          call cal_sigma_iband_k
+         call checkpoint_update(ckpt(iband), force=.true.)
 
 #if defined (MPI)
          call mpi_allreduce(sigma_iband_k(iband)%time_cost_mpi, sigma_iband_k(iband)%time_cost, &
@@ -842,18 +809,60 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
       call mpi_barrier(mpi_cmw, ierr)
 #endif
 
+      do iband= 1, Nband_Fermi_Level
+         call checkpoint_finish(ckpt(iband))
+      enddo
+      call band_interp_free
+
       contains
    
       subroutine cal_sigma_iband_k
+
+         !> orbits integrated together by RKF45_pack_batch
+         integer :: nbatch, ib
+         integer, allocatable :: NSlice_batch(:), icycle_batch(:)
+         logical, allocatable :: fail_batch(:)
+         real(dp), allocatable :: k_batch(:, :), kout_batch(:, :, :)
+
+         nbatch= max(1, RKF45_batch_size)
+         if (BTauMax<=eps3) nbatch= 1
+         if (nbatch>1) then
+            allocate(NSlice_batch(nbatch), icycle_batch(nbatch), fail_batch(nbatch))
+            allocate(k_batch(3, nbatch), kout_batch(3, NSlice_Btau, nbatch))
+         else
+            !> the orbits are integrated one by one with RKF45_pack
+            allocate(NSlice_batch(0), icycle_batch(0), fail_batch(0))
+            allocate(k_batch(3, 0), kout_batch(3, NSlice_Btau, 0))
+         endif
   
-         do ik= KCube3D_left(iband)%Nk_start, KCube3D_left(iband)%Nk_end
+         !> the length of the orbits integrated by RKF45_pack differs a lot
+         !> between the k points, so they are handed out on demand, one by one
+         !> or in blocks of RKF45_batch_size that are integrated together
+         call scheduler_start(sched, KCube3D_left(iband)%Nk_total, nbatch)
+         do while (scheduler_next(sched, ik_first, ik_last))
+         if (nbatch>1) then
+            ib= 0
+            do ik= ik_first, ik_last
+               if (checkpoint_done(ckpt(iband), ik)) cycle
+               ib= ib+ 1
+               k_batch(:, ib)= KCube3D_left(iband)%k_direct(:, ik)
+            enddo
+            call now(time_start1)
+            call RKF45_pack_batch(bands_fermi_level(iband), ib, NSlice_Btau, &
+               k_batch(:, 1:ib), 0d0, -exponent_max*BTauMax, kout_batch(:, :, 1:ib), &
+               NSlice_batch(1:ib), icycle_batch(1:ib), fail_batch(1:ib))
+            call now(time_end1)
+            if (ib>0) time_rkf45= (time_end1-time_start1)/ib
+            ib= 0
+         endif
+         do ik= ik_first, ik_last
+            if (checkpoint_done(ckpt(iband), ik)) cycle
             if (cpuid.eq.0) &
                write(stdout, '(a, i8, a, i18, "   /", i18, a, f10.3, "s", a, f10.3, "s")') &
                'In sigma_OHE iband', iband, ' ik/NK', &
-               ik-KCube3D_left(iband)%Nk_start+1,KCube3D_left(iband)%Nk_current, &
+               ik,KCube3D_left(iband)%Nk_total, &
                ' time cost', time_end-time_start, &
-               ' time left', &
-               (KCube3D_left(iband)%Nk_current+KCube3D_left(iband)%Nk_start-ik)*(time_end-time_start)
+               ' time left', scheduler_time_left(sched)
    
             call now(time_start)
             EE= KCube3D_left(iband)%Ek_total(ik)
@@ -883,20 +892,28 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
    
             !> Runge-Kutta only applied with BTauMax>0
             !> if the magnetic field is zero. 
-            call now(time_start1)
-            if (BTauMax>eps3) then
-               NSlice_Btau_inuse= NSlice_Btau
-               call RKF45_pack(magnetic_field, bands_fermi_level(iband),  &
-                    NSlice_Btau_inuse, k_start, Btau_start, Btau_final, kout, icycle, fail)
+            if (nbatch>1) then
+               ib= ib+ 1
+               NSlice_Btau_inuse= NSlice_batch(ib)
+               kout= kout_batch(:, :, ib)
+               icycle= icycle_batch(ib)
+               fail= fail_batch(ib)
             else
-               icycle= 1
-               do ibtau=1, NSlice_Btau
-                  kout(:, ibtau)= k_start(:)
-               enddo
-               NSlice_Btau_inuse = NSlice_Btau
+               call now(time_start1)
+               if (BTauMax>eps3) then
+                  NSlice_Btau_inuse= NSlice_Btau
+                  call RKF45_pack(magnetic_field, bands_fermi_level(iband),  &
+                       NSlice_Btau_inuse, k_start, Btau_start, Btau_final, kout, icycle, fail)
+               else
+                  icycle= 1
+                  do ibtau=1, NSlice_Btau
+                     kout(:, ibtau)= k_start(:)
+                  enddo
+                  NSlice_Btau_inuse = NSlice_Btau
+               endif
+               call now(time_end1)
+               time_rkf45= time_end1-time_start1
             endif
-            call now(time_end1)
-            time_rkf45= time_end1-time_start1
    
             if (NSlice_Btau_inuse==1) then
                write(stdout, '(a, i6, a, i4, a, i6, a, 3f12.6)')&
@@ -908,6 +925,7 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
                write(stdout, '(a, i6, a, i4, a, i6, a, 3f12.6)')&
                   '>>> Runge-Kutta integration fails at cpuid=', cpuid, ' iband=', iband, ' ik', ik, ' k', k_start
                write(stdout, *)' '
+               call checkpoint_mark(ckpt(iband), ik)
                cycle
             endif
   
@@ -921,12 +939,18 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
                enddo
                NSlice_Btau_inuse = NSlice_Btau
             else
-               do it= 1, icycle
-                  k= kout(:, it) 
-                  call velocity_calc_iband(bands_fermi_level(iband), k, v_t)
-                  klist_iband(iband)%velocity_k(:, it)= v_t
-                  kout_all(:, it) = k
-               enddo ! integrate over time step
+               if (nbatch>1) then
+                  call velocity_calc_iband_batch(bands_fermi_level(iband), icycle, kout(:, 1:icycle), &
+                     klist_iband(iband)%velocity_k(:, 1:icycle))
+                  kout_all(:, 1:icycle)= kout(:, 1:icycle)
+               else
+                  do it= 1, icycle
+                     k= kout(:, it) 
+                     call velocity_calc_iband(bands_fermi_level(iband), k, v_t)
+                     klist_iband(iband)%velocity_k(:, it)= v_t
+                     kout_all(:, it) = k
+                  enddo ! integrate over time step
+               endif
    
                !> periodic kpath in the BZ can be reused
                do i=2, NSlice_Btau_inuse/icycle
@@ -1046,7 +1070,6 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
                         endif
        
                         !> calculate the conductivity now
-                        ik_temp= ik - KCube3D_left(iband)%Nk_start+ 1
                         sigma_symm_t= 0d0
        
                         !> Apply point group operations to the velocities, and average them
@@ -1110,7 +1133,11 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
             call now(time_end)
             sigma_iband_k(iband)%time_cost_mpi(ik)= time_end- time_start
             if (cpuid.eq.0) write(stdout, '(a, f16.2, a)')'>> time cost for this loop is     ', time_end- time_start, ' s'
+            call checkpoint_mark(ckpt(iband), ik)
          enddo ! ik  kpoints
+         call checkpoint_update(ckpt(iband))
+         enddo
+         call scheduler_finish(sched, 'sigma_OHE')
    
       end subroutine cal_sigma_iband_k
 
@@ -1399,6 +1426,7 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
 
       use wmpi
       use para
+      use band_interp
       implicit none
 
       !> inout parameters
@@ -1420,6 +1448,12 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
       complex(dp), allocatable :: UU(:)
       complex(dp), allocatable :: Hamk_bulk(:, :)
 
+      !> from the table of band_interp if there is one
+      if (band_interp_eval(iband, k, velocity_k, E_iband)) then
+         if (abs(E_iband)/eV2Hartree>EF_integral_range) velocity_k= 0d0
+         return
+      endif
+
       allocate( W (Num_wann))
       allocate( vx(Num_wann, Num_wann))
       allocate( vy(Num_wann, Num_wann))
@@ -1475,6 +1509,7 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
 
       use wmpi
       use para
+      use band_interp
       implicit none
 
       !> inout parameters
@@ -1485,7 +1520,7 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
       real(dp), intent(inout) :: velocity_k(3)
 
       integer :: iR
-      real(dp) :: kdotr
+      real(dp) :: kdotr, E_iband
       complex(dp) :: factor
       !> velocity operator
       real(dp), allocatable :: W(:)
@@ -1495,6 +1530,12 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
       complex(dp), allocatable :: UU(:)
       complex(dp), allocatable :: Hamk_bulk(:, :)
 
+      !> from the table of band_interp if there is one
+      if (band_interp_eval(iband, k, velocity_k, E_iband)) then
+         if (abs(E_iband)/eV2Hartree>EF_integral_range) velocity_k= 0d0
+         return
+      endif
+
       allocate( W (Num_wann))
       allocate( vx(Num_wann, Num_wann))
       allocate( vy(Num_wann, Num_wann))
@@ -1749,6 +1790,7 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
    subroutine evolve_k_ohe
       use wmpi
       use para
+      use band_interp
       implicit none
      
       !real(dp) :: OmegaTau  !> e*B/m*Tau
@@ -1853,6 +1895,9 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
      magnetic_field(1)=Bx
      magnetic_field(2)=By
      magnetic_field(3)=Bz
+
+     !> tabulate the bands for the orbit integration if Nk_interp > 0
+     call band_interp_build(Nband_Fermi_Level, bands_fermi_level)
   
       !> exclude all kpoints with zero velocity x B and large energy away from Fermi level
      do ib= 1, Nband_Fermi_Level 
@@ -1940,6 +1985,7 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
         call mpi_barrier(mpi_cmw, ierr)
 #endif
      enddo ! ib
+     call band_interp_free
     
      return
   end subroutine evolve_k_ohe
@@ -1954,6 +2000,7 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
    subroutine sigma_k_ohe
       use wmpi
       use para
+      use band_interp
       implicit none
      
       real(dp), allocatable :: sigma_k_ohe_tensor(:, :) 
@@ -2048,6 +2095,9 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
       allocate(bands_fermi_level(Nband_Fermi_Level))
       bands_fermi_level= bands_fermi_level_temp(1:Nband_Fermi_Level)
 
+      !> tabulate the bands for the orbit integration if Nk_interp > 0
+      call band_interp_build(Nband_Fermi_Level, bands_fermi_level)
+
       !> setup NSlice_Btau
       !> NSlice_Btau should be the integer times of NBTau
       NSlice_Btau= Nslice_BTau_Max
@@ -2404,7 +2454,10 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
                enddo ! integrate over time step
      
      
-               !> calculate the conductivity/tau
+               !> calculate the conductivity/tau at BTau= BTauMax, the orbit
+               !> goes to -15*BTauMax in NSlice_Btau_inuse steps
+               BTau= BTauMax
+               NSlice_Btau_local= NSlice_Btau_inuse
                DeltaBtau= 15d0/NSlice_Btau_local
      
                if (BTau>eps3) then
@@ -2516,6 +2569,7 @@ subroutine sigma_ohe_calc_symm(mu_array, KBT_array, BTau_array, Nband_Fermi_Leve
             close(myfileindex(ib))
          enddo ! ib, band
       endif ! cpuid=0
+      call band_interp_free
 
       !> In the end, we start to care about the units of the conductivity/tau
       !> the conductivity/tau is in units of Ohm^-1*m^-1*s^-1
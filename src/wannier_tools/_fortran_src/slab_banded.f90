@@ -0,0 +1,482 @@
+!> Band storage eigensolver for the slab, ribbon and slab BdG Hamiltonians.
+!>
+!> The slab Hamiltonian only couples layers that are at most nrange layers
+!> apart, the largest distance with a nonzero block Hij(i, :, :) and at
+!> most ijmax, so it is a band matrix with KD= (nrange+1)*Num_wann-1
+!> superdiagonals. With Slab_solver='BANDED' the upper band is filled from
+!> the layer blocks Hij directly, AB(KD+1+i-j, j)= H(i, j), and solved by
+!> eigensystem_banded: all eigenvalues from the band reduction in O(N^2*KD)
+!> instead of O(N^3), the eigenvectors by inverse iteration in O(N*KD^2)
+!> each. The dense (Num_wann*Nslab)^2 Hamiltonian is never built.
+!>
+!> The band structure drivers pass window=.true.: with Band_window=T only
+!> the eigenvectors of the NumSelectedEigenVals bands closest to
+!> iso_energy are calculated, by eigensystem_window for the dense matrix,
+!> and the other bands get zero weights. The Berry curvature and the BdG
+!> Wilson loop need all eigenvectors.
+!>
+!> Ribbons are ordered row by row, the bandwidth is nrange+1 rows of
+!> Nslab2*Num_wann orbitals. The slab BdG Hamiltonian is banded after the
+!> electron and hole orbitals are put layer by layer, the eigenvectors are
+!> returned in the original electron-hole order.
+!>
+!> Usage:
+!>    ! replaces ham_slab and eigensystem_c
+!>    call eigensystem_slab(k, Hamk_slab, W, window=.true.)
+!>    call eigensystem_ribbon(k, Hamk_ribbon, W, window=.true.)
+!>    call eigensystem_slab_BdG(k, Hamk_slab_BdG, W)
+!>
+!> With Slab_solver='DENSE' or a non-orthogonal basis, whose orthogonalized
+!> Hamiltonian is dense, these routines do exactly the old dense
+!> calculation, or eigensystem_window for a window of bands.
+
+module slab_banded
+   use para, only : dp, zi, Num_wann, Nslab, Nslab1, Nslab2, ijmax, Slab_solver, &
+      Orthogonal_Basis, Particle, LOTO_correction, eV2Hartree, Add_surf_zeeman_field, &
+      Bx_surf, By_surf, Bz_surf, Add_Delta_BdG, Delta_BdG, mu_BdG, Num_wann_BdG, &
+      iso_energy
+   use eigen_window, only : band_window_nvec, eigensystem_window
+   implicit none
+
+contains
+
+   logical function slab_banded_on()
+      !> whether the band storage path is used
+      implicit none
+
+      slab_banded_on= Slab_solver=='BANDED' .and. Orthogonal_Basis
+
+      return
+   end function slab_banded_on
+
+
+   integer function slab_nvec(ndim, window)
+      !> number of eigenvectors for eigensystem_banded
+      implicit none
+
+      integer, intent(in) :: ndim
+      logical, intent(in), optional :: window
+
+      slab_nvec= ndim
+      if (.not. present(window)) return
+      if (window) slab_nvec= band_window_nvec(ndim)
+
+      return
+   end function slab_nvec
+
+
+   subroutine eigensystem_dense(ndim, Hamk, W, window)
+      !> eigensystem_c of the dense Hamiltonian, or eigensystem_window for
+      !> the band structure drivers
+      implicit none
+
+      integer, intent(in) :: ndim
+      complex(dp), intent(inout) :: Hamk(ndim, ndim)
+      real(dp), intent(out) :: W(ndim)
+      logical, intent(in), optional :: window
+
+      if (slab_nvec(ndim, window)<ndim) then
+         call eigensystem_window(ndim, Hamk, W)
+      else
+         call eigensystem_c('V', 'U', ndim, Hamk, W)
+      endif
+
+      return
+   end subroutine eigensystem_dense
+
+
+   integer function slab_bandwidth(nblock, nlayer, nrange)
+      !> number of superdiagonals of nlayer layers of nblock orbitals
+      !> coupled up to nrange layers apart
+      implicit none
+
+      integer, intent(in) :: nblock, nlayer, nrange
+
+      slab_bandwidth= min(nblock*nlayer- 1, (nrange+ 1)*nblock- 1)
+
+      return
+   end function slab_bandwidth
+
+
+   integer function slab_coupling_range(Hij)
+      !> largest layer distance with a nonzero block Hij(i, :, :), the
+      !> blocks are only calculated up to ijmax
+      implicit none
+
+      complex(dp), intent(in) :: Hij(-ijmax:ijmax, Num_wann, Num_wann)
+
+      integer :: i
+
+      slab_coupling_range= 0
+      do i=ijmax, 1, -1
+         if (any(Hij(i, :, :)/=0d0) .or. any(Hij(-i, :, :)/=0d0)) then
+            slab_coupling_range= i
+            return
+         endif
+      enddo
+
+      return
+   end function slab_coupling_range
+
+
+   subroutine slab_layer_blocks(k, Hij, surface_zeeman)
+      !> layer blocks Hij of ham_slab, or of ham_slab_surface_zeeman if
+      !> surface_zeeman
+      implicit none
+
+      real(dp), intent(in) :: k(2)
+      complex(dp), intent(out) :: Hij(-ijmax:ijmax, Num_wann, Num_wann)
+      logical, intent(in) :: surface_zeeman
+
+      if (.not. surface_zeeman .and. index(Particle,'phonon')/=0 .and. LOTO_correction) then
+         call ham_qlayer2qlayer2_LOTO(k, Hij)
+      else
+         call ham_qlayer2qlayer2(k, Hij)
+      endif
+
+      return
+   end subroutine slab_layer_blocks
+
+
+   subroutine eigensystem_slab(k, Hamk_slab, W, surface_zeeman, window)
+      !> Eigenvalues and eigenvectors of the slab Hamiltonian at k,
+      !> ham_slab or, with surface_zeeman, ham_slab_surface_zeeman.
+      !> On exit Hamk_slab holds the eigenvectors as after eigensystem_c.
+      implicit none
+
+      real(dp), intent(in) :: k(2)
+      complex(dp), intent(out) :: Hamk_slab(Num_wann*Nslab, Num_wann*Nslab)
+      real(dp), intent(out) :: W(Num_wann*Nslab)
+      logical, intent(in), optional :: surface_zeeman
+      logical, intent(in), optional :: window
+
+      integer :: kd, nrange
+      logical :: zeeman
+      complex(dp), allocatable :: AB(:, :), Hij(:, :, :)
+
+      zeeman= .false.
+      if (present(surface_zeeman)) zeeman= surface_zeeman
+
+      if (.not. slab_banded_on()) then
+         if (zeeman) then
+            call ham_slab_surface_zeeman(k, Hamk_slab)
+         else
+            call ham_slab(k, Hamk_slab)
+         endif
+         call eigensystem_dense(Num_wann*Nslab, Hamk_slab, W, window)
+         return
+      endif
+
+      allocate(Hij(-ijmax:ijmax, Num_wann, Num_wann))
+      call slab_layer_blocks(k, Hij, zeeman)
+      nrange= slab_coupling_range(Hij)
+      kd= slab_bandwidth(Num_wann, Nslab, nrange)
+      allocate(AB(kd+1, Num_wann*Nslab))
+      call ham_slab_banded(Hij, nrange, kd, AB, zeeman)
+      call eigensystem_banded('V', Num_wann*Nslab, kd, AB, W, &
+         slab_nvec(Num_wann*Nslab, window), iso_energy, Hamk_slab)
+      deallocate(AB, Hij)
+
+      return
+   end subroutine eigensystem_slab
+
+
+   subroutine ham_slab_banded(Hij, nrange, kd, AB, surface_zeeman)
+      !> upper band of ham_slab, or of ham_slab_surface_zeeman if
+      !> surface_zeeman, with kd superdiagonals from the layer blocks Hij
+      !> of slab_layer_blocks, coupled up to nrange layers apart
+      implicit none
+
+      complex(dp), intent(in) :: Hij(-ijmax:ijmax, Num_wann, Num_wann)
+      integer, intent(in) :: nrange, kd
+      complex(dp), intent(out) :: AB(kd+1, Num_wann*Nslab)
+      logical, intent(in) :: surface_zeeman
+
+      integer :: i1, i2, m, n, i, j, io
+      real(dp), allocatable :: static_potential(:)
+
+      !> the block of row layer i2 and column layer i1 is Hij(i1-i2)
+      AB= 0d0
+      do i1=1, Nslab
+         do i2=max(1, i1-nrange), i1
+            do n=1, Num_wann
+               j= (i1-1)*Num_wann+ n
+               do m=1, Num_wann
+                  i= (i2-1)*Num_wann+ m
+                  if (i>j) exit
+                  AB(kd+1+i-j, j)= Hij(i1-i2, m, n)
+               enddo
+            enddo
+         enddo
+      enddo
+
+      if (surface_zeeman) then
+         !> the Zeeman terms of ham_slab_surface_zeeman, inside the first
+         !> or the last layer
+         if (Add_surf_zeeman_field==1 .or. Add_surf_zeeman_field==3) then
+            do i=1, Num_wann/2
+               call add_zeeman(i)
+            enddo
+         endif
+         if (Add_surf_zeeman_field==2 .or. Add_surf_zeeman_field==3) then
+            do i=1, Num_wann/2
+               call add_zeeman((Nslab-1)*Num_wann+ i)
+            enddo
+         endif
+      else
+         !> the static potential of the electric field, as in ham_slab
+         allocate(static_potential(Num_wann*Nslab))
+         call slab_elec_potential(static_potential)
+         do io=1, Num_wann*Nslab
+            AB(kd+1, io)= AB(kd+1, io)+ static_potential(io)
+         enddo
+         deallocate(static_potential)
+      endif
+
+      return
+
+   contains
+
+      subroutine add_zeeman(ii)
+         integer, intent(in) :: ii
+         integer :: jj
+
+         jj= ii+ Num_wann/2
+         AB(kd+1, ii)= AB(kd+1, ii)+ Bz_surf*eV2Hartree
+         AB(kd+1, jj)= AB(kd+1, jj)- Bz_surf*eV2Hartree
+         AB(kd+1+ii-jj, jj)= AB(kd+1+ii-jj, jj)+ Bx_surf*eV2Hartree- zi*By_surf*eV2Hartree
+      end subroutine add_zeeman
+
+   end subroutine ham_slab_banded
+
+
+   subroutine eigensystem_ribbon(k, Hamk_ribbon, W, window)
+      !> Eigenvalues and eigenvectors of ham_ribbon at k. On exit
+      !> Hamk_ribbon holds the eigenvectors as after eigensystem_c.
+      implicit none
+
+      real(dp), intent(in) :: k
+      complex(dp), intent(out) :: Hamk_ribbon(Num_wann*Nslab1*Nslab2, Num_wann*Nslab1*Nslab2)
+      real(dp), intent(out) :: W(Num_wann*Nslab1*Nslab2)
+      logical, intent(in), optional :: window
+
+      integer :: ndim, kd, nrange1, nrange2
+      real(dp) :: k1
+      complex(dp), allocatable :: AB(:, :), Hij(:, :, :, :)
+
+      ndim= Num_wann*Nslab1*Nslab2
+      k1= k
+      if (.not. slab_banded_on()) then
+         call ham_ribbon(k1, Hamk_ribbon)
+         call eigensystem_dense(ndim, Hamk_ribbon, W, window)
+         return
+      endif
+
+      allocate(Hij(-ijmax:ijmax, -ijmax:ijmax, Num_wann, Num_wann))
+      call ham_qlayer2qlayerribbon(k1, Hij)
+      call ribbon_coupling_range(Hij, nrange1, nrange2)
+      kd= min(ndim- 1, nrange1*Nslab2*Num_wann+ min(nrange2, Nslab2-1)*Num_wann+ Num_wann- 1)
+      allocate(AB(kd+1, ndim))
+      call ham_ribbon_banded(Hij, nrange1, nrange2, kd, AB)
+      call eigensystem_banded('V', ndim, kd, AB, W, slab_nvec(ndim, window), &
+         iso_energy, Hamk_ribbon)
+      deallocate(AB, Hij)
+
+      return
+   end subroutine eigensystem_ribbon
+
+
+   subroutine ribbon_coupling_range(Hij, nrange1, nrange2)
+      !> largest distances along the two ribbon directions with a nonzero
+      !> block Hij(i, j, :, :) of ham_qlayer2qlayerribbon
+      implicit none
+
+      complex(dp), intent(in) :: Hij(-ijmax:ijmax, -ijmax:ijmax, Num_wann, Num_wann)
+      integer, intent(out) :: nrange1, nrange2
+
+      integer :: i, j
+
+      nrange1= 0
+      nrange2= 0
+      do i=-ijmax, ijmax
+         do j=-ijmax, ijmax
+            if (any(Hij(i, j, :, :)/=0d0)) then
+               nrange1= max(nrange1, abs(i))
+               nrange2= max(nrange2, abs(j))
+            endif
+         enddo
+      enddo
+
+      return
+   end subroutine ribbon_coupling_range
+
+
+   subroutine ham_ribbon_banded(Hij, nrange1, nrange2, kd, AB)
+      !> upper band of ham_ribbon with kd superdiagonals from the blocks
+      !> Hij of ham_qlayer2qlayerribbon, coupled up to nrange1 rows and
+      !> nrange2 columns apart
+      implicit none
+
+      complex(dp), intent(in) :: Hij(-ijmax:ijmax, -ijmax:ijmax, Num_wann, Num_wann)
+      integer, intent(in) :: nrange1, nrange2, kd
+      complex(dp), intent(out) :: AB(kd+1, Num_wann*Nslab1*Nslab2)
+
+      integer :: i1, j1, i2, j2, m, n, i, j
+
+      !> row (i1, j1) and column (i2, j2) are coupled by Hij(i2-i1, j2-j1)
+      AB= 0d0
+      do i2=1, Nslab1
+      do j2=1, Nslab2
+         do i1=max(1, i2-nrange1), i2
+         do j1=max(1, j2-nrange2), min(Nslab2, j2+nrange2)
+            do n=1, Num_wann
+               j= (i2-1)*Nslab2*Num_wann+ (j2-1)*Num_wann+ n
+               do m=1, Num_wann
+                  i= (i1-1)*Nslab2*Num_wann+ (j1-1)*Num_wann+ m
+                  if (i>j) exit
+                  AB(kd+1+i-j, j)= Hij(i2-i1, j2-j1, m, n)
+               enddo
+            enddo
+         enddo
+         enddo
+      enddo
+      enddo
+
+      return
+   end subroutine ham_ribbon_banded
+
+
+   subroutine eigensystem_slab_BdG(k, Hamk_slab_BdG, W, window)
+      !> Eigenvalues and eigenvectors of ham_slab_BdG at k. On exit
+      !> Hamk_slab_BdG holds the eigenvectors as after eigensystem_c,
+      !> in the basis C1^dag, C2^dag, C1, C2 of ham_slab_BdG.
+      implicit none
+
+      real(dp), intent(in) :: k(2)
+      complex(dp), intent(out) :: Hamk_slab_BdG(Num_wann_BdG*Nslab, Num_wann_BdG*Nslab)
+      real(dp), intent(out) :: W(Num_wann_BdG*Nslab)
+      logical, intent(in), optional :: window
+
+      integer :: ndim, kd, ib, ic, nrange
+      complex(dp), allocatable :: AB(:, :), column(:), Hij_k(:, :, :), Hij_minus_k(:, :, :)
+
+      ndim= Num_wann_BdG*Nslab
+      if (.not. slab_banded_on()) then
+         call ham_slab_BdG(k, Hamk_slab_BdG)
+         call eigensystem_dense(ndim, Hamk_slab_BdG, W, window)
+         return
+      endif
+
+      allocate(Hij_k(-ijmax:ijmax, Num_wann, Num_wann))
+      allocate(Hij_minus_k(-ijmax:ijmax, Num_wann, Num_wann))
+      call slab_layer_blocks( k, Hij_k, .true.)
+      call slab_layer_blocks(-k, Hij_minus_k, .true.)
+      nrange= max(slab_coupling_range(Hij_k), slab_coupling_range(Hij_minus_k))
+      kd= slab_bandwidth(2*Num_wann, Nslab, nrange)
+      allocate(AB(kd+1, ndim), column(ndim))
+      call ham_slab_BdG_banded(Hij_k, Hij_minus_k, nrange, kd, AB)
+      call eigensystem_banded('V', ndim, kd, AB, W, slab_nvec(ndim, window), &
+         iso_energy, Hamk_slab_BdG)
+
+      !> back from the layer by layer order
+      do ic=1, ndim
+         column= Hamk_slab_BdG(:, ic)
+         do ib=1, ndim
+            Hamk_slab_BdG(BdG_index(ib), ic)= column(ib)
+         enddo
+      enddo
+      deallocate(AB, column, Hij_k, Hij_minus_k)
+
+      return
+   end subroutine eigensystem_slab_BdG
+
+
+   subroutine ham_slab_BdG_banded(Hij_k, Hij_minus_k, nrange, kd, AB)
+      !> upper band of ham_slab_BdG with kd superdiagonals, with the electron
+      !> and the hole orbitals of each layer next to each other, from the
+      !> layer blocks at k and -k coupled up to nrange layers apart
+      implicit none
+
+      complex(dp), intent(in) :: Hij_k(-ijmax:ijmax, Num_wann, Num_wann)
+      complex(dp), intent(in) :: Hij_minus_k(-ijmax:ijmax, Num_wann, Num_wann)
+      integer, intent(in) :: nrange, kd
+      complex(dp), intent(out) :: AB(kd+1, Num_wann_BdG*Nslab)
+
+      integer :: kds, i, j, bi, bj, il, m, nh, ndim
+      complex(dp), allocatable :: AB_k(:, :), AB_minus_k(:, :)
+
+      ndim= Num_wann*Nslab
+      nh= Num_wann/2
+      kds= slab_bandwidth(Num_wann, Nslab, nrange)
+      allocate(AB_k(kds+1, ndim), AB_minus_k(kds+1, ndim))
+      call ham_slab_banded(Hij_k, nrange, kds, AB_k, .true.)
+      call ham_slab_banded(Hij_minus_k, nrange, kds, AB_minus_k, .true.)
+
+      AB= 0d0
+      do j=1, ndim
+         do i=max(1, j-kds), j
+            !> electron block H(k)-mu
+            bi= layer_index(i, 0); bj= layer_index(j, 0)
+            AB(kd+1+bi-bj, bj)= AB_k(kds+1+i-j, j)
+            !> hole block -conj(H(-k))+mu
+            bi= layer_index(i, 1); bj= layer_index(j, 1)
+            AB(kd+1+bi-bj, bj)= -conjg(AB_minus_k(kds+1+i-j, j))
+         enddo
+         bj= layer_index(j, 0)
+         AB(kd+1, bj)= AB(kd+1, bj)- mu_BdG*eV2Hartree
+         bj= layer_index(j, 1)
+         AB(kd+1, bj)= AB(kd+1, bj)+ mu_BdG*eV2Hartree
+      enddo
+
+      !> onsite s-wave pairing i*Delta*sigma_y, electron row and hole column
+      do il=1, Nslab
+         if (Add_Delta_BdG==1 .and. il/=1) cycle
+         if (Add_Delta_BdG==2 .and. il/=Nslab) cycle
+         if (Add_Delta_BdG/=1 .and. Add_Delta_BdG/=2 .and. Add_Delta_BdG/=3) cycle
+         do m=1, nh
+            i= (il-1)*Num_wann+ m
+            bi= layer_index(i, 0); bj= layer_index(i+nh, 1)
+            AB(kd+1+bi-bj, bj)= Delta_BdG*eV2Hartree
+            bi= layer_index(i+nh, 0); bj= layer_index(i, 1)
+            AB(kd+1+bi-bj, bj)= -Delta_BdG*eV2Hartree
+         enddo
+      enddo
+
+      deallocate(AB_k, AB_minus_k)
+      return
+   end subroutine ham_slab_BdG_banded
+
+
+   integer function layer_index(i, ihole)
+      !> position of the electron (ihole=0) or hole (ihole=1) orbital i of
+      !> the slab in the layer by layer order of ham_slab_BdG_banded
+      implicit none
+
+      integer, intent(in) :: i, ihole
+
+      layer_index= i+ ((i-1)/Num_wann+ ihole)*Num_wann
+
+      return
+   end function layer_index
+
+
+   integer function BdG_index(ib)
+      !> inverse of layer_index, position in the basis of ham_slab_BdG
+      implicit none
+
+      integer, intent(in) :: ib
+
+      integer :: il, r
+
+      il= (ib-1)/(2*Num_wann)
+      r= mod(ib-1, 2*Num_wann)+ 1
+      if (r<=Num_wann) then
+         BdG_index= il*Num_wann+ r
+      else
+         BdG_index= Num_wann*Nslab+ il*Num_wann+ r- Num_wann
+      endif
+
+      return
+   end function BdG_index
+
+end module slab_banded
@@ -4,8 +4,12 @@
 ! History:
 !         by Quan Sheng Wu on Oct/17/2012                                !
 !+---------+---------+---------+---------+---------+---------+--------+!
-  subroutine surfgreen_1985(omega,GLL,GRR,GB,H00,H01,ones, eta_broadening)
+  subroutine surfgreen_1985(omega,GLL,GRR,GB,H00,H01, eta_broadening)
+     !> Takes the work arrays from the workspace of this thread and calls
+     !> surfgreen_1985_work. Loops over many energies can also allocate the
+     !> work arrays once and call surfgreen_1985_work directly.
      use para
+     use workspace
      implicit none
 
      ! inout variables     
@@ -20,10 +24,6 @@
      ! H01 Hamiltonian between next-nearest neighbour-quintuple-layers
      complex(Dp),intent(in) :: H01(Ndim,Ndim)
 
-     ! temp hamiltonian
-
-     complex(Dp),intent(in)   :: ones(Ndim,Ndim)
-
      ! surface green function
      complex(Dp),intent(inout)  :: GLL(Ndim,Ndim)
      complex(Dp),intent(inout)  :: GRR(Ndim,Ndim)
@@ -31,110 +31,198 @@
      !> bulk green's function
      complex(Dp),intent(inout)  :: GB(Ndim,Ndim)
 
-     ! >> local variables
-     ! iteration number
-     integer :: iter
-
-     ! maximun iteration 
-     integer ,parameter:: itermax=100
+     complex(Dp), pointer :: work(:, :, :)
 
-     ! accuracy control
-     real(Dp) :: accuracy=1e-16
-
-     ! a real type temp variable
-     real(Dp) :: real_temp
-
-     ! omegac=omega(i)+I * Fermi_broadening
-     complex(Dp) :: omegac 
+     work(1:Ndim, 1:Ndim, 1:Nwork_surfgreen) => &
+        ws_complex(WS_SURFGREEN_1985, 1, Ndim*Ndim*Nwork_surfgreen)
+     call surfgreen_1985_work(omega,GLL,GRR,GB,H00,H01, eta_broadening, work)
 
+     return
+  end subroutine surfgreen_1985
 
-     ! some variables in Eq.(11)
-     complex(Dp), allocatable :: alphai(:, :) 
-     complex(Dp), allocatable :: betai(:, :) 
-     complex(Dp), allocatable :: epsiloni(:, :) 
-     complex(Dp), allocatable :: epsilons(:, :) 
-     complex(Dp), allocatable :: epsilons_t(:, :) 
+  subroutine surfgreen_1985_work(omega,GLL,GRR,GB,H00,H01, eta_broadening, work)
+     !> The decimation of surfgreen_1985 with the work arrays given by the
+     !> caller, so that the energy loop at one k point does not allocate.
+     !> Every energy iterates until its own alpha_i has converged.
+     !>
+     !> The two products alpha_i*g0 and beta_i*g0 are obtained from one
+     !> linear solve with g0^{-1}=w-e_i instead of an explicit inverse, and
+     !> the four products of Eq.(11) with alpha_i and beta_i are done by one
+     !> ZGEMM of size (2Ndim, 2Ndim, Ndim).
+     use para
+     implicit none
 
-     complex(Dp), allocatable :: mat1 (:, :) 
-     complex(Dp), allocatable :: mat2 (:, :) 
+     real(Dp),intent(in) :: omega  
+     real(Dp),intent(in) :: eta_broadening
+     complex(Dp),intent(in) :: H00(Ndim,Ndim)
+     complex(Dp),intent(in) :: H01(Ndim,Ndim)
 
-     ! g0= inv(w-e_i)
-     complex(Dp), allocatable :: g0 (:, :) 
+     ! surface green functions and bulk green's function
+     complex(Dp),intent(out)  :: GLL(Ndim,Ndim)
+     complex(Dp),intent(out)  :: GRR(Ndim,Ndim)
+     complex(Dp),intent(out)  :: GB(Ndim,Ndim)
 
-     ! allocate some variables
-     allocate(alphai(Ndim, Ndim)) 
-     allocate(betai (Ndim, Ndim)) 
-     allocate(epsiloni (Ndim, Ndim)) 
-     allocate(epsilons (Ndim, Ndim)) 
-     allocate(epsilons_t(Ndim, Ndim)) 
-     allocate(mat1(Ndim, Ndim)) 
-     allocate(mat2(Ndim, Ndim)) 
-     allocate(g0(Ndim, Ndim)) 
+     !> work arrays, Nwork_surfgreen matrices of Ndim*Ndim
+     complex(Dp),intent(inout) :: work(Ndim, Ndim, Nwork_surfgreen)
 
-     epsiloni= H00
-     epsilons= H00
-     epsilons_t= H00
-     alphai  = H01
-     betai   = conjg(transpose(H01))
-    !print *, sqrt(sum(abs(H00)**2)), 'H00'
+     call surfgreen_1985_decimation(work(:, :, 1), work(:, :, 2), work(:, :, 3), &
+        work(:, :, 4), work(:, :, 5:6), work(:, :, 7:8), work(:, :, 9:12))
 
-     ! w+i*0^+
-     omegac= dcmplx(omega, eta_broadening)
-    !print *, omegac
+     return
 
-     ! begin iteration
-     do iter=1, itermax
+     contains
 
-        g0= omegac*ones- epsiloni
-        call inv(Ndim, g0)
+     subroutine surfgreen_1985_decimation(g0, epsiloni, epsilons, epsilons_t, &
+        ba, ybuf, prod)
+        complex(Dp), intent(inout) :: g0(Ndim, Ndim)
+        complex(Dp), intent(inout) :: epsiloni(Ndim, Ndim)
+        complex(Dp), intent(inout) :: epsilons(Ndim, Ndim)
+        complex(Dp), intent(inout) :: epsilons_t(Ndim, Ndim)
+
+        !> ba= (beta_i, alpha_i)
+        complex(Dp), intent(inout) :: ba(Ndim, 2*Ndim)
+
+        !> ybuf= (alpha_i*g0, beta_i*g0)^T
+        complex(Dp), intent(inout) :: ybuf(Ndim, 2*Ndim)
+
+        !> prod= (alpha_i*g0, beta_i*g0)^T^T*(beta_i, alpha_i)
+        complex(Dp), intent(inout) :: prod(2*Ndim, 2*Ndim)
+
+        ! iteration number
+        integer :: iter, i, info
+        integer :: ipiv(Ndim)
+
+        ! maximun iteration 
+        integer ,parameter:: itermax=100
+
+        ! accuracy control
+        real(Dp), parameter :: accuracy=1e-16
+
+        ! a real type temp variable
+        real(Dp) :: real_temp
+
+        ! omegac=omega(i)+I * Fermi_broadening
+        complex(Dp) :: omegac 
+
+        complex(Dp), parameter :: zone= (1d0, 0d0), zzero= (0d0, 0d0)
+
+        epsiloni= H00
+        epsilons= H00
+        epsilons_t= H00
+        ba(:, Ndim+1:2*Ndim)= H01
+        ba(:, 1:Ndim)= conjg(transpose(H01))
+
+        ! w+i*0^+
+        omegac= dcmplx(omega, eta_broadening)
+
+        ! begin iteration
+        do iter=1, itermax
+
+           ! (w-e_i-1)^T, the solve below gives (a_i-1*(w-e_i-1)^-1)^T
+           g0= -transpose(epsiloni)
+           do i=1, Ndim
+              g0(i, i)= g0(i, i)+ omegac
+           enddo
+           ybuf(:, 1:Ndim)= transpose(ba(:, Ndim+1:2*Ndim))
+           ybuf(:, Ndim+1:2*Ndim)= transpose(ba(:, 1:Ndim))
+           call zgesv(Ndim, 2*Ndim, g0, Ndim, ipiv, ybuf, Ndim, info)
+           if(info.ne.0)print *,'something wrong with zgesv'
+
+           ! prod(1:N, 1:N)      = a_i-1*(w-e_i-1)^-1*b_i-1
+           ! prod(1:N, N+1:2N)   = a_i-1*(w-e_i-1)^-1*a_i-1
+           ! prod(N+1:2N, 1:N)   = b_i-1*(w-e_i-1)^-1*b_i-1
+           ! prod(N+1:2N, N+1:2N)= b_i-1*(w-e_i-1)^-1*a_i-1
+           call zgemm('T', 'N', 2*Ndim, 2*Ndim, Ndim, zone, ybuf, Ndim, &
+              ba, Ndim, zzero, prod, 2*Ndim)
+
+           ! es_i= es_i-1 + a_i-1*(w-e_i-1)^-1*b_i-1
+           epsilons= epsilons+ prod(1:Ndim, 1:Ndim)
+           epsilons_t= epsilons_t+ prod(Ndim+1:2*Ndim, Ndim+1:2*Ndim)
+           epsiloni= epsiloni+ prod(1:Ndim, 1:Ndim)+ prod(Ndim+1:2*Ndim, Ndim+1:2*Ndim)
+
+           ! a_i= a_i-1*(w-e_i-1)^-1*a_i-1 
+           ! b_i= b_i-1*(w-e_i-1)^-1*b_i-1 
+           ba(:, Ndim+1:2*Ndim)= prod(1:Ndim, Ndim+1:2*Ndim)
+           ba(:, 1:Ndim)= prod(Ndim+1:2*Ndim, 1:Ndim)
+
+           real_temp=sum(abs(ba(:, Ndim+1:2*Ndim)))
+           if (real_temp.le.accuracy) exit
+
+        enddo ! end of iteration
+
+        ! calculate surface green's function
+        call green_inverse(epsilons, GLL, g0)
+        call green_inverse(epsilons_t, GRR, g0)
+        call green_inverse(epsiloni, GB, g0)
+
+        return
+     end subroutine surfgreen_1985_decimation
+
+     subroutine green_inverse(eps, G, amat)
+        !> G= (omegac-eps)^-1, amat is a work array
+        complex(Dp), intent(in) :: eps(Ndim, Ndim)
+        complex(Dp), intent(out) :: G(Ndim, Ndim)
+        complex(Dp), intent(inout) :: amat(Ndim, Ndim)
+
+        integer :: i, info
+        integer :: ipiv(Ndim)
+        complex(Dp) :: omegac
+
+        omegac= dcmplx(omega, eta_broadening)
+        amat= -eps
+        G= (0d0, 0d0)
+        do i=1, Ndim
+           amat(i, i)= amat(i, i)+ omegac
+           G(i, i)= (1d0, 0d0)
+        enddo
+        call zgesv(Ndim, Ndim, amat, Ndim, ipiv, G, Ndim, info)
+        if(info.ne.0)print *,'something wrong with zgesv'
+
+        return
+     end subroutine green_inverse
+  end subroutine surfgreen_1985_work
+
+  subroutine spin_green_diag(ndim, nblock, G, norbs, orbs, spin)
+     !> Spin resolved spectral weight of a Green's function
+     !> spin(1:3)= -sum_io Im (G*sigma_{x,y,z})(io, io) over the orbitals orbs.
+     !> The basis of every block of nblock orbitals (one principal layer, or
+     !> the bulk unit cell) is |↑↑↓↓>, so the Pauli matrices only couple io
+     !> with its spin partner io+-nblock/2, and only G(io, io) and
+     !> G(io, partner) are needed instead of the full products G*sigma.
+     use para, only : dp, zi
+     implicit none
 
-        ! a_i-1*(w-e_i-1)^-1
-        call mat_mul(Ndim, alphai, g0, mat1 )
-        
-        ! b_i-1*(w-e_i-1)^-1
-        call mat_mul(Ndim, betai, g0, mat2 )
-
-        ! a_i-1*(w-e_i-1)^-1*b_i-1
-        call mat_mul(Ndim, mat1, betai, g0)
-        epsiloni= epsiloni+ g0
-       !print *, sqrt(sum(abs(epsiloni)**2)), 'ei'
-        ! es_i= es_i-1 + a_i-1*(w-e_i-1)^-1*b_i-1
-        epsilons= epsilons+ g0
-       !print *, sqrt(sum(abs(epsilons)**2)), 'es'
-       !pause
-
-        ! b_i-1*(w-e_i-1)^-1*a_i-1
-        call mat_mul(Ndim, mat2, alphai, g0)
-        epsiloni= epsiloni+ g0
-        ! es_i= es_i-1 + a_i-1*(w-e_i-1)^-1*b_i-1
-        epsilons_t= epsilons_t+ g0
-
-        ! a_i= a_i-1*(w-e_i-1)^-1*a_i-1 
-        call mat_mul(Ndim, mat1, alphai, g0)
-        alphai= g0
-        ! b_i= b_i-1*(w-e_i-1)^-1*b_i-1 
-        call mat_mul(Ndim, mat2, betai, g0)
-        betai= g0
-
-       !real_temp=maxval(abs(alphai))   
-        real_temp=sum(abs(alphai))   
-       !if (cpuid.eq.0) print *, iter, real_temp
-        if (real_temp.le.accuracy) exit
-
-     enddo ! end of iteration
-
-     ! calculate surface green's function
-     GLL= omegac*ones- epsilons
-     call inv(Ndim, GLL)
-
-     GRR= omegac*ones- epsilons_t
-     call inv(Ndim, GRR)
-
-     GB = omegac*ones- epsiloni
-     call inv(Ndim, GB)
+     integer, intent(in) :: ndim
+     integer, intent(in) :: nblock
+     complex(dp), intent(in) :: G(ndim, ndim)
+     integer, intent(in) :: norbs
+     integer, intent(in) :: orbs(norbs)
+     real(dp), intent(out) :: spin(3)
+
+     integer :: i, io, nhalf
+     complex(dp) :: g_partner
+
+     nhalf= nblock/2
+     spin= 0d0
+     do i= 1, norbs
+        io= orbs(i)
+        if (mod(io-1, nblock)< nhalf) then
+           !> spin up, sigma(io+nhalf, io) = 1, i, 0 for x, y, z
+           g_partner= G(io, io+ nhalf)
+           spin(1)= spin(1)- aimag(g_partner)
+           spin(2)= spin(2)- aimag(zi*g_partner)
+           spin(3)= spin(3)- aimag(G(io, io))
+        else
+           !> spin down, sigma(io-nhalf, io) = 1, -i, 0 for x, y, z
+           g_partner= G(io, io- nhalf)
+           spin(1)= spin(1)- aimag(g_partner)
+           spin(2)= spin(2)+ aimag(zi*g_partner)
+           spin(3)= spin(3)+ aimag(G(io, io))
+        endif
+     enddo
 
      return
-  end subroutine surfgreen_1985
+  end subroutine spin_green_diag
 
 
 !+---------+---------+---------+---------+---------+---------+--------+!
@@ -151,6 +239,7 @@
 
      use wmpi
      use para
+     use workspace
      implicit none
      
 
@@ -195,42 +284,41 @@
      !> infinite small value broadening
      real(dp), intent(in) :: eta_broadening
 
-     complex(Dp),allocatable  :: H01dag(:,:)
+     complex(Dp),pointer  :: H01dag(:,:)
 
      !> surface hamiltonian
-     complex(Dp),allocatable  :: Hs(:,:)
+     complex(Dp),pointer  :: Hs(:,:)
 
      ! temp hamiltonian
-     complex(Dp),allocatable  :: t0(:,:)
-     complex(Dp),allocatable  :: Tmatrix(:,:)
-     complex(Dp),allocatable  :: Tmatrixt(:,:)
-     complex(Dp),allocatable  :: t0tilde(:,:)
-     complex(Dp),allocatable  :: tnew(:,:)
-     complex(Dp),allocatable  :: tnewtilde(:,:)
-     complex(Dp) ,allocatable :: told(:,:)
-     complex(Dp),allocatable  :: toldtilde(:,:)
-     complex(Dp),allocatable  :: temp(:,:)
-     complex(Dp),allocatable  :: Tmat_temp(:,:)
-     complex(Dp),allocatable  :: Tmat_tempt(:,:)
-
-     real(Dp),allocatable     :: abs_told(:,:)
-
-     ! allocate variables
-     allocate(Hs(ndim,ndim))
-     allocate(t0(ndim,ndim))
-     allocate(Tmatrix(ndim,ndim))
-     allocate(Tmatrixt(ndim,ndim))
-     allocate(t0tilde(ndim,ndim))
-     allocate(tnew(ndim,ndim))
-     allocate(tnewtilde(ndim,ndim))
-     allocate(told(ndim,ndim))
-     allocate(toldtilde(ndim,ndim))
-     allocate(temp(ndim,ndim))
-     allocate(Tmat_temp(ndim,ndim))
-     allocate(Tmat_tempt(ndim,ndim))
-     allocate(abs_told(ndim,ndim))
-    
-     allocate(H01dag(ndim,ndim))
+     complex(Dp),pointer  :: t0(:,:)
+     complex(Dp),pointer  :: Tmatrix(:,:)
+     complex(Dp),pointer  :: Tmatrixt(:,:)
+     complex(Dp),pointer  :: t0tilde(:,:)
+     complex(Dp),pointer  :: tnew(:,:)
+     complex(Dp),pointer  :: tnewtilde(:,:)
+     complex(Dp),pointer  :: told(:,:)
+     complex(Dp),pointer  :: toldtilde(:,:)
+     complex(Dp),pointer  :: temp(:,:)
+     complex(Dp),pointer  :: Tmat_temp(:,:)
+     complex(Dp),pointer  :: Tmat_tempt(:,:)
+
+     real(Dp),pointer     :: abs_told(:,:)
+
+     ! work arrays from the workspace of this thread
+     Hs(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 1, ndim*ndim)
+     t0(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 2, ndim*ndim)
+     Tmatrix(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 3, ndim*ndim)
+     Tmatrixt(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 4, ndim*ndim)
+     t0tilde(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 5, ndim*ndim)
+     tnew(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 6, ndim*ndim)
+     tnewtilde(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 7, ndim*ndim)
+     told(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 8, ndim*ndim)
+     toldtilde(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 9, ndim*ndim)
+     temp(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 10, ndim*ndim)
+     Tmat_temp(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 11, ndim*ndim)
+     Tmat_tempt(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 12, ndim*ndim)
+     abs_told(1:ndim,1:ndim) => ws_real(WS_SURFGREEN_1984, 1, ndim*ndim)
+     H01dag(1:ndim,1:ndim) => ws_complex(WS_SURFGREEN_1984, 13, ndim*ndim)
  
      Hs=0.0d0
      t0=0.0d0
@@ -14,29 +14,45 @@
 
      use wmpi
      use para
+     use scheduler
+     use kstream
+     use result_sink
      implicit none
 
      integer :: ierr, doslfile, dosrfile, dosbulkfile
 
      ! general loop index
-     integer :: i, j, io, ikp, nw_half, spindoslfile, spindosrfile
+     integer :: i, j, io, ikp, spindoslfile, spindosrfile
+     integer :: ik1, ik2, ic, nblk, id_surf(7)
+     type(scheduler_type) :: sched
+     type(kstream_type) :: st
 
-     real(dp) :: emin, emax, w, k(2), time_start, time_end, s0(3), s1(3), eta_broadening
+     real(dp) :: emin, emax, w, k(2), s0(3), s1(3), eta_broadening
+     real(dp) :: dos_l, dos_r, dos_bulk, dos_l_only, dos_r_only
 
      real(dp), allocatable :: omega(:)
 
-     real(dp), allocatable :: dos_l(:,:), dos_r(:,:), dos_l_only(:, :), dos_r_only(:,:)
-     real(dp), allocatable :: dos_l_mpi(:,:), dos_r_mpi(:,:), dos_bulk(:,:), dos_bulk_mpi(:,:)
+     !> spectra of the k points in the current chunk, (omega, quantity, k)
+     !> with the quantities dos_l, dos_r, dos_bulk, sx_l, sy_l, sz_l, sx_r,
+     !> sy_r and sz_r. They are streamed to disk after every chunk and read
+     !> back in blocks of nblk k points for the output.
+     integer, parameter :: nsurf= 9
+     real(dp), allocatable :: surf_chunk(:,:,:), surf_blk(:,:,:)
 
-     complex(dp), allocatable :: GLL(:,:), GRR(:,:), GB (:,:), H00(:,:), H01(:,:), ones(:,:)
+     !> binary output of a block: dos_l, dos_l_only, dos_r, dos_r_only and
+     !> dos_bulk as in the text files, and the rotated spins of both sides
+     real(dp), allocatable :: dos_blk(:,:,:), spin_blk(:,:,:,:)
+
+     complex(dp), allocatable :: GLL(:,:), GRR(:,:), GB (:,:), H00(:,:), H01(:,:)
+
+     !> work arrays of surfgreen_1985_work, reused for all energies
+     complex(dp), allocatable :: sgwork(:,:,:)
  
      ! Spin resolved component
-     REAL(DP),    ALLOCATABLE  :: sx_l(:, :), sy_l(:, :), sz_l(:, :)
-     REAL(DP),    ALLOCATABLE  :: sx_r(:, :), sy_r(:, :), sz_r(:, :)
-     REAL(DP),    ALLOCATABLE  :: sx_l_mpi(:, :), sy_l_mpi(:, :), sz_l_mpi(:, :)
-     REAL(DP),    ALLOCATABLE  :: sx_r_mpi(:, :), sy_r_mpi(:, :), sz_r_mpi(:, :)
-     COMPLEX(DP), ALLOCATABLE  :: sigma_x(:,:), sigma_y(:,:), sigma_z(:,:)
-     COMPLEX(DP), ALLOCATABLE  :: ctemp(:,:)
+     REAL(DP) :: spin_l(3), spin_r(3)
+
+     integer :: nthreads
+     integer, external :: get_num_threads
 
 
      !> for special line
@@ -62,23 +78,8 @@
     !   print *, i, t1
     !ENDDO
 
-     allocate( omega(omeganum), dos_l(knv2, omeganum), dos_r(knv2, omeganum))
-     allocate( dos_l_only(knv2, omeganum), dos_r_only(knv2, omeganum))
-     allocate( dos_l_mpi(knv2, omeganum), dos_r_mpi(knv2, omeganum))
-     allocate( dos_bulk(knv2, omeganum), dos_bulk_mpi(knv2, omeganum))
-     omega=0d0;  dos_l=0d0;  dos_r=0d0;  dos_l_only=0d0;  dos_r_only=0d0
-     dos_l_mpi=0d0;  dos_r_mpi=0d0;  dos_bulk=0d0;  dos_bulk_mpi=0d0
-
-     ALLOCATE( sx_l(knv2, omeganum), sy_l(knv2, omeganum), sz_l(knv2, omeganum))
-     ALLOCATE( sx_l_mpi(knv2, omeganum), sy_l_mpi(knv2, omeganum), sz_l_mpi(knv2, omeganum))
-     ALLOCATE( sx_r(knv2, omeganum), sy_r(knv2, omeganum), sz_r(knv2, omeganum))
-     ALLOCATE( sx_r_mpi(knv2, omeganum), sy_r_mpi(knv2, omeganum), sz_r_mpi(knv2, omeganum))
-     ALLOCATE( sigma_x(ndim,ndim), sigma_y(ndim,ndim), sigma_z(ndim,ndim), ctemp(ndim,ndim))
-     sigma_x      = 0d0;      sigma_y      = 0d0;      sigma_z      = 0d0
-     sx_l         = 0d0;      sy_l         = 0d0;      sz_l         = 0d0
-     sx_r         = 0d0;      sy_r         = 0d0;      sz_r         = 0d0
-     sx_l_mpi     = 0d0;      sy_l_mpi     = 0d0;      sz_l_mpi     = 0d0
-     sx_r_mpi     = 0d0;      sy_r_mpi     = 0d0;      sz_r_mpi     = 0d0
+     allocate( omega(omeganum))
+     omega=0d0
 
 
      eta_broadening=(omegamax- omegamin)/dble(omeganum)*3.0d0
@@ -96,38 +97,31 @@
      endif
 
      allocate(GLL(Ndim, Ndim), GRR(Ndim, Ndim), GB (Ndim, Ndim))
-     allocate(H00(Ndim, Ndim), H01(Ndim, Ndim), ones(Ndim, Ndim))
-     GLL= 0d0; GRR= 0d0; GB = 0d0; H00= 0d0; H01= 0d0; ones= 0d0
-
-     !> spin operator matrix
-     !> Note, the basis here should be |↑↑↓↓>
-     nw_half = Num_wann/2
-     do i=1, Np
-        do j=1, nw_half
-           sigma_x( Num_wann*(i-1)+j        , Num_wann*(i-1)+j+nw_half ) =  1.0d0
-           sigma_x( Num_wann*(i-1)+j+nw_half, Num_wann*(i-1)+j         ) =  1.0d0
-           sigma_y( Num_wann*(i-1)+j        , Num_wann*(i-1)+j+nw_half ) = -zi
-           sigma_y( Num_wann*(i-1)+j+nw_half, Num_wann*(i-1)+j         ) =  zi
-           sigma_z( Num_wann*(i-1)+j        , Num_wann*(i-1)+j         ) =  1.0d0
-           sigma_z( Num_wann*(i-1)+j+nw_half, Num_wann*(i-1)+j+nw_half ) = -1.0d0
-        enddo 
-     enddo
+     allocate(H00(Ndim, Ndim), H01(Ndim, Ndim), sgwork(Ndim, Ndim, Nwork_surfgreen))
+     GLL= 0d0; GRR= 0d0; GB = 0d0; H00= 0d0; H01= 0d0; sgwork= 0d0
 
 
-     do i=1,Ndim
-        ones(i,i)=1.0d0
-     enddo
 
-     time_start= 0d0
-     time_end= 0d0
-     do ikp= 1+cpuid, knv2, num_cpu
-        if (cpuid==0.and. mod(ikp/num_cpu, 10)==0) &
-           WRITE(stdout, *) 'SurfaceSS, ik', ikp, 'Nk', knv2, 'time left', &
-           (knv2-ikp)*(time_end- time_start)/num_cpu, ' s'
+     nthreads= get_num_threads()
+     allocate(surf_chunk(omeganum, nsurf, nthreads))
+
+     !> the convergence of surfgreen_1985 depends on k, so the k points are
+     !> handed out to the MPI ranks on demand, one per OpenMP thread. Every
+     !> k point writes its own column of surf_chunk
+     call kstream_open(st, 'surfstat', omeganum*nsurf, knv2)
+     call scheduler_start(sched, knv2, nthreads)
+     do while (scheduler_next(sched, ik1, ik2))
+     if (cpuid==0.and. mod(sched%nchunks, 10)==1) &
+        WRITE(stdout, *) 'SurfaceSS, ik', ik1, 'Nk', knv2, 'time left', &
+        scheduler_time_left(sched), ' s'
+     surf_chunk= 0d0
 
+     !$OMP PARALLEL DO SCHEDULE(DYNAMIC) &
+     !$OMP PRIVATE(ikp, ic, k, i, j, io, w, GLL, GRR, GB, H00, H01, sgwork, spin_l, spin_r)
+     do ikp= ik1, ik2
+        ic= ikp- ik1+ 1
         k= k2_path(ikp,:)
 
-        call now(time_start)
         !> deal with phonon system
         !> get the hopping matrix between two principle layers
         if (index(Particle,'phonon')/=0.and.LOTO_correction) then
@@ -143,108 +137,40 @@
            ! there are two method to calculate surface green's function
            ! the method in 1985 is better, you can find the ref in the
            ! subroutine
-            call surfgreen_1985(w,GLL,GRR,GB,H00,H01,ones, eta_broadening)
+            call surfgreen_1985_work(w,GLL,GRR,GB,H00,H01, eta_broadening, sgwork)
            ! call surfgreen_1984(w,GLL,GRR,H00,H01,ones, eta_broadening)
 
            ! calculate spectral function
            do i= 1, NtopOrbitals
               io= TopOrbitals(i)
-              dos_l(ikp, j)=dos_l(ikp,j)- aimag(GLL(io,io))
+              surf_chunk(j, 1, ic)=surf_chunk(j, 1, ic)- aimag(GLL(io,io))
            enddo ! i
            do i= 1, NBottomOrbitals
               io= Ndim- Num_wann+ BottomOrbitals(i)
-              dos_r(ikp, j)=dos_r(ikp,j)- aimag(GRR(io,io))
+              surf_chunk(j, 2, ic)=surf_chunk(j, 2, ic)- aimag(GRR(io,io))
            enddo ! i
            do i= 1, Ndim
-              dos_bulk(ikp, j)=dos_bulk(ikp,j)- aimag(GB(i,i))
+              surf_chunk(j, 3, ic)=surf_chunk(j, 3, ic)- aimag(GB(i,i))
            enddo ! i
 
-            ! Spin resolved sprectrum
-            call mat_mul(ndim,gll,sigma_x,ctemp)
-            do i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sx_l_mpi(ikp, j) = sx_l_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            enddo ! i
-            call mat_mul(ndim,gll,sigma_y,ctemp)
-            do i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sy_l_mpi(ikp, j) = sy_l_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            enddo !
-            call mat_mul(ndim,gll,sigma_z,ctemp)
-            do i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sz_l_mpi(ikp, j) = sz_l_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            enddo ! i
-            call mat_mul(ndim,grr,sigma_x,ctemp)
-            do i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sx_r_mpi(ikp, j) = sx_r_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            enddo ! i
-            call mat_mul(ndim,grr,sigma_y,ctemp)
-            do i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sy_r_mpi(ikp, j) = sy_r_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            enddo !
-            call mat_mul(ndim,grr,sigma_z,ctemp)
-            do i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sz_r_mpi(ikp, j) = sz_r_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            enddo ! i
+            ! Spin resolved sprectrum, the basis in every layer is |↑↑↓↓>
+            call spin_green_diag(ndim, Num_wann, GLL, NtopOrbitals, TopOrbitals, spin_l)
+            call spin_green_diag(ndim, Num_wann, GRR, NtopOrbitals, TopOrbitals, spin_r)
+            surf_chunk(j, 4:6, ic) = spin_l
+            surf_chunk(j, 7:9, ic) = spin_r
 
 
         enddo ! j
-        call now(time_end)
      enddo ! ikp
-
-!> we do have to do allreduce operation
-#ifdef MPI
-    call mpi_allreduce(sx_l_mpi, sx_l, SIZE(sx_l), mpi_double_precision,&
-    mpi_sum, mpi_comm_world, ierr)
-    call mpi_allreduce(sy_l_mpi, sy_l, SIZE(sy_l), mpi_double_precision,&
-    mpi_sum, mpi_comm_world, ierr)
-    call mpi_allreduce(sz_l_mpi, sz_l, SIZE(sz_l), mpi_double_precision,&
-    mpi_sum, mpi_comm_world, ierr)
-    call mpi_allreduce(sx_r_mpi, sx_r, SIZE(sx_r), mpi_double_precision,&
-    mpi_sum, mpi_comm_world, ierr)
-    call mpi_allreduce(sy_r_mpi, sy_r, SIZE(sy_r), mpi_double_precision,&
-    mpi_sum, mpi_comm_world, ierr)
-    call mpi_allreduce(sz_r_mpi, sz_r, SIZE(sz_r), mpi_double_precision,&
-    mpi_sum, mpi_comm_world, ierr)
-#else
-    sx_l     = sx_l_mpi;      sy_l     = sy_l_mpi;      sz_l     = sz_l_mpi
-    sx_r     = sx_r_mpi;      sy_r     = sy_r_mpi;      sz_r     = sz_r_mpi
-#endif
-
-    deallocate( sx_l_mpi, sy_l_mpi, sz_l_mpi )
-    deallocate( sx_r_mpi, sy_r_mpi, sz_r_mpi )
-    deallocate( sigma_x, sigma_y, sigma_z, ctemp )
-
-
-     !> we don't have to do allreduce operation
-#if defined (MPI)
-     call mpi_reduce(dos_l, dos_l_mpi, size(dos_l), mpi_double_precision,&
-                     mpi_sum, 0, mpi_comm_world, ierr)
-     call mpi_reduce(dos_r, dos_r_mpi, size(dos_r), mpi_double_precision,&
-                     mpi_sum, 0, mpi_comm_world, ierr)
-     call mpi_reduce(dos_bulk, dos_bulk_mpi, size(dos_bulk), mpi_double_precision,&
-                     mpi_sum, 0, mpi_comm_world, ierr)
-#else
-     dos_l_mpi= dos_l
-     dos_r_mpi= dos_r
-     dos_bulk_mpi= dos_bulk
-#endif
-
-     dos_l=log(abs(dos_l_mpi))
-     dos_r=log(abs(dos_r_mpi))
-     dos_bulk=log(abs(dos_bulk_mpi)+eps9)
-     do ikp=1, knv2
-        do j=1, omeganum
-           dos_l_only(ikp, j)= dos_l_mpi(ikp, j)- dos_bulk_mpi(ikp, j)
-           if (dos_l_only(ikp, j)<0) dos_l_only(ikp, j)=eps9
-           dos_r_only(ikp, j)= dos_r_mpi(ikp, j)- dos_bulk_mpi(ikp, j)
-           if (dos_r_only(ikp, j)<0) dos_r_only(ikp, j)=eps9
-        enddo
+     !$OMP END PARALLEL DO
+     call kstream_write(st, ik1, ik2, surf_chunk)
      enddo
+     call scheduler_finish(sched, 'surfstat')
+     deallocate(surf_chunk)
+
+     call kstream_merge(st)
+     nblk= kstream_block_size(st, omeganum*nsurf)
+     allocate(surf_blk(omeganum, nsurf, nblk))
 
      outfileindex= outfileindex+ 1
      doslfile= outfileindex
@@ -268,6 +194,20 @@
  
      ! Write surface state to files
      IF (cpuid .eq. 0) THEN
+        if (result_binary) then
+         call result_write('surfdos/klen', [knv2], k2len*Angstrom2atomic, '1/Angstrom', 'k')
+         call result_write('surfdos/omega', [omeganum], omega/eV2Hartree, 'eV', 'energy')
+         call result_dataset('surfdos/dos_l', [omeganum, knv2], 'log', 'k,energy', id_surf(1))
+         call result_dataset('surfdos/dos_l_only', [omeganum, knv2], ' ', 'k,energy', id_surf(2))
+         call result_dataset('surfdos/dos_r', [omeganum, knv2], 'log', 'k,energy', id_surf(3))
+         call result_dataset('surfdos/dos_r_only', [omeganum, knv2], ' ', 'k,energy', id_surf(4))
+         call result_dataset('surfdos/dos_bulk', [omeganum, knv2], 'log', 'k,energy', id_surf(5))
+         call result_dataset('surfdos/spin_l', [3, omeganum, knv2], ' ', 'k,energy,direction', id_surf(6))
+         call result_dataset('surfdos/spin_r', [3, omeganum, knv2], ' ', 'k,energy,direction', id_surf(7))
+         allocate(dos_blk(omeganum, nblk, 5), spin_blk(3, omeganum, nblk, 2))
+        else
+         !> only used for the binary output
+         allocate(dos_blk(0, 0, 0), spin_blk(0, 0, 0, 0))
          open(unit=doslfile    , file='dos.dat_l')
          open(unit=dosrfile    , file='dos.dat_r')
          open(unit=dosbulkfile , file='dos.dat_bulk')
@@ -282,29 +222,62 @@
          write(spindosrfile, '("#", a)') ' spin dos_r, the axis is rotated as '
          write(spindosrfile, '("#", a)') " x is along R1', z is along R1'xR2', y is along z x y"
          write(spindosrfile, '("#", a12, 6a17)') ' k(1/Ang)', ' E(eV)', 'sx', 'sy', 'sz'
-         do ikp = 1, knv2
+        endif
+         do ik1 = 1, knv2, nblk
+          ik2= min(ik1+nblk-1, knv2)
+          call kstream_read(st, 1, omeganum*nsurf, ik1, ik2, surf_blk)
+          do ikp = ik1, ik2
+            ic= ikp- ik1+ 1
             do j = 1, omeganum
-                write(doslfile,    2002) k2len(ikp)*Angstrom2atomic, omega(j)/eV2Hartree, dos_l(ikp, j), dos_l_only(ikp, j)
-                write(dosrfile,    2002) k2len(ikp)*Angstrom2atomic, omega(j)/eV2Hartree, dos_r(ikp, j), dos_r_only(ikp, j)
-                write(dosbulkfile, 2003) k2len(ikp)*Angstrom2atomic, omega(j)/eV2Hartree, dos_bulk(ikp, j)
-                s0(1)=sx_l(ikp, j); s0(2)=sy_l(ikp, j); s0(3)=sz_l(ikp, j); 
+                dos_l_only= surf_blk(j, 1, ic)- surf_blk(j, 3, ic)
+                if (dos_l_only<0) dos_l_only=eps9
+                dos_r_only= surf_blk(j, 2, ic)- surf_blk(j, 3, ic)
+                if (dos_r_only<0) dos_r_only=eps9
+                dos_l= log(abs(surf_blk(j, 1, ic)))
+                dos_r= log(abs(surf_blk(j, 2, ic)))
+                dos_bulk= log(abs(surf_blk(j, 3, ic))+eps9)
+                if (result_binary) then
+                   dos_blk(j, ic, :)= [dos_l, dos_l_only, dos_r, dos_r_only, dos_bulk]
+                   call rotate(surf_blk(j, 4:6, ic), spin_blk(:, j, ic, 1))
+                   call rotate(surf_blk(j, 7:9, ic), spin_blk(:, j, ic, 2))
+                   cycle
+                endif
+                write(doslfile,    2002) k2len(ikp)*Angstrom2atomic, omega(j)/eV2Hartree, dos_l, dos_l_only
+                write(dosrfile,    2002) k2len(ikp)*Angstrom2atomic, omega(j)/eV2Hartree, dos_r, dos_r_only
+                write(dosbulkfile, 2003) k2len(ikp)*Angstrom2atomic, omega(j)/eV2Hartree, dos_bulk
+                s0= surf_blk(j, 4:6, ic)
                 call rotate(s0, s1)
                 write(spindoslfile,2001) k2len(ikp)*Angstrom2atomic, omega(j)/eV2Hartree, s1
-                s0(1)=sx_r(ikp, j); s0(2)=sy_r(ikp, j); s0(3)=sz_r(ikp, j); 
+                s0= surf_blk(j, 7:9, ic)
                 call rotate(s0, s1)
                 write(spindosrfile,2001) k2len(ikp)*Angstrom2atomic, omega(j)/eV2Hartree, s1
              ENDDO
+             if (result_binary) cycle
              write(doslfile    , *)
              write(dosrfile    , *)
              write(dosbulkfile , *)
              write(spindoslfile, *)
              write(spindosrfile, *)
+          ENDDO
+          if (result_binary) then
+             do i= 1, 5
+                call result_put(id_surf(i), int(ik1-1, 8)*omeganum, omeganum*(ik2-ik1+1), &
+                   dos_blk(:, :, i))
+             enddo
+             do i= 1, 2
+                call result_put(id_surf(5+i), int(ik1-1, 8)*3*omeganum, 3*omeganum*(ik2-ik1+1), &
+                   spin_blk(:, :, :, i))
+             enddo
+          endif
          ENDDO
+        deallocate(dos_blk, spin_blk)
+        if (.not.result_binary) then
          close(doslfile)
          close(dosrfile)
          close(dosbulkfile)
          close(spindoslfile)
          close(spindosrfile)
+        endif
          write(stdout,*)'ndim',ndim
          write(stdout,*) 'knv2,omeganum,eta_broadening',knv2, omeganum, eta_broadening/eV2Hartree
          write(stdout,*)'calculate density of state successfully'
@@ -320,7 +293,7 @@
      emax= maxval(omega)/eV2Hartree
      !> write script for gnuplot
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='surfdos_l.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
         write(outfileindex, '(a)')'#set terminal  postscript enhanced color'
@@ -378,7 +351,7 @@
      endif
 
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='surfdos_l_only.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
         write(outfileindex, '(a)')'#set terminal  postscript enhanced color'
@@ -425,7 +398,7 @@
 
      !> write script for gnuplot
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='surfdos_r_only.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
         write(outfileindex, '(a)')'#set terminal  postscript enhanced color'
@@ -474,7 +447,7 @@
 
      !> write script for gnuplot
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='surfdos_r.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
         write(outfileindex, '(a)')'#set terminal  postscript enhanced color'
@@ -532,7 +505,7 @@
 
      !> write script for gnuplot
      outfileindex= outfileindex+ 1
-     if (cpuid==0) then
+     if (cpuid==0 .and. .not.result_binary) then
         open(unit=outfileindex, file='surfdos_bulk.gnu')
         write(outfileindex, '(a)')"set encoding iso_8859_1"
         write(outfileindex, '(a)')'#set terminal  postscript enhanced color'
@@ -585,21 +558,16 @@
      call mpi_barrier(mpi_cmw, ierr)
 #endif
 
+     call kstream_close(st)
+
      deallocate( omega)
-     deallocate( dos_l)
-     deallocate( dos_r)
-     deallocate( dos_l_only)
-     deallocate( dos_r_only)
-     deallocate( dos_l_mpi)
-     deallocate( dos_r_mpi)
-     deallocate( dos_bulk)
-     deallocate( dos_bulk_mpi)
+     deallocate( surf_blk)
      deallocate(GLL)
      deallocate(GRR)
      deallocate(GB )
      deallocate(H00)
      deallocate(H01)
-     deallocate(ones)
+     deallocate(sgwork)
 
   return
   end subroutine surfstat
@@ -624,7 +592,7 @@ SUBROUTINE surfstat_jdos
     USE wmpi
     USE para, ONLY: omeganum, omegamin, omegamax, ndim, knv2, k2_path, outfileindex, &
                     BottomOrbitals, TopOrbitals, NBottomOrbitals, NtopOrbitals, stdout, &
-                    k2len, Num_wann, eps9, zi, Np, eV2Hartree, Angstrom2atomic
+                    k2len, Num_wann, eps9, zi, Np, eV2Hartree, Angstrom2atomic, Nwork_surfgreen
     IMPLICIT NONE
 
     ! MPI error code
@@ -636,7 +604,7 @@ SUBROUTINE surfstat_jdos
 
     ! general loop index
     INTEGER  :: i, j, io, iq, iq1, ik1, ikp
-    INTEGER  :: Nk_half, imin1, imax1, nw_half
+    INTEGER  :: Nk_half, imin1, imax1
     REAL(DP) :: ktmp(2), eta_broadening, s0(3), s1(3)
     ! string for integer
     CHARACTER(LEN=140) :: ichar, jchar, kchar, fmt
@@ -659,14 +627,13 @@ SUBROUTINE surfstat_jdos
     COMPLEX(DP), ALLOCATABLE  :: GLL(:,:), GRR(:,:), GB (:,:)
     COMPLEX(DP), ALLOCATABLE  :: H00(:,:), H01(:,:)
     ! Unit array
-    COMPLEX(DP), ALLOCATABLE  :: ones(:,:)
+    COMPLEX(DP), ALLOCATABLE  :: sgwork(:,:,:)
     ! Spin resolved component
     REAL(DP),    ALLOCATABLE  :: sx_l(:, :), sy_l(:, :), sz_l(:, :)
     REAL(DP),    ALLOCATABLE  :: sx_r(:, :), sy_r(:, :), sz_r(:, :)
     REAL(DP),    ALLOCATABLE  :: sx_l_mpi(:, :), sy_l_mpi(:, :), sz_l_mpi(:, :)
     REAL(DP),    ALLOCATABLE  :: sx_r_mpi(:, :), sy_r_mpi(:, :), sz_r_mpi(:, :)
-    COMPLEX(DP), ALLOCATABLE  :: sigma_x(:,:), sigma_y(:,:), sigma_z(:,:)
-    COMPLEX(DP), ALLOCATABLE  :: ctemp(:,:)
+    REAL(DP) :: spin_l(3), spin_r(3)
 
     ALLOCATE( omega(omeganum) )
     ALLOCATE( dos_l(knv2, omeganum), dos_r(knv2, omeganum), dos_bulk(knv2, omeganum) )
@@ -679,21 +646,19 @@ SUBROUTINE surfstat_jdos
     ALLOCATE( jdos_l_only_mpi(knv2, omeganum), jdos_r_only_mpi(knv2, omeganum) )
     ALLOCATE( GLL(Ndim, Ndim),GRR(Ndim, Ndim),GB (Ndim, Ndim) )
     ALLOCATE( H00(Ndim, Ndim),H01(Ndim, Ndim) )
-    ALLOCATE( ones(Ndim, Ndim) )
+    ALLOCATE( sgwork(Ndim, Ndim, Nwork_surfgreen) )
     ALLOCATE( sx_l(knv2, omeganum), sy_l(knv2, omeganum), sz_l(knv2, omeganum))
     ALLOCATE( sx_l_mpi(knv2, omeganum), sy_l_mpi(knv2, omeganum), sz_l_mpi(knv2, omeganum))
     ALLOCATE( sx_r(knv2, omeganum), sy_r(knv2, omeganum), sz_r(knv2, omeganum))
     ALLOCATE( sx_r_mpi(knv2, omeganum), sy_r_mpi(knv2, omeganum), sz_r_mpi(knv2, omeganum))
-    ALLOCATE( sigma_x(ndim,ndim), sigma_y(ndim,ndim), sigma_z(ndim,ndim), ctemp(ndim,ndim))
 
-    omega        = 0d0;      ones         = 0d0
+    omega        = 0d0;      sgwork       = 0d0
     dos_l        = 0d0;      dos_r        = 0d0
     dos_l_only   = 0d0;      dos_r_only   = 0d0
     dos_l_mpi    = 0d0;      dos_r_mpi    = 0d0
     dos_bulk     = 0d0;      dos_bulk_mpi = 0d0
     GLL          = 0d0;      GRR          = 0d0;      GB           = 0d0
     H00          = 0d0;      H01          = 0d0
-    sigma_x      = 0d0;      sigma_y      = 0d0;      sigma_z      = 0d0
     sx_l         = 0d0;      sy_l         = 0d0;      sz_l         = 0d0
     sx_r         = 0d0;      sy_r         = 0d0;      sz_r         = 0d0
     sx_l_mpi     = 0d0;      sy_l_mpi     = 0d0;      sz_l_mpi     = 0d0
@@ -707,23 +672,6 @@ SUBROUTINE surfstat_jdos
     ENDDO
     eta_broadening = eta_broadening * 3.0d0
 
-    DO i=1,Ndim
-        ones(i,i) = 1.0d0
-    ENDDO
-
-    !> spin operator matrix
-    !> Note, the basis here should be |↑↑↓↓>
-    nw_half = Num_wann/2
-    DO i=1, Np
-        DO j=1, nw_half
-            sigma_x( Num_wann*(i-1)+j        , Num_wann*(i-1)+j+nw_half ) =  1.0d0
-            sigma_x( Num_wann*(i-1)+j+nw_half, Num_wann*(i-1)+j         ) =  1.0d0
-            sigma_y( Num_wann*(i-1)+j        , Num_wann*(i-1)+j+nw_half ) = -zi
-            sigma_y( Num_wann*(i-1)+j+nw_half, Num_wann*(i-1)+j         ) =  zi
-            sigma_z( Num_wann*(i-1)+j        , Num_wann*(i-1)+j         ) =  1.0d0
-            sigma_z( Num_wann*(i-1)+j+nw_half, Num_wann*(i-1)+j+nw_half ) = -1.0d0
-        ENDDO
-    ENDDO
 
     time_start = 0d0
     time_end   = 0d0
@@ -740,7 +688,7 @@ SUBROUTINE surfstat_jdos
             ! there are two method to calculate surface green's function
             ! the method in 1985 is better, you can find the ref in the
             ! subroutine
-            CALL surfgreen_1985(omega(j),GLL,GRR,GB,H00,H01,ones, eta_broadening)
+            CALL surfgreen_1985_work(omega(j),GLL,GRR,GB,H00,H01, eta_broadening, sgwork)
             ! call surfgreen_1984(w,GLL,GRR,H00,H01,ones, eta_broadening)
             ! calculate spectral function
             DO i = 1, NtopOrbitals
@@ -755,37 +703,15 @@ SUBROUTINE surfstat_jdos
                 dos_bulk_mpi(ikp, j) = dos_bulk_mpi(ikp,j) - AIMAG(GB(i,i))
             ENDDO ! i
 
-            ! Spin resolved sprectrum
-            CALL mat_mul(ndim,gll,sigma_x,ctemp)
-            DO i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sx_l_mpi(ikp, j) = sx_l_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            ENDDO ! i
-            CALL mat_mul(ndim,gll,sigma_y,ctemp)
-            DO i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sy_l_mpi(ikp, j) = sy_l_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            ENDDO !
-            CALL mat_mul(ndim,gll,sigma_z,ctemp)
-            DO i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sz_l_mpi(ikp, j) = sz_l_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            ENDDO ! i
-            CALL mat_mul(ndim,grr,sigma_x,ctemp)
-            DO i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sx_r_mpi(ikp, j) = sx_r_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            ENDDO ! i
-            CALL mat_mul(ndim,grr,sigma_y,ctemp)
-            DO i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sy_r_mpi(ikp, j) = sy_r_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            ENDDO !
-            CALL mat_mul(ndim,grr,sigma_z,ctemp)
-            DO i = 1, NtopOrbitals
-                io = TopOrbitals(i)
-                sz_r_mpi(ikp, j) = sz_r_mpi(ikp, j)- AIMAG(ctemp(io,io))
-            ENDDO ! i
+            ! Spin resolved sprectrum, the basis in every layer is |↑↑↓↓>
+            CALL spin_green_diag(ndim, Num_wann, GLL, NtopOrbitals, TopOrbitals, spin_l)
+            CALL spin_green_diag(ndim, Num_wann, GRR, NtopOrbitals, TopOrbitals, spin_r)
+            sx_l_mpi(ikp, j) = spin_l(1)
+            sy_l_mpi(ikp, j) = spin_l(2)
+            sz_l_mpi(ikp, j) = spin_l(3)
+            sx_r_mpi(ikp, j) = spin_r(1)
+            sy_r_mpi(ikp, j) = spin_r(2)
+            sz_r_mpi(ikp, j) = spin_r(3)
 
         ENDDO ! j
         CALL now(time_end)
@@ -834,8 +760,7 @@ SUBROUTINE surfstat_jdos
     DEALLOCATE( dos_l_mpi, dos_r_mpi, dos_bulk_mpi )
     DEALLOCATE( sx_l_mpi, sy_l_mpi, sz_l_mpi )
     DEALLOCATE( sx_r_mpi, sy_r_mpi, sz_r_mpi )
-    DEALLOCATE( sigma_x, sigma_y, sigma_z, ctemp )
-
+    
     DO ikp=1, knv2
         DO j=1, omeganum
             dos_l_only(ikp, j) = dos_l(ikp, j)- dos_bulk(ikp, j)
@@ -946,7 +871,7 @@ SUBROUTINE surfstat_jdos
         WRITE(stdout,*)'calculate joint density of state successfully'
     ENDIF
 
-    DEALLOCATE( ones, omega )
+    DEALLOCATE( sgwork, omega )
     DEALLOCATE( dos_l, dos_r, dos_l_only, dos_r_only, dos_bulk )
     DEALLOCATE( GLL, GRR, GB )
     DEALLOCATE( H00, H01 )
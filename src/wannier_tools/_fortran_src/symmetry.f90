@@ -865,12 +865,8 @@
      use para
      implicit none
 
-     integer :: nwan, Nk_reduced, k_deg, Nkmesh
-     integer :: ia, i, n, j, ik, ik1, ik2, ik3, i1, i2, i3, j1
-
-     real(dp) :: k3_out_cart(3)
-     real(dp) :: k3_in_cart(3), symm_matrix(3, 3), k3_out_direct(3)
-     real(dp) :: altv(3, 3)
+     integer :: nwan, Nk_reduced
+     integer :: ia, i, n, j
 
      !> get the atom afterr the mirror_x operation
      integer, allocatable :: iatom_mirror_x(:)
@@ -927,65 +923,15 @@
      
      Nk_reduced= 0
      if (Boltz_OHE_calc.or.DOS_calc) then
-        !> setup KCube3D_symm
-        KCube3D_symm%Nk_total= Nk1*Nk2*Nk3
-        Nkmesh= (Nk1+1)*(Nk2+1)*(Nk3+1)
-   
-        !> The coordinate of the k point can be deduced from ik_array
+        !> setup KCube3D_symm on the k mesh of the first BZ
+        !> The coordinate of the k point can be deduced from ik_array_symm
         !> ikx= (ik-1)/(nk2*nk3)+1
         !> iky= ((ik-1-(ikx-1)*Nk2*Nk3)/nk3)+1
         !> ikz= (ik-(iky-1)*Nk3- (ikx-1)*Nk2*Nk3)
-        !> k= K3D_start_cube+ K3D_vec1_cube*(ikx-1)/dble(nk1-1)  &
-        !>  + K3D_vec2_cube*(iky-1)/dble(nk2-1)  &
-        !>  + K3D_vec3_cube*(ikz-1)/dble(nk3-1)
-        allocate(KCube3D_symm%ik_array_symm(Nkmesh))
-        allocate(KCube3D_symm%ik_relate(Nkmesh))
-        allocate(KCube3D_symm%weight_k(Nkmesh))
-        KCube3D_symm%weight_k= 0d0
-        do ik=1, Nk1*Nk2*Nk3
-           KCube3D_symm%ik_relate(ik)=  ik
-        enddo
-   
-        !> reduce k points in the first BZ with symmetries
-        k_deg= 1
-        do ik=1, Nk1*Nk2*Nk3
-           !> ik= 1+(ik3-1)+(ik2-1)*Nk3+(ik1-1)*Nk3*Nk2
-           ik1= (ik-1)/(Nk2*Nk3)+1
-           ik2= ((ik-1-(ik1-1)*Nk2*Nk3)/Nk3)+1
-           ik3= (ik-(ik2-1)*Nk3- (ik1-1)*Nk2*Nk3)
-          !write(1001, '(4i5)')ik1, ik2, ik3, ik
-           k3_in_cart = Origin_cell%Kua*(ik1-1d0)/dble(Nk1)  &
-              + Origin_cell%Kub*(ik2-1d0)/dble(Nk2)  &
-              + Origin_cell%Kuc*(ik3-1d0)/dble(Nk3)
-           if (KCube3D_symm%ik_relate(ik).eq.ik) then
-              Nk_reduced= Nk_reduced+ 1
-              KCube3D_symm%ik_array_symm(Nk_reduced)= ik
-              k_deg= 1
-              do j=1, number_group_operators
-                 symm_matrix= pgop_cart(:, :, j)
-                 !> k3_out_cart= symm_matrix*k3_in_cart
-                 call symm_operation(symm_matrix,k3_in_cart, k3_out_cart)
-                 if (ik==1) goto 130
-                 call cart_direct_rec(k3_out_cart, k3_out_direct)
-   
-                 i1= int8(k3_out_direct(1)*dble(Nk1)+ eps6)+1
-                 i2= int8(k3_out_direct(2)*dble(Nk2)+ eps6)+1
-                 i3= int8(k3_out_direct(3)*dble(Nk3)+ eps6)+1
-                 j1= 1+(i3-1)+(i2-1)*Nk3+(i1-1)*Nk3*Nk2
-   
-                 if (j1/=ik .and. KCube3D_symm%ik_relate(j1)==j1) then
-                    k_deg= k_deg+ 1
-                 endif
-                 KCube3D_symm%ik_relate(j1)= Nk_reduced
-              enddo ! j=1, number_group_operators
-              130 continue
-              KCube3D_symm%weight_k(Nk_reduced) = dble(k_deg)/dble(KCube3D_symm%Nk_total)
-           endif
-        enddo  ! ik
-
-        !> total number of reduced k points after symmetry operation
-        KCube3D_symm%Nk_total_symm= Nk_reduced
-        KCube3D_symm%ik_array_symm(Nk_reduced+1:KCube3D_symm%Nk_total)= 0
+        !> k= (ikx-1)/dble(nk1)*Kua+ (iky-1)/dble(nk2)*Kub+ (ikz-1)/dble(nk3)*Kuc
+        call kmesh_symm_reduce(KCube3D_symm, Nk1, Nk2, Nk3, &
+           [0d0, 0d0, 0d0], [1d0, 0d0, 0d0], [0d0, 1d0, 0d0], [0d0, 0d0, 1d0])
+        Nk_reduced= KCube3D_symm%Nk_total_symm
      endif
 
      if (cpuid.eq.0) then
@@ -1479,3 +1425,239 @@
   end subroutine symm_operation
 
 
+  subroutine kmesh_symm_reduce(kcube, nk1, nk2, nk3, kstart, kvec1, kvec2, kvec3)
+     !> Reduce the periodic k mesh
+     !>    k= kstart+ kvec1*(ik1-1)/nk1+ kvec2*(ik2-1)/nk2+ kvec3*(ik3-1)/nk3
+     !> to its irreducible k points with the space group operators found in
+     !> symmetry, only the identity if Symmetry_Import_calc= F. kstart and kvec
+     !> are in units of the reciprocal lattice vectors. Only operators that map
+     !> the mesh onto itself are used, and none if kvec1, kvec2, kvec3 do not
+     !> span one reciprocal unit cell.
+     !>
+     !> With ik= 1+(ik3-1)+(ik2-1)*nk3+(ik1-1)*nk2*nk3, on return
+     !>    kcube%ik_array_symm(i) is the k point ik of the reduced k point i,
+     !>    kcube%ik_relate(ik) the reduced k point whose star contains ik,
+     !>    kcube%ndeg(i) the number of k points in that star and
+     !>    kcube%weight_k(i)= ndeg(i)/(nk1*nk2*nk3).
+     !> A sum of a scalar over the mesh is the sum over the reduced k points
+     !> weighted by ndeg. Vectors and tensors summed in the same way have to
+     !> be averaged over kcube%op_cart(:, :, 1:kcube%nop) afterwards, see
+     !> symm_average_pseudovector, symm_average_tensor and
+     !> symm_average_spin_tensor.
+     use para, only : dp, eps6, cpuid, stdout, Origin_cell, kcube_type_symm, &
+        number_group_operators, pgop_cart
+     implicit none
+
+     type(kcube_type_symm), intent(inout) :: kcube
+     integer, intent(in) :: nk1, nk2, nk3
+     real(dp), intent(in) :: kstart(3), kvec1(3), kvec2(3), kvec3(3)
+
+     integer :: iop, i, j, ik, jk, nirr, nk(3), n(3), m(3)
+     real(dp) :: bmat(3, 3), binv(3, 3), vmat(3, 3), vinv(3, 3)
+     real(dp) :: rot(3, 3), rot_mesh(3, 3), shift(3), x
+     logical :: periodic, onmesh
+     real(dp), external :: det3
+
+     !> the operators on the mesh indices n= (ik1-1, ik2-1, ik3-1):
+     !> n -> modulo(op_mesh*n+ op_shift, nk)
+     integer, allocatable :: op_mesh(:, :, :), op_shift(:, :)
+
+     nk= [nk1, nk2, nk3]
+     kcube%Nk_total= nk1*nk2*nk3
+     if (allocated(kcube%ik_relate)) deallocate(kcube%ik_relate)
+     if (allocated(kcube%ik_array_symm)) deallocate(kcube%ik_array_symm)
+     if (allocated(kcube%weight_k)) deallocate(kcube%weight_k)
+     if (allocated(kcube%ndeg)) deallocate(kcube%ndeg)
+     if (allocated(kcube%op_cart)) deallocate(kcube%op_cart)
+     allocate(kcube%ik_relate(kcube%Nk_total))
+     allocate(kcube%ik_array_symm(kcube%Nk_total))
+     allocate(kcube%weight_k(kcube%Nk_total))
+     allocate(kcube%ndeg(kcube%Nk_total))
+     allocate(kcube%op_cart(3, 3, max(1, number_group_operators)))
+     allocate(op_mesh(3, 3, max(1, number_group_operators)))
+     allocate(op_shift(3, max(1, number_group_operators)))
+
+     !> the identity is always there
+     kcube%nop= 1
+     kcube%op_cart(:, :, 1)= 0d0
+     op_mesh(:, :, 1)= 0
+     op_shift(:, 1)= 0
+     do i=1, 3
+        kcube%op_cart(i, i, 1)= 1d0
+        op_mesh(i, i, 1)= 1
+     enddo
+
+     bmat(:, 1)= Origin_cell%Kua
+     bmat(:, 2)= Origin_cell%Kub
+     bmat(:, 3)= Origin_cell%Kuc
+     binv= bmat
+     call inv_r(3, binv)
+     vmat(:, 1)= kvec1
+     vmat(:, 2)= kvec2
+     vmat(:, 3)= kvec3
+     periodic= all(abs(vmat-nint(vmat))<eps6) .and. abs(abs(det3(vmat))-1d0)<eps6
+     if (periodic) then
+        vinv= vmat
+        call inv_r(3, vinv)
+     endif
+
+     do iop=1, number_group_operators
+        if (.not.periodic) exit
+        if (sum(abs(pgop_cart(:, :, iop)-kcube%op_cart(:, :, 1)))<eps6) cycle
+
+        !> the operator in units of the reciprocal lattice vectors, then on
+        !> the coordinates along kvec1, kvec2, kvec3
+        rot= matmul(binv, matmul(pgop_cart(:, :, iop), bmat))
+        if (any(abs(rot-nint(rot))>eps6)) cycle
+        rot= dble(nint(rot))
+        rot_mesh= matmul(vinv, matmul(rot, vmat))
+        shift= matmul(vinv, matmul(rot, kstart)- kstart)
+
+        !> the image of every mesh point has to be a mesh point
+        onmesh= .true.
+        do i=1, 3
+           do j=1, 3
+              x= rot_mesh(i, j)*nk(i)/dble(nk(j))
+              if (abs(x-nint(x))>eps6) onmesh= .false.
+              op_mesh(i, j, kcube%nop+1)= nint(x)
+           enddo
+           x= shift(i)*nk(i)
+           if (abs(x-nint(x))>eps6) onmesh= .false.
+           op_shift(i, kcube%nop+1)= nint(x)
+        enddo
+        if (.not.onmesh) cycle
+
+        kcube%nop= kcube%nop+ 1
+        kcube%op_cart(:, :, kcube%nop)= pgop_cart(:, :, iop)
+     enddo
+
+     !> the stars of the k points in the order of ik
+     kcube%ik_relate= 0
+     kcube%ik_array_symm= 0
+     kcube%weight_k= 0d0
+     kcube%ndeg= 0
+     nirr= 0
+     do ik=1, kcube%Nk_total
+        if (kcube%ik_relate(ik)/=0) cycle
+        nirr= nirr+ 1
+        kcube%ik_array_symm(nirr)= ik
+        n(1)= (ik-1)/(nk2*nk3)
+        n(2)= mod((ik-1)/nk3, nk2)
+        n(3)= mod(ik-1, nk3)
+        do iop=1, kcube%nop
+           m= modulo(matmul(op_mesh(:, :, iop), n)+ op_shift(:, iop), nk)
+           jk= 1+ m(3)+ m(2)*nk3+ m(1)*nk2*nk3
+           if (kcube%ik_relate(jk)/=0) cycle
+           kcube%ik_relate(jk)= nirr
+           kcube%ndeg(nirr)= kcube%ndeg(nirr)+ 1
+        enddo
+        kcube%weight_k(nirr)= dble(kcube%ndeg(nirr))/dble(kcube%Nk_total)
+     enddo
+     kcube%Nk_total_symm= nirr
+
+     if (cpuid==0 .and. kcube%nop>1) then
+        write(stdout, '(a, i10, a, i10, a, i3, a)')' >> k mesh reduced from', kcube%Nk_total, &
+           ' to', nirr, ' k points with', kcube%nop, ' symmetry operators'
+     endif
+
+     deallocate(op_mesh, op_shift)
+     return
+  end subroutine kmesh_symm_reduce
+
+  subroutine symm_average_pseudovector(kcube, n, v)
+     !> v(:, i)= sum_R det(R)*R*v(:, i)/nop over the operators R of kcube.
+     !> This gives the sum over the full k mesh of a pseudovector like the
+     !> Berry curvature from its sum over the reduced k points with ndeg.
+     use para, only : dp, kcube_type_symm
+     implicit none
+
+     type(kcube_type_symm), intent(in) :: kcube
+     integer, intent(in) :: n
+     real(dp), intent(inout) :: v(3, n)
+
+     integer :: i, iop
+     real(dp) :: v0(3)
+     real(dp), external :: det3
+
+     if (kcube%nop<=1) return
+
+     do i=1, n
+        v0= v(:, i)
+        v(:, i)= 0d0
+        do iop=1, kcube%nop
+           v(:, i)= v(:, i)+ det3(kcube%op_cart(:, :, iop))* &
+              matmul(kcube%op_cart(:, :, iop), v0)
+        enddo
+        v(:, i)= v(:, i)/dble(kcube%nop)
+     enddo
+
+     return
+  end subroutine symm_average_pseudovector
+
+  subroutine symm_average_tensor(kcube, n, t)
+     !> t(:, :, i)= sum_R R*t(:, :, i)*R^T/nop over the operators R of kcube,
+     !> for a rank-2 tensor like the optical conductivity
+     use para, only : dp, kcube_type_symm
+     implicit none
+
+     type(kcube_type_symm), intent(in) :: kcube
+     integer, intent(in) :: n
+     complex(dp), intent(inout) :: t(3, 3, n)
+
+     integer :: i, iop
+     complex(dp) :: t0(3, 3)
+
+     if (kcube%nop<=1) return
+
+     do i=1, n
+        t0= t(:, :, i)
+        t(:, :, i)= 0d0
+        do iop=1, kcube%nop
+           t(:, :, i)= t(:, :, i)+ matmul(kcube%op_cart(:, :, iop), &
+              matmul(t0, transpose(kcube%op_cart(:, :, iop))))
+        enddo
+        t(:, :, i)= t(:, :, i)/dble(kcube%nop)
+     enddo
+
+     return
+  end subroutine symm_average_tensor
+
+  subroutine symm_average_spin_tensor(kcube, t)
+     !> t(gamma, alpha, beta)= sum_R det(R)*R_gg'*R_aa'*R_bb'*t(g', a', b')/nop
+     !> over the operators R of kcube, for the spin Hall conductivity with
+     !> the spin direction gamma
+     use para, only : dp, kcube_type_symm
+     implicit none
+
+     type(kcube_type_symm), intent(in) :: kcube
+     real(dp), intent(inout) :: t(3, 3, 3)
+
+     integer :: iop, ig, ia, ib, jg, ja, jb
+     real(dp) :: t0(3, 3, 3), r(3, 3), d
+     real(dp), external :: det3
+
+     if (kcube%nop<=1) return
+
+     t0= t
+     t= 0d0
+     do iop=1, kcube%nop
+        r= kcube%op_cart(:, :, iop)
+        d= det3(r)
+        do ib=1, 3
+        do ia=1, 3
+        do ig=1, 3
+           do jb=1, 3
+           do ja=1, 3
+           do jg=1, 3
+              t(ig, ia, ib)= t(ig, ia, ib)+ d*r(ig, jg)*r(ia, ja)*r(ib, jb)*t0(jg, ja, jb)
+           enddo
+           enddo
+           enddo
+        enddo
+        enddo
+        enddo
+     enddo
+     t= t/dble(kcube%nop)
+
+     return
+  end subroutine symm_average_spin_tensor
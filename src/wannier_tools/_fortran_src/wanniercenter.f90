@@ -2486,6 +2486,8 @@ end subroutine  wannier_center3D_plane0
       real(dp), allocatable :: xnm(:)
       real(dp) :: k0(3), k1(3), k2(3)
 
+      integer, external :: get_thread_id
+
       allocate(kpoints(3, Nk1, Nk2))
       kpoints= 0d0
 
@@ -2549,8 +2551,14 @@ end subroutine  wannier_center3D_plane0
 
       !>> Get wannier center for ky=0 plane
       !> for each ky, we can get wanniercenter
+      !> the Wilson loops are shared by the OpenMP threads, every loop
+      !> writes its own column of WannierCenterKy and largestgap
+      !$OMP PARALLEL DO SCHEDULE(STATIC, 1) &
+      !$OMP PRIVATE(ik2, ik1, i, j, m, k, br, ratio, maxgap, maxgap0, imax) &
+      !$OMP PRIVATE(Hamk, Hamk_dag, Eigenvector, eigenvalue, Mmnkb, U, Sigma, VT) &
+      !$OMP PRIVATE(Lambda_eig, Lambda, Lambda0)
       do ik2=1+ cpuid, Nk2, num_cpu
-         if (cpuid.eq.0) write(stdout, *)' Wilson loop ',  'ik, Nk', ik2, nk2
+         if (cpuid.eq.0.and. get_thread_id()==0) write(stdout, *)' Wilson loop ',  'ik, Nk', ik2, nk2
          Lambda0=0d0
          do i=1, Numoccupied
             Lambda0(i, i)= 1d0
@@ -2652,6 +2660,7 @@ end subroutine  wannier_center3D_plane0
 
 
       enddo !< ik2
+      !$OMP END PARALLEL DO
 
       WannierCenterKy_mpi= 0d0
       largestgap_mpi= 0d0
@@ -2896,6 +2905,8 @@ subroutine  wannier_center3D_kpath(kpoints, nkp1, nkp2, largest_gap, wcc, Z2)
 
    complex(dp),allocatable :: gauge_shift(:,:)
 
+   integer, external :: get_thread_id
+
 
 
    allocate(Lambda(NumberofSelectedOccupiedBands, NumberofSelectedOccupiedBands))
@@ -2940,10 +2951,16 @@ subroutine  wannier_center3D_kpath(kpoints, nkp1, nkp2, largest_gap, wcc, Z2)
    Umatrix_t= transpose(Umatrix)
    call inv_r(3, Umatrix_t)
 
+   if (index(KPorTB, 'KP')==0) call atomicgauge_table_init()
+
    !>> Get wannier center for ky=0 plane
    !> for each ky, we can get wanniercenter
+   !> the Wilson loops are shared by the OpenMP threads, every loop
+   !> writes its own column of WannierCenterKy and largestgap
+   !$OMP PARALLEL DO SCHEDULE(STATIC, 1) &
+   !$OMP PRIVATE(ik2, ik1, i, k, maxgap, maxgap0, imax, Hamk, Eigenvector, eigenvalue, Lambda)
    do ik2=1+ cpuid, Nkp2, num_cpu
-      if (cpuid.eq.0) write(stdout, *)' Wilson loop ',  'ik, Nk', ik2, nkp2
+      if (cpuid.eq.0.and. get_thread_id()==0) write(stdout, *)' Wilson loop ',  'ik, Nk', ik2, nkp2
       do i=1, NumberofSelectedOccupiedBands
       enddo
 
@@ -3004,6 +3021,7 @@ subroutine  wannier_center3D_kpath(kpoints, nkp1, nkp2, largest_gap, wcc, Z2)
 
 
    enddo !< ik2
+   !$OMP END PARALLEL DO
 
    WannierCenterKy_mpi= 0d0
    largestgap_mpi= 0d0
@@ -3348,6 +3366,8 @@ subroutine  wannier_center3D_weyl_func_kpoints(kpoints, wcc, chirality)
    real(dp) :: gap_sum, gap_step
    real(dp), allocatable :: xnm(:)
 
+   integer, external :: get_thread_id
+
 
        allocate(Lambda_eig(NumberofSelectedOccupiedBands))
     allocate(Lambda(NumberofSelectedOccupiedBands, NumberofSelectedOccupiedBands))
@@ -3379,8 +3399,14 @@ subroutine  wannier_center3D_weyl_func_kpoints(kpoints, wcc, chirality)
    call inv_r(3, Umatrix_t)
 
    !> for each ky, we can get wanniercenter
+   !> the Wilson loops are shared by the OpenMP threads, every loop
+   !> writes its own column of WannierCenterKy
+   !$OMP PARALLEL DO SCHEDULE(STATIC, 1) &
+   !$OMP PRIVATE(ik2, ik1, i, j, m, k, b, br, ratio) &
+   !$OMP PRIVATE(Hamk, Hamk_dag, Eigenvector, eigenvalue, Mmnkb, U, Sigma, VT) &
+   !$OMP PRIVATE(Lambda_eig, Lambda, Lambda0)
    do ik2=1+ cpuid, Nk2, num_cpu
-      if (cpuid.eq.0) write(stdout, *)' Wilson loop ',  'ik, Nk', ik2, nk2
+      if (cpuid.eq.0.and. get_thread_id()==0) write(stdout, *)' Wilson loop ',  'ik, Nk', ik2, nk2
       Lambda0=0d0
       do i=1, NumberofSelectedOccupiedBands
          Lambda0(i, i)= 1d0
@@ -3463,6 +3489,7 @@ subroutine  wannier_center3D_weyl_func_kpoints(kpoints, wcc, chirality)
       call sortheap(NumberofSelectedOccupiedBands, WannierCenterKy(:, ik2))
 
    enddo !< ik2
+   !$OMP END PARALLEL DO
 
    WannierCenterKy_mpi= 0d0
 #if defined (MPI)
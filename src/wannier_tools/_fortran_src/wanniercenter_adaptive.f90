@@ -3,17 +3,22 @@
       ! this suboutine is used for wannier center calculation for 3D system
       use para
       use wmpi
+      use checkpoint
       implicit none
 
-      integer :: ik2, i, j 
+      integer :: ik2, i, j, iplane
       integer :: Nk2_adaptive
 
       real(dp) :: kstart(3)
       real(dp) :: kvec1(3)
       real(dp) :: kvec2(3)
+      real(dp) :: kstart_all(3, 6), kvec1_all(3, 6), kvec2_all(3, 6)
 
       integer :: Z2
       integer :: Z2_all(6)
+      real(dp), target :: Z2_ckpt(1, 6)
+      type(checkpoint_type) :: ckpt
+      character(40) :: wccfile
 
       !> wannier centers for each ky, bands
       real(dp), allocatable :: wcc(:, :)
@@ -34,140 +39,65 @@
       wcc= 0d0
       wcc_all= 0d0
 
-      !> integration over kc (\bar{c}}, wcc along kb, fixed k1=0
-      kstart= (/0.0d0, 0.0d0, 0.0d0/)
-      kvec1 = (/0.0d0, 0.0d0, 1.0d0/)
-      kvec2 = (/0.0d0, 0.5d0, 0.0d0/)
-
-      call  wannier_center3D_plane_adaptive_func(Kstart, Kvec1, Kvec2, &
-         largestgap, wcc, Z2, Nk2_adaptive, kpath_wcc)
-      Z2_all(1)= Z2
-
-      outfileindex= outfileindex+ 1
-      if (cpuid==0) then
-         open(unit=outfileindex, file='wanniercenter3D_Z2_1.dat')
-         do i=1, NumberofSelectedOccupiedBands
-            do ik2=1, Nk2_adaptive
-               write(outfileindex, '(10000f16.8)') kpath_wcc(ik2), &
-                  (dmod((wcc(i, ik2)), 1d0))
-            enddo
-            write(outfileindex, *)' '
-         enddo
-         close(outfileindex)
-      endif
-
-
-      !> integration over kc (\bar{c}}, wcc along kb, fixed k1=ka/2
-      kstart= (/0.5d0, 0.0d0, 0.0d0/)
-      kvec1 = (/0.0d0, 0.0d0, 1.0d0/)
-      kvec2 = (/0.0d0, 0.5d0, 0.0d0/)
-
-      call  wannier_center3D_plane_adaptive_func(Kstart, Kvec1, Kvec2, &
-         largestgap, wcc, Z2, Nk2_adaptive, kpath_wcc)
-      Z2_all(2)= Z2
-
-      outfileindex= outfileindex+ 1
-      if (cpuid==0) then
-         open(unit=outfileindex, file='wanniercenter3D_Z2_2.dat')
-         do i=1, NumberofSelectedOccupiedBands
-            do ik2=1, Nk2_adaptive
-               write(outfileindex, '(10000f16.8)') kpath_wcc(ik2), &
-                  (dmod((wcc(i, ik2)), 1d0))
-            enddo
-            write(outfileindex, *)' '
-         enddo
-         close(outfileindex)
-      endif
-
-
-
-      !> integration over kc (\bar{c}}, wcc along ka, fixed k2=0
-      kstart= (/0.0d0, 0.0d0, 0.0d0/)
-      kvec1 = (/0.0d0, 0.0d0, 1.0d0/)
-      kvec2 = (/0.5d0, 0.0d0, 0.0d0/)
-
-      call  wannier_center3D_plane_adaptive_func(Kstart, Kvec1, Kvec2, &
-         largestgap, wcc, Z2, Nk2_adaptive, kpath_wcc)
-      Z2_all(3)= Z2
-
-      outfileindex= outfileindex+ 1
-      if (cpuid==0) then
-         open(unit=outfileindex, file='wanniercenter3D_Z2_3.dat')
-         do i=1, NumberofSelectedOccupiedBands
-            do ik2=1, Nk2_adaptive
-               write(outfileindex, '(10000f16.8)') kpath_wcc(ik2), &
-                  (dmod((wcc(i, ik2)), 1d0))
-            enddo
-            write(outfileindex, *)' '
-         enddo
-         close(outfileindex)
-      endif
-
-      !> integration over kc (\bar{c}}, wcc along ka, fixed k2=kb/2
-      kstart= (/0.0d0, 0.5d0, 0.0d0/)
-      kvec1 = (/0.0d0, 0.0d0, 1.0d0/)
-      kvec2 = (/0.5d0, 0.0d0, 0.0d0/)
-
-      call  wannier_center3D_plane_adaptive_func(Kstart, Kvec1, Kvec2, &
-         largestgap, wcc, Z2, Nk2_adaptive, kpath_wcc)
-      Z2_all(4)= Z2
-
-      outfileindex= outfileindex+ 1
-      if (cpuid==0) then
-         open(unit=outfileindex, file='wanniercenter3D_Z2_4.dat')
-         do i=1, NumberofSelectedOccupiedBands
-            do ik2=1, Nk2_adaptive
-               write(outfileindex, '(10000f16.8)') kpath_wcc(ik2), &
-                  (dmod((wcc(i, ik2)), 1d0))
-            enddo
-            write(outfileindex, *)' '
-         enddo
-         close(outfileindex)
-      endif
+      !> the six time reversal invariant planes, kstart and the two vectors
+      !> spanning half of the plane, the wcc are calculated along kvec2
+      !> integration over kc (\bar{c}}, wcc along kb, fixed k1=0 and k1=ka/2
+      kstart_all(:, 1)= (/0.0d0, 0.0d0, 0.0d0/)
+      kstart_all(:, 2)= (/0.5d0, 0.0d0, 0.0d0/)
+      kvec1_all(:, 1:2)= spread((/0.0d0, 0.0d0, 1.0d0/), 2, 2)
+      kvec2_all(:, 1:2)= spread((/0.0d0, 0.5d0, 0.0d0/), 2, 2)
+
+      !> integration over kc (\bar{c}}, wcc along ka, fixed k2=0 and k2=kb/2
+      kstart_all(:, 3)= (/0.0d0, 0.0d0, 0.0d0/)
+      kstart_all(:, 4)= (/0.0d0, 0.5d0, 0.0d0/)
+      kvec1_all(:, 3:4)= spread((/0.0d0, 0.0d0, 1.0d0/), 2, 2)
+      kvec2_all(:, 3:4)= spread((/0.5d0, 0.0d0, 0.0d0/), 2, 2)
+
+      !> integration over ka (\bar{a}}, wcc along kb, fixed k3=0 and k3=kc/2
+      kstart_all(:, 5)= (/0.0d0, 0.0d0, 0.0d0/)
+      kstart_all(:, 6)= (/0.0d0, 0.0d0, 0.5d0/)
+      kvec1_all(:, 5:6)= spread((/1.0d0, 0.0d0, 0.0d0/), 2, 2)
+      kvec2_all(:, 5:6)= spread((/0.0d0, 0.5d0, 0.0d0/), 2, 2)
+
+      !> a plane can take hours, so the Z2 numbers of the finished planes are
+      !> kept in a checkpoint. Their wcc files are already written.
+      Z2_ckpt= 0d0
+      call checkpoint_add_items(ckpt, Z2_ckpt, 1)
+      call checkpoint_start(ckpt, 'Z2_3D', 6, &
+         [dble(NumberofSelectedOccupiedBands), wcc_calc_tol, wcc_neighbour_tol])
+
+      do iplane= 1, 6
+         outfileindex= outfileindex+ 1
+         if (checkpoint_done(ckpt, iplane)) then
+            Z2_all(iplane)= nint(Z2_ckpt(1, iplane))
+            cycle
+         endif
 
-      !> integration over ka (\bar{a}}, wcc along kb, fixed k3=0
-      kstart= (/0.0d0, 0.0d0, 0.0d0/)
-      kvec1 = (/1.0d0, 0.0d0, 0.0d0/)
-      kvec2 = (/0.0d0, 0.5d0, 0.0d0/)
+         kstart= kstart_all(:, iplane)
+         kvec1 = kvec1_all(:, iplane)
+         kvec2 = kvec2_all(:, iplane)
 
-      call  wannier_center3D_plane_adaptive_func(Kstart, Kvec1, Kvec2, &
-         largestgap, wcc, Z2, Nk2_adaptive, kpath_wcc)
-      Z2_all(5)= Z2
+         call  wannier_center3D_plane_adaptive_func(Kstart, Kvec1, Kvec2, &
+            largestgap, wcc, Z2, Nk2_adaptive, kpath_wcc)
+         Z2_all(iplane)= Z2
 
-      outfileindex= outfileindex+ 1
-      if (cpuid==0) then
-         open(unit=outfileindex, file='wanniercenter3D_Z2_5.dat')
-         do i=1, NumberofSelectedOccupiedBands
-            do ik2=1, Nk2_adaptive
-               write(outfileindex, '(10000f16.8)') kpath_wcc(ik2), &
-                  (dmod((wcc(i, ik2)), 1d0))
+         if (cpuid==0) then
+            write(wccfile, '(a, i1, a)')'wanniercenter3D_Z2_', iplane, '.dat'
+            open(unit=outfileindex, file=wccfile)
+            do i=1, NumberofSelectedOccupiedBands
+               do ik2=1, Nk2_adaptive
+                  write(outfileindex, '(10000f16.8)') kpath_wcc(ik2), &
+                     (dmod((wcc(i, ik2)), 1d0))
+               enddo
+               write(outfileindex, *)' '
             enddo
-            write(outfileindex, *)' '
-         enddo
-         close(outfileindex)
-      endif
-
-      !> integration over ka (\bar{a}}, wcc along kb, fixed k3=kc/2
-      kstart= (/0.0d0, 0.0d0, 0.5d0/)
-      kvec1 = (/1.0d0, 0.0d0, 0.0d0/)
-      kvec2 = (/0.0d0, 0.5d0, 0.0d0/)
+            close(outfileindex)
+         endif
 
-      call  wannier_center3D_plane_adaptive_func(Kstart, Kvec1, Kvec2, &
-         largestgap, wcc, Z2, Nk2_adaptive, kpath_wcc)
-      Z2_all(6)= Z2
-
-      outfileindex= outfileindex+ 1
-      if (cpuid==0) then
-         open(unit=outfileindex, file='wanniercenter3D_Z2_6.dat')
-         do i=1, NumberofSelectedOccupiedBands
-            do ik2=1, Nk2_adaptive
-               write(outfileindex, '(10000f16.8)') kpath_wcc(ik2), &
-                  (dmod((wcc(i, ik2)), 1d0))
-            enddo
-            write(outfileindex, *)' '
-         enddo
-         close(outfileindex)
-      endif
+         Z2_ckpt(1, iplane)= Z2
+         call checkpoint_mark(ckpt, iplane)
+         call checkpoint_update(ckpt, force=.true.)
+      enddo ! iplane
 
       outfileindex= outfileindex+ 1
       if (cpuid==0) then
@@ -263,6 +193,8 @@
          write(stdout, *)'k3=0.5, k1-k2 plane: ', Z2_all(6)
       endif
 
+      call checkpoint_finish(ckpt)
+
       return
    end subroutine  Z2_3D_adaptive
 
@@ -273,6 +205,7 @@
 
       use para
       use wmpi
+      use result_sink
       implicit none
       integer :: ik2
 
@@ -299,8 +232,15 @@
          largestgap, wcc, Z2, Nk2_adaptive, kpath_wcc)
 
 
+      if (cpuid==0 .and. result_binary) then
+         call result_write('wcc/k', [Nk2_adaptive], kpath_wcc, 'fractional', 'k')
+         call result_write('wcc/largestgap', [Nk2_adaptive], largestgap, ' ', 'k')
+         call result_write('wcc/wcc', [NumberofSelectedOccupiedBands, Nk2_adaptive], &
+            wcc(:, 1:Nk2_adaptive), ' ', 'k,band')
+      endif
+
       outfileindex= outfileindex+ 1
-      if (cpuid==0) then
+      if (cpuid==0 .and. .not.result_binary) then
          open(unit=outfileindex, file='wcc.dat')
          write(outfileindex, '(4A16, A)')'#      k', 'largestgap', 'sum(wcc(:,ik))', &
                                           'wcc(i, ik)', '(i=1, NumberofSelectedOccupiedBands)'
@@ -316,7 +256,7 @@
    
       !> generate gnu script for wannier charge center plots
       outfileindex= outfileindex+ 1
-      if (cpuid==0) then
+      if (cpuid==0 .and. .not.result_binary) then
          open(unit=outfileindex, file='wcc.gnu')
          write(outfileindex, '(a)')"# gnuplot version > 5.4"
          write(outfileindex, '(a)')"set encoding iso_8859_1"
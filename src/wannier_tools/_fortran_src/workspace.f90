@@ -0,0 +1,204 @@
+!> Persistent scratch arrays of the small routines called inside the k and
+!> energy loops.
+!>
+!> eigensystem_c, eigensystem_window, zheevx_pack, inv, surfgreen_1985,
+!> surfgreen_1984, ham_slab and ham_qlayer2qlayer are called millions of
+!> times with the same sizes. Instead of allocating their work arrays on
+!> every call they take them from this module: every routine owns a slot,
+!> every array of the routine a buffer in that slot, and every OpenMP
+!> thread has its own set of buffers. A buffer is only reallocated if a larger size is asked
+!> for, so the k loops run without allocations after their first k point.
+!>
+!> The buffers are rank 1, the caller maps them to the shape it needs:
+!>
+!>    complex(dp), pointer :: work(:), Bmat(:, :)
+!>    work => ws_complex(WS_INV, 1, lwork)
+!>    Bmat(1:n, 1:n) => ws_complex(WS_INV, 2, n*n)
+!>
+!> The content of a buffer is undefined on return, and a routine must not
+!> call itself while it uses its buffers. The peak of the scratch memory
+!> held by all threads is written to WT.out by workspace_report, and
+!> workspace_release frees the buffers of all threads.
+
+module workspace
+   use para, only : dp
+   implicit none
+
+   private
+   public :: ws_complex, ws_real, ws_int, workspace_report, workspace_release
+
+   !> slots of the routines using the workspace
+   integer, parameter, public :: WS_EIGENSYSTEM_C   = 1
+   integer, parameter, public :: WS_ZHEEVX_PACK     = 2
+   integer, parameter, public :: WS_INV             = 3
+   integer, parameter, public :: WS_SURFGREEN_1985  = 4
+   integer, parameter, public :: WS_SURFGREEN_1984  = 5
+   integer, parameter, public :: WS_HAM_SLAB        = 6
+   integer, parameter, public :: WS_HAM_QLAYER2QLAYER= 7
+   integer, parameter, public :: WS_EIGENSYSTEM_WINDOW= 8
+   integer, parameter :: nslots= 8
+
+   !> maximum number of buffers of one type in a slot
+   integer, parameter :: nbuffers= 16
+
+   type ws_buffer
+      complex(dp), allocatable :: c(:)
+      real(dp), allocatable :: r(:)
+      integer, allocatable :: i(:)
+   end type ws_buffer
+
+   !> buffers of this thread
+   type(ws_buffer), target, save :: buffers(nbuffers, nslots)
+   !$OMP THREADPRIVATE(buffers)
+
+   !> scratch memory of all threads of this rank, its peak and the number
+   !> of (re)allocations
+   integer(8), save :: total_bytes= 0
+   integer(8), save :: peak_bytes= 0
+   integer(8), save :: nallocations= 0
+
+contains
+
+   function ws_complex(slot, ibuf, n) result(p)
+      !> complex buffer ibuf of slot with at least n elements
+      implicit none
+
+      integer, intent(in) :: slot, ibuf, n
+      complex(dp), pointer :: p(:)
+
+      integer :: nold
+
+      nold= 0
+      if (allocated(buffers(ibuf, slot)%c)) nold= size(buffers(ibuf, slot)%c)
+      if (n>nold) then
+         if (nold>0) deallocate(buffers(ibuf, slot)%c)
+         allocate(buffers(ibuf, slot)%c(n))
+         call ws_count(16_8*(n- nold))
+      endif
+      p => buffers(ibuf, slot)%c
+
+      return
+   end function ws_complex
+
+
+   function ws_real(slot, ibuf, n) result(p)
+      !> real buffer ibuf of slot with at least n elements
+      implicit none
+
+      integer, intent(in) :: slot, ibuf, n
+      real(dp), pointer :: p(:)
+
+      integer :: nold
+
+      nold= 0
+      if (allocated(buffers(ibuf, slot)%r)) nold= size(buffers(ibuf, slot)%r)
+      if (n>nold) then
+         if (nold>0) deallocate(buffers(ibuf, slot)%r)
+         allocate(buffers(ibuf, slot)%r(n))
+         call ws_count(8_8*(n- nold))
+      endif
+      p => buffers(ibuf, slot)%r
+
+      return
+   end function ws_real
+
+
+   function ws_int(slot, ibuf, n) result(p)
+      !> integer buffer ibuf of slot with at least n elements
+      implicit none
+
+      integer, intent(in) :: slot, ibuf, n
+      integer, pointer :: p(:)
+
+      integer :: nold
+
+      nold= 0
+      if (allocated(buffers(ibuf, slot)%i)) nold= size(buffers(ibuf, slot)%i)
+      if (n>nold) then
+         if (nold>0) deallocate(buffers(ibuf, slot)%i)
+         allocate(buffers(ibuf, slot)%i(n))
+         call ws_count(4_8*(n- nold))
+      endif
+      p => buffers(ibuf, slot)%i
+
+      return
+   end function ws_int
+
+
+   subroutine ws_count(nbytes)
+      !> book keeping of a (re)allocation of nbytes more
+      implicit none
+
+      integer(8), intent(in) :: nbytes
+
+      !$OMP CRITICAL (workspace_count)
+      total_bytes= total_bytes+ nbytes
+      peak_bytes= max(peak_bytes, total_bytes)
+      nallocations= nallocations+ 1
+      !$OMP END CRITICAL (workspace_count)
+
+      return
+   end subroutine ws_count
+
+
+   subroutine workspace_report
+      !> peak scratch memory of all threads, the largest over the MPI
+      !> ranks, and the number of allocations of rank 0
+      use wmpi
+      use para, only : stdout, cpuid
+      implicit none
+
+      integer :: ierr
+      real(dp) :: peak_mb, peak_mb_mpi
+
+      peak_mb= dble(peak_bytes)/1024d0**2
+#if defined (MPI)
+      call mpi_allreduce(peak_mb, peak_mb_mpi, 1, mpi_dp, mpi_max, mpi_cmw, ierr)
+#else
+      peak_mb_mpi= peak_mb
+#endif
+      if (cpuid==0) then
+         write(stdout, '(1x, a, f14.3, a)')'Peak scratch memory of the work arrays : ', &
+            peak_mb_mpi, ' MB per MPI rank'
+         write(stdout, '(1x, a, i14)')'Number of work array allocations       : ', nallocations
+      endif
+
+      return
+   end subroutine workspace_report
+
+
+   subroutine workspace_release
+      !> free the buffers of all threads, must be called outside of
+      !> parallel regions
+      implicit none
+
+      !$OMP PARALLEL
+      call workspace_release_thread
+      !$OMP END PARALLEL
+
+      total_bytes= 0
+      peak_bytes= 0
+      nallocations= 0
+
+      return
+   end subroutine workspace_release
+
+
+   subroutine workspace_release_thread
+      !> free the buffers of the calling thread
+      implicit none
+
+      integer :: islot, ibuf
+
+      do islot=1, nslots
+         do ibuf=1, nbuffers
+            if (allocated(buffers(ibuf, islot)%c)) deallocate(buffers(ibuf, islot)%c)
+            if (allocated(buffers(ibuf, islot)%r)) deallocate(buffers(ibuf, islot)%r)
+            if (allocated(buffers(ibuf, islot)%i)) deallocate(buffers(ibuf, islot)%i)
+         enddo
+      enddo
+
+      return
+   end subroutine workspace_release_thread
+
+end module workspace
@@ -36,6 +36,54 @@
      return
   end subroutine print_time_cost
 
+!>> Number of OpenMP threads used by the thread parallel k loops,
+!>  1 if the code is built without OpenMP
+  function get_num_threads() result(nthreads)
+     !$ use omp_lib
+     implicit none
+     integer :: nthreads
+
+     nthreads= 1
+     !$ nthreads= omp_get_max_threads()
+
+     return
+  end function get_num_threads
+
+!>> Index of the calling OpenMP thread, 0 outside of parallel regions.
+!>  Progress messages inside the k loops are only written by thread 0.
+  function get_thread_id() result(ithread)
+     !$ use omp_lib
+     implicit none
+     integer :: ithread
+
+     ithread= 0
+     !$ ithread= omp_get_thread_num()
+
+     return
+  end function get_thread_id
+
+!>> Rename the file oldname to newname, replacing newname if it exists.
+!>  Calls rename(3) of the C library, the rename subroutine of gfortran is
+!>  an extension. ierr is 0 on success.
+  subroutine rename_file(oldname, newname, ierr)
+     use iso_c_binding, only : c_int, c_char, c_null_char
+     implicit none
+     character(*), intent(in) :: oldname, newname
+     integer, intent(out) :: ierr
+
+     interface
+        function c_rename(oldpath, newpath) bind(c, name='rename') result(istat)
+           import :: c_int, c_char
+           character(kind=c_char), dimension(*), intent(in) :: oldpath, newpath
+           integer(c_int) :: istat
+        end function c_rename
+     end interface
+
+     ierr= int(c_rename(trim(oldname)//c_null_char, trim(newname)//c_null_char))
+
+     return
+  end subroutine rename_file
+
   subroutine printallocationinfo(variablename, ierr)
      use para, only : stdout
 
@@ -0,0 +1,268 @@
+!> In-process access to the bulk tight-binding model for the Python API
+!> (wannier_tools.Model). The model is set up once by wt_model_init from
+!> the wt.in in the current directory; every other routine only reads the
+!> para module state and works on a block of k points given in units of
+!> the reciprocal lattice vectors.
+!>
+!> Internally everything is in atomic units, the results are returned in
+!> eV, eV*Angstrom (velocities) and Angstrom^2 (Berry curvature).
+!> The k points are not distributed over MPI ranks, each caller gets the
+!> full result.
+!>
+!> The model also acts as a session: wt_model_reload reads the namelists
+!> again while keeping the Hamiltonian, wt_model_calculate runs the
+!> calculations switched on in CONTROL and wt_model_close frees everything.
+
+subroutine wt_model_init(nwann, ierr)
+   !> read wt.in and the Hamiltonian, return the number of Wannier orbitals
+   !> ierr= 1: MPI could not be initialised
+   !> ierr= 2: the model API needs the dense HmnR, Is_Sparse=T is not supported
+
+   use para, only : dp, Num_wann, Is_Sparse
+   implicit none
+
+   integer, intent(out) :: nwann
+   integer, intent(out) :: ierr
+
+   real(dp) :: time_init
+
+   nwann= 0
+   call wannier_tools_init(time_init, ierr)
+   if (ierr.ne.0) then
+      ierr= 1
+      return
+   endif
+
+   if (Is_Sparse) then
+      ierr= 2
+      return
+   endif
+
+   nwann= Num_wann
+
+   return
+end subroutine wt_model_init
+
+subroutine wt_model_hk(nk, kpoints, Hamk)
+   !> H(k) in eV for nk k points
+
+   use para, only : dp, Num_wann, eV2Hartree
+   implicit none
+
+   integer, intent(in) :: nk
+   real(dp), intent(in) :: kpoints(3, nk)
+   complex(dp), intent(out) :: Hamk(Num_wann, Num_wann, nk)
+
+   integer :: ik0, nkb, nk_batch
+   integer, external :: hk_batch_size
+
+   nkb= hk_batch_size(nk)
+   do ik0=1, nk, nkb
+      nk_batch= min(nkb, nk-ik0+1)
+      call ham_bulk_latticegauge_batch(nk_batch, kpoints(:, ik0:ik0+nk_batch-1), &
+         Hamk(:, :, ik0:ik0+nk_batch-1))
+   enddo
+   Hamk= Hamk/eV2Hartree
+
+   return
+end subroutine wt_model_hk
+
+subroutine wt_model_eigvals(nk, kpoints, ib1, nb, eigval)
+   !> eigenvalues ib1..ib1+nb-1 in eV for nk k points
+
+   use para, only : dp, Num_wann, eV2Hartree
+   implicit none
+
+   integer, intent(in) :: nk, ib1, nb
+   real(dp), intent(in) :: kpoints(3, nk)
+   real(dp), intent(out) :: eigval(nb, nk)
+
+   integer :: ik, ik0, nkb, nk_batch
+   real(dp), allocatable :: W(:)
+   complex(dp), allocatable :: Hamk_batch(:, :, :)
+   integer, external :: hk_batch_size
+
+   nkb= hk_batch_size(nk)
+   allocate(W(Num_wann), Hamk_batch(Num_wann, Num_wann, nkb))
+   do ik0=1, nk, nkb
+      nk_batch= min(nkb, nk-ik0+1)
+      call ham_bulk_latticegauge_batch(nk_batch, kpoints(:, ik0:ik0+nk_batch-1), Hamk_batch)
+      do ik=1, nk_batch
+         call eigensystem_c( 'N', 'U', Num_wann, Hamk_batch(:, :, ik), W)
+         eigval(:, ik0+ik-1)= W(ib1:ib1+nb-1)/eV2Hartree
+      enddo
+   enddo
+   deallocate(W, Hamk_batch)
+
+   return
+end subroutine wt_model_eigvals
+
+subroutine wt_model_eigh(nk, kpoints, ib1, nb, eigval, eigvec)
+   !> eigenvalues in eV and eigenvectors ib1..ib1+nb-1 for nk k points
+   !> eigvec(:, n, ik) is the eigenvector of eigval(n, ik)
+
+   use para, only : dp, Num_wann, eV2Hartree
+   implicit none
+
+   integer, intent(in) :: nk, ib1, nb
+   real(dp), intent(in) :: kpoints(3, nk)
+   real(dp), intent(out) :: eigval(nb, nk)
+   complex(dp), intent(out) :: eigvec(Num_wann, nb, nk)
+
+   integer :: ik, ik0, nkb, nk_batch
+   real(dp), allocatable :: W(:)
+   complex(dp), allocatable :: Hamk_batch(:, :, :)
+   integer, external :: hk_batch_size
+
+   nkb= hk_batch_size(nk)
+   allocate(W(Num_wann), Hamk_batch(Num_wann, Num_wann, nkb))
+   do ik0=1, nk, nkb
+      nk_batch= min(nkb, nk-ik0+1)
+      call ham_bulk_latticegauge_batch(nk_batch, kpoints(:, ik0:ik0+nk_batch-1), Hamk_batch)
+      do ik=1, nk_batch
+         call eigensystem_c( 'V', 'U', Num_wann, Hamk_batch(:, :, ik), W)
+         eigval(:, ik0+ik-1)= W(ib1:ib1+nb-1)/eV2Hartree
+         eigvec(:, :, ik0+ik-1)= Hamk_batch(:, ib1:ib1+nb-1, ik)
+      enddo
+   enddo
+   deallocate(W, Hamk_batch)
+
+   return
+end subroutine wt_model_eigh
+
+subroutine wt_model_velocity(nk, kpoints, velocity)
+   !> band velocities dE_n/dk in eV*Angstrom for nk k points
+
+   use para, only : dp, Num_wann, eV2Hartree, Angstrom2atomic
+   implicit none
+
+   integer, intent(in) :: nk
+   real(dp), intent(in) :: kpoints(3, nk)
+   real(dp), intent(out) :: velocity(3, Num_wann, nk)
+
+   integer :: ik, ik0, nkb, nk_batch, n
+   real(dp), allocatable :: W(:)
+   complex(dp), allocatable :: Hamk_batch(:, :, :), Vmn_Ham(:, :, :)
+   integer, external :: hk_batch_size
+
+   nkb= hk_batch_size(nk)
+   allocate(W(Num_wann), Hamk_batch(Num_wann, Num_wann, nkb))
+   allocate(Vmn_Ham(Num_wann, Num_wann, 3))
+   do ik0=1, nk, nkb
+      nk_batch= min(nkb, nk-ik0+1)
+      call ham_bulk_latticegauge_batch(nk_batch, kpoints(:, ik0:ik0+nk_batch-1), Hamk_batch)
+      do ik=1, nk_batch
+         call eigensystem_c( 'V', 'U', Num_wann, Hamk_batch(:, :, ik), W)
+         call dHdk_latticegauge_Ham(kpoints(:, ik0+ik-1), W, Hamk_batch(:, :, ik), Vmn_Ham)
+         do n=1, Num_wann
+            velocity(:, n, ik0+ik-1)= real(Vmn_Ham(n, n, :))
+         enddo
+      enddo
+   enddo
+   velocity= velocity/eV2Hartree/Angstrom2atomic
+   deallocate(W, Hamk_batch, Vmn_Ham)
+
+   return
+end subroutine wt_model_velocity
+
+subroutine wt_model_berry_curvature(nk, kpoints, Omega)
+   !> Berry curvature (Omega_x, Omega_y, Omega_z) of every band in
+   !> Angstrom^2 for nk k points
+
+   use para, only : dp, Num_wann, Angstrom2atomic
+   implicit none
+
+   integer, intent(in) :: nk
+   real(dp), intent(in) :: kpoints(3, nk)
+   real(dp), intent(out) :: Omega(3, Num_wann, nk)
+
+   integer :: ik, ik0, nkb, nk_batch
+   real(dp), allocatable :: W(:), Omega_BerryCurv(:, :)
+   complex(dp), allocatable :: Hamk_batch(:, :, :), Vmn_Ham(:, :, :), Dmn_Ham(:, :, :)
+   integer, external :: hk_batch_size
+
+   nkb= hk_batch_size(nk)
+   allocate(W(Num_wann), Hamk_batch(Num_wann, Num_wann, nkb))
+   allocate(Vmn_Ham(Num_wann, Num_wann, 3), Dmn_Ham(Num_wann, Num_wann, 3))
+   allocate(Omega_BerryCurv(Num_wann, 3))
+   do ik0=1, nk, nkb
+      nk_batch= min(nkb, nk-ik0+1)
+      call ham_bulk_latticegauge_batch(nk_batch, kpoints(:, ik0:ik0+nk_batch-1), Hamk_batch)
+      do ik=1, nk_batch
+         call eigensystem_c( 'V', 'U', Num_wann, Hamk_batch(:, :, ik), W)
+         call dHdk_latticegauge_Ham(kpoints(:, ik0+ik-1), W, Hamk_batch(:, :, ik), Vmn_Ham)
+         call get_Dmn_Ham(W, Vmn_Ham, Dmn_Ham)
+         call Berry_curvature_singlek_allbands(Dmn_Ham, Omega_BerryCurv)
+         Omega(:, :, ik0+ik-1)= transpose(Omega_BerryCurv)
+      enddo
+   enddo
+   Omega= Omega/Angstrom2atomic/Angstrom2atomic
+   deallocate(W, Hamk_batch, Vmn_Ham, Dmn_Ham, Omega_BerryCurv)
+
+   return
+end subroutine wt_model_berry_curvature
+
+subroutine wt_model_reload(fname, ierr)
+   !> Read the input file fname again, without the Hamiltonian. Only
+   !> parameters that do not change HmnR may differ from the first read.
+   !> ierr= 1: Num_wann differs from the loaded Hamiltonian
+
+   use para
+   implicit none
+
+   character(*), intent(in) :: fname
+   integer, intent(out) :: ierr
+
+   integer :: nwann_loaded
+
+   ierr= 0
+   nwann_loaded= Num_wann
+
+   call wannier_tools_release(.true.)
+   Input_file= fname
+   call wannier_tools_setup
+   Input_file= 'wt.in'
+
+   if (Num_wann/=nwann_loaded) then
+      ierr= 1
+      return
+   endif
+
+   !> as in readNormalHmnR, the Zeeman term made the Hamiltonian spinful
+   if (Add_Zeeman_Field) SOC= 1
+
+   if (.not.Is_Sparse) call get_hmnr_cell(Cell_defined_by_surface)
+
+   return
+end subroutine wt_model_reload
+
+subroutine wt_model_calculate
+   !> Run the calculations switched on in the CONTROL namelist
+
+   use wmpi, only : cpuid
+   use para, only : dp, stdout
+   implicit none
+
+   real(dp) :: time_start, time_end
+
+   call now(time_start)
+   call wannier_tools_dispatch
+   call now(time_end)
+   if(cpuid.eq.0)write(stdout, *)' '
+   call print_time_cost(time_start, time_end, 'calculate')
+
+   return
+end subroutine wt_model_calculate
+
+subroutine wt_model_close
+   !> Free the Hamiltonian and all input arrays, close WT.out
+
+   use wmpi, only : cpuid
+   use para, only : stdout
+   implicit none
+
+   call wannier_tools_release(.false.)
+   if (cpuid==0) close(stdout)
+
+   return
+end subroutine wt_model_close
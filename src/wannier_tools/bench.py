@@ -0,0 +1,475 @@
+"""
+Benchmarks of the core kernels on synthetic tight-binding models.
+
+``python -m wannier_tools.bench`` writes random Hermitian models of the
+requested sizes (orbitals x R vectors) in the wannier90_hr.dat format,
+times the kernels below on each of them for fixed numbers of k points and
+writes the rates to a JSON report:
+
+    hr_load_text   reading the text hr file              MB/s
+    hr_load_cache  reading the binary sidecar <Hrfile>.wtb MB/s of hr text
+    hk             H(k), Model.hk                        k/s
+    eigh           H(k) and eigensystem_c, Model.eigh    k/s
+    surfgreen      SlabSS_calc, surfgreen_1985 per (k, E) (k,E)/s
+    wilson_loop    WannierCenter_calc on KPLANE_BULK     k/s
+    lanczos_dos    LandauLevel_k_dos_calc, Lanczos DOS   k/s
+
+Every kernel is run --repeat times and the shortest time is kept. The
+calculations are timed as a whole through Model.calculate, including
+reading the namelists and writing their output files.
+
+    python -m wannier_tools.bench --sizes 8x50 64x500 -o new.json
+    python -m wannier_tools.bench --sizes 8x50 64x500 --baseline old.json
+
+With --baseline, the rates are compared with those of an earlier report
+for the same kernel, model size and number of k points, and the exit status
+is 1 if one of them dropped by more than --tolerance. The models are
+generated with a fixed seed, so reports from different builds or machines
+time the same Hamiltonians. Under mpirun the calculations run on all
+ranks and the other kernels on every rank at the same time. Rank 0 writes
+the models, the binary sidecar and the report, and the other ranks wait
+for them.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+KERNELS = ('hr_load_text', 'hr_load_cache', 'hk', 'eigh', 'surfgreen', 'wilson_loop',
+           'lanczos_dos')
+
+# default model sizes, num_wann x nrpts
+DEFAULT_SIZES = ('8x50', '32x200', '64x300')
+
+# k points per Wilson loop of WannierCenter_calc once the adaptive refinement
+# is switched off, twice its starting mesh of 32
+_WILSON_NK = 64
+
+# environment variables that change the timings, stored in the report
+_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+             'VECLIB_MAXIMUM_THREADS')
+
+_INPUT_TEMPLATE = """&TB_FILE
+Hrfile = '{hrfile}'
+/
+
+&CONTROL
+/
+
+&SYSTEM
+NSLAB = 4
+NumOccupied = {nocc}
+SOC = 0
+E_FERMI = 0.0
+/
+
+&PARAMETERS
+Nk1 = 10
+Nk2 = 10
+Nk3 = 10
+NP = {np}
+OmegaNum = 10
+OmegaMin = -1.0
+OmegaMax = 1.0
+Eta_Arc = 0.01
+Magp = 1
+Magq = 4
+NumLCZVecs = 100
+/
+
+LATTICE
+Angstrom
+3.0 0.0 0.0
+0.0 3.0 0.0
+0.0 0.0 3.0
+
+ATOM_POSITIONS
+{natoms}
+Direct
+{atoms}
+
+PROJECTORS
+{projectors}
+{orbitals}
+
+SURFACE
+ 1  0  0
+ 0  1  0
+
+KPATH_BULK
+1
+G 0.0 0.0 0.0 X 0.5 0.0 0.0
+
+KPATH_SLAB
+1
+G 0.0 0.0 X 0.5 0.0
+
+KPLANE_BULK
+ 0.00  0.00  0.00
+ 1.00  0.00  0.00
+ 0.00  1.00  0.00
+
+KCUBE_BULK
+ 0.00  0.00  0.00
+ 1.00  0.00  0.00
+ 0.00  1.00  0.00
+ 0.00  0.00  1.00
+"""
+
+
+def _mpi_rank():
+    """MPI rank from the launcher environment, 0 without MPI."""
+    for var in ('PMI_RANK', 'OMPI_COMM_WORLD_RANK', 'SLURM_PROCID'):
+        if var in os.environ:
+            return int(os.environ[var])
+    return 0
+
+
+def parse_size(size):
+    """
+    Parse a model size 'NWxNR'.
+
+    Parameters:
+    size (str): number of orbitals and of R vectors, e.g. '64x500'.
+
+    Returns:
+    tuple: (num_wann, nrpts). nrpts is rounded up to an odd number, the R
+        vectors come in pairs R, -R around R= 0.
+    """
+    try:
+        num_wann, nrpts = (int(x) for x in size.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"model size must look like 64x500, got {size!r}") from None
+    if num_wann < 2 or nrpts < 1:
+        raise ValueError(f"model size needs at least 2 orbitals and 1 R vector, got {size!r}")
+    return num_wann, nrpts + 1 - nrpts % 2
+
+
+def _r_vectors(nrpts):
+    """R= 0 and the (nrpts-1)/2 shortest pairs R, -R, the positive one of each pair first."""
+    rmax = 1
+    while (2*rmax + 1)**3 < nrpts:
+        rmax += 1
+    box = [r for r in itertools.product(range(-rmax, rmax + 1), repeat=3) if r > (0, 0, 0)]
+    box.sort(key=lambda r: (r[0]**2 + r[1]**2 + r[2]**2, r))
+    half = box[:(nrpts - 1)//2]
+    return [(0, 0, 0)] + half, half
+
+
+def write_model(directory, num_wann, nrpts, seed=0):
+    """
+    Write a random Hermitian tight-binding model and a wt.in for it, to
+    the subdirectory synth_<num_wann>x<nrpts> of directory.
+
+    The hoppings are complex Gaussian numbers that decay with |R|, the
+    on-site energies are spread over [-2, 2] eV. H(-R) is the conjugate
+    transpose of H(R), so H(k) is Hermitian. There is one s orbital per
+    atom, at random positions in a cubic cell, and NP covers the longest
+    hopping along the third lattice vector.
+
+    Parameters:
+    directory (str): Directory for the models, created if needed.
+    num_wann (int): Number of orbitals.
+    nrpts (int): Number of R vectors, odd.
+    seed (int): Seed of the random numbers.
+
+    Returns:
+    str: path of the wt.in.
+    """
+    directory = os.path.join(directory, f'synth_{num_wann}x{nrpts}')
+    os.makedirs(directory, exist_ok=True)
+    hrfile = 'wannier90_hr.dat'
+    hr_path = os.path.join(directory, hrfile)
+    input_path = os.path.join(directory, 'wt.in')
+    if os.path.exists(input_path):
+        return input_path
+
+    rng = np.random.default_rng(seed)
+    rvecs, half = _r_vectors(nrpts)
+    hoppings = {}
+    onsite = rng.normal(size=(num_wann, num_wann)) + 1j*rng.normal(size=(num_wann, num_wann))
+    onsite = 0.1*(onsite + onsite.conj().T) + np.diag(np.linspace(-2, 2, num_wann))
+    hoppings[(0, 0, 0)] = onsite
+    for r in half:
+        scale = 0.5*np.exp(-np.sqrt(r[0]**2 + r[1]**2 + r[2]**2))
+        h = scale*(rng.normal(size=(num_wann, num_wann)) + 1j*rng.normal(size=(num_wann, num_wann)))
+        hoppings[r] = h
+        hoppings[tuple(-x for x in r)] = h.conj().T
+    rvecs = rvecs + [tuple(-x for x in r) for r in half]
+
+    m, n = np.meshgrid(np.arange(1, num_wann + 1), np.arange(1, num_wann + 1), indexing='ij')
+    m = m.T.ravel()
+    n = n.T.ravel()
+    tmp_path = hr_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(f'synthetic model, seed {seed}\n{num_wann:12d}\n{nrpts:12d}\n')
+        for i in range(0, nrpts, 15):
+            f.write(''.join('%5d' % 1 for _ in range(min(15, nrpts - i))) + '\n')
+        for r in rvecs:
+            # the hr file runs over m fastest: H(R)[m-1, n-1]
+            h = hoppings[r].T.ravel()
+            block = np.column_stack([np.tile(r, (num_wann*num_wann, 1)), m, n, h.real, h.imag])
+            np.savetxt(f, block, fmt='%5d%5d%5d%5d%5d%12.6f%12.6f')
+    os.replace(tmp_path, hr_path)
+
+    positions = rng.random((num_wann, 3))
+    atoms = '\n'.join(f'A{i + 1} {p[0]:.6f} {p[1]:.6f} {p[2]:.6f}' for i, p in enumerate(positions))
+    text = _INPUT_TEMPLATE.format(
+        hrfile=hrfile, nocc=num_wann//2, np=max(1, max(abs(r[2]) for r in rvecs)),
+        natoms=num_wann, atoms=atoms, projectors=' '.join('1' for _ in range(num_wann)),
+        orbitals='\n'.join(f'A{i + 1} s' for i in range(num_wann)))
+    with open(input_path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(input_path + '.tmp', input_path)
+    return input_path
+
+
+def _best_time(func, repeat):
+    """Shortest wall time of repeat calls of func()."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _kpoints(nk, seed=1):
+    """nk random k points in units of the reciprocal lattice vectors."""
+    return np.random.default_rng(seed).random((nk, 3))
+
+
+def run_benchmarks(input_file, kernels, counts, repeat):
+    """
+    Time the kernels on the model of one wt.in.
+
+    Parameters:
+    input_file (str): wt.in written by write_model.
+    kernels (sequence of str): names from KERNELS.
+    counts (dict): number of k points per kernel, for surfgreen the number
+        of k points times the number of energies, for wilson_loop the
+        number of Wilson loops Nk2.
+    repeat (int): number of runs of each kernel, the shortest is kept.
+
+    Returns:
+    list of dict: one entry per kernel with its count, unit, time and rate.
+    """
+    from .io import ensure_hr_cache, hr_cache_path, read_tb_file_namelist
+    from .model import Model
+
+    hr_path = read_tb_file_namelist(input_file)['hrfile']
+    hr_path = os.path.join(os.path.dirname(os.path.abspath(input_file)), hr_path)
+    hr_mb = os.path.getsize(hr_path)/1e6
+    results = []
+
+    def add(kernel, count, unit, seconds):
+        results.append({'kernel': kernel, 'count': count, 'unit': unit,
+                        'seconds': seconds, 'rate': count/seconds if seconds > 0 else None})
+
+    def load(cache):
+        Model.from_input(input_file, hr_cache=cache).close()
+
+    # the first model of a process also starts MPI and the runtime libraries
+    if not run_benchmarks.warm:
+        load(False)
+        run_benchmarks.warm = True
+
+    if 'hr_load_text' in kernels:
+        add('hr_load_text', hr_mb, 'MB', _best_time(lambda: load(False), repeat))
+    if 'hr_load_cache' in kernels:
+        if _mpi_rank() == 0:
+            ensure_hr_cache(input_file)
+        else:
+            _wait_for(hr_cache_path(hr_path))
+        add('hr_load_cache', hr_mb, 'MB', _best_time(lambda: load(True), repeat))
+
+    model = Model.from_input(input_file, hr_cache=False)
+    try:
+        model.hk(_kpoints(1))
+        if 'hk' in kernels:
+            kpts = _kpoints(counts['hk'])
+            add('hk', counts['hk'], 'k', _best_time(lambda: model.hk(kpts), repeat))
+        if 'eigh' in kernels:
+            kpts = _kpoints(counts['eigh'])
+            add('eigh', counts['eigh'], 'k', _best_time(lambda: model.eigh(kpts), repeat))
+        if 'surfgreen' in kernels:
+            nk, ne = counts['surfgreen']
+            params = {'Nk1': nk, 'OmegaNum': ne}
+            add('surfgreen', nk*ne, '(k,E)', _best_time(
+                lambda: model.calculate('SlabSS_calc', PARAMETERS=params), repeat))
+        if 'wilson_loop' in kernels:
+            # the WCC are refined adaptively along and across the loops; with
+            # these tolerances every loop is evaluated once on _WILSON_NK points
+            nk2 = counts['wilson_loop']
+            params = {'Nk2': nk2, 'wcc_calc_tol': 1.0, 'wcc_neighbour_tol': 1e12}
+            add('wilson_loop', _WILSON_NK*nk2, 'k', _best_time(
+                lambda: model.calculate('WannierCenter_calc', PARAMETERS=params), repeat))
+        if 'lanczos_dos' in kernels:
+            params = {'Nk1': counts['lanczos_dos']}
+            add('lanczos_dos', counts['lanczos_dos'], 'k', _best_time(
+                lambda: model.calculate('LandauLevel_k_dos_calc', PARAMETERS=params), repeat))
+    finally:
+        model.close()
+    return results
+
+
+run_benchmarks.warm = False
+
+
+def compare(report, baseline, tolerance):
+    """
+    Compare the rates of a report with those of a baseline report.
+
+    Entries are matched on kernel, model size and count.
+
+    Parameters:
+    report (dict): report of this run.
+    baseline (dict): earlier report.
+    tolerance (float): relative drop of a rate that counts as regression.
+
+    Returns:
+    list of dict: the matched entries with the baseline rate, the ratio
+        new/baseline and whether it is a regression.
+    """
+    def key(entry):
+        return entry['kernel'], entry['num_wann'], entry['nrpts'], entry['count']
+
+    base = {key(e): e for e in baseline.get('results', [])}
+    rows = []
+    for entry in report['results']:
+        old = base.get(key(entry))
+        if old is None or not old.get('rate') or not entry.get('rate'):
+            continue
+        ratio = entry['rate']/old['rate']
+        rows.append(dict(entry, baseline_rate=old['rate'], ratio=ratio,
+                         regression=ratio < 1 - tolerance))
+    return rows
+
+
+def _print_results(results):
+    print(f"{'kernel':14s} {'num_wann':>8s} {'nrpts':>6s} {'count':>10s} {'seconds':>10s}  rate")
+    for e in results:
+        rate = f"{e['rate']:.4g} {e['unit']}/s" if e['rate'] else '-'
+        print(f"{e['kernel']:14s} {e['num_wann']:8d} {e['nrpts']:6d} {e['count']:10.4g} "
+              f"{e['seconds']:10.4f}  {rate}")
+
+
+def _print_comparison(rows, tolerance):
+    print(f"\n{'kernel':14s} {'num_wann':>8s} {'nrpts':>6s} {'baseline':>12s} {'new':>12s} {'ratio':>7s}")
+    for r in rows:
+        flag = '  REGRESSION' if r['regression'] else ''
+        print(f"{r['kernel']:14s} {r['num_wann']:8d} {r['nrpts']:6d} {r['baseline_rate']:12.4g} "
+              f"{r['rate']:12.4g} {r['ratio']:7.3f}{flag}")
+    nbad = sum(r['regression'] for r in rows)
+    print(f"\n{len(rows)} kernels compared, {nbad} slower than the baseline by more than "
+          f"{tolerance:.0%}")
+
+
+def _wait_for(path, timeout=3600):
+    """Wait until rank 0 has written path."""
+    start = time.time()
+    while not os.path.exists(path):
+        if time.time() - start > timeout:
+            raise TimeoutError(f"{path} was not written by rank 0")
+        time.sleep(0.5)
+
+
+def main(argv=None):
+    """Command line interface of python -m wannier_tools.bench."""
+    parser = argparse.ArgumentParser(
+        prog='python -m wannier_tools.bench',
+        description="Time the WannierTools kernels on synthetic tight-binding models.")
+    parser.add_argument('--sizes', nargs='+', default=list(DEFAULT_SIZES),
+                        help="model sizes as NUM_WANNxNRPTS (default: %(default)s)")
+    parser.add_argument('--kernels', nargs='+', default=list(KERNELS), choices=KERNELS,
+                        metavar='KERNEL', help=f"kernels to time, from {', '.join(KERNELS)}")
+    parser.add_argument('--nk-hk', type=int, default=2000, help="k points for hk (default: %(default)s)")
+    parser.add_argument('--nk-eigh', type=int, default=500, help="k points for eigh (default: %(default)s)")
+    parser.add_argument('--nk-surfgreen', type=int, nargs=2, default=[10, 10], metavar=('NK', 'NE'),
+                        help="k points and energies for surfgreen (default: %(default)s)")
+    parser.add_argument('--nk-wilson', type=int, default=20,
+                        help=f"Wilson loops of {_WILSON_NK} k points for wilson_loop (default: %(default)s)")
+    parser.add_argument('--nk-lanczos', type=int, default=4,
+                        help="k points for lanczos_dos (default: %(default)s)")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="runs per kernel, the shortest is kept (default: %(default)s)")
+    parser.add_argument('-o', '--output', default='wt_bench.json',
+                        help="JSON report to write (default: %(default)s)")
+    parser.add_argument('--baseline', help="earlier report to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="relative drop of a rate reported as regression (default: %(default)s)")
+    parser.add_argument('--workdir', help="directory for the models and the output files of the "
+                        "calculations, kept afterwards; a temporary directory by default")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the models (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    rank = _mpi_rank()
+    sizes = [parse_size(s) for s in args.sizes]
+    counts = {'hk': args.nk_hk, 'eigh': args.nk_eigh, 'surfgreen': tuple(args.nk_surfgreen),
+              'wilson_loop': args.nk_wilson, 'lanczos_dos': args.nk_lanczos}
+
+    workdir = args.workdir
+    if workdir is None:
+        if 'OMPI_COMM_WORLD_SIZE' in os.environ or 'PMI_SIZE' in os.environ:
+            parser.error("--workdir is needed under mpirun, on a file system shared by all ranks")
+        workdir = tempfile.mkdtemp(prefix='wt_bench_')
+    workdir = os.path.abspath(workdir)
+
+    from . import __version__
+    report = {
+        'wannier_tools': __version__,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'mpi_ranks': int(os.environ.get('OMPI_COMM_WORLD_SIZE', os.environ.get('PMI_SIZE', 1))),
+        'env': {var: os.environ.get(var) for var in _ENV_VARS},
+        'repeat': args.repeat,
+        'results': [],
+    }
+    try:
+        for num_wann, nrpts in sizes:
+            if rank == 0:
+                print(f"Model {num_wann} orbitals x {nrpts} R vectors", flush=True)
+                input_file = write_model(workdir, num_wann, nrpts, seed=args.seed)
+            else:
+                input_file = os.path.join(workdir, f'synth_{num_wann}x{nrpts}', 'wt.in')
+                _wait_for(input_file)
+            for entry in run_benchmarks(input_file, args.kernels, counts, args.repeat):
+                report['results'].append(dict(entry, num_wann=num_wann, nrpts=nrpts))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if rank != 0:
+        return 0
+
+    print()
+    _print_results(report['results'])
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"\nReport written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.tolerance)
+        _print_comparison(rows, args.tolerance)
+        if any(r['regression'] for r in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,6 +15,7 @@ import platform
 from pathlib import Path
 
 from . import run, create_sample_input
+from .model import _configure_threads
 
 def main():
     """Main command line interface"""
@@ -28,6 +29,7 @@ Examples:
   wt-py -o output.log      # Redirect output to file
   wt-py --sample           # Create sample input file
   wt-py -i input.in -o out.log  # Custom input and output
+  wt-py -n 2 -t 4          # 2 MPI processes with 4 threads each
 
 Note: For parallel computation, make sure MPI is installed:
   macOS: brew install open-mpi
@@ -54,6 +56,26 @@ Note: For parallel computation, make sure MPI is installed:
         help='Number of processes for parallel run (default: 1)'
     )
 
+    parser.add_argument(
+        '-t', '--threads',
+        type=int,
+        default=None,
+        help='Number of OpenMP threads per process for the k loops '
+             '(default: OMP_NUM_THREADS, or 1)'
+    )
+
+    parser.add_argument(
+        '--no-hr-cache',
+        action='store_true',
+        help='Do not use the binary cache <Hrfile>.wtb, always parse the hr file'
+    )
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue a killed run from its checkpoint files wt_checkpoint_*.bin'
+    )
+
     # internal flag used to stop recursive spawning
     parser.add_argument('--no-spawn', action='store_true', help=argparse.SUPPRESS)
     
@@ -75,6 +97,11 @@ Note: For parallel computation, make sure MPI is installed:
         create_sample_input()
         print("Sample input file created. You can now edit wt.in and run the calculation.")
         return 0
+
+    try:
+        threads = _configure_threads(args.threads)
+    except ValueError as e:
+        parser.error(str(e))
     
     # Parallel execution wrapper -------------------------------------------------
     if not args.no_spawn and args.np > 1:
@@ -146,6 +173,12 @@ Note: For parallel computation, make sure MPI is installed:
                     new_cmd.extend([flag, val])
             if args.sample:
                 new_cmd.append('--sample')
+            if args.no_hr_cache:
+                new_cmd.append('--no-hr-cache')
+            if args.resume:
+                new_cmd.append('--resume')
+            if args.threads is not None:
+                new_cmd.extend(['--threads', str(threads)])
 
             # Set up environment for bundled MPI
             env = os.environ.copy()
@@ -204,12 +237,20 @@ Note: For parallel computation, make sure MPI is installed:
         
         # Fallback for all systems if no mpirun/mpiexec was found
         else:
-            print(f"[ERROR] Requested np > 1 on {sysname} but no mpirun/mpiexec found (bundled or system).\n"
-                  "Falling back to serial execution.")
+            if args.threads is None:
+                print(f"[ERROR] Requested np > 1 on {sysname} but no mpirun/mpiexec found (bundled or system).\n"
+                      "Falling back to serial execution.")
+            else:
+                # the k loops are thread parallel, so the cores of the
+                # missing processes are given to one process as threads
+                threads = _configure_threads(threads * args.np)
+                print(f"[INFO] No mpirun/mpiexec found (bundled or system) for np = {args.np}, "
+                      f"running one process with {threads} OpenMP threads instead.")
 
 
     # Run WannierTools (serial or already-spawned)
-    return run(input_file=args.input, output_file=args.output)
+    return run(input_file=args.input, output_file=args.output, hr_cache=not args.no_hr_cache,
+               resume=args.resume)
 
 if __name__ == '__main__':
     sys.exit(main()) 
\ No newline at end of file
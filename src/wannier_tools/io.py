@@ -0,0 +1,450 @@
+"""
+Readers for the tight-binding files used by WannierTools.
+
+The hr reader follows the same strategy as ``readNormalHmnR`` in the
+Fortran code: the data lines are parsed in large blocks and the R vectors
+are located through a hash table, so loading is linear in the file size.
+
+The first run through wt-py writes a binary sidecar ``<Hrfile>.wtb`` next
+to the hr file. Later runs memory map it from Python, and the Fortran code
+reads it directly instead of parsing the text.
+"""
+import hashlib
+import os
+import re
+import struct
+from itertools import islice
+
+import numpy as np
+
+# lines per parsing block, about 50 MB of text for a standard hr file
+_BLOCK_LINES = 1 << 20
+
+
+def _read_header(f):
+    """Read the header of a wannier90_hr.dat file: num_wann, nrpts, ndegen."""
+    f.readline()  # comment line
+    num_wann = int(f.readline().split()[0])
+    nrpts = int(f.readline().split()[0])
+    if num_wann <= 0 or nrpts <= 0:
+        raise ValueError(f"Invalid hr header: num_wann={num_wann}, nrpts={nrpts}")
+
+    ndegen = []
+    while len(ndegen) < nrpts:
+        line = f.readline()
+        if not line:
+            raise ValueError("Unexpected end of file while reading the R point degeneracies")
+        ndegen.extend(int(x) for x in line.split())
+    return num_wann, nrpts, np.array(ndegen[:nrpts], dtype=np.int32)
+
+
+def _parse_hr_data(f, path, nrpts, irvec, hmnr):
+    """Parse the data lines of an hr file into irvec and hmnr in place."""
+    num_wann = hmnr.shape[1]
+
+    # hash index from the packed R vector to its position in irvec
+    rindex = {}
+    nlines = nrpts * num_wann * num_wann
+    nread = 0
+    while nread < nlines:
+        lines = list(islice(f, min(_BLOCK_LINES, nlines - nread)))
+        if not lines:
+            raise ValueError(f"{path}: expected {nlines} data lines but found {nread}")
+
+        data = np.fromstring(''.join(lines), sep=' ')
+        if data.size != 7 * len(lines):
+            raise ValueError(f"{path}: malformed data line after line {nread}")
+        data = data.reshape(-1, 7)
+        ints = np.rint(data[:, :5]).astype(np.int64)
+
+        # pack (i1, i2, i3) into one integer key, then only the few
+        # distinct R vectors of this block go through the hash table
+        keys = ((ints[:, 0] + 2**20) << 42) | ((ints[:, 1] + 2**20) << 21) | (ints[:, 2] + 2**20)
+        ukeys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        uidx = np.empty(len(ukeys), dtype=np.int64)
+        for j in np.argsort(first):
+            key = int(ukeys[j])
+            ir = rindex.get(key)
+            if ir is None:
+                ir = len(rindex)
+                if ir >= nrpts:
+                    raise ValueError(f"{path}: more R vectors than nrpts={nrpts}")
+                rindex[key] = ir
+                irvec[ir] = ints[first[j], :3]
+            uidx[j] = ir
+
+        hmnr[uidx[inverse].reshape(-1), ints[:, 3] - 1, ints[:, 4] - 1] = data[:, 5] + 1j * data[:, 6]
+        nread += len(lines)
+
+
+def load_hr(path, cache=False):
+    """
+    Load a tight-binding Hamiltonian in the Wannier90 hr format.
+
+    Parameters:
+    path (str): Path to the wannier90_hr.dat file.
+    cache (bool): If True, use the binary sidecar ``path + '.wtb'`` and
+        create it when it is missing or outdated. The arrays are then
+        read-only memory maps of the sidecar.
+
+    Returns:
+    irvec (ndarray): int32 array of shape (nrpts, 3), R vectors in units of
+        the lattice vectors, in the order they appear in the file.
+    ndegen (ndarray): int32 array of shape (nrpts,), Wigner-Seitz degeneracies.
+    HmnR (ndarray): complex128 array of shape (nrpts, num_wann, num_wann),
+        HmnR[ir, m-1, n-1] is the hopping <m, 0|H|n, R> in eV as written in
+        the file (no Fermi level shift, no unit conversion).
+    """
+    if cache:
+        cache_path = hr_cache_path(path)
+        try:
+            if not hr_cache_is_valid(path, cache_path):
+                write_hr_cache(path, cache_path)
+            return load_hr_cache(cache_path)
+        except OSError:
+            # e.g. a read-only directory, fall back to the text file
+            pass
+
+    with open(path, 'r') as f:
+        num_wann, nrpts, ndegen = _read_header(f)
+        irvec = np.zeros((nrpts, 3), dtype=np.int32)
+        hmnr = np.zeros((nrpts, num_wann, num_wann), dtype=np.complex128)
+        _parse_hr_data(f, path, nrpts, irvec, hmnr)
+
+    return irvec, ndegen, hmnr
+
+
+# ------------------------------------------------------------------
+# Binary sidecar of the hr file (.wtb)
+#
+# A 128 byte little endian header followed by three contiguous blocks:
+#   0   magic b'WTHRBIN\0'
+#   8   int32 version, num_wann, nrpts, reserved
+#   24  int64 size and mtime (ns) of the hr file
+#   40  int64 offsets of the ndegen, irvec and HmnR blocks
+#   64  sha256 of the hr file
+#   ndegen int32 (nrpts), irvec int32 (nrpts, 3) and HmnR complex128
+#   stored as the Fortran array HmnR(num_wann, num_wann, nrpts) in eV.
+# The layout is read by open_hr_cache/read_hr_cache in readHmnR.f90, keep
+# both sides in sync and bump the version when it changes.
+# ------------------------------------------------------------------
+
+WTB_MAGIC = b'WTHRBIN\0'
+WTB_VERSION = 1
+_WTB_HEADER = struct.Struct('<8s4i5q32s')
+_WTB_HEADER_SIZE = 128
+_WTB_ALIGN = 64
+
+
+def hr_cache_path(path):
+    """Return the path of the binary sidecar of an hr file."""
+    return os.fspath(path) + '.wtb'
+
+
+def _file_checksum(path):
+    """sha256 of a file, read in chunks."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 22), b''):
+            sha.update(chunk)
+    return sha.digest()
+
+
+def _align(offset):
+    return (offset + _WTB_ALIGN - 1) // _WTB_ALIGN * _WTB_ALIGN
+
+
+def _read_cache_header(cache_path):
+    """Return the header fields of a .wtb file as a dict, None if it is not one."""
+    with open(cache_path, 'rb') as f:
+        raw = f.read(_WTB_HEADER_SIZE)
+    if len(raw) < _WTB_HEADER_SIZE:
+        return None
+    (magic, version, num_wann, nrpts, _, size, mtime_ns,
+     off_ndegen, off_irvec, off_hmnr, checksum) = _WTB_HEADER.unpack_from(raw)
+    if magic != WTB_MAGIC or version != WTB_VERSION:
+        return None
+    return dict(num_wann=num_wann, nrpts=nrpts, size=size, mtime_ns=mtime_ns,
+                offsets=(off_ndegen, off_irvec, off_hmnr), checksum=checksum)
+
+
+def hr_cache_is_valid(path, cache_path=None):
+    """
+    Check whether the binary sidecar matches the current hr file.
+
+    The size and modification time of the hr file are compared first, the
+    sha256 checksum is only computed when the modification time changed.
+
+    Parameters:
+    path (str): Path to the wannier90_hr.dat file.
+    cache_path (str or None): Path to the sidecar (default: path + '.wtb').
+    """
+    if cache_path is None:
+        cache_path = hr_cache_path(path)
+    if not os.path.isfile(cache_path):
+        return False
+    header = _read_cache_header(cache_path)
+    if header is None:
+        return False
+
+    st = os.stat(path)
+    if st.st_size != header['size']:
+        return False
+    if st.st_mtime_ns == header['mtime_ns']:
+        return True
+    if _file_checksum(path) != header['checksum']:
+        return False
+
+    # same content, e.g. the file was copied or touched: record the new mtime
+    try:
+        with open(cache_path, 'r+b') as f:
+            f.seek(32)
+            f.write(struct.pack('<q', st.st_mtime_ns))
+    except OSError:
+        pass
+    return True
+
+
+def write_hr_cache(path, cache_path=None):
+    """
+    Write the binary sidecar of an hr file.
+
+    The data are parsed straight into a memory map of the new file, so the
+    whole Hamiltonian is never held in memory. The file is written under a
+    temporary name and renamed, readers never see a partial cache.
+
+    Parameters:
+    path (str): Path to the wannier90_hr.dat file.
+    cache_path (str or None): Path to the sidecar (default: path + '.wtb').
+
+    Returns:
+    str: Path to the sidecar.
+    """
+    if cache_path is None:
+        cache_path = hr_cache_path(path)
+    st = os.stat(path)
+    checksum = _file_checksum(path)
+
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(path, 'r') as f:
+            num_wann, nrpts, ndegen = _read_header(f)
+            off_ndegen = _WTB_HEADER_SIZE
+            off_irvec = _align(off_ndegen + 4 * nrpts)
+            off_hmnr = _align(off_irvec + 12 * nrpts)
+            total = off_hmnr + 16 * nrpts * num_wann * num_wann
+
+            with open(tmp_path, 'wb') as out:
+                out.write(_WTB_HEADER.pack(WTB_MAGIC, WTB_VERSION, num_wann, nrpts, 0,
+                                           st.st_size, st.st_mtime_ns,
+                                           off_ndegen, off_irvec, off_hmnr, checksum))
+                out.truncate(total)
+
+            irvec = np.memmap(tmp_path, dtype='<i4', mode='r+', offset=off_irvec, shape=(nrpts, 3))
+            hmnr = np.memmap(tmp_path, dtype='<c16', mode='r+', offset=off_hmnr,
+                             shape=(nrpts, num_wann, num_wann))
+            # HmnR(m, n, ir) in Fortran order is [ir, n, m] in C order
+            _parse_hr_data(f, path, nrpts, irvec, hmnr.transpose(0, 2, 1))
+            hmnr.flush()
+            irvec.flush()
+            del hmnr, irvec
+
+        with open(tmp_path, 'r+b') as out:
+            out.seek(off_ndegen)
+            out.write(ndegen.astype('<i4').tobytes())
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return cache_path
+
+
+def load_hr_cache(cache_path):
+    """
+    Memory map the binary sidecar of an hr file.
+
+    Parameters:
+    cache_path (str): Path to the .wtb file.
+
+    Returns:
+    irvec, ndegen, HmnR: read-only arrays with the same shapes and meaning
+        as returned by load_hr.
+    """
+    header = _read_cache_header(cache_path)
+    if header is None:
+        raise ValueError(f"{cache_path}: not a WannierTools binary hr cache (version {WTB_VERSION})")
+    num_wann, nrpts = header['num_wann'], header['nrpts']
+    off_ndegen, off_irvec, off_hmnr = header['offsets']
+
+    ndegen = np.memmap(cache_path, dtype='<i4', mode='r', offset=off_ndegen, shape=(nrpts,))
+    irvec = np.memmap(cache_path, dtype='<i4', mode='r', offset=off_irvec, shape=(nrpts, 3))
+    hmnr = np.memmap(cache_path, dtype='<c16', mode='r', offset=off_hmnr,
+                     shape=(nrpts, num_wann, num_wann))
+    return irvec, ndegen, hmnr.transpose(0, 2, 1)
+
+
+def read_tb_file_namelist(input_file):
+    """
+    Read the &TB_FILE namelist of a wt.in file.
+
+    Only the simple ``key = value`` form used in WannierTools inputs is
+    understood. Keys are returned in lower case, strings without quotes
+    and logicals as bool.
+
+    Parameters:
+    input_file (str): Path to the wt.in file.
+
+    Returns:
+    dict: The values found in the namelist.
+    """
+    with open(input_file, 'r') as f:
+        text = f.read()
+
+    match = re.search(r'&tb_file\b(.*?)^\s*/', text, re.IGNORECASE | re.DOTALL | re.MULTILINE)
+    if match is None:
+        return {}
+
+    values = {}
+    body = '\n'.join(line.split('!')[0] for line in match.group(1).splitlines())
+    for key, value in re.findall(r'(\w+)\s*=\s*(\'[^\']*\'|"[^"]*"|[^\s,]+)', body):
+        value = value.strip()
+        if value[:1] in '\'"':
+            value = value[1:-1]
+        elif value.lower().strip('.') in ('t', 'true'):
+            value = True
+        elif value.lower().strip('.') in ('f', 'false'):
+            value = False
+        values[key.lower()] = value
+    return values
+
+
+# order in which readinput reads the namelists of wt.in
+NAMELIST_ORDER = ('TB_FILE', 'CONTROL', 'SYSTEM', 'PARAMETERS')
+
+_NAMELIST_RE = re.compile(r'^[ \t]*&(\w+)\b(.*?)^\s*/[ \t]*\n?', re.DOTALL | re.MULTILINE)
+
+
+def read_namelist(text, group):
+    """
+    Return the entries of one namelist of a wt.in text.
+
+    Parameters:
+    text (str): Content of the wt.in file.
+    group (str): Namelist name, case insensitive, e.g. 'PARAMETERS'.
+
+    Returns:
+    dict: key -> value as written in the file (unparsed string), in file
+        order. Empty if the namelist is missing.
+    """
+    for match in _NAMELIST_RE.finditer(text):
+        if match.group(1).upper() == group.upper():
+            return _parse_namelist_body(match.group(2))
+    return {}
+
+
+def _parse_namelist_body(body):
+    body = '\n'.join(line.split('!')[0] for line in body.splitlines())
+    parts = re.split(r'(?:^|[\s,]+)(\w+)\s*=', body)
+    return {key: value.strip().rstrip(',').strip() for key, value in zip(parts[1::2], parts[2::2])}
+
+
+def format_namelist_value(value):
+    """Format a Python value as a Fortran namelist value."""
+    if isinstance(value, (bool, np.bool_)):
+        return 'T' if value else 'F'
+    if isinstance(value, str):
+        return "'" + value + "'"
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return ' '.join(format_namelist_value(v) for v in value)
+    return repr(value.item() if isinstance(value, np.generic) else value)
+
+
+def override_namelists(text, overrides):
+    """
+    Return a copy of a wt.in text with some namelist entries replaced.
+
+    Entries already present are changed in place, the others are appended
+    to their namelist. A missing namelist is created at its place in
+    NAMELIST_ORDER, the cards after the namelists are not touched.
+
+    Parameters:
+    text (str): Content of the wt.in file.
+    overrides (dict): namelist name -> {key: value}, e.g.
+        {'PARAMETERS': {'Nk1': 51}}. Values are Python objects, formatted
+        with format_namelist_value.
+
+    Returns:
+    str: The new input text.
+    """
+    overrides = {group.upper(): values for group, values in overrides.items()}
+    pieces = []
+    found = set()
+    pos = 0
+    for match in _NAMELIST_RE.finditer(text):
+        group = match.group(1).upper()
+        pieces.append(text[pos:match.start()])
+        pos = match.end()
+        for missing in _missing_groups_before(group, overrides, found):
+            pieces.append(_format_namelist(missing, {}, overrides[missing]))
+            found.add(missing)
+        found.add(group)
+        if group in overrides:
+            pieces.append(_format_namelist(match.group(1), _parse_namelist_body(match.group(2)),
+                                           overrides[group]))
+        else:
+            pieces.append(match.group(0))
+    head = ''.join(pieces)
+    order = {group: i for i, group in enumerate(NAMELIST_ORDER)}
+    for group in sorted(overrides, key=lambda g: order.get(g, len(order))):
+        if group not in found:
+            head += _format_namelist(group, {}, overrides[group])
+    return head + text[pos:]
+
+
+def _missing_groups_before(group, overrides, found):
+    if group not in NAMELIST_ORDER:
+        return []
+    earlier = NAMELIST_ORDER[:NAMELIST_ORDER.index(group)]
+    return [g for g in earlier if g in overrides and g not in found]
+
+
+def _format_namelist(name, entries, values):
+    entries = dict(entries)
+    lower = {key.lower(): key for key in entries}
+    for key, value in values.items():
+        entries[lower.get(key.lower(), key)] = format_namelist_value(value)
+    lines = [f'&{name}'] + [f'{key} = {value}' for key, value in entries.items()] + ['/', '']
+    return '\n'.join(lines)
+
+
+def ensure_hr_cache(input_file):
+    """
+    Make sure the hr file referenced by a wt.in input has an up-to-date
+    binary sidecar, so that the Fortran code reads it instead of the text.
+
+    Only the dense Wannier90 hr format is cached, sparse hr files and
+    HWR files are left alone.
+
+    Parameters:
+    input_file (str): Path to the wt.in file.
+
+    Returns:
+    str or None: Path to the sidecar, or None if no cache is used.
+    """
+    tb_file = read_tb_file_namelist(input_file)
+    if (tb_file.get('is_sparse_hr') or tb_file.get('is_sparse') or tb_file.get('is_hrfile') is False
+            or str(tb_file.get('kportb', 'TB')).upper() != 'TB'):
+        return None
+    hr_file = tb_file.get('hrfile', 'wannier90_hr.dat')
+    if 'HWR' in hr_file:
+        return None
+
+    hr_path = os.path.join(os.path.dirname(os.path.abspath(input_file)), hr_file)
+    if not os.path.isfile(hr_path):
+        return None
+
+    cache_path = hr_cache_path(hr_path)
+    if not hr_cache_is_valid(hr_path, cache_path):
+        write_hr_cache(hr_path, cache_path)
+    return cache_path
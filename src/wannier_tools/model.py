@@ -0,0 +1,378 @@
+"""
+In-process access to the bulk tight-binding model.
+
+``Model.from_input("wt.in")`` reads the input file and the Hamiltonian once
+through the Fortran code and keeps them resident in the ``para`` module.
+H(k), eigenvalues, band velocities and Berry curvatures can then be
+evaluated for any set of k points without writing input files or parsing
+``.dat`` outputs:
+
+    >>> from wannier_tools import Model
+    >>> model = Model.from_input("wt.in")
+    >>> energies = model.eigh(kpts, vectors=False)
+
+The model is also a session for the file based calculations: calculate()
+runs one of them on the resident Hamiltonian with modified namelist
+parameters, and close() frees the Fortran memory:
+
+    >>> model.calculate("AHC_calc", PARAMETERS={"Nk1": 51, "Nk2": 51, "Nk3": 51})
+    >>> model.close()
+
+k points are given as an (N, 3) array in units of the reciprocal lattice
+vectors, like KPATH_BULK in wt.in. Energies are in eV measured from
+E_FERMI, velocities in eV*Angstrom and Berry curvatures in Angstrom^2.
+"""
+import atexit
+import os
+import tempfile
+
+import numpy as np
+
+from .io import override_namelists, read_namelist
+
+# The Fortran module state holds a single model per process.
+_loaded = None
+
+_finalize_registered = False
+
+# CONTROL flags that are not calculations and stay as in wt.in
+_KEEP_CONTROL = {'symmetry_import_calc', 'valley_projection_calc'}
+
+# inputs that are folded into HmnR when it is read, a loaded model cannot change them
+_HAMILTONIAN_KEYS = {
+    'CONTROL': {'valley_projection_calc'},
+    'SYSTEM': {'soc', 'e_fermi', 'add_zeeman_field', 'zeeman_energy_in_ev', 'effective_gfactor',
+               'electric_field_in_evpa', 'symmetrical_electric_field_in_evpa',
+               'inner_symmetrical_electric_field', 'center_atom_for_electric_field'},
+}
+
+# the magnetic field only enters HmnR through the Zeeman term
+_ZEEMAN_KEYS = {'bx', 'by', 'bz', 'btheta', 'bphi', 'bmagnitude'}
+
+# thread count variables of the BLAS libraries the extension may be linked to
+_BLAS_THREAD_VARS = ('OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+
+def _configure_threads(threads=None):
+    """
+    Set the OpenMP and BLAS thread counts for this process.
+
+    Has to run before the Fortran extension is imported, the OpenMP and
+    BLAS runtimes read the environment when they are loaded. The k loops
+    call BLAS from inside their threads, so BLAS runs on one thread when
+    there is more than one OpenMP thread.
+
+    Parameters:
+    threads (int or None): OpenMP threads of this process. If None, an
+        existing OMP_NUM_THREADS is kept, otherwise one thread is used.
+
+    Returns:
+    int: the number of OpenMP threads.
+    """
+    if threads is None:
+        # OMP_NUM_THREADS may be a list for nested regions, the first entry counts
+        try:
+            threads = int(os.environ.get('OMP_NUM_THREADS', '1').split(',')[0])
+        except ValueError:
+            threads = 1
+        threads = max(threads, 1)
+        os.environ.setdefault('OMP_NUM_THREADS', '1')
+    elif threads < 1:
+        raise ValueError(f"--threads must be at least 1, got {threads}")
+    else:
+        os.environ['OMP_NUM_THREADS'] = str(threads)
+
+    if threads > 1:
+        for var in _BLAS_THREAD_VARS:
+            os.environ[var] = '1'
+        # private work arrays of the callees live on the thread stacks
+        os.environ.setdefault('OMP_STACKSIZE', '64M')
+    return threads
+
+
+def _wrapper():
+    """Return the Fortran wrapper, making sure MPI is shut down at exit."""
+    global _finalize_registered
+    _configure_threads()
+    from . import wannier_tools_ext
+    wrapper = wannier_tools_ext.wannier_tools_wrapper
+    if not _finalize_registered:
+        atexit.register(wrapper.finalize_wannier_tools)
+        _finalize_registered = True
+    return wrapper
+
+
+def is_loaded():
+    """Return True if a Model currently holds the Fortran state."""
+    return _loaded is not None
+
+
+def _band_range(bands, num_wann):
+    """Convert bands (None, slice or range, 0-based) to (first, count)."""
+    if bands is None:
+        return 0, num_wann
+    if isinstance(bands, range):
+        bands = slice(bands.start, bands.stop, bands.step)
+    if not isinstance(bands, slice):
+        raise TypeError("bands must be None, a slice or a range")
+    start, stop, step = bands.indices(num_wann)
+    if step != 1 or stop <= start:
+        raise ValueError(f"bands must be a non-empty contiguous range, got {bands}")
+    return start, stop - start
+
+
+def _as_kpoints(kpts):
+    """Return kpts as a Fortran ordered (3, N) float64 array and N."""
+    kpts = np.ascontiguousarray(kpts, dtype=np.float64)
+    if kpts.ndim == 1:
+        kpts = kpts.reshape(1, -1)
+    if kpts.ndim != 2 or kpts.shape[1] != 3:
+        raise ValueError(f"k points must have shape (N, 3), got {kpts.shape}")
+    # the transpose of a C ordered (N, 3) array is a Fortran ordered (3, N)
+    # array, so f2py passes it on without a copy
+    return kpts.T, kpts.shape[0]
+
+
+class Model:
+    """
+    Bulk tight-binding model held by the Fortran code.
+
+    Use Model.from_input to create it. Only one model can be loaded in a
+    process, because the Fortran code keeps the Hamiltonian in module
+    variables; close() frees it so that another model can be loaded. The
+    model can also be used as a context manager.
+
+    Attributes:
+    input_file (str): Absolute path of the wt.in the model was read from.
+    num_wann (int): Number of Wannier orbitals, i.e. the size of H(k).
+    """
+
+    def __init__(self, input_file, num_wann, input_text=''):
+        self.input_file = input_file
+        self.num_wann = num_wann
+        self._input_text = input_text
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def from_input(cls, input_file="wt.in", hr_cache=True):
+        """
+        Read wt.in and the Hamiltonian it points to.
+
+        The Fortran code writes WT.out to the directory of the input file,
+        as a normal run does. Errors in the input stop the process, like in
+        a normal run.
+
+        Parameters:
+        input_file (str): Path to the WannierTools input file.
+        hr_cache (bool): If True, read the hr file through its binary
+            sidecar (<Hrfile>.wtb), writing it when needed. If False, the
+            text file is read even if a sidecar exists.
+
+        Returns:
+        Model: the loaded model.
+        """
+        global _loaded
+        if _loaded is not None:
+            raise RuntimeError(
+                f"A model is already loaded from {_loaded.input_file}, "
+                "only one model can be loaded per process")
+
+        input_path = os.path.abspath(input_file)
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"Input file not found: {input_file}")
+
+        use_cache = False
+        if hr_cache:
+            from .io import ensure_hr_cache
+            try:
+                use_cache = ensure_hr_cache(input_path) is not None
+            except (OSError, ValueError):
+                # the Fortran reader falls back to the text file
+                pass
+
+        _wrapper().set_hr_cache(1 if use_cache else 0)
+        original_cwd = os.getcwd()
+        os.chdir(os.path.dirname(input_path))
+        try:
+            num_wann, ierr = _wrapper().model_init()
+        finally:
+            os.chdir(original_cwd)
+
+        if ierr != 0:
+            _wrapper().model_close()
+        if ierr == 1:
+            raise RuntimeError("MPI could not be initialised")
+        if ierr == 2:
+            raise ValueError("Model does not support sparse Hamiltonians (Is_Sparse = T)")
+
+        with open(input_path, 'r') as f:
+            input_text = f.read()
+        _loaded = cls(input_path, int(num_wann), input_text)
+        return _loaded
+
+    def close(self):
+        """
+        Free the Hamiltonian and all other Fortran arrays of this model.
+
+        The model cannot be used afterwards. Calling close() again does
+        nothing.
+        """
+        global _loaded
+        if self._closed:
+            return
+        _wrapper().model_close()
+        self._closed = True
+        if _loaded is self:
+            _loaded = None
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("The model has been closed")
+
+    def calculate(self, calc=None, **namelists):
+        """
+        Run WannierTools calculations on the loaded Hamiltonian.
+
+        The namelists of the wt.in the model was loaded from are read again
+        with the given changes, the Hamiltonian is not read again. Changes
+        do not carry over to the next call. Cards such as KPATH_BULK or
+        KPLANE_BULK are used as they are in wt.in. The output files are
+        written next to wt.in, as in a normal run.
+
+        Parameters:
+        calc (str or None): CONTROL flag to switch on, e.g.
+            'BulkBand_line_calc', 'BulkFS_plane_calc', 'AHC_calc' or
+            'WannierCenter_calc'; the '_calc' suffix may be left out. All
+            other calculations of wt.in are switched off. If None, CONTROL
+            is used as given.
+        **namelists: Changes per namelist, e.g. PARAMETERS={'Nk1': 51} or
+            SYSTEM={'NumOccupied': 4}. Inputs that are folded into the
+            Hamiltonian (TB_FILE, SOC, E_FERMI, Zeeman and electric fields)
+            cannot be changed.
+        """
+        self._check_open()
+        overrides = {}
+        for group, values in namelists.items():
+            overrides[group.upper()] = dict(values)
+        self._check_overrides(overrides)
+
+        if calc is not None:
+            calc = calc if calc.lower().endswith('_calc') else calc + '_calc'
+            control = {key: False for key in read_namelist(self._input_text, 'CONTROL')
+                       if key.lower().endswith('_calc') and key.lower() not in _KEEP_CONTROL}
+            control[calc] = True
+            control.update(overrides.get('CONTROL', {}))
+            overrides['CONTROL'] = control
+
+        input_dir = os.path.dirname(self.input_file)
+        fd, session_input = tempfile.mkstemp(prefix='.wt_session_', suffix='.in', dir=input_dir)
+        original_cwd = os.getcwd()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(override_namelists(self._input_text, overrides))
+            os.chdir(input_dir)
+            ierr = _wrapper().model_reload(os.path.basename(session_input))
+            if ierr != 0:
+                raise ValueError("The modified input changes the size of the Hamiltonian")
+            _wrapper().model_calculate()
+        finally:
+            os.chdir(original_cwd)
+            os.remove(session_input)
+
+    def _check_overrides(self, overrides):
+        """Reject changes of inputs that the loaded Hamiltonian depends on."""
+        if 'TB_FILE' in overrides:
+            raise ValueError("TB_FILE cannot be changed on a loaded model, load a new Model instead")
+        system = {k.lower(): v for k, v in read_namelist(self._input_text, 'SYSTEM').items()}
+        zeeman = system.get('add_zeeman_field', 'F').strip('.').upper().startswith('T')
+        for group, values in overrides.items():
+            fixed = set(_HAMILTONIAN_KEYS.get(group, ()))
+            if group == 'SYSTEM' and zeeman:
+                fixed |= _ZEEMAN_KEYS
+            for key in values:
+                if key.lower() in fixed:
+                    raise ValueError(f"{group}:{key} is part of the loaded Hamiltonian and cannot "
+                                     "be changed, load a new Model instead")
+
+    def _band_range(self, bands):
+        """Convert bands (None, slice or range, 0-based) to (first, count)."""
+        return _band_range(bands, self.num_wann)
+
+    def hk(self, kpts):
+        """
+        Bloch Hamiltonian H(k) in the Wannier basis (lattice gauge).
+
+        Parameters:
+        kpts (array_like): k points, shape (N, 3), in units of the
+            reciprocal lattice vectors.
+
+        Returns:
+        ndarray: complex array of shape (N, num_wann, num_wann) in eV.
+        """
+        self._check_open()
+        kpts_f, nk = _as_kpoints(kpts)
+        hk = _wrapper().model_hk(kpts_f, self.num_wann, nk=nk)
+        return np.moveaxis(hk, 2, 0)
+
+    def eigh(self, kpts, bands=None, vectors=True):
+        """
+        Eigenvalues and eigenvectors of H(k).
+
+        Parameters:
+        kpts (array_like): k points, shape (N, 3), in units of the
+            reciprocal lattice vectors.
+        bands (slice or range or None): 0-based contiguous band window,
+            e.g. slice(10, 20). All bands by default.
+        vectors (bool): If False, only the eigenvalues are computed.
+
+        Returns:
+        w (ndarray): eigenvalues in eV, shape (N, nbands), ascending.
+        v (ndarray): eigenvectors, shape (N, num_wann, nbands), v[i, :, n]
+            belongs to w[i, n] as in numpy.linalg.eigh. Only returned when
+            vectors is True.
+        """
+        self._check_open()
+        kpts_f, nk = _as_kpoints(kpts)
+        first, nbands = self._band_range(bands)
+        if not vectors:
+            w = _wrapper().model_eigvals(kpts_f, first + 1, nbands, nk=nk)
+            return w.T
+        w, v = _wrapper().model_eigh(kpts_f, self.num_wann, first + 1, nbands, nk=nk)
+        return w.T, np.moveaxis(v, 2, 0)
+
+    def velocity(self, kpts):
+        """
+        Band velocities dE_n/dk of all bands.
+
+        Parameters:
+        kpts (array_like): k points, shape (N, 3), in units of the
+            reciprocal lattice vectors.
+
+        Returns:
+        ndarray: shape (N, num_wann, 3), Cartesian components in eV*Angstrom.
+        """
+        self._check_open()
+        kpts_f, nk = _as_kpoints(kpts)
+        return _wrapper().model_velocity(kpts_f, self.num_wann, nk=nk).T
+
+    def berry_curvature(self, kpts):
+        """
+        Berry curvature of all bands, Eq. (30) of PRB 74, 195118 (2006).
+
+        Parameters:
+        kpts (array_like): k points, shape (N, 3), in units of the
+            reciprocal lattice vectors.
+
+        Returns:
+        ndarray: shape (N, num_wann, 3), (Omega_x, Omega_y, Omega_z) in
+            Angstrom^2.
+        """
+        self._check_open()
+        kpts_f, nk = _as_kpoints(kpts)
+        return _wrapper().model_berry_curvature(kpts_f, self.num_wann, nk=nk).T
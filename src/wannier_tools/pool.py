@@ -0,0 +1,179 @@
+"""
+Process pool for evaluating a tight-binding model on many k points.
+
+The Fortran code keeps one model per process, so Model itself cannot run
+on several cores except through the OpenMP threads of the extension.
+ModelPool starts worker processes that each load their own Model from the
+same wt.in, splits the k points into chunks, evaluates the chunks in the
+workers and joins the results in order. It needs no MPI runtime:
+
+    >>> from wannier_tools import ModelPool
+    >>> with ModelPool("wt.in", workers=8) as pool:
+    ...     energies = pool.eigh(kpts, vectors=False)
+
+The workers are started with the 'spawn' method, so scripts using a pool
+must protect their main code with ``if __name__ == '__main__':``.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Model held by a worker process
+_worker_model = None
+
+
+def _init_worker(input_file, threads, hr_cache, load_lock):
+    """Load the model of one worker process."""
+    global _worker_model
+    # the OpenMP and BLAS runtimes read these when the extension is loaded,
+    # the workers already fill the cores so BLAS stays on one thread
+    from .model import Model, _BLAS_THREAD_VARS, _configure_threads
+    _configure_threads(threads)
+    for var in _BLAS_THREAD_VARS:
+        os.environ[var] = '1'
+    # the workers write WT.out and the POSCAR files next to wt.in, one at a
+    # time, the sidecar was refreshed by the parent and is only checked here
+    with load_lock:
+        _worker_model = Model.from_input(input_file, hr_cache=hr_cache)
+
+
+def _num_wann():
+    """Number of Wannier orbitals of the worker model."""
+    return _worker_model.num_wann
+
+
+def _evaluate(method, kpts, kwargs):
+    """Evaluate one chunk of k points in a worker."""
+    return getattr(_worker_model, method)(kpts, **kwargs)
+
+
+class ModelPool:
+    """
+    Worker processes holding the same Model, for large sets of k points.
+
+    The methods take and return the same arrays as the Model methods. The
+    pool can also be used as a context manager.
+
+    Attributes:
+    input_file (str): Absolute path of the wt.in the workers read.
+    workers (int): Number of worker processes.
+    num_wann (int): Number of Wannier orbitals of the model.
+    """
+
+    def __init__(self, input_file="wt.in", workers=None, threads=1, chunk_size=None,
+                 hr_cache=True):
+        """
+        Start the worker processes and load the model in each of them.
+
+        Parameters:
+        input_file (str): Path to the WannierTools input file.
+        workers (int or None): Number of worker processes, by default the
+            number of cores divided by threads.
+        threads (int): OpenMP threads per worker.
+        chunk_size (int or None): k points per task. By default the k points
+            of a call are split into four tasks per worker.
+        hr_cache (bool): If True, write or refresh the binary sidecar of the
+            hr file (<Hrfile>.wtb) once before the workers read it.
+        """
+        input_path = os.path.abspath(input_file)
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"Input file not found: {input_file}")
+        if threads < 1:
+            raise ValueError(f"threads must be at least 1, got {threads}")
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 1) // threads)
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+
+        if hr_cache:
+            from .io import ensure_hr_cache
+            try:
+                ensure_hr_cache(input_path)
+            except (OSError, ValueError):
+                # the Fortran reader falls back to the text file
+                pass
+
+        self.input_file = input_path
+        self.workers = workers
+        self._chunk_size = chunk_size
+
+        context = multiprocessing.get_context('spawn')
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker,
+            initargs=(input_path, threads, hr_cache, context.Lock()))
+        # the first worker loads the model here, so input errors show up now
+        try:
+            self.num_wann = self._executor.submit(_num_wann).result()
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes. Calling close() again does nothing."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _map(self, method, kpts, **kwargs):
+        """Evaluate method of the worker models chunk by chunk, in order."""
+        if self._executor is None:
+            raise RuntimeError("The pool has been closed")
+        kpts = np.ascontiguousarray(kpts, dtype=np.float64)
+        if kpts.ndim == 1:
+            kpts = kpts.reshape(1, -1)
+        if kpts.ndim != 2 or kpts.shape[1] != 3:
+            raise ValueError(f"k points must have shape (N, 3), got {kpts.shape}")
+
+        nk = kpts.shape[0]
+        if nk == 0:
+            return []
+        chunk_size = self._chunk_size or max(1, -(-nk // (4 * self.workers)))
+        chunks = [kpts[i:i + chunk_size] for i in range(0, nk, chunk_size)]
+        return list(self._executor.map(_evaluate, [method] * len(chunks), chunks,
+                                       [kwargs] * len(chunks)))
+
+    def hk(self, kpts):
+        """H(k) in eV, shape (N, num_wann, num_wann), see Model.hk."""
+        results = self._map('hk', kpts)
+        if not results:
+            return np.zeros((0, self.num_wann, self.num_wann), dtype=np.complex128)
+        return np.concatenate(results)
+
+    def eigh(self, kpts, bands=None, vectors=True):
+        """Eigenvalues and, if vectors is True, eigenvectors, see Model.eigh."""
+        from .model import _band_range
+        _, nbands = _band_range(bands, self.num_wann)
+        results = self._map('eigh', kpts, bands=bands, vectors=vectors)
+        if not results:
+            w = np.zeros((0, nbands))
+            if not vectors:
+                return w
+            return w, np.zeros((0, self.num_wann, nbands), dtype=np.complex128)
+        if not vectors:
+            return np.concatenate(results)
+        return (np.concatenate([w for w, _ in results]),
+                np.concatenate([v for _, v in results]))
+
+    def velocity(self, kpts):
+        """Band velocities in eV*Angstrom, shape (N, num_wann, 3), see Model.velocity."""
+        results = self._map('velocity', kpts)
+        if not results:
+            return np.zeros((0, self.num_wann, 3))
+        return np.concatenate(results)
+
+    def berry_curvature(self, kpts):
+        """Berry curvatures in Angstrom^2, shape (N, num_wann, 3), see Model.berry_curvature."""
+        results = self._map('berry_curvature', kpts)
+        if not results:
+            return np.zeros((0, self.num_wann, 3))
+        return np.concatenate(results)
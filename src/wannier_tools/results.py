@@ -0,0 +1,654 @@
+"""
+Reading the results of a WannierTools run.
+
+``load(run_dir)`` returns the results of a run directory as labelled NumPy
+arrays. It finds out which calculations ran from the output files that
+exist, and parses a file only when one of its arrays is accessed, so
+opening a run directory is instant::
+
+    >>> from wannier_tools import results
+    >>> res = results.load("run")
+    >>> res.calculations
+    ['BulkBand_calc', 'SlabSS_calc']
+    >>> e = res["bulkek/energy"]          # (k, band), eV
+    >>> res.axes["bulkek/energy"], res.units["bulkek/energy"]
+    (('k', 'band'), 'eV')
+
+With ``Output_format`` other than ``'ASCII'`` the Fortran code writes the
+arrays of the supported calculations as float64 values to
+``wt_results.bin`` and describes every dataset (name, dtype, shape, byte
+offset, units and axis names) in ``wt_results.json``. After the run, wt-py
+packs the two files into the container that was asked for:
+
+* ``NPZ``:  ``wt_results.npz``, read with ``numpy.load``
+* ``HDF5``: ``wt_results.h5``, needs h5py, otherwise NPZ is written
+* ``RAW``:  the two files are kept, ``read_raw`` memory maps them
+
+The shapes are those of C ordered NumPy arrays, e.g. ``bulkek/energy`` is
+(k, band) and ``fs3d/energy`` is (band, k1, k2, k3). ``load`` gives the
+arrays of the text outputs the same names and shapes.
+"""
+import glob
+import io
+import json
+import os
+import re
+import zipfile
+from collections.abc import Mapping
+from itertools import islice
+
+import numpy as np
+
+INDEX_FILE = 'wt_results.json'
+DATA_FILE = 'wt_results.bin'
+NPZ_FILE = 'wt_results.npz'
+HDF5_FILE = 'wt_results.h5'
+
+# values per copy when a dataset is written to NPZ or HDF5
+_COPY_VALUES = 1 << 22
+
+# bytes per parsing block of the text outputs
+_BLOCK_BYTES = 1 << 26
+
+
+def read_index(run_dir='.'):
+    """
+    Read the index wt_results.json of a run.
+
+    Parameters:
+    run_dir (str): Directory of the run.
+
+    Returns:
+    dict: with the keys "format", "data" and "datasets", a list of dicts
+        with "name", "dtype", "units", "shape", "offset" and "axes".
+    """
+    with open(os.path.join(run_dir, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def read_raw(run_dir='.', index=None):
+    """
+    Memory map the datasets in wt_results.bin of a run.
+
+    Parameters:
+    run_dir (str): Directory of the run.
+    index (dict or None): The index from read_index, read if None.
+
+    Returns:
+    dict: dataset name -> read-only numpy.memmap of its shape.
+    """
+    if index is None:
+        index = read_index(run_dir)
+    path = os.path.join(run_dir, index['data'])
+    arrays = {}
+    for d in index['datasets']:
+        shape = tuple(d['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[d['name']] = np.zeros(shape, dtype=d['dtype'])
+            continue
+        arrays[d['name']] = np.memmap(path, dtype=d['dtype'], mode='r',
+                                      offset=d['offset'], shape=shape)
+    return arrays
+
+
+def _input_text(input_file):
+    if not input_file or not os.path.exists(input_file):
+        return ''
+    with open(input_file, errors='replace') as f:
+        return f.read()
+
+
+def _write_npz(path, index, arrays, input_text):
+    """Write the datasets, the index and the input file to an NPZ file."""
+    tmp = path + '.tmp'
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED, allowZip64=True) as z:
+        for name, a in [('__index__', np.array(json.dumps(index))),
+                        ('__input__', np.array(input_text))]:
+            with z.open(name + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, a)
+
+        # np.savez would copy every memory mapped dataset into memory
+        for name, a in arrays.items():
+            with z.open(name + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array_header_1_0(
+                    f, np.lib.format.header_data_from_array_1_0(a))
+                flat = a.reshape(-1)
+                for i in range(0, flat.size, _COPY_VALUES):
+                    f.write(flat[i:i + _COPY_VALUES].tobytes())
+    os.replace(tmp, path)
+
+
+def _write_hdf5(path, index, arrays, input_text):
+    """Write the datasets with their units and axes to an HDF5 file."""
+    import h5py
+
+    tmp = path + '.tmp'
+    with h5py.File(tmp, 'w') as f:
+        f.attrs['format'] = 'WannierTools results'
+        f.attrs['input'] = input_text
+        for d in index['datasets']:
+            a = arrays[d['name']]
+            dset = f.create_dataset(d['name'], shape=a.shape, dtype='<f8')
+            dset.attrs['units'] = d['units']
+            dset.attrs['axes'] = ','.join(d['axes'])
+
+            # copy along the first axis, so large datasets are never read
+            # into memory at once
+            if a.ndim == 0 or a.size == 0:
+                dset[...] = a
+                continue
+            step = max(1, _COPY_VALUES // max(1, a.size // a.shape[0]))
+            for i in range(0, a.shape[0], step):
+                dset[i:i + step] = a[i:i + step]
+    os.replace(tmp, path)
+
+
+def pack_results(run_dir='.', input_file=None):
+    """
+    Pack wt_results.bin and wt_results.json of a finished run into the
+    container selected by Output_format. Does nothing if the run wrote no
+    binary results or Output_format is RAW.
+
+    Parameters:
+    run_dir (str): Directory of the run.
+    input_file (str or None): The input file, stored with the results.
+
+    Returns:
+    str or None: Path of the container, or None if nothing was packed.
+    """
+    if not os.path.exists(os.path.join(run_dir, INDEX_FILE)):
+        return None
+    index = read_index(run_dir)
+    fmt = index.get('format', 'raw')
+    if fmt not in ('npz', 'hdf5'):
+        return None
+
+    input_text = _input_text(input_file)
+    arrays = read_raw(run_dir, index)
+    if fmt == 'hdf5':
+        try:
+            import h5py  # noqa: F401
+        except ImportError:
+            print("Warning: h5py is not installed, the results are written to "
+                  f"{NPZ_FILE} instead of {HDF5_FILE}.")
+            fmt = 'npz'
+
+    if fmt == 'hdf5':
+        path = os.path.join(run_dir, HDF5_FILE)
+        _write_hdf5(path, index, arrays, input_text)
+    else:
+        path = os.path.join(run_dir, NPZ_FILE)
+        _write_npz(path, index, arrays, input_text)
+
+    # release the memory maps before the raw files are removed
+    del arrays
+    os.remove(os.path.join(run_dir, DATA_FILE))
+    os.remove(os.path.join(run_dir, INDEX_FILE))
+    return path
+
+
+# ----------------------------------------------------------------------
+# text outputs
+# ----------------------------------------------------------------------
+
+def read_table(path, ncols=None):
+    """
+    Read the numbers of a text output file in blocks of bytes.
+
+    Lines starting with '#' or '%' are skipped. Blank lines separate the
+    blocks the Fortran code writes, e.g. one block per band in bulkek.dat.
+    Both are located with NumPy on the raw bytes, only the few candidate
+    lines are looked at in Python, and the numbers are parsed by the C
+    reader of numpy.loadtxt.
+
+    Parameters:
+    path (str): The text file.
+    ncols (int or None): Numbers per line, taken from the first data line
+        if None.
+
+    Returns:
+    tuple: data (rows, ncols) and the number of rows of every block.
+    """
+    chunks = []
+    blocks = []
+    nrows = 0
+    start = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_BLOCK_BYTES)
+            if not chunk:
+                break
+            chunk += f.readline()
+            if not chunk.endswith(b'\n'):
+                chunk += b'\n'
+
+            raw = np.frombuffer(chunk, np.uint8)
+            ends = np.flatnonzero(raw == 10)
+            starts = np.empty_like(ends)
+            starts[0] = 0
+            starts[1:] = ends[:-1] + 1
+
+            # blank lines are short, comment lines contain '#' or '%'
+            marks = np.flatnonzero((raw == 35) | (raw == 37))
+            candidates = np.union1d(np.flatnonzero(ends - starts <= 8),
+                                    np.searchsorted(ends, marks))
+            blank = []
+            comment = []
+            for i in candidates:
+                line = chunk[starts[i]:ends[i]].strip()
+                if not line:
+                    blank.append(i)
+                elif line[:1] in (b'#', b'%'):
+                    comment.append(i)
+
+            data_line = np.ones(len(ends), dtype=bool)
+            data_line[blank] = False
+            data_line[comment] = False
+            before = np.cumsum(data_line)
+            for i in blank:
+                n = nrows + int(before[i])
+                if n > start:
+                    blocks.append(n - start)
+                    start = n
+            n = int(before[-1])
+            if n == 0:
+                continue
+
+            if comment:
+                keep = np.r_[0, ends[comment] + 1]
+                drop = np.r_[starts[comment], len(chunk)]
+                chunk = b''.join(chunk[i:j] for i, j in zip(keep, drop))
+            data = np.loadtxt(io.BytesIO(chunk), ndmin=2)
+            if ncols is None:
+                ncols = data.shape[1]
+            if data.shape != (n, ncols):
+                raise ValueError(f"{path}: malformed data line after line {nrows}")
+            chunks.append(data)
+            nrows += n
+    if nrows > start:
+        blocks.append(nrows - start)
+    if not chunks:
+        return np.zeros((0, ncols or 0)), blocks
+    data = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+    return data, blocks
+
+
+def _grid(data, blocks, path):
+    """Reshape rows written in equal blank line separated blocks to
+    (blocks, rows per block, columns)."""
+    if not blocks or any(b != blocks[0] for b in blocks):
+        raise ValueError(f"{path}: blocks of different length")
+    return data.reshape(len(blocks), blocks[0], data.shape[1])
+
+
+def _parse_bulkek(path):
+    # one block per band: klen, E, weights of the orbital groups
+    g = _grid(*read_table(path), path)
+    return {
+        'bulkek/klen': g[0, :, 0],
+        'bulkek/energy': g[:, :, 1].T,
+        'bulkek/weight': g[:, :, 2:].transpose(1, 0, 2),
+    }
+
+
+def _parse_bulkek_plane(path):
+    # one block per k1: k, k in the plane and the bands around the Fermi level
+    g = _grid(*read_table(path), path)
+    return {
+        'bulkek_plane/k': g[:, :, 0:3],
+        'bulkek_plane/k_plane': g[:, :, 3:6],
+        'bulkek_plane/energy': g[:, :, 6:],
+    }
+
+
+def _parse_slabek(path):
+    # one block per band: klen, E, weights of the bottom and top surface
+    g = _grid(*read_table(path), path)
+    return {
+        'slabek/klen': g[0, :, 0],
+        'slabek/energy': g[:, :, 1].T,
+        'slabek/weight_l': g[:, :, 2].T,
+        'slabek/weight_r': g[:, :, 3].T,
+    }
+
+
+def _parse_fs3d(paths):
+    # one file per band, header '%Nk1, Nk2, Nk3, total' and E(k1, k2, k3)
+    paths = sorted(paths, key=lambda p: int(re.findall(r'(\d+)\.txt$', p)[0]))
+    with open(paths[0]) as f:
+        f.readline()
+        nk = [int(x) for x in f.readline().split()[-4:-1]]
+    energy = np.empty([len(paths)] + nk)
+    for i, p in enumerate(paths):
+        energy[i] = read_table(p, 1)[0].reshape(nk)
+    return {'fs3d/energy': energy}
+
+
+def _parse_dos(path):
+    # E and the DOS for every broadening, listed in the header
+    data, _ = read_table(path)
+    eta = []
+    with open(path) as f:
+        for line in islice(f, 5):
+            if 'eta' in line:
+                eta = [float(x) for x in line.split(':')[-1].split()]
+    return {
+        'dos/energy': data[:, 0],
+        'dos/eta': np.array(eta),
+        'dos/dos': data[:, 1:].T,
+    }
+
+
+def _parse_surfdos(side):
+    # one block per k point: klen, E, log(dos) and for l and r dos_only
+    def parse(path):
+        g = _grid(*read_table(path), path)
+        out = {
+            'surfdos/klen': g[:, 0, 0],
+            'surfdos/omega': g[0, :, 1],
+            f'surfdos/dos_{side}': g[:, :, 2],
+        }
+        if side != 'bulk':
+            out[f'surfdos/dos_{side}_only'] = g[:, :, 3]
+        return out
+    return parse
+
+
+def _parse_arc(side):
+    # one block per k1: kx, ky, log(dos)
+    def parse(path):
+        g = _grid(*read_table(path), path)
+        return {'arc/k': g[:, :, 0:2], f'arc/dos_{side}': g[:, :, 2]}
+    return parse
+
+
+def _parse_wcc(path):
+    # k, largest gap, sum of the WCCs, WCCs
+    data, _ = read_table(path)
+    return {
+        'wcc/k': data[:, 0],
+        'wcc/largestgap': data[:, 1],
+        'wcc/wcc': data[:, 3:],
+    }
+
+
+def _ahc_eta(path):
+    return float(re.findall(r'sigma_ahc_eta(.*)meV\.txt$', path)[0])
+
+
+def _parse_ahc(paths):
+    # one file per broadening: E, sigma_xy, sigma_yz, sigma_zx
+    paths = sorted(paths, key=_ahc_eta)
+    tables = [read_table(p)[0] for p in paths]
+    return {
+        'ahc/energy': tables[0][:, 0],
+        'ahc/eta': np.array([_ahc_eta(p) for p in paths]),
+        'ahc/sigma': np.stack([t[:, 1:4] for t in tables]),
+    }
+
+
+def _parse_berry(path):
+    # one block per k1: k, k in the plane and four sets of Omega
+    g = _grid(*read_table(path), path)
+    out = {'berry/k': g[:, :, 0:3], 'berry/k_plane': g[:, :, 3:6]}
+    for i, name in enumerate(['occ_sum', 'occ_band', 'ef_sum', 'ef_band']):
+        out['berry/omega_' + name] = g[:, :, 6 + 3 * i:9 + 3 * i]
+    return out
+
+
+def _parse_orbmag(path):
+    # the same layout as Berrycurvature.dat
+    g = _grid(*read_table(path), path)
+    return {'orbmag/m_' + name: g[:, :, 6 + 3 * i:9 + 3 * i]
+            for i, name in enumerate(['occ_sum', 'occ_band', 'ef_sum', 'ef_band'])}
+
+
+# units and axes of the arrays, the same as in wt_results.json
+_LABELS = {
+    'bulkek/klen': ('1/Angstrom', 'k'),
+    'bulkek/energy': ('eV', 'k,band'),
+    'bulkek/weight': ('', 'k,band,group'),
+    'bulkek_plane/k': ('1/Angstrom', 'k1,k2,direction'),
+    'bulkek_plane/k_plane': ('1/Angstrom', 'k1,k2,direction'),
+    'bulkek_plane/energy': ('eV', 'k1,k2,band'),
+    'slabek/klen': ('1/Angstrom', 'k'),
+    'slabek/energy': ('eV', 'k,band'),
+    'slabek/weight_l': ('', 'k,band'),
+    'slabek/weight_r': ('', 'k,band'),
+    'fs3d/energy': ('eV', 'band,k1,k2,k3'),
+    'dos/energy': ('eV', 'energy'),
+    'dos/eta': ('meV', 'eta'),
+    'dos/dos': ('1/eV', 'eta,energy'),
+    'surfdos/klen': ('1/Angstrom', 'k'),
+    'surfdos/omega': ('eV', 'energy'),
+    'surfdos/dos_l': ('log', 'k,energy'),
+    'surfdos/dos_l_only': ('', 'k,energy'),
+    'surfdos/dos_r': ('log', 'k,energy'),
+    'surfdos/dos_r_only': ('', 'k,energy'),
+    'surfdos/dos_bulk': ('log', 'k,energy'),
+    'arc/k': ('1/Angstrom', 'k1,k2,direction'),
+    'arc/dos_l': ('log', 'k1,k2'),
+    'arc/dos_r': ('log', 'k1,k2'),
+    'arc/dos_bulk': ('log', 'k1,k2'),
+    'wcc/k': ('fractional', 'k'),
+    'wcc/largestgap': ('', 'k'),
+    'wcc/wcc': ('', 'k,band'),
+    'ahc/energy': ('eV', 'energy'),
+    'ahc/eta': ('meV', 'eta'),
+    'ahc/sigma': ('S/cm', 'eta,energy,component'),
+    'berry/k': ('1/Angstrom', 'k1,k2,direction'),
+    'berry/k_plane': ('1/Angstrom', 'k1,k2,direction'),
+    'berry/omega_occ_sum': ('Angstrom^2', 'k1,k2,direction'),
+    'berry/omega_occ_band': ('Angstrom^2', 'k1,k2,direction'),
+    'berry/omega_ef_sum': ('Angstrom^2', 'k1,k2,direction'),
+    'berry/omega_ef_band': ('Angstrom^2', 'k1,k2,direction'),
+    'orbmag/m_occ_sum': ('mu_B', 'k1,k2,direction'),
+    'orbmag/m_occ_band': ('mu_B', 'k1,k2,direction'),
+    'orbmag/m_ef_sum': ('mu_B', 'k1,k2,direction'),
+    'orbmag/m_ef_band': ('mu_B', 'k1,k2,direction'),
+}
+
+# text outputs: file name or glob pattern, the arrays it holds and the
+# parser, which gets the path, or the sorted list of paths for a pattern
+_TEXT_OUTPUTS = [
+    ('bulkek.dat', ('bulkek/klen', 'bulkek/energy', 'bulkek/weight'), _parse_bulkek),
+    ('bulkek_plane.dat', ('bulkek_plane/k', 'bulkek_plane/k_plane', 'bulkek_plane/energy'),
+     _parse_bulkek_plane),
+    ('slabek.dat', ('slabek/klen', 'slabek/energy', 'slabek/weight_l', 'slabek/weight_r'),
+     _parse_slabek),
+    ('FS3D_matlab_band_*.txt', ('fs3d/energy',), _parse_fs3d),
+    ('dos.dat', ('dos/energy', 'dos/eta', 'dos/dos'), _parse_dos),
+    ('dos.dat_l', ('surfdos/klen', 'surfdos/omega', 'surfdos/dos_l', 'surfdos/dos_l_only'),
+     _parse_surfdos('l')),
+    ('dos.dat_r', ('surfdos/klen', 'surfdos/omega', 'surfdos/dos_r', 'surfdos/dos_r_only'),
+     _parse_surfdos('r')),
+    ('dos.dat_bulk', ('surfdos/klen', 'surfdos/omega', 'surfdos/dos_bulk'),
+     _parse_surfdos('bulk')),
+    ('arc.dat_l', ('arc/k', 'arc/dos_l'), _parse_arc('l')),
+    ('arc.dat_r', ('arc/k', 'arc/dos_r'), _parse_arc('r')),
+    ('arc.dat_bulk', ('arc/k', 'arc/dos_bulk'), _parse_arc('bulk')),
+    ('wcc.dat', ('wcc/k', 'wcc/largestgap', 'wcc/wcc'), _parse_wcc),
+    ('sigma_ahc_eta*meV.txt', ('ahc/energy', 'ahc/eta', 'ahc/sigma'), _parse_ahc),
+    ('Berrycurvature.dat', ('berry/k', 'berry/k_plane', 'berry/omega_occ_sum',
+                            'berry/omega_occ_band', 'berry/omega_ef_sum',
+                            'berry/omega_ef_band'), _parse_berry),
+    ('Orbitalmagnetization.dat', ('orbmag/m_occ_sum', 'orbmag/m_occ_band',
+                                  'orbmag/m_ef_sum', 'orbmag/m_ef_band'), _parse_orbmag),
+]
+
+# the calculation that writes the arrays with this prefix
+_PREFIX_CALCS = {
+    'bulkek': 'BulkBand_calc',
+    'bulkek_plane': 'BulkBand_plane_calc',
+    'slabek': 'SlabBand_calc',
+    'fs3d': 'BulkFS_calc',
+    'dos': 'Dos_calc',
+    'surfdos': 'SlabSS_calc',
+    'arc': 'SlabArc_calc',
+    'wcc': 'wanniercenter_calc',
+    'ahc': 'AHC_calc',
+    'berry': 'BerryCurvature_calc',
+    'orbmag': 'BerryCurvature_calc',
+}
+
+
+class Results(Mapping):
+    """
+    The results of a run directory, a mapping from the array names, e.g.
+    'bulkek/energy', to NumPy arrays. The arrays are read on first access.
+
+    Attributes:
+    run_dir (str): The run directory.
+    calculations (list): The calculations whose outputs were found.
+    units (dict): Units of every array, '' if dimensionless.
+    axes (dict): Names of the axes of every array.
+    files (dict): The file every array is read from.
+    """
+
+    def __init__(self, run_dir='.'):
+        self.run_dir = run_dir
+        self.calculations = []
+        self.units = {}
+        self.axes = {}
+        self.files = {}
+        self._arrays = {}
+        self._loaders = {}
+        self._open = []
+
+        for pattern, names, parse in _TEXT_OUTPUTS:
+            if any(c in pattern for c in '*?'):
+                paths = sorted(glob.glob(os.path.join(run_dir, pattern)))
+                if not paths:
+                    continue
+                source, label = paths, pattern
+            else:
+                source = os.path.join(run_dir, pattern)
+                if not os.path.exists(source):
+                    continue
+                label = pattern
+            loader = _Loader(parse, source)
+            for name in names:
+                # arrays in several files, e.g. surfdos/klen, come from the first
+                if name not in self._loaders:
+                    self._loaders[name] = loader
+                    self.files[name] = label
+                    self.units[name], axes = _LABELS[name]
+                    self.axes[name] = tuple(axes.split(','))
+
+        # binary results take precedence over text files of the same array
+        self._add_binary()
+
+        # not the flags in WT.out, a calculation may have been switched off
+        # by the code or stopped before it wrote its files
+        for name in self._loaders:
+            calc = _PREFIX_CALCS.get(name.split('/')[0])
+            if calc and calc not in self.calculations:
+                self.calculations.append(calc)
+
+    def _add_binary(self):
+        for fname in (NPZ_FILE, HDF5_FILE, INDEX_FILE):
+            path = os.path.join(self.run_dir, fname)
+            if not os.path.exists(path):
+                continue
+            if fname == NPZ_FILE:
+                z = np.load(path)
+                self._open.append(z)
+                index = json.loads(str(z['__index__']))
+                get = z.__getitem__
+            elif fname == HDF5_FILE:
+                import h5py
+                h = h5py.File(path, 'r')
+                self._open.append(h)
+                index = {'datasets': [{'name': name, 'units': str(h[name].attrs['units']),
+                                       'axes': str(h[name].attrs['axes']).split(',')}
+                                      for name in _h5_datasets(h)]}
+
+                def get(name, h=h):
+                    return h[name][()]
+            else:
+                index = read_index(self.run_dir)
+                arrays = read_raw(self.run_dir, index)
+                get = arrays.__getitem__
+            for d in index['datasets']:
+                name = d['name']
+                self._arrays.pop(name, None)
+                self._loaders[name] = _Loader(lambda n, get=get: {n: get(n)}, name)
+                self.units[name] = d['units']
+                self.axes[name] = tuple(d['axes'])
+                self.files[name] = fname
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            if name not in self._loaders:
+                raise KeyError(name)
+            loader = self._loaders[name]
+            for key, value in loader().items():
+                # a file also holds arrays that are read from elsewhere
+                if self._loaders.get(key) is loader:
+                    self._arrays[key] = value
+        return self._arrays[name]
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self):
+        return len(self._loaders)
+
+    def __repr__(self):
+        return (f"Results({self.run_dir!r}, calculations={self.calculations}, "
+                f"arrays={list(self._loaders)})")
+
+    def close(self):
+        """Close the NPZ and HDF5 files, the arrays already read stay valid."""
+        for f in self._open:
+            f.close()
+        self._open = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Loader:
+    """A parser and the file, or the files, it reads."""
+
+    def __init__(self, parse, source):
+        self.parse = parse
+        self.source = source
+
+    def __call__(self):
+        return self.parse(self.source)
+
+
+def _h5_datasets(h, prefix=''):
+    names = []
+    for key, item in h.items():
+        if hasattr(item, 'keys'):
+            names.extend(_h5_datasets(item, f'{prefix}{key}/'))
+        else:
+            names.append(prefix + key)
+    return names
+
+
+def load(run_dir='.'):
+    """
+    Open the results of a WannierTools run.
+
+    The arrays of wt_results.npz, wt_results.h5 or wt_results.bin of a run
+    with Output_format, and of the text outputs (bulkek.dat, bulkek_plane.dat,
+    slabek.dat, FS3D_matlab_band_*.txt, dos.dat, dos.dat_l/_r/_bulk,
+    arc.dat_l/_r/_bulk, wcc.dat, sigma_ahc_eta*meV.txt, Berrycurvature.dat
+    and Orbitalmagnetization.dat) are available under the same names and with
+    the same shapes. Nothing is read before an array is accessed.
+
+    Parameters:
+    run_dir (str): The directory the calculation ran in.
+
+    Returns:
+    Results: mapping from the array names to NumPy arrays.
+    """
+    if not os.path.isdir(run_dir):
+        raise FileNotFoundError(f"No such run directory: {run_dir}")
+    return Results(run_dir)